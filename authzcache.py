@@ -0,0 +1,166 @@
+#!/usr/bin/python3
+import collections
+import threading
+import time
+
+# Default bounds for the authorization decision cache.
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 30.0
+
+class _CacheEntry:
+    __slots__ = ("allowed", "expires_at")
+
+    def __init__(self, allowed, expires_at):
+        self.allowed = allowed
+        self.expires_at = expires_at
+
+# A bounded LRU/TTL cache of Oso Cloud authorization decisions.
+# Entries are keyed on (username, permission, repo_name). Decisions
+# for a (username, repo_name) pair are tracked together so that a fact
+# write for that pair (i.e. a new "has_role" fact) can drop every cached
+# decision it could affect, without scanning the whole cache.
+#
+# Only allows are cached. A grant made by another worker process, or one
+# still waiting in that worker's write-behind journal, never reaches this
+# cache's invalidate, so a cached deny could outlive it by the whole TTL.
+# Every invalidation also bumps the pair's generation: a decision read
+# from Oso Cloud is only cached if no invalidation happened meanwhile
+# (see generation and put).
+class AuthorizationCache:
+    def __init__(self,
+                 max_entries=DEFAULT_MAX_ENTRIES,
+                 ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._entries = collections.OrderedDict()
+        # (username, repo_name) -> set of cached permissions.
+        self._permissions_by_pair = {}
+        # (username, repo_name) -> invalidations so far. The table is
+        # emptied when it outgrows max_entries, which bumps the epoch so no
+        # decision read before then can be cached.
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale_hits = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _remove_key(self, key):
+        self._entries.pop(key, None)
+        (username, permission, repo_name) = key
+        pair = (username, repo_name)
+        permissions = self._permissions_by_pair.get(pair)
+        if permissions is not None:
+            permissions.discard(permission)
+            if not permissions:
+                del self._permissions_by_pair[pair]
+
+        return None
+
+    # Returns the cached decision (True/False), or None on a miss.
+    def get(self, username, permission, repo_name):
+        key = (username, permission, repo_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.expires_at <= time.monotonic():
+                # Expired entries are kept as the last known decision
+                # (see get_stale) until they are replaced or evicted.
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.allowed
+
+    # Returns the last known decision even if it has expired, or None.
+    # Used to keep serving requests while Oso Cloud is unavailable.
+    def get_stale(self, username, permission, repo_name):
+        key = (username, permission, repo_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            self.stale_hits += 1
+            return entry.allowed
+
+    # Read before asking Oso Cloud for a decision, and passed to put with it.
+    def generation(self, username, repo_name):
+        with self._lock:
+            return (self._epoch, self._generations.get((username, repo_name), 0))
+
+    # Cache an allow. Denies are not cached, and neither is a decision
+    # whose generation shows the pair was invalidated since it was read.
+    def put(self, username, permission, repo_name, allowed, generation=None):
+        if self.max_entries <= 0 or not allowed:
+            return None
+
+        key = (username, permission, repo_name)
+        expires_at = time.monotonic() + self.ttl_seconds
+        with self._lock:
+            if (generation is not None and
+                generation != (self._epoch, self._generations.get((username, repo_name), 0))):
+                return None
+
+            self._entries[key] = _CacheEntry(bool(allowed), expires_at)
+            self._entries.move_to_end(key)
+            self._permissions_by_pair.setdefault(
+                (username, repo_name), set()).add(permission)
+
+            # Evict the least recently used decisions.
+            while len(self._entries) > self.max_entries:
+                (oldest_key, _) = next(iter(self._entries.items()))
+                self._remove_key(oldest_key)
+                self.evictions += 1
+
+        return None
+
+    # Drop every cached decision for the (username, repo_name) pair.
+    def invalidate(self, username, repo_name):
+        with self._lock:
+            self._generations[(username, repo_name)] = (
+                self._generations.get((username, repo_name), 0) + 1)
+            if len(self._generations) > self.max_entries:
+                self._generations.clear()
+                self._epoch += 1
+
+            permissions = self._permissions_by_pair.pop((username, repo_name), None)
+            if permissions:
+                for permission in permissions:
+                    self._entries.pop((username, permission, repo_name), None)
+                    self.invalidations += 1
+
+        return None
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._permissions_by_pair.clear()
+            self._generations.clear()
+            self._epoch += 1
+
+        return None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale_hits": self.stale_hits,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
@@ -0,0 +1,173 @@
+#!/usr/bin/python3
+import argparse
+import errno
+import hashlib
+import os
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+
+# Content-addressed storage for repository files.
+#
+# Every distinct file body is stored once, under objects/<aa>/<rest of
+# the SHA-256 digest>, and repository paths are hard links to it. Writing
+# a file that is already stored costs no extra disk space and no second
+# copy of the bytes: the new upload is hashed as it streams into a
+# temporary file, and the temporary file is dropped if its digest is
+# already known.
+#
+# Blobs are made read-only, since a write through any of their links
+# would change the file in every repository that shares it. Writers
+# always replace a repository path with a new link instead.
+#
+# The store must be on the same filesystem as the repositories for hard
+# links to work; if linking fails the blob is copied instead.
+
+BLOB_DIRECTORY_NAME = ".blobs"
+HASH_ALGORITHM = "sha256"
+
+# Blobs and temporary files younger than this are never collected, so
+# that a blob written but not yet linked into a repository survives.
+DEFAULT_GARBAGE_GRACE_SECONDS = 300.0
+
+_BLOB_FILE_MODE = 0o444
+
+# A binary file wrapper that hashes and counts what is written through it.
+class HashingWriter:
+    def __init__(self, file_object):
+        self.file_object = file_object
+        self.bytes_written = 0
+        self._hash = hashlib.new(HASH_ALGORITHM)
+
+    def write(self, data):
+        self._hash.update(data)
+        self.bytes_written += len(data)
+        return self.file_object.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+class BlobStore:
+    def __init__(self, root_directory):
+        self.root_directory = root_directory
+        self._objects_directory = os.path.join(root_directory, "objects")
+        self._temporary_directory = os.path.join(root_directory, "tmp")
+        os.makedirs(self._objects_directory, exist_ok=True)
+        os.makedirs(self._temporary_directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.blobs_written = 0
+        self.blobs_reused = 0
+        self.bytes_written = 0
+        self.bytes_deduplicated = 0
+        self.links_copied = 0
+
+    def blob_path(self, digest):
+        return os.path.join(self._objects_directory, digest[:2], digest[2:])
+
+    # Returns (file_descriptor, path) of a new temporary file in the store,
+    # to be filled through a HashingWriter and passed to commit.
+    def temporary_file(self):
+        return tempfile.mkstemp(prefix=".blob-", dir=self._temporary_directory)
+
+    # Move a filled temporary file into the store under its digest and
+    # return the blob path. If the blob already exists the temporary
+    # file is discarded.
+    def commit(self, temporary_path, digest, size):
+        blob_path = self.blob_path(digest)
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        os.chmod(temporary_path, _BLOB_FILE_MODE)
+        try:
+            # Unlike os.replace, os.link never swaps out a blob that other
+            # repositories already link to.
+            os.link(temporary_path, blob_path)
+            reused = False
+        except FileExistsError:
+            reused = True
+        finally:
+            os.unlink(temporary_path)
+
+        with self._lock:
+            if reused:
+                self.blobs_reused += 1
+                self.bytes_deduplicated += size
+            else:
+                self.blobs_written += 1
+                self.bytes_written += size
+
+        return blob_path
+
+    # Point target_path at the blob, replacing whatever was there.
+    def link(self, blob_path, target_path):
+        link_path = os.path.join(
+            os.path.dirname(target_path),
+            ".link-{}".format(secrets.token_hex(8)))
+        try:
+            os.link(blob_path, link_path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EMLINK, errno.EPERM, errno.ENOTSUP):
+                raise
+            shutil.copyfile(blob_path, link_path)
+            with self._lock:
+                self.links_copied += 1
+
+        try:
+            os.replace(link_path, target_path)
+        except BaseException:
+            os.unlink(link_path)
+            raise
+
+        return target_path
+
+    # Remove blobs no repository links to any more, and temporary files
+    # left behind by interrupted writes. Returns the number of bytes freed.
+    def collect_garbage(self, grace_seconds=DEFAULT_GARBAGE_GRACE_SECONDS):
+        cutoff = time.time() - grace_seconds
+        bytes_freed = 0
+
+        for directory_entry in os.scandir(self._temporary_directory):
+            entry_stat = directory_entry.stat()
+            if entry_stat.st_mtime < cutoff:
+                os.unlink(directory_entry.path)
+                bytes_freed += entry_stat.st_size
+
+        for fan_out_entry in os.scandir(self._objects_directory):
+            if not fan_out_entry.is_dir():
+                continue
+            for blob_entry in os.scandir(fan_out_entry.path):
+                blob_stat = blob_entry.stat()
+                # Linking and unlinking update st_ctime, so a recently
+                # committed or unlinked blob is left for the next pass.
+                if 1 == blob_stat.st_nlink and blob_stat.st_ctime < cutoff:
+                    os.unlink(blob_entry.path)
+                    bytes_freed += blob_stat.st_size
+
+        return bytes_freed
+
+    def stats(self):
+        with self._lock:
+            bytes_received = self.bytes_written + self.bytes_deduplicated
+            return {
+                "blobs_written": self.blobs_written,
+                "blobs_reused": self.blobs_reused,
+                "bytes_written": self.bytes_written,
+                "bytes_deduplicated": self.bytes_deduplicated,
+                "deduplication_ratio": (self.bytes_deduplicated / bytes_received) if bytes_received else 0.0,
+                "links_copied": self.links_copied
+            }
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Maintain the content-addressed blob store.")
+    parser.add_argument("--root", default=os.path.join("repo-host-root", BLOB_DIRECTORY_NAME),
+                        help="Blob store directory.")
+    parser.add_argument("--grace", type=float, default=DEFAULT_GARBAGE_GRACE_SECONDS,
+                        help="Seconds an unreferenced blob is kept before it is removed.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = _parse_arguments()
+    blob_store = BlobStore(arguments.root)
+    freed = blob_store.collect_garbage(grace_seconds=arguments.grace)
+    print("Removed {} bytes of unreferenced blobs from {}".format(freed, arguments.root))
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+import asyncio
+import concurrent.futures
+import threading
+import time
+
+# Circuit breaker for calls to a remote backend (i.e. Oso Cloud).
+#
+# CLOSED:    calls go through. Consecutive failures (errors or timeouts)
+#            are counted and the breaker opens at failure_threshold.
+# OPEN:      calls fail immediately with CircuitOpenError until
+#            reset_timeout_seconds have passed.
+# HALF_OPEN: a single trial call is let through. Success closes the
+#            breaker, failure opens it again.
+#
+# Calls run on a bounded pool of worker threads so that a slow backend
+# times out after call_timeout_seconds instead of holding the request
+# thread. When every worker is busy the call is rejected right away
+# rather than queued behind the slow ones.
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_TIMEOUT_SECONDS = 30.0
+DEFAULT_CALL_TIMEOUT_SECONDS = 5.0
+DEFAULT_MAX_CONCURRENT_CALLS = 32
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# The backend cannot be used right now; callers should degrade or
+# report the service as unavailable.
+class BackendUnavailableError(Exception):
+    pass
+
+class CircuitOpenError(BackendUnavailableError):
+    pass
+
+class CallTimeoutError(BackendUnavailableError):
+    pass
+
+class CircuitBreaker:
+    def __init__(self,
+                 failure_threshold=DEFAULT_FAILURE_THRESHOLD,
+                 reset_timeout_seconds=DEFAULT_RESET_TIMEOUT_SECONDS,
+                 call_timeout_seconds=DEFAULT_CALL_TIMEOUT_SECONDS,
+                 max_concurrent_calls=DEFAULT_MAX_CONCURRENT_CALLS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_seconds = reset_timeout_seconds
+        self.call_timeout_seconds = call_timeout_seconds
+        self.max_concurrent_calls = max_concurrent_calls
+
+        self._state = STATE_CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+        self._call_slots = threading.BoundedSemaphore(max_concurrent_calls)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_concurrent_calls,
+            thread_name_prefix="circuit-breaker")
+
+        self.successes = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.rejections = 0
+        self.times_opened = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if (STATE_OPEN == self._state and
+            time.monotonic() - self._opened_at >= self.reset_timeout_seconds):
+            self._state = STATE_HALF_OPEN
+        return self._state
+
+    def _admit(self):
+        with self._lock:
+            state = self._current_state()
+            if STATE_OPEN == state:
+                self.rejections += 1
+                raise CircuitOpenError("The circuit breaker is open.")
+            if STATE_HALF_OPEN == state:
+                if self._trial_in_flight:
+                    self.rejections += 1
+                    raise CircuitOpenError("The circuit breaker is waiting on a trial call.")
+                self._trial_in_flight = True
+
+        return None
+
+    def _record_success(self):
+        with self._lock:
+            self.successes += 1
+            self._consecutive_failures = 0
+            self._trial_in_flight = False
+            self._state = STATE_CLOSED
+
+        return None
+
+    def _record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._consecutive_failures += 1
+            was_trial = self._trial_in_flight
+            self._trial_in_flight = False
+            if (was_trial or
+                (STATE_CLOSED == self._state and
+                 self._consecutive_failures >= self.failure_threshold)):
+                if STATE_OPEN != self._state:
+                    self.times_opened += 1
+                self._state = STATE_OPEN
+                self._opened_at = time.monotonic()
+
+        return None
+
+    # A call refused locally, before it reached the backend. It says
+    # nothing about the backend's health, so it is not a failure, but a
+    # trial call refused this way frees the trial for the next caller.
+    def _record_rejection(self):
+        with self._lock:
+            self.rejections += 1
+            self._trial_in_flight = False
+
+        return None
+
+    def _release_slot(self, _):
+        self._call_slots.release()
+
+        return None
+
+    def call(self, function, *args, **kwargs):
+        self._admit()
+
+        if not self._call_slots.acquire(blocking=False):
+            # Every worker is tied up in a slow call.
+            self._record_rejection()
+            raise CircuitOpenError("Too many calls are waiting on the backend.")
+
+        future = self._executor.submit(function, *args, **kwargs)
+        # The slot is freed when the call really finishes, even if the
+        # caller stopped waiting for it.
+        future.add_done_callback(self._release_slot)
+        try:
+            result = future.result(timeout=self.call_timeout_seconds)
+        except concurrent.futures.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            self._record_failure()
+            raise CallTimeoutError("The backend did not respond within {} seconds.".format(
+                self.call_timeout_seconds))
+        except Exception:
+            self._record_failure()
+            raise
+
+        self._record_success()
+        return result
+
+    # Await a coroutine function through the breaker. The call needs no
+    # worker thread, so only the state and the timeout apply, not
+    # max_concurrent_calls.
+    async def call_async(self, function, *args, **kwargs):
+        self._admit()
+
+        try:
+            result = await asyncio.wait_for(
+                function(*args, **kwargs),
+                timeout=self.call_timeout_seconds)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            self._record_failure()
+            raise CallTimeoutError("The backend did not respond within {} seconds.".format(
+                self.call_timeout_seconds))
+        except Exception:
+            self._record_failure()
+            raise
+
+        self._record_success()
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutive_failures": self._consecutive_failures,
+                "successes": self.successes,
+                "failures": self.failures,
+                "timeouts": self.timeouts,
+                "rejections": self.rejections,
+                "times_opened": self.times_opened
+            }
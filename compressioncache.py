@@ -0,0 +1,327 @@
+#!/usr/bin/python3
+import gzip
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Compressed variants of repository files, kept on disk.
+#
+# A variant is stored under the file's strong ETag and the encoding, so a
+# file is compressed once per version no matter how often it is
+# downloaded, and a changed file simply misses. The cache directory is
+# bounded by size: the least recently served variants are removed first.
+#
+# Every worker process shares the directory, so the variants, their sizes
+# and when each was last served are kept in one SQLite database in it,
+# updated in short write transactions (as ratelimits.py does), and the
+# bound holds for the directory as a whole. A variant is handed out as a
+# file opened before anyone can evict it, so removing it while it is
+# being sent does not cut the download short.
+#
+# gzip is always available; zstd is offered when the optional zstandard
+# package is installed.
+
+ENCODING_GZIP = "gzip"
+ENCODING_ZSTD = "zstd"
+
+COMPRESSED_DIRECTORY_NAME = ".compressed"
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# Files smaller than this gain little from compression, and larger ones
+# would keep the first request waiting too long; both are sent as is.
+MIN_COMPRESS_BYTES = 1024
+MAX_COMPRESS_BYTES = 64 * 1024 * 1024
+
+# Temporary files older than this are left over from an interrupted write.
+STALE_TEMPORARY_FILE_SECONDS = 3600.0
+
+VARIANTS_FILE_NAME = "variants.sqlite3"
+# Seconds a write waits for another process holding the database.
+BUSY_TIMEOUT_SECONDS = 5.0
+# A hit records when the variant was served at most this often, so a
+# popular variant does not write to the database on every download.
+TOUCH_INTERVAL_SECONDS = 10.0
+
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+COPY_CHUNK_SIZE = 64 * 1024
+
+_COMPRESSIBLE_MIMETYPES = {
+    "application/javascript",
+    "application/json",
+    "application/ld+json",
+    "application/sql",
+    "application/toml",
+    "application/wasm",
+    "application/x-httpd-php",
+    "application/x-javascript",
+    "application/x-sh",
+    "application/x-tex",
+    "application/xhtml+xml",
+    "application/xml",
+    "application/yaml",
+    "image/svg+xml"
+}
+
+def is_compressible(mimetype):
+    if mimetype is None:
+        return False
+    mimetype = mimetype.split(";")[0].strip().lower()
+    return (mimetype.startswith("text/") or
+            mimetype in _COMPRESSIBLE_MIMETYPES or
+            mimetype.endswith("+json") or
+            mimetype.endswith("+xml"))
+
+# Encodings in order of preference.
+def available_encodings():
+    if zstandard is not None:
+        return [ENCODING_ZSTD, ENCODING_GZIP]
+    return [ENCODING_GZIP]
+
+def _compress(source_file, target_file, encoding):
+    if ENCODING_ZSTD == encoding:
+        zstandard.ZstdCompressor(level=ZSTD_LEVEL).copy_stream(
+            source_file,
+            target_file,
+            read_size=COPY_CHUNK_SIZE)
+        return None
+
+    # mtime=0 keeps the output identical for identical input.
+    with gzip.GzipFile(fileobj=target_file, mode="wb", compresslevel=GZIP_LEVEL, mtime=0) as gzip_file:
+        shutil.copyfileobj(source_file, gzip_file, COPY_CHUNK_SIZE)
+
+    return None
+
+class CompressionCache:
+    def __init__(self, root_directory, max_bytes=DEFAULT_MAX_CACHE_BYTES):
+        self.root_directory = os.path.abspath(root_directory)
+        self.database_path = os.path.join(self.root_directory, VARIANTS_FILE_NAME)
+        self.max_bytes = max_bytes
+        os.makedirs(self.root_directory, exist_ok=True)
+
+        # Variant path -> when this process last recorded serving it.
+        self._touched = {}
+        # Variant path -> Event set once the variant has been written.
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+        with self._lock:
+            self._load()
+
+    # Called with the lock held. A connection must not be used across a
+    # fork, so every process opens its own, on first use.
+    def _connect(self):
+        if self._connection_pid == os.getpid():
+            return self._connection
+
+        self._connection = sqlite3.connect(
+            self.database_path,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            isolation_level=None,
+            check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=OFF")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS variants ("
+            "path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "served REAL NOT NULL)")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS variants_served ON variants (served)")
+        self._connection_pid = os.getpid()
+        self._touched.clear()
+
+        return self._connection
+
+    # Called with the lock held. Record the variants on disk that the
+    # database does not know of, i.e. left by a run without it, and remove
+    # interrupted writes.
+    def _load(self):
+        connection = self._connect()
+        known_paths = set(row[0] for row in connection.execute("SELECT path FROM variants"))
+        variants = []
+        for directory_entry in os.scandir(self.root_directory):
+            # Variants are stored one directory down.
+            if not directory_entry.is_dir():
+                continue
+            for file_entry in os.scandir(directory_entry.path):
+                variant_stat = file_entry.stat()
+                if file_entry.name.startswith("."):
+                    # An interrupted write, unless another process is
+                    # still writing it.
+                    if time.time() - variant_stat.st_mtime > STALE_TEMPORARY_FILE_SECONDS:
+                        os.unlink(file_entry.path)
+                    continue
+                if file_entry.path not in known_paths:
+                    variants.append((file_entry.path, variant_stat.st_size, variant_stat.st_mtime))
+
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.executemany("INSERT OR IGNORE INTO variants VALUES (?, ?, ?)", variants)
+            self._evict(connection)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        return None
+
+    def _variant_path(self, etag, encoding):
+        return os.path.join(
+            self.root_directory,
+            etag[:2],
+            "{}.{}".format(etag, encoding))
+
+    # Called with the lock held, in a write transaction. Removes the least
+    # recently served variants, except keep_path, until the cache fits in
+    # max_bytes.
+    def _evict(self, connection, keep_path=None):
+        total_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM variants").fetchone()[0]
+        if total_bytes <= self.max_bytes:
+            return None
+
+        for (variant_path, size) in connection.execute(
+                "SELECT path, size FROM variants ORDER BY served").fetchall():
+            if total_bytes <= self.max_bytes:
+                break
+            if variant_path == keep_path:
+                continue
+            connection.execute("DELETE FROM variants WHERE path = ?", (variant_path,))
+            total_bytes -= size
+            self.evictions += 1
+            self._touched.pop(variant_path, None)
+            try:
+                os.unlink(variant_path)
+            except FileNotFoundError:
+                pass
+
+        return None
+
+    # Called with the lock held. Record that the variant was served, and
+    # its size if the database does not know it yet.
+    def _record(self, variant_path, size, evict=False):
+        now = time.time()
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(
+                "INSERT INTO variants VALUES (?, ?, ?) "
+                "ON CONFLICT (path) DO UPDATE SET served = excluded.served",
+                (variant_path, size, now))
+            if evict:
+                # Never evict the variant about to be served.
+                self._evict(connection, keep_path=variant_path)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._touched[variant_path] = now
+
+        return None
+
+    def _write_variant(self, source_file, variant_path, encoding):
+        variant_directory = os.path.dirname(variant_path)
+        os.makedirs(variant_directory, exist_ok=True)
+        (temporary_file_descriptor, temporary_file_path) = tempfile.mkstemp(
+            prefix=".compress-",
+            dir=variant_directory)
+        try:
+            source_file.seek(0)
+            with os.fdopen(temporary_file_descriptor, "wb") as target_file:
+                _compress(source_file, target_file, encoding)
+            source_size = source_file.tell()
+            os.replace(temporary_file_path, variant_path)
+        except BaseException:
+            os.unlink(temporary_file_path)
+            raise
+
+        return source_size
+
+    # Returns source_file, a file opened for reading in binary mode,
+    # compressed with encoding and opened for reading, compressing it first
+    # if needed. etag must change whenever the file's contents do. Concurrent requests for the same variant in this
+    # process wait for a single writer; a variant missing from disk, i.e.
+    # just evicted by another process, is written again.
+    def open_variant(self, source_file, etag, encoding):
+        variant_path = self._variant_path(etag, encoding)
+        while True:
+            try:
+                variant_file = open(variant_path, "rb")
+            except FileNotFoundError:
+                variant_file = None
+
+            with self._lock:
+                if variant_file is not None:
+                    self.hits += 1
+                    if time.time() - self._touched.get(variant_path, 0.0) >= TOUCH_INTERVAL_SECONDS:
+                        self._record(variant_path, os.fstat(variant_file.fileno()).st_size)
+                    return variant_file
+
+                in_flight = self._in_flight.get(variant_path)
+                if in_flight is None:
+                    in_flight = threading.Event()
+                    self._in_flight[variant_path] = in_flight
+                    self.misses += 1
+                    break
+            in_flight.wait()
+
+        try:
+            source_size = self._write_variant(source_file, variant_path, encoding)
+            variant_file = open(variant_path, "rb")
+            try:
+                variant_size = os.fstat(variant_file.fileno()).st_size
+                with self._lock:
+                    self.bytes_read += source_size
+                    self.bytes_written += variant_size
+                    self._record(variant_path, variant_size, evict=True)
+            except BaseException:
+                variant_file.close()
+                raise
+        finally:
+            with self._lock:
+                del self._in_flight[variant_path]
+            in_flight.set()
+
+        return variant_file
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._connection_pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+            self._connection_pid = None
+
+        return None
+
+    def stats(self):
+        with self._lock:
+            (variant_count, total_bytes) = self._connect().execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM variants").fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "variants": variant_count,
+                "bytes": total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "compression_ratio": (self.bytes_written / self.bytes_read) if self.bytes_read else 0.0,
+                "encodings": available_encodings()
+            }
@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+import base64
+import binascii
+import heapq
+import os
+
+# Bounded-memory directory walks for /list-directories.
+#
+# Entries are produced one at a time from os.scandir rather than collected
+# into a list, so memory does not grow with the size of a directory:
+#
+# walk_entries:  every entry in scandir order, depth first, for streaming.
+#                At most one open scandir iterator per directory level.
+# page_entries:  one page of entries in a stable (sorted, depth first)
+#                order, resumable from a cursor. Each directory level keeps
+#                at most page_size candidates (heapq.nsmallest), so a page
+#                costs O(page_size) memory however large the directory is.
+#
+# Paths are relative to the listed directory and use "/" separators.
+# Symbolic links are never followed.
+
+ENTRY_TYPE_DIRECTORY = "directory"
+ENTRY_TYPE_FILE = "file"
+
+# Deepest level a recursive walk descends to.
+MAX_DEPTH = 64
+
+# Name prefixes of the temporary files writers leave next to their target.
+TEMPORARY_FILE_PREFIXES = (".upload-", ".link-")
+
+class InvalidCursorError(ValueError):
+    pass
+
+def encode_cursor(relative_path):
+    return base64.urlsafe_b64encode(relative_path.encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor):
+    try:
+        relative_path = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursorError("The cursor is not valid.")
+
+    cursor_parts = tuple(relative_path.split("/"))
+    if not relative_path or "" in cursor_parts:
+        raise InvalidCursorError("The cursor is not valid.")
+    return cursor_parts
+
+def _join(relative_directory, name):
+    if not relative_directory:
+        return name
+    return "{}/{}".format(relative_directory, name)
+
+def _entry_info(directory_entry, is_directory):
+    if is_directory:
+        return (ENTRY_TYPE_DIRECTORY, None)
+    return (ENTRY_TYPE_FILE, directory_entry.stat(follow_symlinks=False).st_size)
+
+def _is_listed(directory_entry, include_files):
+    if directory_entry.name.startswith(TEMPORARY_FILE_PREFIXES):
+        return (False, False)
+    is_directory = directory_entry.is_dir(follow_symlinks=False)
+    return (is_directory or include_files, is_directory)
+
+# Yields (relative_path, entry_type, size) for every entry under
+# full_directory_path, down to max_depth levels (1 lists only the
+# directory's own entries). size is None for directories.
+def walk_entries(full_directory_path, max_depth=1, include_files=False):
+    max_depth = min(max_depth, MAX_DEPTH)
+    stack = [(os.scandir(full_directory_path), "", 1)]
+    try:
+        while stack:
+            (scandir_iterator, relative_directory, depth) = stack[-1]
+            directory_entry = next(scandir_iterator, None)
+            if directory_entry is None:
+                scandir_iterator.close()
+                stack.pop()
+                continue
+
+            (listed, is_directory) = _is_listed(directory_entry, include_files)
+            if not listed:
+                continue
+
+            relative_path = _join(relative_directory, directory_entry.name)
+            (entry_type, size) = _entry_info(directory_entry, is_directory)
+            yield (relative_path, entry_type, size)
+
+            if is_directory and depth < max_depth:
+                stack.append((os.scandir(directory_entry.path), relative_path, depth + 1))
+    finally:
+        for (scandir_iterator, _, _) in stack:
+            scandir_iterator.close()
+
+def _page_candidates(full_directory_path, resume_name, can_descend, include_files):
+    with os.scandir(full_directory_path) as scandir_iterator:
+        for directory_entry in scandir_iterator:
+            if resume_name is not None and directory_entry.name < resume_name:
+                continue
+            (listed, is_directory) = _is_listed(directory_entry, include_files)
+            if not listed:
+                continue
+            # The entry named by the cursor was already returned; only its
+            # subtree (if any) remains.
+            if directory_entry.name == resume_name and not (is_directory and can_descend):
+                continue
+            yield (directory_entry.name, is_directory, directory_entry)
+
+def _page_walk(full_directory_path,
+               relative_directory,
+               depth,
+               max_depth,
+               include_files,
+               cursor_parts,
+               page_size):
+    resume_name = cursor_parts[0] if cursor_parts else None
+    can_descend = depth < max_depth
+    # Every candidate but the resumed one yields an entry of its own, so
+    # page_size of them (plus that one) are enough to fill the page.
+    candidates = heapq.nsmallest(
+        page_size if resume_name is None else page_size + 1,
+        _page_candidates(full_directory_path, resume_name, can_descend, include_files),
+        key=lambda candidate: candidate[0])
+
+    for (name, is_directory, directory_entry) in candidates:
+        relative_path = _join(relative_directory, name)
+        resuming = (name == resume_name)
+        if not resuming:
+            (entry_type, size) = _entry_info(directory_entry, is_directory)
+            yield (relative_path, entry_type, size)
+        if is_directory and can_descend:
+            yield from _page_walk(
+                directory_entry.path,
+                relative_path,
+                depth + 1,
+                max_depth,
+                include_files,
+                cursor_parts[1:] if resuming else (),
+                page_size)
+
+# Returns (entries, next_cursor): up to page_size (relative_path,
+# entry_type, size) tuples following the cursor, and the cursor of the
+# next page, or None after the last page.
+def page_entries(full_directory_path,
+                 page_size,
+                 cursor=None,
+                 max_depth=1,
+                 include_files=False):
+    max_depth = min(max_depth, MAX_DEPTH)
+    cursor_parts = decode_cursor(cursor) if cursor else ()
+
+    entries = []
+    page_walk = _page_walk(
+        full_directory_path,
+        "",
+        1,
+        max_depth,
+        include_files,
+        cursor_parts,
+        page_size + 1)
+    for entry in page_walk:
+        entries.append(entry)
+        if len(entries) > page_size:
+            break
+    page_walk.close()
+
+    if len(entries) <= page_size:
+        return (entries, None)
+
+    entries = entries[:page_size]
+    return (entries, encode_cursor(entries[-1][0]))
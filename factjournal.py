@@ -0,0 +1,348 @@
+#!/usr/bin/python3
+import collections
+import json
+import os
+import re
+import threading
+
+import localpolicy
+
+# Write-behind journal for Oso facts.
+#
+# Facts are appended to a local, append-only journal file and confirmed
+# to the caller immediately. A background worker sends pending facts to
+# Oso Cloud in bulk, oldest first, and appends an acknowledgement record
+# once a batch has been accepted. Acknowledgements are cumulative ("every
+# fact up to seq N is stored in Oso Cloud"), so facts are always sent in
+# the order they were written. Any fact without an acknowledgement is sent
+# again after a restart.
+#
+# Journal records are JSON lines of one of two forms:
+#   {"seq": <n>, "fact": [<predicate>, <arg>, ...]}
+#   {"ack": <n>}
+#
+# Transport errors and 5xx responses are retried with backoff. A fact
+# Oso Cloud rejects with a 4xx would be rejected again on every retry and
+# hold back every fact behind it, so it is moved to a dead-letter file
+# next to the journal (one {"seq", "fact", "error"} JSON line each),
+# logged, and acknowledged. When a batch is rejected, its facts are sent
+# again one by one to find the rejected ones.
+#
+# Each pre-forked worker has a journal of its own. With shared_pending (a
+# sharedfacts.SharedFacts), its pending facts are also told there and
+# deleted once confirmed or rejected, so every worker honors a grant
+# before Oso Cloud has confirmed it, not only the worker that wrote it.
+
+JOURNAL_DIRECTORY_NAME = ".oso-facts"
+JOURNAL_FILE_NAME = "journal.log"
+
+# The journal of one pre-forked worker. Slot 0 keeps the single-process
+# name, so a server going from one worker to several keeps its journal.
+def journal_file_name(worker_slot=0):
+    if 0 == worker_slot:
+        return JOURNAL_FILE_NAME
+    return "journal-{}.log".format(worker_slot)
+
+DEFAULT_FLUSH_INTERVAL_SECONDS = 0.2
+DEFAULT_MAX_BATCH_SIZE = 100
+DEFAULT_MIN_RETRY_DELAY_SECONDS = 0.5
+DEFAULT_MAX_RETRY_DELAY_SECONDS = 30.0
+
+# Rewrite the journal once everything in it has been acknowledged and it
+# has grown past this size.
+DEFAULT_COMPACT_SIZE_IN_BYTES = 1024 * 1024
+
+# 4xx responses that are retried like 5xx ones: timeouts, throttling, and
+# credentials errors, which reject this client rather than the fact.
+RETRIED_CLIENT_ERROR_CODES = (401, 403, 408, 425, 429)
+
+# The oso_cloud client raises a plain Exception carrying the status code.
+_OSO_STATUS_CODE_PATTERN = re.compile(r"error from Oso Service: (\d{3})")
+
+# Whether error is Oso Cloud refusing the facts themselves, so sending them
+# again cannot succeed.
+def is_rejection(error):
+    status_code = getattr(getattr(error, "response", None), "status_code", None)
+    if status_code is None:
+        match = _OSO_STATUS_CODE_PATTERN.search(str(error))
+        if match is None:
+            return False
+        status_code = int(match.group(1))
+
+    return 400 <= status_code < 500 and status_code not in RETRIED_CLIENT_ERROR_CODES
+
+def dead_letter_path(journal_path):
+    return "{}.rejected.log".format(os.path.splitext(journal_path)[0])
+
+class FactJournal:
+    def __init__(self,
+                 journal_path,
+                 oso_client,
+                 policy,
+                 on_confirmed=None,
+                 flush_interval_seconds=DEFAULT_FLUSH_INTERVAL_SECONDS,
+                 max_batch_size=DEFAULT_MAX_BATCH_SIZE,
+                 min_retry_delay_seconds=DEFAULT_MIN_RETRY_DELAY_SECONDS,
+                 max_retry_delay_seconds=DEFAULT_MAX_RETRY_DELAY_SECONDS,
+                 compact_size_in_bytes=DEFAULT_COMPACT_SIZE_IN_BYTES,
+                 fsync=True,
+                 shared_pending=None):
+        self.journal_path = journal_path
+        self.shared_pending = shared_pending
+        self.dead_letter_path = dead_letter_path(journal_path)
+        self.oso_client = oso_client
+        self.on_confirmed = on_confirmed
+        self.flush_interval_seconds = flush_interval_seconds
+        self.max_batch_size = max_batch_size
+        self.min_retry_delay_seconds = min_retry_delay_seconds
+        self.max_retry_delay_seconds = max_retry_delay_seconds
+        self.compact_size_in_bytes = compact_size_in_bytes
+        self.fsync = fsync
+
+        # Facts that are not yet stored in Oso Cloud, answered locally
+        # so a grant is honored before it is confirmed.
+        self._pending_authorizer = localpolicy.LocalAuthorizer(policy)
+        # Deque of (seq, fact) in journal order.
+        self._pending = collections.deque()
+        self._next_seq = 1
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._stopping = False
+        self._worker = None
+
+        self.flushed_facts = 0
+        self.flush_failures = 0
+        self.rejected_facts = 0
+
+        self._replay()
+        self._journal_file = open(self.journal_path, "a")
+
+    def _replay(self):
+        if not os.path.exists(self.journal_path):
+            return None
+
+        facts_by_seq = collections.OrderedDict()
+        acked_seq = 0
+        with open(self.journal_path) as journal_file:
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A torn final line from a crash mid-append.
+                    continue
+                if "ack" in record:
+                    acked_seq = max(acked_seq, record["ack"])
+                elif "seq" in record:
+                    facts_by_seq[record["seq"]] = record["fact"]
+                    self._next_seq = max(self._next_seq, record["seq"] + 1)
+
+        for (seq, fact) in facts_by_seq.items():
+            if seq > acked_seq:
+                self._pending.append((seq, fact))
+                self._pending_authorizer.tell(*fact)
+
+        # Start over with only the unacknowledged facts.
+        self._rewrite_journal()
+
+        return None
+
+    def _rewrite_journal(self):
+        temporary_path = "{}.tmp".format(self.journal_path)
+        with open(temporary_path, "w") as journal_file:
+            for (seq, fact) in self._pending:
+                journal_file.write(json.dumps({"seq": seq, "fact": fact}) + "\n")
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(temporary_path, self.journal_path)
+
+        return None
+
+    def _write_record(self, record):
+        self._journal_file.write(json.dumps(record) + "\n")
+        self._journal_file.flush()
+        if self.fsync:
+            os.fsync(self._journal_file.fileno())
+
+        return None
+
+    # Durably record a fact. It is sent to Oso Cloud by the worker.
+    def append(self, predicate, *args):
+        fact = [predicate] + list(args)
+        with self._lock:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._write_record({"seq": seq, "fact": fact})
+            self._pending.append((seq, fact))
+            self._pending_authorizer.tell(*fact)
+            self._wake.notify()
+        if self.shared_pending is not None:
+            try:
+                self.shared_pending.tell(*fact)
+            except OSError as e:
+                # Only the other workers wait for Oso Cloud to confirm it.
+                print(e)
+
+        return seq
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    # Whether a fact still waiting to be confirmed, by this or any worker
+    # sharing shared_pending, grants the permission.
+    def pending_allows(self, actor, permission, resource):
+        if self._pending_authorizer.authorize(actor, permission, resource):
+            return True
+        return (self.shared_pending is not None and
+                self.shared_pending.authorize(actor, permission, resource))
+
+    def _drop_shared(self, facts):
+        if self.shared_pending is None:
+            return None
+        for fact in facts:
+            try:
+                self.shared_pending.delete(*fact)
+            except OSError as e:
+                # The other workers keep honoring the fact until a restart.
+                print(e)
+
+        return None
+
+    def _next_batch(self):
+        with self._lock:
+            return [self._pending[index]
+                    for index in range(min(self.max_batch_size, len(self._pending)))]
+
+    def _confirm(self, batch):
+        with self._lock:
+            for _ in batch:
+                (_, fact) = self._pending.popleft()
+                self._pending_authorizer.delete(*fact)
+            self._write_record({"ack": batch[-1][0]})
+            self.flushed_facts += len(batch)
+
+            if (not self._pending and
+                self._journal_file.tell() >= self.compact_size_in_bytes):
+                self._journal_file.close()
+                self._rewrite_journal()
+                self._journal_file = open(self.journal_path, "a")
+
+        self._drop_shared([fact for (_, fact) in batch])
+        if self.on_confirmed is not None:
+            self.on_confirmed([fact for (_, fact) in batch])
+
+        return None
+
+    # Move the oldest pending fact, which Oso Cloud rejected, to the
+    # dead-letter file.
+    def _reject(self, seq, fact, error):
+        with self._lock:
+            self._pending.popleft()
+            self._pending_authorizer.delete(*fact)
+            with open(self.dead_letter_path, "a") as dead_letter_file:
+                dead_letter_file.write(json.dumps({"seq": seq, "fact": fact, "error": str(error)}) + "\n")
+                dead_letter_file.flush()
+                if self.fsync:
+                    os.fsync(dead_letter_file.fileno())
+            self._write_record({"ack": seq})
+            self.rejected_facts += 1
+        self._drop_shared([fact])
+
+        print("Oso Cloud rejected fact {} {}, moved it to {}: {}".format(
+            seq,
+            json.dumps(fact),
+            self.dead_letter_path,
+            error))
+
+        return None
+
+    # Returns the number of facts of batch that were confirmed; the others
+    # were rejected. Raises if the batch should be retried.
+    def _send(self, batch):
+        try:
+            self.oso_client.bulk_tell([fact for (_, fact) in batch])
+        except Exception as e:
+            if not is_rejection(e):
+                raise
+            if 1 == len(batch):
+                self._reject(batch[0][0], batch[0][1], e)
+                return 0
+            return sum(self._send([entry]) for entry in batch)
+
+        self._confirm(batch)
+        return len(batch)
+
+    # Send the oldest pending facts to Oso Cloud. Returns the number of
+    # facts confirmed; rejected facts are moved to the dead-letter file.
+    # Raises if the batch could not be sent and should be retried.
+    def flush_once(self):
+        batch = self._next_batch()
+        if not batch:
+            return 0
+
+        return self._send(batch)
+
+    def _run(self):
+        retry_delay_seconds = self.min_retry_delay_seconds
+        while True:
+            with self._lock:
+                if not self._pending and not self._stopping:
+                    self._wake.wait(self.flush_interval_seconds)
+                if self._stopping and not self._pending:
+                    return None
+
+            try:
+                self.flush_once()
+                retry_delay_seconds = self.min_retry_delay_seconds
+            except Exception as e:
+                print(e)
+                self.flush_failures += 1
+                with self._lock:
+                    if self._stopping:
+                        # Leave the rest for the next start-up.
+                        return None
+                    self._wake.wait(retry_delay_seconds)
+                retry_delay_seconds = min(retry_delay_seconds * 2,
+                                          self.max_retry_delay_seconds)
+
+    def start(self):
+        with self._lock:
+            if self._worker is not None:
+                return None
+            self._stopping = False
+            self._worker = threading.Thread(
+                target=self._run,
+                name="fact-journal",
+                daemon=True)
+            self._worker.start()
+
+        return None
+
+    # Stop the worker after it has sent everything it can.
+    def stop(self, timeout_seconds=None):
+        with self._lock:
+            worker = self._worker
+            self._stopping = True
+            self._wake.notify()
+        if worker is not None:
+            worker.join(timeout_seconds)
+        with self._lock:
+            self._worker = None
+
+        return None
+
+    def close(self, timeout_seconds=None):
+        self.stop(timeout_seconds)
+        with self._lock:
+            self._journal_file.close()
+
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "flushed": self.flushed_facts,
+                "flush_failures": self.flush_failures,
+                "rejected": self.rejected_facts
+            }
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+import argparse
+import collections
+import contextlib
+import hashlib
+import mimetypes
+import os
+import sqlite3
+import threading
+
+import directorylisting
+
+# Per-repository index of file metadata.
+#
+# Each repository gets a small SQLite database holding the size, mtime,
+# inode, SHA-256 digest and mimetype of its files. It is updated as files
+# are written through repohostutils, so requests can read a file's
+# metadata without hashing it or guessing its mimetype again. Files
+# changed behind the application's back are picked up by rebuilding the
+# index from disk:
+#   python3 fileindex.py [--username <user> [--repo-name <repo>]]
+
+INDEX_DIRECTORY_NAME = ".file-index"
+INDEX_FILE_EXTENSION = "sqlite3"
+HASH_ALGORITHM = "sha256"
+HASH_CHUNK_SIZE = 64 * 1024
+
+# Repositories whose index database is kept open at once.
+DEFAULT_MAX_OPEN_INDEXES = 128
+
+FileRecord = collections.namedtuple(
+    "FileRecord",
+    ["file_path", "size", "mtime_ns", "inode", "content_hash", "mimetype"])
+
+def hash_file(full_file_path):
+    file_hash = hashlib.new(HASH_ALGORITHM)
+    with open(full_file_path, "rb") as f:
+        while True:
+            chunk = f.read(HASH_CHUNK_SIZE)
+            if not chunk:
+                break
+            file_hash.update(chunk)
+
+    return file_hash.hexdigest()
+
+def guess_mimetype(file_path):
+    (mimetype_str, _) = mimetypes.guess_type(file_path)
+    return mimetype_str
+
+def normalize_file_path(file_path):
+    return os.path.normpath(file_path.replace("\\", "/")).lstrip("/")
+
+# Describe a file from its stat result and content hash.
+def make_record(file_path, file_stat, content_hash):
+    file_path = normalize_file_path(file_path)
+    return FileRecord(
+        file_path,
+        file_stat.st_size,
+        file_stat.st_mtime_ns,
+        file_stat.st_ino,
+        content_hash,
+        guess_mimetype(file_path))
+
+class RepoFileIndex:
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(index_path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "file_path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, "
+            "mtime_ns INTEGER NOT NULL, "
+            "inode INTEGER NOT NULL, "
+            "content_hash TEXT, "
+            "mimetype TEXT)")
+        self._connection.commit()
+
+        # Guarded by the FileIndexes lock: the threads using this index,
+        # and whether it has left the open indexes and should be closed
+        # once the last of them is done.
+        self._users = 0
+        self._evicted = False
+
+    def put(self, record):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                tuple(record))
+            self._connection.commit()
+
+        return None
+
+    def get(self, file_path):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT * FROM files WHERE file_path = ?",
+                (normalize_file_path(file_path),)).fetchone()
+
+        if row is None:
+            return None
+        return FileRecord(*row)
+
+    def remove(self, file_path):
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM files WHERE file_path = ?",
+                (normalize_file_path(file_path),))
+            self._connection.commit()
+
+        return None
+
+    def records(self):
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT * FROM files ORDER BY file_path").fetchall()
+
+        return [FileRecord(*row) for row in rows]
+
+    # Replace the whole index with the files currently in repo_directory.
+    # Returns the number of files indexed.
+    def rebuild(self, repo_directory):
+        records = []
+        for (directory_path, _, file_names) in os.walk(repo_directory):
+            for file_name in file_names:
+                if file_name.startswith(directorylisting.TEMPORARY_FILE_PREFIXES):
+                    continue
+                full_file_path = os.path.join(directory_path, file_name)
+                file_path = os.path.relpath(full_file_path, repo_directory)
+                records.append(make_record(
+                    file_path,
+                    os.stat(full_file_path),
+                    hash_file(full_file_path)))
+
+        with self._lock:
+            with self._connection:
+                self._connection.execute("DELETE FROM files")
+                self._connection.executemany(
+                    "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                    [tuple(record) for record in records])
+
+        return len(records)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+        return None
+
+# The index databases of every repository, opened on first use.
+class FileIndexes:
+    def __init__(self, root_directory, max_open_indexes=DEFAULT_MAX_OPEN_INDEXES):
+        self.root_directory = root_directory
+        self.max_open_indexes = max_open_indexes
+        self._indexes = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def index_path(self, username, repo_name):
+        return os.path.join(
+            self.root_directory,
+            username,
+            "{}.{}".format(repo_name, INDEX_FILE_EXTENSION))
+
+    # Use the index of a repository, opening it if needed. The least
+    # recently used indexes are closed past max_open_indexes, but not
+    # while a thread is still inside this block with one of them.
+    @contextlib.contextmanager
+    def repo_index(self, username, repo_name):
+        key = (username, repo_name)
+        with self._lock:
+            repo_index = self._indexes.get(key)
+            if repo_index is not None:
+                self._indexes.move_to_end(key)
+            else:
+                index_path = self.index_path(username, repo_name)
+                os.makedirs(os.path.dirname(index_path), exist_ok=True)
+                repo_index = RepoFileIndex(index_path)
+                self._indexes[key] = repo_index
+
+                while len(self._indexes) > self.max_open_indexes:
+                    (_, oldest_index) = self._indexes.popitem(last=False)
+                    oldest_index._evicted = True
+                    if 0 == oldest_index._users:
+                        oldest_index.close()
+            repo_index._users += 1
+
+        try:
+            yield repo_index
+        finally:
+            with self._lock:
+                repo_index._users -= 1
+                if repo_index._evicted and 0 == repo_index._users:
+                    repo_index.close()
+
+    def close(self):
+        with self._lock:
+            for repo_index in self._indexes.values():
+                repo_index._evicted = True
+                if 0 == repo_index._users:
+                    repo_index.close()
+            self._indexes.clear()
+
+        return None
+
+def _repo_directories(host_root_directory, username=None, repo_name=None):
+    for user_entry in sorted(os.scandir(host_root_directory), key=lambda entry: entry.name):
+        # Application data lives in dot directories next to the users.
+        if user_entry.name.startswith(".") or not user_entry.is_dir():
+            continue
+        if username is not None and username != user_entry.name:
+            continue
+        for repo_entry in sorted(os.scandir(user_entry.path), key=lambda entry: entry.name):
+            if not repo_entry.is_dir():
+                continue
+            if repo_name is not None and repo_name != repo_entry.name:
+                continue
+            yield (user_entry.name, repo_entry.name, repo_entry.path)
+
+def rebuild_indexes(host_root_directory, username=None, repo_name=None):
+    file_indexes = FileIndexes(os.path.join(host_root_directory, INDEX_DIRECTORY_NAME))
+    try:
+        for (user_directory_name, repo_directory_name, repo_directory) in _repo_directories(
+                host_root_directory, username, repo_name):
+            with file_indexes.repo_index(user_directory_name, repo_directory_name) as repo_index:
+                file_count = repo_index.rebuild(repo_directory)
+            print("Indexed {} files in {}/{}".format(
+                file_count,
+                user_directory_name,
+                repo_directory_name))
+    finally:
+        file_indexes.close()
+
+    return None
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Rebuild the per-repository file metadata indexes.")
+    parser.add_argument("--root", default="repo-host-root",
+                        help="Repo host root directory.")
+    parser.add_argument("--username", default=None,
+                        help="Only rebuild the indexes of this user's repositories.")
+    parser.add_argument("--repo-name", default=None,
+                        help="Only rebuild the index of this repository.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = _parse_arguments()
+    rebuild_indexes(arguments.root, arguments.username, arguments.repo_name)
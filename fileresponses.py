@@ -0,0 +1,405 @@
+#!/usr/bin/python3
+import datetime
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import unicodedata
+import urllib.parse
+
+from flask import Response
+from flask import request
+from flask import send_file
+from werkzeug.http import http_date, is_resource_modified, parse_date, parse_range_header
+from werkzeug.wsgi import ClosingIterator
+
+import compressioncache
+
+from repohostutils import HttpResponseCode
+
+# HTTP responses for files served from the repo host.
+#
+# Full downloads go through flask.send_file, which hands the open file to
+# the WSGI server's wsgi.file_wrapper (zero-copy sendfile on servers that
+# support it). Range requests (RFC 7233) are answered here: a single range
+# is served from a file positioned at the start of the range, so servers
+# with a file wrapper can still use sendfile; several ranges are streamed
+# as a multipart/byteranges body. A file is opened once per request, and
+# its validators, ranges and body all come from that one open file, so a
+# concurrent replace of the path cannot pair the old file's ETag with the
+# new file's bytes. Files carry strong ETags and directory
+# listings weak ones, and If-None-Match/If-Modified-Since are answered
+# with 304 Not Modified.
+
+# Requests asking for more ranges than this get the whole file instead.
+MAX_RANGES_PER_REQUEST = 16
+
+RANGE_CHUNK_SIZE = 64 * 1024
+
+# Servers known to stop writing a file_wrapper body at Content-Length, as
+# PEP 3333 asks. Others (i.e. wsgiref) would send the rest of the file.
+_LENGTH_LIMITING_SERVERS = ("gunicorn",)
+
+# A strong validator for a file: its content hash when the file index
+# has a current record for it, else its inode, mtime and size.
+def file_etag(file_stat, file_record=None):
+    if (file_record is not None and
+        file_record.content_hash is not None and
+        file_record.size == file_stat.st_size and
+        file_record.mtime_ns == file_stat.st_mtime_ns and
+        file_record.inode == file_stat.st_ino):
+        return file_record.content_hash
+
+    return "{:x}-{:x}-{:x}".format(
+        file_stat.st_ino,
+        file_stat.st_mtime_ns,
+        file_stat.st_size)
+
+# The Last-Modified time of a file. A repository path linked into the
+# blob store shares the blob's inode, whose mtime is when those contents
+# were first stored, maybe long before they were written to this path:
+# putting a file back to earlier contents would move its Last-Modified
+# back in time, and clients sending only If-Modified-Since would be told
+# their copy is current. Linking the path updates the inode's change
+# time, so for a linked file that is never earlier than the write.
+def file_last_modified(file_stat):
+    if file_stat.st_nlink > 1:
+        return max(file_stat.st_mtime, file_stat.st_ctime)
+    return file_stat.st_mtime
+
+# A weak validator for a directory listing. Adding or removing an entry
+# changes the directory's mtime, so the listing can be revalidated
+# without scanning the directory. listing_shape holds the request options
+# that decide what the response holds and how it is sent (the response
+# form, page size, cursor, JSON or NDJSON), so that each page and form of
+# the same directory gets its own ETag.
+def listing_etag(directory_stat, listing_shape=()):
+    shape_hash = hashlib.sha256(json.dumps(list(listing_shape)).encode("utf-8")).hexdigest()
+    return "{:x}-{:x}-{}".format(
+        directory_stat.st_ino,
+        directory_stat.st_mtime_ns,
+        shape_hash[:16])
+
+def _set_validators(response, etag, last_modified, weak=False):
+    response.set_etag(etag, weak=weak)
+    response.headers["Last-Modified"] = http_date(last_modified)
+
+    return response
+
+# Returns a 304 response if the client's copy is current according to
+# If-None-Match or If-Modified-Since, else None.
+def not_modified_response(etag, last_modified, weak=False):
+    if request.method not in ("GET", "HEAD"):
+        return None
+    last_modified_datetime = datetime.datetime.fromtimestamp(
+        last_modified,
+        tz=datetime.timezone.utc)
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified_datetime):
+        return None
+
+    response = Response(status=HttpResponseCode.REDIRECTION_MESSAGE_304_NOT_MODIFIED)
+    return _set_validators(response, etag, last_modified, weak=weak)
+
+def set_listing_validators(response, directory_stat, listing_shape=()):
+    return _set_validators(
+        response,
+        listing_etag(directory_stat, listing_shape),
+        directory_stat.st_mtime,
+        weak=True)
+
+def content_disposition_parameters(download_name):
+    try:
+        download_name.encode("ascii")
+    except UnicodeEncodeError:
+        simple_name = unicodedata.normalize("NFKD", download_name)
+        simple_name = simple_name.encode("ascii", "ignore").decode("ascii")
+        quoted_name = urllib.parse.quote(download_name, safe="!#$&+-.^_`|~")
+        return {"filename": simple_name, "filename*": "UTF-8''{}".format(quoted_name)}
+
+    return {"filename": download_name}
+
+# If-Range: serve the ranges only if the client's copy is still current,
+# judged by a strong ETag or an exact Last-Modified date.
+def _if_range_matches(if_range, etag, file_stat):
+    if not if_range:
+        return True
+
+    if_range = if_range.strip()
+    if if_range.startswith("W/"):
+        return False
+    if if_range.startswith('"'):
+        return if_range.strip('"') == etag
+
+    if_range_date = parse_date(if_range)
+    if if_range_date is None:
+        return False
+    return int(if_range_date.timestamp()) == int(file_last_modified(file_stat))
+
+# Returns a list of (start, stop) byte offsets (stop exclusive), an empty
+# list if no requested range can be satisfied, or None to send the whole
+# file. Takes the request's method and Range/If-Range header values, so
+# it serves any request object.
+def requested_byte_ranges(method, range_header, if_range, etag, file_stat):
+    if not range_header or method not in ("GET", "HEAD"):
+        return None
+
+    parsed_range = parse_range_header(range_header)
+    if parsed_range is None or "bytes" != parsed_range.units:
+        return None
+    if len(parsed_range.ranges) > MAX_RANGES_PER_REQUEST:
+        return None
+    if not _if_range_matches(if_range, etag, file_stat):
+        return None
+
+    file_size = file_stat.st_size
+    byte_ranges = []
+    for (start, stop) in parsed_range.ranges:
+        if start < 0:
+            # A suffix range: the last -start bytes of the file.
+            start = max(file_size + start, 0)
+            stop = file_size
+        elif stop is None or stop > file_size:
+            stop = file_size
+        if start < stop:
+            byte_ranges.append((start, stop))
+
+    return byte_ranges
+
+def _requested_ranges(etag, file_stat):
+    return requested_byte_ranges(
+        request.method,
+        request.headers.get("Range"),
+        request.headers.get("If-Range"),
+        etag,
+        file_stat)
+
+def read_range(file_object, start, stop):
+    file_object.seek(start)
+    remaining = stop - start
+    while remaining > 0:
+        chunk = file_object.read(min(RANGE_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+def _single_range_body(file_object, start, stop):
+    file_wrapper = request.environ.get("wsgi.file_wrapper")
+    server_software = request.environ.get("SERVER_SOFTWARE", "").lower()
+    if (file_wrapper is not None and
+        server_software.startswith(_LENGTH_LIMITING_SERVERS)):
+        # The server stops at Content-Length, so a file positioned at the
+        # start of the range is enough for sendfile.
+        file_object.seek(start)
+        return file_wrapper(file_object, RANGE_CHUNK_SIZE)
+
+    def generate():
+        with file_object:
+            yield from read_range(file_object, start, stop)
+
+    return generate()
+
+# Whether application_iter, the body a WSGI application returned, is the
+# server's wsgi.file_wrapper, which the server may send with sendfile.
+def is_file_wrapper(application_iter, environ):
+    file_wrapper = environ.get("wsgi.file_wrapper")
+    return (isinstance(file_wrapper, type) and
+            isinstance(application_iter, file_wrapper))
+
+# For WSGI middleware: returns a body that calls callback once the server
+# has closed application_iter. A file_wrapper body is returned as it is,
+# with the callback chained to its close, so it keeps its sendfile path.
+def call_on_close(application_iter, environ, callback):
+    if is_file_wrapper(application_iter, environ):
+        close = getattr(application_iter, "close", None)
+
+        def close_then_callback():
+            try:
+                if close is not None:
+                    close()
+            finally:
+                callback()
+
+        try:
+            application_iter.close = close_then_callback
+            return application_iter
+        except AttributeError:
+            pass
+
+    return ClosingIterator(application_iter, callback)
+
+# Returns (body, boundary, content_length) of a multipart/byteranges
+# response; body is a generator of the bytes of file_object, which it
+# closes.
+def multiple_ranges_body(file_object, mimetype, byte_ranges, file_size):
+    boundary = secrets.token_hex(16)
+    part_headers = []
+    for (start, stop) in byte_ranges:
+        part_headers.append((
+            "--{}\r\n"
+            "Content-Type: {}\r\n"
+            "Content-Range: bytes {}-{}/{}\r\n"
+            "\r\n".format(boundary, mimetype, start, stop - 1, file_size)
+        ).encode("latin-1"))
+    closing_delimiter = "--{}--\r\n".format(boundary).encode("latin-1")
+
+    content_length = len(closing_delimiter)
+    for (part_header, (start, stop)) in zip(part_headers, byte_ranges):
+        content_length += len(part_header) + (stop - start) + 2
+
+    def generate():
+        with file_object:
+            for (part_header, (start, stop)) in zip(part_headers, byte_ranges):
+                yield part_header
+                yield from read_range(file_object, start, stop)
+                yield b"\r\n"
+        yield closing_delimiter
+
+    return (generate(), boundary, content_length)
+
+# Compressed variants of downloads (see compressioncache.py). Downloads
+# are only compressed when it is enabled.
+_compression_cache = None
+
+def enable_compression(cache_directory, max_bytes=compressioncache.DEFAULT_MAX_CACHE_BYTES):
+    global _compression_cache
+    _compression_cache = compressioncache.CompressionCache(cache_directory, max_bytes=max_bytes)
+
+    return _compression_cache
+
+def get_compression_cache():
+    return _compression_cache
+
+# Returns the Content-Encoding to send the file with, or None. Range
+# requests are always answered from the file as stored.
+def _content_encoding(mimetype, file_size):
+    if (_compression_cache is None or
+        not compressioncache.is_compressible(mimetype) or
+        "Range" in request.headers or
+        file_size < compressioncache.MIN_COMPRESS_BYTES or
+        file_size > compressioncache.MAX_COMPRESS_BYTES):
+        return None
+
+    return request.accept_encodings.best_match(compressioncache.available_encodings())
+
+def send_repo_file(full_file_path, mimetype, download_name, file_record=None):
+    if mimetype is None:
+        mimetype = "application/octet-stream"
+
+    file_object = open(full_file_path, "rb")
+    try:
+        return _send_open_file(file_object, mimetype, download_name, file_record)
+    except BaseException:
+        file_object.close()
+        raise
+
+# Returns the response for file_object, which the response body closes,
+# or closes it itself when the response has no body.
+def _send_open_file(file_object, mimetype, download_name, file_record):
+    file_stat = os.fstat(file_object.fileno())
+    etag = file_etag(file_stat, file_record)
+    file_size = file_stat.st_size
+
+    # Each encoding is a different representation with its own ETag.
+    content_encoding = _content_encoding(mimetype, file_size)
+    representation_etag = etag
+    if content_encoding is not None:
+        representation_etag = "{}-{}".format(etag, content_encoding)
+
+    last_modified = file_last_modified(file_stat)
+    response = not_modified_response(representation_etag, last_modified)
+    if response is not None:
+        file_object.close()
+        return response
+
+    variant_file = None
+    if content_encoding is not None:
+        # The cache is only a shortcut: when it fails, i.e. on a full disk,
+        # the file is sent as stored.
+        try:
+            variant_file = _compression_cache.open_variant(file_object, etag, content_encoding)
+        except (OSError, sqlite3.Error) as e:
+            print(e)
+            content_encoding = None
+            representation_etag = etag
+            file_object.seek(0)
+
+    byte_ranges = _requested_ranges(etag, file_stat)
+    if variant_file is not None:
+        file_object.close()
+        response = send_file(
+            variant_file,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            conditional=False,
+            etag=False)
+        response.content_length = os.fstat(variant_file.fileno()).st_size
+        response.headers["Content-Encoding"] = content_encoding
+    elif byte_ranges is None:
+        # Conditional and range headers have been handled above, so
+        # send_file must not act on them again.
+        response = send_file(
+            file_object,
+            mimetype=mimetype,
+            as_attachment=True,
+            download_name=download_name,
+            conditional=False,
+            etag=False)
+        response.content_length = file_size
+    elif not byte_ranges:
+        file_object.close()
+        response = Response(status=HttpResponseCode.CLIENT_ERROR_RESPONSE_416_RANGE_NOT_SATISFIABLE)
+        response.headers["Content-Range"] = "bytes */{}".format(file_size)
+        return response
+    elif 1 == len(byte_ranges):
+        (start, stop) = byte_ranges[0]
+        response = Response(
+            _single_range_body(file_object, start, stop),
+            status=HttpResponseCode.SUCCESSFUL_RESPONSE_206_PARTIAL_CONTENT,
+            mimetype=mimetype,
+            direct_passthrough=True)
+        response.content_length = stop - start
+        response.headers["Content-Range"] = "bytes {}-{}/{}".format(start, stop - 1, file_size)
+    else:
+        (body, boundary, content_length) = multiple_ranges_body(
+            file_object,
+            mimetype,
+            byte_ranges,
+            file_size)
+        response = Response(
+            body,
+            status=HttpResponseCode.SUCCESSFUL_RESPONSE_206_PARTIAL_CONTENT,
+            direct_passthrough=True)
+        response.headers["Content-Type"] = "multipart/byteranges; boundary={}".format(boundary)
+        response.content_length = content_length
+
+    if byte_ranges:
+        response.headers.set("Content-Disposition", "attachment", **content_disposition_parameters(download_name))
+    # Ranges are only served from the file as stored, not from a
+    # compressed variant.
+    if content_encoding is None:
+        response.headers["Accept-Ranges"] = "bytes"
+    else:
+        response.headers["Accept-Ranges"] = "none"
+    if _compression_cache is not None and compressioncache.is_compressible(mimetype):
+        response.vary.add("Accept-Encoding")
+    return _set_validators(response, representation_etag, last_modified)
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+
+def accepts_ndjson():
+    return request.accept_mimetypes.best_match(
+        ["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+# Stream an iterable of JSON-serializable objects, one per line, as they
+# are produced. last_line, if given, is written after them.
+def ndjson_response(objects, last_line=None):
+    def generate():
+        for json_object in objects:
+            yield json.dumps(json_object) + "\n"
+        if last_line is not None:
+            yield json.dumps(last_line) + "\n"
+
+    return Response(generate(), mimetype=NDJSON_MIMETYPE)
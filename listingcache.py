@@ -0,0 +1,127 @@
+#!/usr/bin/python3
+import collections
+import os
+import threading
+import time
+
+# Default bounds for the directory listing cache.
+DEFAULT_MAX_ENTRIES = 1024
+# Listings longer than this are not cached.
+DEFAULT_MAX_LISTING_LENGTH = 10000
+# A directory modified this recently may change again within the same
+# filesystem timestamp tick, so its listing is not cached yet.
+DEFAULT_RACY_SECONDS = 1.0
+
+class _CacheEntry:
+    __slots__ = ("validator", "listing")
+
+    def __init__(self, validator, listing):
+        self.validator = validator
+        self.listing = listing
+
+def _validator(directory_stat):
+    return (directory_stat.st_ino, directory_stat.st_mtime_ns)
+
+# A bounded LRU cache of directory listings, keyed on
+# (username, repo_name, directory_path).
+#
+# Writes made through repohostutils invalidate the listings they affect.
+# Every lookup also compares the directory's inode and mtime with the
+# ones the listing was read at, so a change made by another process or
+# outside the application is never served from the cache.
+class ListingCache:
+    def __init__(self,
+                 max_entries=DEFAULT_MAX_ENTRIES,
+                 max_listing_length=DEFAULT_MAX_LISTING_LENGTH,
+                 racy_seconds=DEFAULT_RACY_SECONDS):
+        self.max_entries = max_entries
+        self.max_listing_length = max_listing_length
+        self.racy_seconds = racy_seconds
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _key(username, repo_name, directory_path):
+        return (username, repo_name, os.path.normpath(directory_path))
+
+    # Returns the cached listing of the directory whose current os.stat
+    # result is directory_stat, or None on a miss.
+    def get(self, username, repo_name, directory_path, directory_stat):
+        key = self._key(username, repo_name, directory_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            if entry.validator != _validator(directory_stat):
+                del self._entries[key]
+                self.stale += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.listing
+
+    # Cache a listing read from the directory after it was stat'ed as
+    # directory_stat.
+    def put(self, username, repo_name, directory_path, directory_stat, listing):
+        if (self.max_entries <= 0 or
+            len(listing) > self.max_listing_length or
+            time.time() - directory_stat.st_mtime < self.racy_seconds):
+            return None
+
+        key = self._key(username, repo_name, directory_path)
+        with self._lock:
+            self._entries[key] = _CacheEntry(_validator(directory_stat), listing)
+            self._entries.move_to_end(key)
+
+            # Evict the least recently used listings.
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return None
+
+    # Drop the listing of directory_path and of every directory above it
+    # in the repository, since writing a path may create any of them.
+    def invalidate_path(self, username, repo_name, directory_path):
+        directory_path = os.path.normpath(directory_path)
+        with self._lock:
+            while True:
+                if self._entries.pop((username, repo_name, directory_path), None) is not None:
+                    self.invalidations += 1
+                if directory_path in (".", "/", ""):
+                    break
+                directory_path = os.path.dirname(directory_path) or "."
+
+        return None
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+        return None
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations
+            }
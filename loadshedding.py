@@ -0,0 +1,311 @@
+#!/usr/bin/python3
+import asyncio
+import collections
+import math
+import threading
+import time
+
+import fileresponses
+
+# Admission control for one worker process.
+#
+# At most max_in_flight requests run at once. A request that finds no
+# free slot waits in a bounded queue, served by priority class and then
+# in arrival order, so cheap routes keep flowing while heavy uploads and
+# archive jobs wait behind them.
+#
+# Overload is judged by the queueing delay the requests actually see,
+# not by the length of the queue: at the end of every measurement
+# interval the standing delay is the smallest delay any request waited
+# for during it (the age of the oldest waiter when none got through). A
+# queue that drains quickly has a standing delay of 0 however long it
+# gets; one that does not drain has a standing delay that keeps growing.
+# Each class may be shed once the standing delay passes a multiple of
+# the target delay, low priority first, and then fails with
+# LoadShedError at once instead of joining the queue. High priority
+# requests are only shed when the queue is full, and then the newest
+# waiting request of a lower class gives up its place first. A waiting
+# request is also shed after max_queue_delay_seconds.
+
+PRIORITY_HIGH = "high"
+PRIORITY_NORMAL = "normal"
+PRIORITY_LOW = "low"
+
+# In the order their waiting requests are admitted.
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+
+# Routes not listed here are normal priority.
+DEFAULT_ROUTE_PRIORITIES = {
+    "list-directories": PRIORITY_HIGH,
+    "list-upload-parts": PRIORITY_HIGH,
+    "metrics": PRIORITY_HIGH,
+    "upload-file": PRIORITY_LOW,
+    "upload-archive": PRIORITY_LOW,
+    "upload-part": PRIORITY_LOW,
+    "complete-multipart-upload": PRIORITY_LOW,
+    "download-archive": PRIORITY_LOW
+}
+
+DEFAULT_TARGET_QUEUE_DELAY_SECONDS = 0.1
+DEFAULT_MAX_QUEUE_DELAY_SECONDS = 5.0
+MEASUREMENT_INTERVAL_SECONDS = 1.0
+
+# Multiples of the target delay above which a class is shed on arrival.
+# High priority requests are not shed for delay.
+SHED_DELAY_FACTORS = {
+    PRIORITY_HIGH: None,
+    PRIORITY_NORMAL: 5.0,
+    PRIORITY_LOW: 1.0
+}
+
+class LoadShedError(Exception):
+    def __init__(self, message, retry_after_seconds):
+        super().__init__(message)
+        self.retry_after_seconds = retry_after_seconds
+
+# Parse "<route>=<priority>,..." into {route: priority}.
+def parse_route_priorities(text):
+    route_priorities = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        route, _, priority = item.partition("=")
+        priority = priority.strip()
+        if priority not in PRIORITIES:
+            raise ValueError("Invalid route priority '{}', expected <route>=<{}>.".format(
+                item,
+                "|".join(PRIORITIES)))
+        route_priorities[route.strip().strip("/")] = priority
+
+    return route_priorities
+
+class _Waiter:
+    def __init__(self, priority, enqueued_at, notify):
+        self.priority = priority
+        self.enqueued_at = enqueued_at
+        # None while waiting, then whether the request was admitted.
+        self.admitted = None
+        self._notify = notify
+
+    # Called with the controller's lock held.
+    def resolve(self, admitted):
+        self.admitted = admitted
+        self._notify()
+
+        return None
+
+class AdmissionController:
+    def __init__(self,
+                 max_in_flight,
+                 max_queued=None,
+                 target_queue_delay_seconds=DEFAULT_TARGET_QUEUE_DELAY_SECONDS,
+                 max_queue_delay_seconds=DEFAULT_MAX_QUEUE_DELAY_SECONDS,
+                 route_priorities=None,
+                 clock=time.monotonic):
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued if max_queued is not None else 4 * max_in_flight
+        self.target_queue_delay_seconds = target_queue_delay_seconds
+        self.max_queue_delay_seconds = max_queue_delay_seconds
+        self.route_priorities = dict(DEFAULT_ROUTE_PRIORITIES)
+        self.route_priorities.update(route_priorities or {})
+        self._clock = clock
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queues = {priority: collections.deque() for priority in PRIORITIES}
+        self._queued = 0
+        self._interval_started_at = clock()
+        self._interval_min_delay = None
+        self._standing_delay = 0.0
+
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.shed = {priority: 0 for priority in PRIORITIES}
+
+    def priority_of(self, route):
+        return self.route_priorities.get(route.strip("/"), PRIORITY_NORMAL)
+
+    # The following methods are called with the lock held.
+    def _measure(self, now):
+        if now - self._interval_started_at < MEASUREMENT_INTERVAL_SECONDS:
+            return None
+
+        if self._interval_min_delay is not None:
+            self._standing_delay = self._interval_min_delay
+        else:
+            # Nothing got through; the queue is as slow as its oldest waiter.
+            self._standing_delay = max(
+                [now - queue[0].enqueued_at for queue in self._queues.values() if queue],
+                default=0.0)
+        self._interval_started_at = now
+        self._interval_min_delay = None
+
+        return None
+
+    def _record_admission(self, priority, delay):
+        self.admitted[priority] += 1
+        if self._interval_min_delay is None or delay < self._interval_min_delay:
+            self._interval_min_delay = delay
+
+        return None
+
+    def _shed_error(self, priority, reason):
+        self.shed[priority] += 1
+        return LoadShedError(
+            "Shed a {} priority request: {}.".format(priority, reason),
+            max(self._standing_delay, self.target_queue_delay_seconds))
+
+    # Admit the request at once (returns None), or queue it (returns its
+    # _Waiter), or raise LoadShedError.
+    def _enqueue(self, priority, notify):
+        now = self._clock()
+        self._measure(now)
+
+        ahead = any(self._queues[other] for other in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        if self._in_flight < self.max_in_flight and not ahead:
+            self._in_flight += 1
+            self._record_admission(priority, 0.0)
+            return None
+
+        shed_delay_factor = SHED_DELAY_FACTORS[priority]
+        if (shed_delay_factor is not None and
+            self._standing_delay > shed_delay_factor * self.target_queue_delay_seconds):
+            raise self._shed_error(priority, "the queueing delay is {:.3f} seconds".format(
+                self._standing_delay))
+
+        if self._queued >= self.max_queued:
+            # Make room by shedding the newest request of a lower class.
+            for lower in reversed(PRIORITIES[PRIORITIES.index(priority) + 1:]):
+                if self._queues[lower]:
+                    victim = self._queues[lower].pop()
+                    self._queued -= 1
+                    self.shed[lower] += 1
+                    victim.resolve(False)
+                    break
+            else:
+                raise self._shed_error(priority, "the queue is full")
+
+        waiter = _Waiter(priority, now, notify)
+        self._queues[priority].append(waiter)
+        self._queued += 1
+        return waiter
+
+    # Stop waiting. Returns whether the request was admitted meanwhile.
+    def _abandon(self, waiter):
+        with self._lock:
+            if waiter.admitted is None:
+                self._queues[waiter.priority].remove(waiter)
+                self._queued -= 1
+                self.shed[waiter.priority] += 1
+                waiter.admitted = False
+            return waiter.admitted
+
+    def _shed_waiter_error(self, waiter):
+        with self._lock:
+            return LoadShedError(
+                "Shed a {} priority request after it waited in the queue.".format(waiter.priority),
+                max(self._standing_delay, self.target_queue_delay_seconds))
+
+    # Wait for a slot to run a request to route in. Raises LoadShedError
+    # when the request should be refused. Every admitted request must be
+    # followed by a call to release().
+    def admit(self, route):
+        priority = self.priority_of(route)
+        admitted_event = threading.Event()
+        with self._lock:
+            waiter = self._enqueue(priority, admitted_event.set)
+        if waiter is None:
+            return None
+
+        admitted_event.wait(self.max_queue_delay_seconds)
+        if not self._abandon(waiter):
+            raise self._shed_waiter_error(waiter)
+
+        return None
+
+    # Same as admit, for a request served on an asyncio event loop.
+    async def admit_async(self, route):
+        priority = self.priority_of(route)
+        loop = asyncio.get_running_loop()
+        admitted_future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(
+                lambda: admitted_future.done() or admitted_future.set_result(None))
+
+        with self._lock:
+            waiter = self._enqueue(priority, notify)
+        if waiter is None:
+            return None
+
+        try:
+            await asyncio.wait_for(asyncio.shield(admitted_future), self.max_queue_delay_seconds)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if self._abandon(waiter):
+                self.release()
+            raise
+        if not self._abandon(waiter):
+            raise self._shed_waiter_error(waiter)
+
+        return None
+
+    # Free the slot of a finished request, handing it to the first waiting
+    # request of the highest class.
+    def release(self):
+        with self._lock:
+            now = self._clock()
+            self._measure(now)
+            for priority in PRIORITIES:
+                if self._queues[priority]:
+                    waiter = self._queues[priority].popleft()
+                    self._queued -= 1
+                    self._record_admission(priority, now - waiter.enqueued_at)
+                    waiter.resolve(True)
+                    return None
+            self._in_flight -= 1
+
+        return None
+
+    def stats(self):
+        with self._lock:
+            self._measure(self._clock())
+            return {
+                "in_flight": self._in_flight,
+                "queued": {priority: len(self._queues[priority]) for priority in PRIORITIES},
+                "standing_queue_delay_seconds": self._standing_delay,
+                "admitted": dict(self.admitted),
+                "shed": dict(self.shed)
+            }
+
+# WSGI middleware running every request through an AdmissionController.
+# A shed request is answered with 503 before the application sees it,
+# and an admitted one keeps its slot until its response has been sent,
+# streamed responses included.
+class AdmissionMiddleware:
+    def __init__(self, application, admission_controller):
+        self.application = application
+        self.admission_controller = admission_controller
+
+    def __call__(self, environ, start_response):
+        try:
+            self.admission_controller.admit(environ.get("PATH_INFO", ""))
+        except LoadShedError as e:
+            start_response("503 SERVICE UNAVAILABLE", [
+                ("Content-Type", "text/html; charset=utf-8"),
+                ("Content-Length", "0"),
+                ("Retry-After", retry_after_header(e))
+            ])
+            return [b""]
+
+        try:
+            application_iter = self.application(environ, start_response)
+        except BaseException:
+            self.admission_controller.release()
+            raise
+
+        return fileresponses.call_on_close(application_iter, environ, self.admission_controller.release)
+
+# Whole seconds for the Retry-After header of a shed request.
+def retry_after_header(load_shed_error):
+    return str(max(1, math.ceil(load_shed_error.retry_after_seconds)))
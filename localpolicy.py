@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+import os
+import re
+
+import permissionmasks
+
+# Local evaluation of the Polar policy used by this application.
+#
+# Only the subset of Polar used in policy.polar is understood: actor and
+# resource blocks that declare "permissions" and "roles" lists, plus
+# shorthand rules of the form `"<permission or role>" if "<role>";`.
+# The role hierarchy is expanded once, up front, into a table of
+# role -> permissions, which is then compiled into bitmasks.
+
+DEFAULT_POLICY_FILE_NAME = "policy.polar"
+
+HAS_ROLE_PREDICATE = "has_role"
+
+class PolicyParseError(Exception):
+    pass
+
+_COMMENT_PATTERN = re.compile(r"#[^\n]*")
+_BLOCK_PATTERN = re.compile(r"\b(actor|resource)\s+(\w+)\s*\{", re.MULTILINE)
+_LIST_PATTERN = re.compile(r"\b(permissions|roles)\s*=\s*\[([^\]]*)\]\s*;")
+_RULE_PATTERN = re.compile(r"\"([^\"]+)\"\s+if\s+\"([^\"]+)\"\s*;")
+_STRING_PATTERN = re.compile(r"\"([^\"]*)\"")
+
+class ResourcePolicy:
+    def __init__(self, resource_type, permissions, roles, rules):
+        self.resource_type = resource_type
+        self.permissions = tuple(permissions)
+        self.roles = tuple(roles)
+        self.role_permissions = self._expand_roles(rules)
+
+    def _expand_roles(self, rules):
+        # Split the shorthand rules into direct permission grants and
+        # role implications ("admin" if "owner").
+        granted_permissions = {role: set() for role in self.roles}
+        implied_roles = {role: set() for role in self.roles}
+        for (granted, required_role) in rules:
+            if required_role not in granted_permissions:
+                raise PolicyParseError(
+                    "'{}' is not a role of resource '{}'.".format(
+                        required_role, self.resource_type))
+            if granted in self.permissions:
+                granted_permissions[required_role].add(granted)
+            elif granted in self.roles:
+                implied_roles[required_role].add(granted)
+            else:
+                raise PolicyParseError(
+                    "'{}' is not a permission or role of resource '{}'.".format(
+                        granted, self.resource_type))
+
+        # Fold every transitively implied role into each role's permissions.
+        role_permissions = {}
+        for role in self.roles:
+            permissions = set()
+            visited = set()
+            pending = [role]
+            while pending:
+                current_role = pending.pop()
+                if current_role in visited:
+                    continue
+                visited.add(current_role)
+                permissions.update(granted_permissions[current_role])
+                pending.extend(implied_roles[current_role])
+            role_permissions[role] = frozenset(permissions)
+
+        return role_permissions
+
+    def has_permission(self, role, permission):
+        return permission in self.role_permissions.get(role, ())
+
+def _find_block_body(policy_string, open_brace_index):
+    depth = 0
+    for index in range(open_brace_index, len(policy_string)):
+        character = policy_string[index]
+        if "{" == character:
+            depth += 1
+        elif "}" == character:
+            depth -= 1
+            if 0 == depth:
+                return policy_string[open_brace_index + 1:index]
+
+    raise PolicyParseError("Unterminated block in policy.")
+
+def parse_policy(policy_string):
+    policy_string = _COMMENT_PATTERN.sub("", policy_string)
+
+    actor_types = set()
+    resource_policies = {}
+    for block_match in _BLOCK_PATTERN.finditer(policy_string):
+        (block_kind, type_name) = block_match.groups()
+        body = _find_block_body(policy_string, block_match.end() - 1)
+        if "actor" == block_kind:
+            actor_types.add(type_name)
+            continue
+
+        declarations = {"permissions": [], "roles": []}
+        for list_match in _LIST_PATTERN.finditer(body):
+            (list_name, list_body) = list_match.groups()
+            declarations[list_name] = _STRING_PATTERN.findall(list_body)
+
+        rules = _RULE_PATTERN.findall(body)
+        resource_policies[type_name] = ResourcePolicy(
+            type_name,
+            declarations["permissions"],
+            declarations["roles"],
+            rules)
+
+    return LocalPolicy(actor_types, resource_policies)
+
+def load_policy_file(policy_file_name=DEFAULT_POLICY_FILE_NAME):
+    with open(policy_file_name) as policy_file:
+        return parse_policy(policy_file.read())
+
+class LocalPolicy:
+    def __init__(self, actor_types, resource_policies):
+        self.actor_types = frozenset(actor_types)
+        self.resource_policies = resource_policies
+
+    def role_permission_table(self, resource_type):
+        resource_policy = self.resource_policies.get(resource_type)
+        if resource_policy is None:
+            return {}
+        return dict(resource_policy.role_permissions)
+
+    def has_permission(self, resource_type, role, permission):
+        resource_policy = self.resource_policies.get(resource_type)
+        if resource_policy is None:
+            return False
+        return resource_policy.has_permission(role, permission)
+
+# An in-memory stand-in for the Oso Cloud client. It mirrors the
+# "has_role" facts told to it and answers authorization requests from the
+# compiled role -> permission bitmasks (see permissionmasks). Actors and
+# resources use the same {"type": ..., "id": ...} dictionaries as the Oso
+# Cloud client.
+class LocalAuthorizer:
+    def __init__(self, policy):
+        self.policy = policy
+        # resource_type -> GrantTable of (actor_type, actor_id) x resource_id.
+        self._grant_tables = {}
+        for (resource_type, resource_policy) in policy.resource_policies.items():
+            model = permissionmasks.PermissionModel.from_resource_policy(resource_policy)
+            self._grant_tables[resource_type] = permissionmasks.GrantTable(model)
+
+    @classmethod
+    def from_policy_file(cls, policy_file_name=DEFAULT_POLICY_FILE_NAME):
+        return cls(load_policy_file(policy_file_name))
+
+    def _grant_table(self, resource):
+        grant_table = self._grant_tables.get(resource["type"])
+        if grant_table is None:
+            raise ValueError("Unknown resource type '{}'.".format(resource["type"]))
+        return grant_table
+
+    @staticmethod
+    def _actor_key(actor):
+        return (actor["type"], actor["id"])
+
+    def tell(self, predicate, actor, role, resource):
+        if HAS_ROLE_PREDICATE != predicate:
+            raise ValueError("Unsupported fact predicate '{}'.".format(predicate))
+
+        self._grant_table(resource).grant(self._actor_key(actor), role, resource["id"])
+
+        return None
+
+    def delete(self, predicate, actor, role, resource):
+        if HAS_ROLE_PREDICATE != predicate:
+            raise ValueError("Unsupported fact predicate '{}'.".format(predicate))
+
+        self._grant_table(resource).revoke(self._actor_key(actor), role, resource["id"])
+
+        return None
+
+    def clear_data(self):
+        for grant_table in self._grant_tables.values():
+            grant_table.clear()
+
+        return None
+
+    # Mirror the "has_role" facts already stored in Oso Cloud. Depending
+    # on the client version, facts are returned as [predicate, *args] lists
+    # or as {"predicate": ..., "args": [...]} dictionaries, and string
+    # arguments either as plain strings or as {"type": "String", ...}.
+    def load_facts(self, oso_client):
+        for fact in oso_client.get(HAS_ROLE_PREDICATE):
+            if isinstance(fact, dict):
+                (actor, role, resource) = fact["args"]
+            else:
+                (_, actor, role, resource) = fact
+            if isinstance(role, dict):
+                role = role["id"]
+            self.tell(HAS_ROLE_PREDICATE, actor, role, resource)
+
+        return None
+
+    def roles(self, actor, resource):
+        grant_table = self._grant_tables.get(resource["type"])
+        if grant_table is None:
+            return frozenset()
+        return grant_table.roles(self._actor_key(actor), resource["id"])
+
+    def authorize(self, actor, action, resource):
+        grant_table = self._grant_tables.get(resource["type"])
+        if grant_table is None:
+            return False
+        return grant_table.check(self._actor_key(actor), action, resource["id"])
+
+    def actions(self, actor, resource):
+        grant_table = self._grant_tables.get(resource["type"])
+        if grant_table is None:
+            return []
+        return sorted(grant_table.permissions(self._actor_key(actor), resource["id"]))
+
+    def authorize_resources(self, actor, action, resources):
+        return [resource for resource in resources
+                if self.authorize(actor, action, resource)]
+
+def default_policy_file_path():
+    return os.path.join(
+        os.path.dirname(os.path.abspath(__file__)),
+        DEFAULT_POLICY_FILE_NAME)
@@ -0,0 +1,602 @@
+#!/usr/bin/python3
+import contextlib
+import contextvars
+import fcntl
+import functools
+import glob
+import inspect
+import json
+import os
+import threading
+import time
+
+import fileresponses
+
+# Request metrics in the Prometheus text format.
+#
+# Every request is timed in stages:
+#   queue:         from arrival until its route starts (admission control
+#                  and rate limit checks included),
+#   authorization: Oso Cloud calls, decision cache and local engine
+#                  lookups, and role facts told or journaled,
+#   filesystem:    the rest of the route's work, which is mostly repo
+#                  host reads and writes,
+#   response:      from the route's status line until its last byte has
+#                  been handed to the server.
+# Exceptions the routes catch are counted by class.
+#
+# Each worker process keeps its metrics in memory and writes a snapshot
+# of them to its own file under the host directory about once a second.
+# /metrics adds up the files of every worker, so it reports the same
+# totals whichever worker answers it. When a worker exits, its counters
+# and histograms are folded into one file of retired totals and its own
+# file is removed, so totals do not drop across a reload and /metrics
+# does not read a file per worker ever started. Gauges are reported for
+# each running worker, with a pid label. The files are removed when the
+# application is loaded.
+
+METRICS_DIRECTORY_NAME = ".metrics"
+# The counters and histograms of workers that have exited, and the lock
+# that keeps them from being counted twice while they are moved there.
+RETIRED_FILE_NAME = "retired.json"
+LOCK_FILE_NAME = "metrics.lock"
+FLUSH_INTERVAL_SECONDS = 1.0
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Upper bounds of the latency histogram buckets, in seconds.
+LATENCY_BUCKETS_SECONDS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_QUEUE = "queue"
+STAGE_AUTHORIZATION = "authorization"
+STAGE_FILESYSTEM = "filesystem"
+STAGE_RESPONSE = "response"
+
+# Route label of requests to paths that are not routes.
+OTHER_ROUTE = "other"
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# name: (type, help), in the order they are rendered.
+METRICS = {
+    "repo_api_requests_total": (
+        COUNTER, "Requests answered, by route, method and status code."),
+    "repo_api_request_duration_seconds": (
+        HISTOGRAM, "Time from a request's arrival until its response was sent, by route."),
+    "repo_api_request_stage_duration_seconds": (
+        HISTOGRAM, "Time requests spent in each stage (queue, authorization, filesystem, response), by route."),
+    "repo_api_received_bytes_total": (
+        COUNTER, "Request body bytes read, by route."),
+    "repo_api_sent_bytes_total": (
+        COUNTER, "Response body bytes sent, by route."),
+    "repo_api_errors_total": (
+        COUNTER, "Exceptions caught by the routes, by route and exception class."),
+    "repo_api_cache_hits_total": (
+        COUNTER, "Cache lookups answered from the cache, by cache."),
+    "repo_api_cache_misses_total": (
+        COUNTER, "Cache lookups not answered from the cache, by cache."),
+    "repo_api_oso_breaker_calls_total": (
+        COUNTER, "Oso Cloud calls through the circuit breaker, by result."),
+    "repo_api_rate_limit_checks_total": (
+        COUNTER, "Rate limit checks and byte charges, by result (granted, limited, or error when the database failed)."),
+    "repo_api_admitted_requests_total": (
+        COUNTER, "Requests admitted by load shedding, by priority class."),
+    "repo_api_shed_requests_total": (
+        COUNTER, "Requests refused by load shedding, by priority class."),
+    "repo_api_in_flight_requests": (
+        GAUGE, "Requests running under admission control, by worker process."),
+    "repo_api_queued_requests": (
+        GAUGE, "Requests waiting for admission, by priority class and worker process."),
+    "repo_api_queue_delay_seconds": (
+        GAUGE, "Standing queueing delay measured by load shedding, by worker process.")
+}
+
+# The timings of the request being served, in this thread or task.
+_current_request = contextvars.ContextVar("metrics_current_request", default=None)
+_current_stage = contextvars.ContextVar("metrics_current_stage", default=None)
+
+class RequestTimer:
+    def __init__(self, route, method):
+        self.route = route
+        self.method = method
+        self.status = None
+        self.started_at = time.perf_counter()
+        self.handler_started_at = None
+        self.handler_finished_at = None
+        self.stage_seconds = {}
+        self.errors = []
+        self.bytes_received = 0
+        self.bytes_sent = 0
+
+def start_request(request_timer):
+    return _current_request.set(request_timer)
+
+def end_request(token):
+    _current_request.reset(token)
+
+    return None
+
+# Marks the start of the route's own work; what came before is queueing.
+def mark_handler_started():
+    request_timer = _current_request.get()
+    if request_timer is not None and request_timer.handler_started_at is None:
+        request_timer.handler_started_at = time.perf_counter()
+
+    return None
+
+# Marks the end of the route's own work, when its status line is sent.
+def mark_handler_finished(status):
+    request_timer = _current_request.get()
+    if request_timer is not None:
+        request_timer.status = status
+        if request_timer.handler_finished_at is None:
+            request_timer.handler_finished_at = time.perf_counter()
+
+    return None
+
+def record_error(error):
+    request_timer = _current_request.get()
+    if request_timer is not None:
+        request_timer.errors.append(type(error).__name__)
+
+    return None
+
+def _add_stage_time(stage, started_at):
+    request_timer = _current_request.get()
+    if request_timer is not None:
+        request_timer.stage_seconds[stage] = (
+            request_timer.stage_seconds.get(stage, 0.0) + time.perf_counter() - started_at)
+
+    return None
+
+# Decorator counting the time spent in a function, or coroutine function,
+# towards stage. Calls nested in a timed call are not counted twice.
+def timed_stage(stage):
+    def decorator(function):
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def timed_coroutine(*args, **kwargs):
+                if _current_stage.get() is not None:
+                    return await function(*args, **kwargs)
+                token = _current_stage.set(stage)
+                started_at = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    _add_stage_time(stage, started_at)
+                    _current_stage.reset(token)
+            return timed_coroutine
+
+        @functools.wraps(function)
+        def timed_function(*args, **kwargs):
+            if _current_stage.get() is not None:
+                return function(*args, **kwargs)
+            token = _current_stage.set(stage)
+            started_at = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                _add_stage_time(stage, started_at)
+                _current_stage.reset(token)
+        return timed_function
+
+    return decorator
+
+# The route label of a request path: the route's name without the leading
+# slash, or OTHER_ROUTE, so unknown paths cannot add label values.
+def route_label(path, routes):
+    route = path.strip("/")
+    return route if route in routes else OTHER_ROUTE
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+class MetricsRegistry:
+    def __init__(self, latency_buckets=LATENCY_BUCKETS_SECONDS):
+        self.latency_buckets = tuple(latency_buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        # (name, labels): [count per bucket..., count above the last, sum]
+        self._histograms = {}
+        self._collectors = []
+        self.version = 0
+
+    def inc(self, name, labels, amount=1):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+            self.version += 1
+
+        return None
+
+    def observe(self, name, labels, value):
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.latency_buckets) + 1) + [0.0]
+            bucket = len(self.latency_buckets)
+            for (index, upper_bound) in enumerate(self.latency_buckets):
+                if value <= upper_bound:
+                    bucket = index
+                    break
+            histogram[bucket] += 1
+            histogram[-1] += value
+            self.version += 1
+
+        return None
+
+    # collector() returns a list of (name, labels, value) samples, read
+    # when the metrics are written, i.e. from another module's stats().
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+        return None
+
+    # Record a finished request.
+    def record_request(self, request_timer):
+        finished_at = time.perf_counter()
+        handler_started_at = request_timer.handler_started_at or request_timer.started_at
+        handler_finished_at = request_timer.handler_finished_at or finished_at
+        authorization_seconds = request_timer.stage_seconds.get(STAGE_AUTHORIZATION, 0.0)
+        stage_seconds = {
+            STAGE_QUEUE: handler_started_at - request_timer.started_at,
+            STAGE_AUTHORIZATION: authorization_seconds,
+            STAGE_FILESYSTEM: max(0.0, handler_finished_at - handler_started_at - authorization_seconds),
+            STAGE_RESPONSE: finished_at - handler_finished_at
+        }
+
+        route_labels = {"route": request_timer.route}
+        self.inc("repo_api_requests_total", {
+            "route": request_timer.route,
+            "method": request_timer.method,
+            "status": str(request_timer.status)
+        })
+        self.observe("repo_api_request_duration_seconds",
+                     route_labels,
+                     finished_at - request_timer.started_at)
+        for (stage, seconds) in stage_seconds.items():
+            self.observe("repo_api_request_stage_duration_seconds",
+                         {"route": request_timer.route, "stage": stage},
+                         seconds)
+        if request_timer.bytes_received:
+            self.inc("repo_api_received_bytes_total", route_labels, request_timer.bytes_received)
+        if request_timer.bytes_sent:
+            self.inc("repo_api_sent_bytes_total", route_labels, request_timer.bytes_sent)
+        for error_class in request_timer.errors:
+            self.inc("repo_api_errors_total", {"route": request_timer.route, "class": error_class})
+
+        return None
+
+    def snapshot(self):
+        samples = []
+        for collector in self._collectors:
+            try:
+                samples.extend(collector())
+            except Exception as e:
+                print(e)
+
+        with self._lock:
+            snapshot = {
+                "pid": os.getpid(),
+                "buckets": list(self.latency_buckets),
+                "counters": [[name, list(labels), value] for ((name, labels), value) in self._counters.items()],
+                "histograms": [[name, list(labels), list(values)] for ((name, labels), values) in self._histograms.items()],
+                "gauges": []
+            }
+        for (name, labels, value) in samples:
+            if GAUGE == METRICS[name][0]:
+                snapshot["gauges"].append([name, list(_labels_key(labels)), value])
+            else:
+                snapshot["counters"].append([name, list(_labels_key(labels)), value])
+
+        return snapshot
+
+def _process_is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+def _escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{{{}}}".format(",".join(
+        "{}=\"{}\"".format(name, _escape_label_value(value)) for (name, value) in labels))
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+# Add up snapshots of several processes and render them in the
+# Prometheus text exposition format.
+def render(snapshots):
+    counters = {}
+    histograms = {}
+    gauges = {}
+    latency_buckets = LATENCY_BUCKETS_SECONDS
+    for snapshot in snapshots:
+        latency_buckets = tuple(snapshot["buckets"])
+        for (name, labels, value) in snapshot["counters"]:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for (name, labels, values) in snapshot["histograms"]:
+            key = (name, tuple(map(tuple, labels)))
+            total = histograms.setdefault(key, [0] * len(values))
+            for (index, value) in enumerate(values):
+                total[index] += value
+        if snapshot["pid"] is not None and _process_is_running(snapshot["pid"]):
+            for (name, labels, value) in snapshot["gauges"]:
+                key = (name, tuple(map(tuple, labels)) + (("pid", str(snapshot["pid"])),))
+                gauges[key] = value
+
+    lines = []
+    for (name, (metric_type, help_text)) in METRICS.items():
+        lines.append("# HELP {} {}".format(name, help_text))
+        lines.append("# TYPE {} {}".format(name, metric_type))
+        if HISTOGRAM == metric_type:
+            for ((sample_name, labels), values) in sorted(histograms.items()):
+                if sample_name != name:
+                    continue
+                cumulative_count = 0
+                for (upper_bound, count) in zip(latency_buckets + (float("inf"),), values[:-1]):
+                    cumulative_count += count
+                    lines.append("{}_bucket{} {}".format(
+                        name,
+                        _format_labels(labels + (("le", "+Inf" if float("inf") == upper_bound else repr(upper_bound)),)),
+                        cumulative_count))
+                lines.append("{}_sum{} {}".format(name, _format_labels(labels), _format_value(values[-1])))
+                lines.append("{}_count{} {}".format(name, _format_labels(labels), cumulative_count))
+        else:
+            samples = counters if COUNTER == metric_type else gauges
+            for ((sample_name, labels), value) in sorted(samples.items()):
+                if sample_name == name:
+                    lines.append("{}{} {}".format(name, _format_labels(labels), _format_value(value)))
+
+    return "\n".join(lines) + "\n"
+
+# Add the counters and histograms of snapshot to those of retired. Gauges
+# describe live processes only and are dropped.
+def _fold_snapshot(retired, snapshot):
+    counters = {(name, tuple(map(tuple, labels))): value for (name, labels, value) in retired["counters"]}
+    for (name, labels, value) in snapshot["counters"]:
+        key = (name, tuple(map(tuple, labels)))
+        counters[key] = counters.get(key, 0) + value
+    histograms = {(name, tuple(map(tuple, labels))): values for (name, labels, values) in retired["histograms"]}
+    for (name, labels, values) in snapshot["histograms"]:
+        key = (name, tuple(map(tuple, labels)))
+        total = histograms.setdefault(key, [0] * len(values))
+        for (index, value) in enumerate(values):
+            total[index] += value
+
+    return {
+        "pid": None,
+        "buckets": snapshot["buckets"],
+        "counters": [[name, list(labels), value] for ((name, labels), value) in counters.items()],
+        "histograms": [[name, list(labels), values] for ((name, labels), values) in histograms.items()],
+        "gauges": []
+    }
+
+# The metrics of this process, written to a directory shared with the
+# other worker processes.
+class SharedMetrics:
+    def __init__(self, registry, directory):
+        self.registry = registry
+        self.directory = directory
+        self._flush_lock = threading.Lock()
+        self._flushed_version = None
+        self._retired = False
+        self._stop_event = None
+        self._thread = None
+
+    def _file_path(self, pid=None):
+        return "{}/{}.json".format(self.directory, os.getpid() if pid is None else pid)
+
+    # Hold the directory's lock, shared to read the files or exclusive to
+    # move a worker's file into the retired one.
+    @contextlib.contextmanager
+    def _locked(self, operation):
+        with open("{}/{}".format(self.directory, LOCK_FILE_NAME), "a") as lock_file:
+            fcntl.flock(lock_file.fileno(), operation)
+            yield
+
+    # Remove the files of earlier runs.
+    def clear(self):
+        for file_path in glob.glob("{}/*.json".format(self.directory)):
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+        return None
+
+    def flush(self, force=False):
+        with self._flush_lock:
+            version = self.registry.version
+            if self._retired or (not force and version == self._flushed_version):
+                return None
+            file_path = self._file_path()
+            temporary_file_path = "{}.tmp".format(file_path)
+            with open(temporary_file_path, "w") as metrics_file:
+                json.dump(self.registry.snapshot(), metrics_file)
+            os.replace(temporary_file_path, file_path)
+            self._flushed_version = version
+
+        return None
+
+    # Fold the file of a worker that has exited into the retired totals
+    # and remove it, so its counters keep counting without a file per
+    # worker ever started, and a new process reusing its pid does not
+    # overwrite them.
+    def retire(self, pid):
+        file_path = self._file_path(pid)
+        retired_file_path = "{}/{}".format(self.directory, RETIRED_FILE_NAME)
+        with self._locked(fcntl.LOCK_EX):
+            try:
+                with open(file_path) as metrics_file:
+                    snapshot = json.load(metrics_file)
+            except FileNotFoundError:
+                return None
+            except ValueError:
+                # Written by an older version.
+                snapshot = None
+
+            if snapshot is not None:
+                try:
+                    with open(retired_file_path) as metrics_file:
+                        retired = json.load(metrics_file)
+                except (FileNotFoundError, ValueError):
+                    retired = {"counters": [], "histograms": []}
+                temporary_file_path = "{}.tmp".format(retired_file_path)
+                with open(temporary_file_path, "w") as metrics_file:
+                    json.dump(_fold_snapshot(retired, snapshot), metrics_file)
+                os.replace(temporary_file_path, retired_file_path)
+            os.remove(file_path)
+
+        return None
+
+    def _run(self, stop_event):
+        while not stop_event.wait(FLUSH_INTERVAL_SECONDS):
+            try:
+                self.flush()
+            except Exception as e:
+                print(e)
+
+        return None
+
+    # Write the metrics in the background. Threads do not survive a fork,
+    # so a pre-forked worker starts its own. A file already under this
+    # pid was left by an earlier process that was not retired.
+    def start(self):
+        self.retire(os.getpid())
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            args=(self._stop_event,),
+            name="metrics-flush",
+            daemon=True)
+        self._thread.start()
+
+        return None
+
+    # Stop writing, and retire this process's metrics when it is exiting.
+    def stop(self, retire=False):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        self.flush(force=True)
+        if retire:
+            with self._flush_lock:
+                self._retired = True
+            self.retire(os.getpid())
+
+        return None
+
+    # The metrics of every worker, this one up to date.
+    def render(self):
+        self.flush(force=True)
+        snapshots = []
+        with self._locked(fcntl.LOCK_SH):
+            for file_path in glob.glob("{}/*.json".format(self.directory)):
+                try:
+                    with open(file_path) as metrics_file:
+                        snapshots.append(json.load(metrics_file))
+                except (FileNotFoundError, ValueError):
+                    # Being replaced, or written by an older version.
+                    continue
+
+        return render(snapshots)
+
+class _CountingInput:
+    def __init__(self, stream, request_timer):
+        self._stream = stream
+        self._request_timer = request_timer
+
+    def _count(self, data):
+        self._request_timer.bytes_received += len(data)
+        return data
+
+    def read(self, *args):
+        return self._count(self._stream.read(*args))
+
+    def readline(self, *args):
+        return self._count(self._stream.readline(*args))
+
+    def readlines(self, *args):
+        return [self._count(line) for line in self._stream.readlines(*args)]
+
+    def __iter__(self):
+        for line in self._stream:
+            yield self._count(line)
+
+# WSGI middleware timing every request and counting its bytes. Put it
+# outside other middleware, so their time counts as queueing.
+class MetricsMiddleware:
+    def __init__(self, application, registry, routes):
+        self.application = application
+        self.registry = registry
+        self.routes = frozenset(routes)
+
+    def __call__(self, environ, start_response):
+        request_timer = RequestTimer(
+            route_label(environ.get("PATH_INFO", ""), self.routes),
+            environ.get("REQUEST_METHOD", ""))
+        if "wsgi.input" in environ:
+            environ["wsgi.input"] = _CountingInput(environ["wsgi.input"], request_timer)
+        content_length = []
+
+        def timed_start_response(status, headers, *args):
+            request_timer.status = status.split(" ", 1)[0]
+            if request_timer.handler_finished_at is None:
+                request_timer.handler_finished_at = time.perf_counter()
+            content_length[:] = [value for (name, value) in headers if "content-length" == name.lower()]
+            return start_response(status, headers, *args)
+
+        token = start_request(request_timer)
+        try:
+            application_iter = self.application(environ, timed_start_response)
+        except BaseException:
+            self.registry.record_request(request_timer)
+            raise
+        finally:
+            end_request(token)
+
+        def finish():
+            self.registry.record_request(request_timer)
+
+        if fileresponses.is_file_wrapper(application_iter, environ):
+            # Sent by the server, possibly with sendfile, so only its
+            # length is known.
+            if content_length and "HEAD" != request_timer.method:
+                request_timer.bytes_sent = int(content_length[0])
+            return fileresponses.call_on_close(application_iter, environ, finish)
+
+        def counted_body():
+            for chunk in application_iter:
+                request_timer.bytes_sent += len(chunk)
+                yield chunk
+
+        return fileresponses.call_on_close(counted_body(), environ, _closing(application_iter, finish))
+
+# A callback closing application_iter, then calling callback.
+def _closing(application_iter, callback):
+    def close_then_callback():
+        try:
+            close = getattr(application_iter, "close", None)
+            if close is not None:
+                close()
+        finally:
+            callback()
+
+    return close_then_callback
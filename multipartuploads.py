@@ -0,0 +1,370 @@
+#!/usr/bin/python3
+import argparse
+import collections
+import contextlib
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import tempfile
+import threading
+import time
+
+# Resumable multipart upload sessions.
+#
+# A large file is uploaded as numbered parts, each in its own request, so
+# a dropped connection only costs the part in flight. Every session is a
+# directory under the sessions root holding session.json (who uploads
+# what, where) and one file per part, named after its part number and
+# SHA-256 digest:
+#   <upload id>/session.json
+#   <upload id>/00001-<sha256>
+# Parts are written to a temporary file and moved into place, so they can
+# be uploaded in parallel, by any worker process, and a client resuming
+# after a disconnect can list the parts that arrived whole. A part sent
+# again replaces the earlier uploads of its part number.
+#
+# Completing a session first renames its directory, so no part can be
+# added while the parts are being assembled and two completions cannot
+# both succeed. Sessions not touched for max_age_seconds are removed by
+# collect_garbage:
+#   python3 multipartuploads.py [--max-age <seconds>]
+
+SESSIONS_DIRECTORY_NAME = ".multipart"
+SESSION_FILE_NAME = "session.json"
+HASH_ALGORITHM = "sha256"
+
+MAX_PART_NUMBER = 10000
+COPY_CHUNK_SIZE = 64 * 1024
+
+# Sessions untouched for this long are considered abandoned.
+DEFAULT_MAX_AGE_SECONDS = 24 * 3600.0
+# Starting a session collects abandoned ones at most this often.
+GARBAGE_COLLECTION_INTERVAL_SECONDS = 3600.0
+
+_UPLOAD_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+_PART_FILE_PATTERN = re.compile(r"^(\d{5})-([0-9a-f]{64})$")
+_COMPLETING_SUFFIX = ".completing"
+
+UploadSession = collections.namedtuple(
+    "UploadSession",
+    ["upload_id", "username", "repo_name", "directory_path", "file_name", "write_mode"])
+
+UploadPart = collections.namedtuple(
+    "UploadPart",
+    ["part_number", "size", "checksum"])
+
+class MultipartUploadError(ValueError):
+    pass
+
+class UploadSessionNotFoundError(MultipartUploadError):
+    pass
+
+# Raised when more than max_bytes are sent for a part.
+class PartTooLargeError(MultipartUploadError):
+    pass
+
+def _part_file_name(part_number, checksum):
+    return "{:05d}-{}".format(part_number, checksum)
+
+# A binary stream over the parts' files, one after the other.
+class _PartsReader:
+    def __init__(self, part_paths):
+        self._part_paths = list(part_paths)
+        self._current_file = None
+
+    def read(self, size=-1):
+        while True:
+            if self._current_file is None:
+                if not self._part_paths:
+                    return b""
+                self._current_file = open(self._part_paths.pop(0), "rb")
+            chunk = self._current_file.read(size)
+            if chunk:
+                return chunk
+            self._current_file.close()
+            self._current_file = None
+
+    def close(self):
+        if self._current_file is not None:
+            self._current_file.close()
+            self._current_file = None
+
+        return None
+
+class UploadSessions:
+    def __init__(self, root_directory, max_age_seconds=DEFAULT_MAX_AGE_SECONDS):
+        self.root_directory = root_directory
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(self.root_directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._last_collection = 0.0
+
+    def _session_directory(self, upload_id):
+        # The upload id comes from the client and becomes a path.
+        if not isinstance(upload_id, str) or not _UPLOAD_ID_PATTERN.match(upload_id):
+            raise UploadSessionNotFoundError("Unknown upload '{}'.".format(upload_id))
+        return os.path.join(self.root_directory, upload_id)
+
+    @staticmethod
+    def _read_session(session_directory, upload_id):
+        try:
+            with open(os.path.join(session_directory, SESSION_FILE_NAME), "r") as f:
+                session_json = json.load(f)
+        except FileNotFoundError:
+            raise UploadSessionNotFoundError("Unknown upload '{}'.".format(upload_id))
+
+        return UploadSession(upload_id, **session_json)
+
+    # Returns the session, checking that it belongs to the repository.
+    def get(self, upload_id, username, repo_name):
+        session = self._read_session(self._session_directory(upload_id), upload_id)
+        if session.username != username or session.repo_name != repo_name:
+            raise UploadSessionNotFoundError("Unknown upload '{}'.".format(upload_id))
+
+        return session
+
+    def start(self, username, repo_name, directory_path, file_name, write_mode="wb"):
+        self._collect_garbage_if_due()
+
+        upload_id = secrets.token_hex(16)
+        session_directory = self._session_directory(upload_id)
+        os.mkdir(session_directory)
+        session_json = {
+            "username": username,
+            "repo_name": repo_name,
+            "directory_path": directory_path,
+            "file_name": file_name,
+            "write_mode": write_mode
+        }
+        with open(os.path.join(session_directory, SESSION_FILE_NAME), "w") as f:
+            json.dump(session_json, f)
+
+        return UploadSession(upload_id, **session_json)
+
+    # Store one part from a binary stream. checksum, when given, is the
+    # hex SHA-256 digest the client computed; a part that does not match
+    # it is dropped. Uploading a part number again replaces the part.
+    def put_part(self, session, part_number, stream, checksum=None, max_bytes=None):
+        if part_number < 1 or part_number > MAX_PART_NUMBER:
+            raise MultipartUploadError("Part numbers go from 1 to {}.".format(MAX_PART_NUMBER))
+
+        session_directory = self._session_directory(session.upload_id)
+        try:
+            (temporary_file_descriptor, temporary_file_path) = tempfile.mkstemp(
+                prefix=".part-",
+                dir=session_directory)
+        except FileNotFoundError:
+            # Completed, aborted or collected meanwhile.
+            raise UploadSessionNotFoundError("Unknown upload '{}'.".format(session.upload_id))
+
+        part_hash = hashlib.new(HASH_ALGORITHM)
+        part_size = 0
+        try:
+            with os.fdopen(temporary_file_descriptor, "wb") as f:
+                while True:
+                    chunk = stream.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    part_size += len(chunk)
+                    if max_bytes is not None and part_size > max_bytes:
+                        raise PartTooLargeError(
+                            "Part {} is larger than {} bytes.".format(part_number, max_bytes))
+                    part_hash.update(chunk)
+                    f.write(chunk)
+
+            part_checksum = part_hash.hexdigest()
+            if checksum is not None and checksum.lower() != part_checksum:
+                raise MultipartUploadError(
+                    "Part {} does not match its checksum.".format(part_number))
+            part_path = os.path.join(session_directory, _part_file_name(part_number, part_checksum))
+            try:
+                os.replace(temporary_file_path, part_path)
+            except FileNotFoundError:
+                raise UploadSessionNotFoundError("Unknown upload '{}'.".format(session.upload_id))
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temporary_file_path)
+            raise
+
+        self._remove_superseded_parts(session_directory, part_number, part_path)
+
+        # Uploading a part keeps the session alive.
+        with contextlib.suppress(FileNotFoundError):
+            os.utime(session_directory)
+
+        return UploadPart(part_number, part_size, part_checksum)
+
+    # Remove the earlier uploads of part_number, which _stored_parts would
+    # never use again. A newer one, from a concurrent upload of the same
+    # part, is left in place: it wins over part_path.
+    @staticmethod
+    def _remove_superseded_parts(session_directory, part_number, part_path):
+        part_prefix = "{:05d}-".format(part_number)
+        try:
+            part_mtime_ns = os.stat(part_path).st_mtime_ns
+            directory_entries = list(os.scandir(session_directory))
+        except FileNotFoundError:
+            # Completed, aborted or collected meanwhile.
+            return None
+
+        for directory_entry in directory_entries:
+            if (directory_entry.path == part_path or
+                not directory_entry.name.startswith(part_prefix) or
+                _PART_FILE_PATTERN.match(directory_entry.name) is None):
+                continue
+            with contextlib.suppress(FileNotFoundError):
+                if directory_entry.stat().st_mtime_ns < part_mtime_ns:
+                    os.unlink(directory_entry.path)
+
+        return None
+
+    # Returns the parts stored so far by part number, with their paths.
+    # If a part was uploaded more than once, the latest upload wins.
+    @staticmethod
+    def _stored_parts(session_directory):
+        stored_parts = {}
+        for directory_entry in os.scandir(session_directory):
+            match = _PART_FILE_PATTERN.match(directory_entry.name)
+            if match is None:
+                continue
+            part_stat = directory_entry.stat()
+            part_number = int(match.group(1))
+            stored_part = stored_parts.get(part_number)
+            if stored_part is not None and stored_part[0] > part_stat.st_mtime_ns:
+                continue
+            stored_parts[part_number] = (
+                part_stat.st_mtime_ns,
+                UploadPart(part_number, part_stat.st_size, match.group(2)),
+                directory_entry.path)
+
+        return {
+            part_number: (upload_part, part_path)
+            for (part_number, (_, upload_part, part_path)) in stored_parts.items()
+        }
+
+    # The parts stored so far, by part number: what a client resuming an
+    # upload still has to send.
+    def parts(self, session):
+        try:
+            stored_parts = self._stored_parts(self._session_directory(session.upload_id))
+        except FileNotFoundError:
+            raise UploadSessionNotFoundError("Unknown upload '{}'.".format(session.upload_id))
+
+        return [stored_parts[part_number][0] for part_number in sorted(stored_parts)]
+
+    # Claim the session and yield a stream of its parts in part number
+    # order. expected_parts, when given, is a list of (part_number,
+    # checksum) the client wants assembled; every one of them must be
+    # stored with that checksum and no other part is used. The session is
+    # removed once the block succeeds, or given back if it raises.
+    @contextlib.contextmanager
+    def completing(self, session, expected_parts=None):
+        session_directory = self._session_directory(session.upload_id)
+        claimed_directory = session_directory + _COMPLETING_SUFFIX
+        try:
+            os.rename(session_directory, claimed_directory)
+        except FileNotFoundError:
+            raise UploadSessionNotFoundError("Unknown upload '{}'.".format(session.upload_id))
+        # Keep the garbage collector away while the parts are assembled.
+        os.utime(claimed_directory)
+
+        parts_reader = None
+        try:
+            stored_parts = self._stored_parts(claimed_directory)
+            if expected_parts is None:
+                part_numbers = sorted(stored_parts)
+            else:
+                part_numbers = []
+                for (part_number, checksum) in expected_parts:
+                    stored_part = stored_parts.get(part_number)
+                    if stored_part is None:
+                        raise MultipartUploadError("Part {} has not been uploaded.".format(part_number))
+                    if checksum is not None and checksum.lower() != stored_part[0].checksum:
+                        raise MultipartUploadError(
+                            "Part {} does not match its checksum.".format(part_number))
+                    part_numbers.append(part_number)
+                if part_numbers != sorted(set(part_numbers)):
+                    raise MultipartUploadError("Parts must be listed once each, in ascending order.")
+            if not part_numbers:
+                raise MultipartUploadError("No parts have been uploaded.")
+
+            parts_reader = _PartsReader(stored_parts[part_number][1] for part_number in part_numbers)
+            yield parts_reader
+        except BaseException:
+            if parts_reader is not None:
+                parts_reader.close()
+            os.rename(claimed_directory, session_directory)
+            raise
+
+        parts_reader.close()
+        shutil.rmtree(claimed_directory, ignore_errors=True)
+
+        return None
+
+    def abort(self, session):
+        session_directory = self._session_directory(session.upload_id)
+        if not os.path.isdir(session_directory):
+            raise UploadSessionNotFoundError("Unknown upload '{}'.".format(session.upload_id))
+        shutil.rmtree(session_directory, ignore_errors=True)
+
+        return None
+
+    # Remove the sessions no part has been uploaded to for max_age_seconds,
+    # including ones whose completion was interrupted. Returns the number
+    # of sessions removed.
+    def collect_garbage(self, max_age_seconds=None):
+        if max_age_seconds is None:
+            max_age_seconds = self.max_age_seconds
+        cutoff = time.time() - max_age_seconds
+
+        sessions_removed = 0
+        for directory_entry in os.scandir(self.root_directory):
+            try:
+                if directory_entry.stat().st_mtime >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            shutil.rmtree(directory_entry.path, ignore_errors=True)
+            sessions_removed += 1
+
+        return sessions_removed
+
+    def _collect_garbage_if_due(self):
+        with self._lock:
+            now = time.time()
+            if now - self._last_collection < GARBAGE_COLLECTION_INTERVAL_SECONDS:
+                return None
+            self._last_collection = now
+
+        self.collect_garbage()
+
+        return None
+
+    def stats(self):
+        session_count = 0
+        for directory_entry in os.scandir(self.root_directory):
+            if _UPLOAD_ID_PATTERN.match(directory_entry.name):
+                session_count += 1
+
+        return {
+            "sessions": session_count,
+            "max_age_seconds": self.max_age_seconds
+        }
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Remove abandoned multipart upload sessions.")
+    parser.add_argument("--root", default=os.path.join("repo-host-root", SESSIONS_DIRECTORY_NAME),
+                        help="Upload sessions directory.")
+    parser.add_argument("--max-age", type=float, default=DEFAULT_MAX_AGE_SECONDS,
+                        help="Seconds a session may go without a new part before it is removed.")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = _parse_arguments()
+    upload_sessions = UploadSessions(arguments.root)
+    removed = upload_sessions.collect_garbage(max_age_seconds=arguments.max_age)
+    print("Removed {} abandoned upload sessions from {}".format(removed, arguments.root))
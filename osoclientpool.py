@@ -0,0 +1,211 @@
+#!/usr/bin/python3
+import os
+import threading
+
+import oso_cloud
+import oso_cloud.api
+import requests
+import requests.adapters
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Factory for Oso Cloud clients that share a pooled, keep-alive HTTP session.
+#
+# The oso_cloud client opens a new connection (and TLS handshake) for
+# every call. Clients built here send their calls through one
+# requests.Session instead, whose connection pool is sized to the number
+# of threads that may call Oso Cloud at once. Connections are kept alive
+# and reused, and every call has explicit connect/read timeouts.
+#
+# AsyncOsoClient makes the authorize call from asyncio code (see
+# repoasgi.py) through an httpx.AsyncClient, when the optional httpx
+# package is installed.
+
+DEFAULT_OSO_URL = "https://cloud.osohq.com"
+DEFAULT_POOL_SIZE = 16
+DEFAULT_CONNECT_TIMEOUT_SECONDS = 3.05
+DEFAULT_READ_TIMEOUT_SECONDS = 10.0
+
+def oso_url():
+    return os.environ.get("OSO_URL", DEFAULT_OSO_URL)
+
+# The pool is sized to the worker's thread count when it is known.
+def default_pool_size():
+    return int(os.environ.get(
+        "REPO_API_OSO_POOL_SIZE",
+        os.environ.get("REPO_API_WORKER_THREADS", DEFAULT_POOL_SIZE)))
+
+# The private oso_cloud.api.API methods _PooledAPI replaces to send every
+# call through its session. They are not part of oso_cloud's public API,
+# so requirements.txt pins the minor version they were tested with, and
+# tests/osoclientpooltests.py fails if they disappear.
+OVERRIDDEN_API_METHODS = ("_do_post", "_do_get", "_do_delete")
+
+class _PooledAPI(oso_cloud.api.API):
+    def __init__(self,
+                 url,
+                 api_key,
+                 pool_size,
+                 connect_timeout_seconds,
+                 read_timeout_seconds):
+        super().__init__(url, api_key)
+        self.timeout = (connect_timeout_seconds, read_timeout_seconds)
+
+        self.adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size)
+        self.session = requests.Session()
+        self.session.headers.update(self._default_headers())
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+        self._requests_sent = 0
+        self._requests_lock = threading.Lock()
+
+    def _do_request(self, method, url, params, json):
+        with self._requests_lock:
+            self._requests_sent += 1
+        return self.session.request(
+            method,
+            url,
+            params=params,
+            json=json,
+            timeout=self.timeout)
+
+    def _do_post(self, url, params, json):
+        return self._do_request("POST", url, params, json)
+
+    def _do_get(self, url, params, json):
+        return self._do_request("GET", url, params, json)
+
+    def _do_delete(self, url, params, json):
+        return self._do_request("DELETE", url, params, json)
+
+    def connection_stats(self):
+        connections_opened = 0
+        pools = self.adapter.poolmanager.pools
+        for pool_key in list(pools.keys()):
+            pool = pools.get(pool_key)
+            if pool is not None:
+                connections_opened += pool.num_connections
+
+        with self._requests_lock:
+            requests_sent = self._requests_sent
+
+        return {
+            "requests": requests_sent,
+            "connections_opened": connections_opened,
+            "connections_reused": max(requests_sent - connections_opened, 0),
+            "reuse_ratio": (1.0 - connections_opened / requests_sent) if requests_sent else 0.0
+        }
+
+    def close(self):
+        self.session.close()
+
+        return None
+
+def create_oso_client(url=None,
+                      api_key=None,
+                      pool_size=None,
+                      connect_timeout_seconds=DEFAULT_CONNECT_TIMEOUT_SECONDS,
+                      read_timeout_seconds=DEFAULT_READ_TIMEOUT_SECONDS):
+    if url is None:
+        url = oso_url()
+    if api_key is None:
+        api_key = os.environ.get("OSO_AUTH")
+    if pool_size is None:
+        pool_size = default_pool_size()
+
+    oso_client = oso_cloud.Oso(url=url, api_key=api_key)
+    oso_client.api = _PooledAPI(
+        url,
+        api_key,
+        pool_size,
+        connect_timeout_seconds,
+        read_timeout_seconds)
+
+    return oso_client
+
+_shared_client = None
+_shared_client_lock = threading.Lock()
+
+# The process-wide client. It is safe to share across threads.
+def get_shared_client():
+    global _shared_client
+    with _shared_client_lock:
+        if _shared_client is None:
+            _shared_client = create_oso_client()
+        return _shared_client
+
+# Drop the process-wide client, i.e. in a worker process after fork, so
+# that pooled connections are never shared between processes.
+def reset_shared_client():
+    global _shared_client
+    with _shared_client_lock:
+        old_client = _shared_client
+        _shared_client = None
+    if old_client is not None:
+        old_client.api.close()
+
+    return None
+
+def connection_stats(oso_client):
+    if isinstance(getattr(oso_client, "api", None), _PooledAPI):
+        return oso_client.api.connection_stats()
+    return None
+
+# Oso Cloud authorization checks for asyncio code, over a pool of
+# keep-alive connections. The client belongs to the event loop it was
+# created on, so each worker process creates its own after fork.
+class AsyncOsoClient:
+    def __init__(self,
+                 url=None,
+                 api_key=None,
+                 pool_size=None,
+                 connect_timeout_seconds=DEFAULT_CONNECT_TIMEOUT_SECONDS,
+                 read_timeout_seconds=DEFAULT_READ_TIMEOUT_SECONDS):
+        if url is None:
+            url = oso_url()
+        if api_key is None:
+            api_key = os.environ.get("OSO_AUTH")
+        if pool_size is None:
+            pool_size = default_pool_size()
+
+        # Same endpoint and headers as the synchronous client.
+        api = oso_cloud.api.API(url, api_key)
+        self._authorize_url = "{}/{}/authorize".format(api.url, api.api_base)
+        self._client = httpx.AsyncClient(
+            headers=api._default_headers(),
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(
+                read_timeout_seconds,
+                connect=connect_timeout_seconds))
+
+    async def authorize(self, actor_object_dict, action, resource_object_dict):
+        http_response = await self._client.post(self._authorize_url, json={
+            "actor_type": actor_object_dict["type"],
+            "actor_id": actor_object_dict["id"],
+            "action": action,
+            "resource_type": resource_object_dict["type"],
+            "resource_id": resource_object_dict["id"],
+            "context_facts": []
+        })
+        http_response.raise_for_status()
+        return http_response.json()["allowed"]
+
+    async def aclose(self):
+        await self._client.aclose()
+
+        return None
+
+# Returns an AsyncOsoClient, or None when httpx is not installed.
+def create_async_oso_client(**kwargs):
+    if httpx is None:
+        return None
+
+    return AsyncOsoClient(**kwargs)
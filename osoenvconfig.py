@@ -1,14 +1,10 @@
 #!/usr/bin/python3
-import os
-import oso_cloud
+import osoclientpool
 
 def clear_environment():
     try:
         # Authenticate the connection to Oso Cloud.
-        host_api_key = os.environ.get("OSO_AUTH")
-        oso_client = oso_cloud.Oso(
-            url="https://cloud.osohq.com",
-            api_key=host_api_key)
+        oso_client = osoclientpool.get_shared_client()
 
         # Clear any existing data in Oso Cloud.
         oso_client.api.clear_data()
@@ -21,10 +17,7 @@ def clear_environment():
 def load_policy(policy_file_name="policy.polar"):
     try:
         # Authenticate the connection to Oso Cloud.
-        host_api_key = os.environ.get("OSO_AUTH")
-        oso_client = oso_cloud.Oso(
-            url="https://cloud.osohq.com",
-            api_key=host_api_key)
+        oso_client = osoclientpool.get_shared_client()
         # Load the Polar authorization policy into Oso Cloud.
         with open(policy_file_name) as policy_file:
             policy_string = policy_file.read()
@@ -0,0 +1,351 @@
+#!/usr/bin/python3
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.parse
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import localpolicy
+
+# A local stand-in for the Oso Cloud HTTP API.
+#
+# It implements the calls this project makes through the oso_cloud client
+# (tell/delete, bulk tell/delete, authorize, authorize_resources, actions,
+# get, policy and clear_data) and evaluates them with localpolicy, so the
+# application and its tests can run with no network access. Latency,
+# jitter and an error rate can be injected to benchmark the application
+# against a realistic (or a misbehaving) authorization backend.
+#
+# Point the application at it with:
+#   OSO_URL=http://localhost:8080 OSO_AUTH=<any value>
+
+DEFAULT_STANDIN_HOST_NAME = "localhost"
+DEFAULT_STANDIN_PORT_NUMBER = 8080
+
+class StandinState:
+    def __init__(self, policy_string):
+        self._lock = threading.Lock()
+        # Fact JSON in the order it was told, keyed on (predicate, args)
+        # where args is a tuple of (type, id) pairs.
+        self._facts = {}
+        self.policy_string = policy_string
+        self.authorizer = localpolicy.LocalAuthorizer(
+            localpolicy.parse_policy(policy_string))
+
+    @staticmethod
+    def _fact_key(fact_json):
+        args = tuple((arg["type"], arg["id"]) for arg in fact_json["args"])
+        return (fact_json["predicate"], args)
+
+    @staticmethod
+    def _apply(authorizer, fact_key, add):
+        (predicate, args) = fact_key
+        if localpolicy.HAS_ROLE_PREDICATE != predicate or 3 != len(args):
+            return None
+
+        (actor, role, resource) = [{"type": arg_type, "id": arg_id} for (arg_type, arg_id) in args]
+        if add:
+            authorizer.tell(predicate, actor, role["id"], resource)
+        else:
+            authorizer.delete(predicate, actor, role["id"], resource)
+
+        return None
+
+    def tell(self, facts_json):
+        with self._lock:
+            for fact_json in facts_json:
+                fact_key = self._fact_key(fact_json)
+                if fact_key not in self._facts:
+                    self._apply(self.authorizer, fact_key, True)
+                    self._facts[fact_key] = fact_json
+
+        return None
+
+    def delete(self, facts_json):
+        with self._lock:
+            for fact_json in facts_json:
+                fact_key = self._fact_key(fact_json)
+                if self._facts.pop(fact_key, None) is not None:
+                    self._apply(self.authorizer, fact_key, False)
+
+        return None
+
+    def get(self, predicate, arg_filters):
+        with self._lock:
+            facts = list(self._facts.values())
+
+        matching_facts = []
+        for fact_json in facts:
+            if predicate is not None and predicate != fact_json["predicate"]:
+                continue
+            matches = True
+            for (index, (arg_type, arg_id)) in arg_filters.items():
+                if index >= len(fact_json["args"]):
+                    matches = False
+                    break
+                arg = fact_json["args"][index]
+                if ((arg_type is not None and arg_type != arg["type"]) or
+                    (arg_id is not None and arg_id != arg["id"])):
+                    matches = False
+                    break
+            if matches:
+                matching_facts.append(fact_json)
+
+        return matching_facts
+
+    # The new policy only replaces the old one once every stored fact has
+    # been loaded into it. If the policy does not parse, or a fact does not
+    # fit it, the error is raised and the old policy stays in place.
+    def set_policy(self, policy_string):
+        authorizer = localpolicy.LocalAuthorizer(localpolicy.parse_policy(policy_string))
+        with self._lock:
+            for fact_key in self._facts:
+                self._apply(authorizer, fact_key, True)
+            self.policy_string = policy_string
+            self.authorizer = authorizer
+
+        return None
+
+    def clear_data(self):
+        with self._lock:
+            self._facts.clear()
+            self.authorizer.clear_data()
+
+        return None
+
+class FaultInjection:
+    def __init__(self, latency_seconds=0.0, jitter_seconds=0.0, error_rate=0.0, seed=None):
+        self.latency_seconds = latency_seconds
+        self.jitter_seconds = jitter_seconds
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay_seconds(self):
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_seconds, self.jitter_seconds)
+        return max(self.latency_seconds + jitter, 0.0)
+
+    def should_fail(self):
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+def _typed_id(actor_type, actor_id):
+    return {"type": actor_type, "id": actor_id}
+
+class _StandinRequestHandler(BaseHTTPRequestHandler):
+    # Keep connections alive like Oso Cloud does. Headers and body are
+    # written separately, so Nagle's algorithm would add a delayed-ACK
+    # stall to every response.
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status_code, body):
+        body_bytes = json.dumps(body).encode("utf-8")
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body_bytes)))
+        self.end_headers()
+        self.wfile.write(body_bytes)
+
+        return None
+
+    def _read_json(self):
+        content_length = int(self.headers.get("Content-Length", 0))
+        if 0 == content_length:
+            return None
+        return json.loads(self.rfile.read(content_length))
+
+    def _handle(self, method):
+        parsed_url = urllib.parse.urlsplit(self.path)
+        route = (method, parsed_url.path.rstrip("/"))
+        try:
+            body = self._read_json()
+        except ValueError:
+            return self._send_json(400, {"message": "Invalid JSON body."})
+
+        delay_seconds = self.server.faults.delay_seconds()
+        if delay_seconds > 0:
+            time.sleep(delay_seconds)
+        if self.server.faults.should_fail():
+            return self._send_json(500, {"message": "Injected error."})
+
+        handler = _ROUTES.get(route)
+        if handler is None:
+            return self._send_json(404, {"message": "Unknown route {} {}.".format(*route)})
+
+        try:
+            (status_code, response_body) = handler(
+                self.server.state,
+                body,
+                urllib.parse.parse_qs(parsed_url.query))
+        except (KeyError, TypeError, ValueError) as e:
+            return self._send_json(400, {"message": str(e)})
+
+        return self._send_json(status_code, response_body)
+
+    def do_GET(self):
+        return self._handle("GET")
+
+    def do_POST(self):
+        return self._handle("POST")
+
+    def do_DELETE(self):
+        return self._handle("DELETE")
+
+def _post_facts(state, body, _):
+    state.tell([body])
+    return (200, body)
+
+def _delete_facts(state, body, _):
+    state.delete([body])
+    return (200, {"message": "Deleted fact."})
+
+def _get_facts(state, _, query):
+    predicate = query.get("predicate", [None])[0]
+    arg_filters = {}
+    for (name, values) in query.items():
+        parts = name.split(".")
+        if 3 == len(parts) and "args" == parts[0]:
+            index = int(parts[1])
+            (arg_type, arg_id) = arg_filters.get(index, (None, None))
+            if "type" == parts[2]:
+                arg_type = values[0]
+            elif "id" == parts[2]:
+                arg_id = values[0]
+            arg_filters[index] = (arg_type, arg_id)
+    return (200, state.get(predicate, arg_filters))
+
+def _post_bulk_load(state, body, _):
+    state.tell(body)
+    return (200, {"message": "Loaded {} facts.".format(len(body))})
+
+def _post_bulk_delete(state, body, _):
+    state.delete(body)
+    return (200, {"message": "Deleted {} facts.".format(len(body))})
+
+def _post_authorize(state, body, _):
+    allowed = state.authorizer.authorize(
+        _typed_id(body["actor_type"], body["actor_id"]),
+        body["action"],
+        _typed_id(body["resource_type"], body["resource_id"]))
+    return (200, {"allowed": allowed})
+
+def _post_authorize_resources(state, body, _):
+    actor = _typed_id(body["actor_type"], body["actor_id"])
+    results = state.authorizer.authorize_resources(
+        actor,
+        body["action"],
+        body["resources"])
+    return (200, {"results": results})
+
+def _post_actions(state, body, _):
+    actions = state.authorizer.actions(
+        _typed_id(body["actor_type"], body["actor_id"]),
+        _typed_id(body["resource_type"], body["resource_id"]))
+    return (200, {"results": actions})
+
+def _get_policy(state, _, __):
+    return (200, {"policy": {"filename": "", "src": state.policy_string}})
+
+def _post_policy(state, body, _):
+    try:
+        state.set_policy(body["src"])
+    except (localpolicy.PolicyParseError, ValueError) as e:
+        return (400, {"message": str(e)})
+    return (200, {"message": "Policy loaded."})
+
+def _post_clear_data(state, _, __):
+    state.clear_data()
+    return (200, {"message": "Data cleared."})
+
+_ROUTES = {
+    ("POST", "/api/facts"): _post_facts,
+    ("DELETE", "/api/facts"): _delete_facts,
+    ("GET", "/api/facts"): _get_facts,
+    ("POST", "/api/bulk_load"): _post_bulk_load,
+    ("POST", "/api/bulk_delete"): _post_bulk_delete,
+    ("POST", "/api/authorize"): _post_authorize,
+    ("POST", "/api/authorize_resources"): _post_authorize_resources,
+    ("POST", "/api/actions"): _post_actions,
+    ("GET", "/api/policy"): _get_policy,
+    ("POST", "/api/policy"): _post_policy,
+    ("POST", "/api/clear_data"): _post_clear_data
+}
+
+class StandinServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address, state, faults, verbose=False):
+        super().__init__(server_address, _StandinRequestHandler)
+        self.state = state
+        self.faults = faults
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        (host, port) = self.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+# Start a stand-in server on a background thread. Port 0 picks a free port;
+# the chosen URL is available as server.url.
+def start_standin_server(host=DEFAULT_STANDIN_HOST_NAME,
+                         port=0,
+                         policy_file_name=None,
+                         faults=None,
+                         verbose=False):
+    if policy_file_name is None:
+        policy_file_name = localpolicy.default_policy_file_path()
+    with open(policy_file_name) as policy_file:
+        state = StandinState(policy_file.read())
+    if faults is None:
+        faults = FaultInjection()
+
+    server = StandinServer((host, port), state, faults, verbose=verbose)
+    thread = threading.Thread(target=server.serve_forever, name="oso-standin", daemon=True)
+    thread.start()
+
+    return server
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Local stand-in for the Oso Cloud API.")
+    parser.add_argument("--host", default=DEFAULT_STANDIN_HOST_NAME)
+    parser.add_argument("--port", type=int, default=DEFAULT_STANDIN_PORT_NUMBER)
+    parser.add_argument("--policy", default=localpolicy.default_policy_file_path(),
+                        help="Polar policy file loaded at start-up.")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds added to every response.")
+    parser.add_argument("--jitter", type=float, default=0.0,
+                        help="Maximum seconds randomly added to or removed from the latency.")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="Fraction of requests answered with a 500 error.")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = _parse_arguments()
+    with open(arguments.policy) as policy_file:
+        standin_state = StandinState(policy_file.read())
+    standin_faults = FaultInjection(
+        latency_seconds=arguments.latency,
+        jitter_seconds=arguments.jitter,
+        error_rate=arguments.error_rate,
+        seed=arguments.seed)
+    standin_server = StandinServer(
+        (arguments.host, arguments.port),
+        standin_state,
+        standin_faults,
+        verbose=arguments.verbose)
+    print("Oso Cloud stand-in running on {}".format(standin_server.url))
+    try:
+        standin_server.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+import contextlib
+import os
+import threading
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Per-path write locks shared by every worker process.
+#
+# A path is hashed onto one of stripe_count lock files under the locks
+# directory, and writers hold an exclusive flock on it while they replace
+# the file. Writes to different paths almost never wait for each other,
+# the number of lock files stays fixed however many paths are written,
+# and a lock is released by the kernel if its holder dies.
+#
+# Inside a process, a threading lock per stripe comes first: threads then
+# share one descriptor per stripe instead of each opening the lock file.
+# Descriptors are reopened after a fork, since a forked child shares its
+# parent's open file descriptions and with them its flocks.
+#
+# Without fcntl (Windows) the locks only exclude threads of one process.
+
+LOCKS_DIRECTORY_NAME = ".locks"
+DEFAULT_STRIPE_COUNT = 1024
+
+class PathLocks:
+    def __init__(self, root_directory, stripe_count=DEFAULT_STRIPE_COUNT):
+        self.root_directory = root_directory
+        self.stripe_count = stripe_count
+        os.makedirs(self.root_directory, exist_ok=True)
+
+        self._thread_locks = [threading.Lock() for _ in range(stripe_count)]
+        self._lock_files = {}
+        self._lock_files_pid = os.getpid()
+        self._lock_files_lock = threading.Lock()
+
+        self.acquisitions = 0
+        self.contentions = 0
+
+    def _stripe(self, key):
+        return zlib.crc32(key.encode("utf-8", "surrogateescape")) % self.stripe_count
+
+    def _lock_file_descriptor(self, stripe):
+        with self._lock_files_lock:
+            if self._lock_files_pid != os.getpid():
+                # Inherited from the parent process; never unlock them here.
+                self._lock_files = {}
+                self._lock_files_pid = os.getpid()
+
+            file_descriptor = self._lock_files.get(stripe)
+            if file_descriptor is None:
+                file_descriptor = os.open(
+                    os.path.join(self.root_directory, "{:04x}.lock".format(stripe)),
+                    os.O_RDWR | os.O_CREAT,
+                    0o644)
+                self._lock_files[stripe] = file_descriptor
+
+        return file_descriptor
+
+    def _acquire(self, stripe):
+        thread_lock = self._thread_locks[stripe]
+        if not thread_lock.acquire(blocking=False):
+            self.contentions += 1
+            thread_lock.acquire()
+        try:
+            if fcntl is not None:
+                file_descriptor = self._lock_file_descriptor(stripe)
+                try:
+                    fcntl.flock(file_descriptor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    self.contentions += 1
+                    fcntl.flock(file_descriptor, fcntl.LOCK_EX)
+        except BaseException:
+            thread_lock.release()
+            raise
+        self.acquisitions += 1
+
+        return None
+
+    def _release(self, stripe):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._lock_file_descriptor(stripe), fcntl.LOCK_UN)
+        finally:
+            self._thread_locks[stripe].release()
+
+        return None
+
+    # Hold the write locks of every key for the duration of the block.
+    # Stripes are taken in a fixed order, so two writers locking several
+    # paths cannot deadlock.
+    @contextlib.contextmanager
+    def locked(self, *keys):
+        stripes = sorted(set(self._stripe(key) for key in keys))
+        acquired_stripes = []
+        try:
+            for stripe in stripes:
+                self._acquire(stripe)
+                acquired_stripes.append(stripe)
+            yield None
+        finally:
+            for stripe in reversed(acquired_stripes):
+                self._release(stripe)
+
+    def close(self):
+        with self._lock_files_lock:
+            if self._lock_files_pid == os.getpid():
+                for file_descriptor in self._lock_files.values():
+                    os.close(file_descriptor)
+            self._lock_files = {}
+
+        return None
+
+    def stats(self):
+        return {
+            "stripes": self.stripe_count,
+            "acquisitions": self.acquisitions,
+            "contentions": self.contentions,
+            "cross_process": fcntl is not None
+        }
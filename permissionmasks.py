@@ -0,0 +1,241 @@
+#!/usr/bin/python3
+import threading
+import timeit
+import tracemalloc
+
+from policydefinitions import RepositoryPermissions, RepositoryRoles
+
+# Compiled, bitmask form of a resource's roles and permissions.
+#
+# Each permission is assigned one bit. Each role is assigned a mask of
+# every permission it grants, with the role hierarchy (i.e. "admin" if
+# "owner") already folded in. Roles also get their own bit above the
+# permission bits, so a single integer per (user, resource) records both
+# the granted roles and the resulting permissions, and a check is one
+# integer AND.
+
+def _public_constants(constants_class):
+    # Class attributes are kept in definition order.
+    return tuple(value for (name, value) in vars(constants_class).items()
+                 if not name.startswith("_") and isinstance(value, str))
+
+REPOSITORY_PERMISSIONS = _public_constants(RepositoryPermissions)
+REPOSITORY_ROLES = _public_constants(RepositoryRoles)
+
+class PermissionModel:
+    __slots__ = ("permissions", "roles", "permission_bits", "role_bits", "role_masks")
+
+    # role_permissions maps each role to every permission it grants,
+    # including the permissions of the roles it implies.
+    def __init__(self, permissions, roles, role_permissions):
+        self.permissions = tuple(permissions)
+        self.roles = tuple(roles)
+
+        self.permission_bits = {}
+        for (index, permission) in enumerate(self.permissions):
+            self.permission_bits[permission] = 1 << index
+
+        self.role_bits = {}
+        self.role_masks = {}
+        role_shift = len(self.permissions)
+        for (index, role) in enumerate(self.roles):
+            self.role_bits[role] = 1 << (role_shift + index)
+            permission_mask = 0
+            for permission in role_permissions.get(role, ()):
+                permission_mask |= self.permission_bits[permission]
+            self.role_masks[role] = permission_mask
+
+    @classmethod
+    def from_resource_policy(cls, resource_policy):
+        return cls(
+            resource_policy.permissions,
+            resource_policy.roles,
+            resource_policy.role_permissions)
+
+    def permission_bit(self, permission):
+        return self.permission_bits.get(permission, 0)
+
+    def grant_mask(self, roles):
+        mask = 0
+        for role in roles:
+            role_bit = self.role_bits.get(role)
+            if role_bit is None:
+                raise ValueError("Unknown role '{}'.".format(role))
+            mask |= role_bit | self.role_masks[role]
+        return mask
+
+    def roles_in_mask(self, mask):
+        return frozenset(role for (role, role_bit) in self.role_bits.items()
+                         if mask & role_bit)
+
+    def permissions_in_mask(self, mask):
+        return frozenset(permission for (permission, permission_bit) in self.permission_bits.items()
+                         if mask & permission_bit)
+
+# Compile the Repository model using the order of the constants defined in
+# policydefinitions. The role -> permission table comes from the parsed
+# policy (see localpolicy.ResourcePolicy.role_permissions).
+def compile_repository_model(role_permissions):
+    unknown_roles = set(role_permissions) - set(REPOSITORY_ROLES)
+    if unknown_roles:
+        raise ValueError("Roles missing from RepositoryRoles: {}".format(
+            sorted(unknown_roles)))
+
+    return PermissionModel(REPOSITORY_PERMISSIONS, REPOSITORY_ROLES, role_permissions)
+
+# Per-(user, resource) grants stored as one small integer each.
+#
+# Grants are kept by user, then by resource: each user is stored once, as
+# the key of a dictionary of its resources' grant masks, rather than once
+# per grant inside a (user, resource) tuple, and a check builds no tuple.
+# Users hold several grants each, so this costs about half the memory of
+# a dictionary keyed on (user, resource) tuples. Masks that fit in a byte
+# are shared, cached small integers. A check is two dictionary lookups and
+# one integer AND.
+class GrantTable:
+    __slots__ = ("model", "_permission_bits", "_grants", "_grant_count", "_lock")
+
+    def __init__(self, model):
+        self.model = model
+        self._permission_bits = model.permission_bits
+        # user -> {resource: grant mask}; users without grants are removed.
+        self._grants = {}
+        self._grant_count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._grant_count
+
+    def grant(self, user, role, resource):
+        role_mask = self.model.grant_mask((role,))
+        with self._lock:
+            user_grants = self._grants.get(user)
+            if user_grants is None:
+                user_grants = {}
+                self._grants[user] = user_grants
+            mask = user_grants.get(resource, 0)
+            if 0 == mask:
+                self._grant_count += 1
+            user_grants[resource] = mask | role_mask
+
+        return None
+
+    def revoke(self, user, role, resource):
+        with self._lock:
+            user_grants = self._grants.get(user)
+            if user_grants is None or resource not in user_grants:
+                return None
+
+            remaining_roles = self.model.roles_in_mask(user_grants[resource]) - {role}
+            if remaining_roles:
+                user_grants[resource] = self.model.grant_mask(remaining_roles)
+            else:
+                del user_grants[resource]
+                self._grant_count -= 1
+                if not user_grants:
+                    del self._grants[user]
+
+        return None
+
+    def clear(self):
+        with self._lock:
+            self._grants.clear()
+            self._grant_count = 0
+
+        return None
+
+    def mask(self, user, resource):
+        user_grants = self._grants.get(user)
+        if user_grants is None:
+            return 0
+        return user_grants.get(resource, 0)
+
+    # The hot path: two lookups of the grant and one AND.
+    def check(self, user, permission, resource):
+        user_grants = self._grants.get(user)
+        return (user_grants is not None and
+                0 != (user_grants.get(resource, 0) &
+                      self._permission_bits.get(permission, 0)))
+
+    def roles(self, user, resource):
+        return self.model.roles_in_mask(self.mask(user, resource))
+
+    def permissions(self, user, resource):
+        return self.model.permissions_in_mask(self.mask(user, resource))
+
+###############################################################################
+# Benchmark
+###############################################################################
+def _grant_triples(number_of_grants):
+    roles = REPOSITORY_ROLES
+    for index in range(number_of_grants):
+        yield ("user-{}".format(index // 4),
+               roles[index % len(roles)],
+               "repo-{}".format(index))
+
+def _build_string_sets(role_permissions, number_of_grants):
+    grants = {}
+    for (username, role, repo_name) in _grant_triples(number_of_grants):
+        grants.setdefault((username, repo_name), set()).add(role)
+
+    def check(username, permission, repo_name):
+        for role in grants.get((username, repo_name), ()):
+            if permission in role_permissions[role]:
+                return True
+        return False
+
+    return (grants, check)
+
+def _build_grant_table(model, number_of_grants):
+    grant_table = GrantTable(model)
+    for (username, role, repo_name) in _grant_triples(number_of_grants):
+        grant_table.grant(username, role, repo_name)
+    return (grant_table, grant_table.check)
+
+def _measure(build, number_of_grants, number_of_checks):
+    tracemalloc.start()
+    (structure, check) = build(number_of_grants)
+    (memory_in_bytes, _) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    checks = [
+        ("user-{}".format(index // 4),
+         REPOSITORY_PERMISSIONS[index % len(REPOSITORY_PERMISSIONS)],
+         "repo-{}".format(index % number_of_grants))
+        for index in range(number_of_checks)
+    ]
+
+    def run_checks():
+        for (username, permission, repo_name) in checks:
+            check(username, permission, repo_name)
+
+    seconds = min(timeit.repeat(run_checks, number=1, repeat=3))
+    return {
+        "memory_in_bytes": memory_in_bytes,
+        "checks_per_second": number_of_checks / seconds if seconds else float("inf")
+    }
+
+# Compare grant table checks against string-set lookups of the same grants.
+def benchmark(role_permissions, number_of_grants=100000, number_of_checks=100000):
+    model = compile_repository_model(role_permissions)
+    return {
+        "string_sets": _measure(
+            lambda count: _build_string_sets(role_permissions, count),
+            number_of_grants,
+            number_of_checks),
+        "grant_table": _measure(
+            lambda count: _build_grant_table(model, count),
+            number_of_grants,
+            number_of_checks)
+    }
+
+if __name__ == "__main__":
+    import localpolicy
+
+    policy = localpolicy.load_policy_file(localpolicy.default_policy_file_path())
+    results = benchmark(policy.role_permission_table("Repository"))
+    for (name, result) in results.items():
+        print("{:<12} {:>14,} bytes {:>14,.0f} checks/s".format(
+            name,
+            result["memory_in_bytes"],
+            result["checks_per_second"]))
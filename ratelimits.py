@@ -0,0 +1,280 @@
+#!/usr/bin/python3
+import collections
+import os
+import sqlite3
+import threading
+import time
+
+# Token bucket rate limits shared by every worker process.
+#
+# A bucket holds up to `burst` tokens and refills at `rate` tokens per
+# second. Request limits take one token per request; byte limits are
+# charged the bytes a request actually moved once it is done, and may go
+# into debt, so one large transfer holds back the user's next ones for as
+# long as it should have taken at the configured rate.
+#
+# Buckets live in one SQLite database under the host directory, updated
+# in short write transactions, so all workers see the same state. It is
+# not synced to disk: losing it in a crash only refills the buckets. A
+# bucket that has refilled completely is the same as no bucket, so such
+# rows are deleted from time to time.
+
+RATE_LIMITS_DIRECTORY_NAME = ".rate-limits"
+BUCKETS_FILE_NAME = "buckets.sqlite3"
+
+# Seconds a write waits for another process holding the database.
+BUSY_TIMEOUT_SECONDS = 5.0
+# Full buckets are removed at most this often.
+PURGE_INTERVAL_SECONDS = 60.0
+
+# rate: tokens per second; burst: bucket size.
+RateLimit = collections.namedtuple("RateLimit", ["rate", "burst"])
+
+class RateLimitError(ValueError):
+    pass
+
+# Parse "<rate>[/<burst>]", i.e. "10" or "10/50". The burst defaults to
+# one second's worth of tokens.
+def parse_rate_limit(text):
+    try:
+        rate_text, _, burst_text = text.partition("/")
+        rate = float(rate_text)
+        burst = float(burst_text) if burst_text else max(rate, 1.0)
+    except ValueError:
+        raise RateLimitError("Invalid rate limit '{}', expected <rate>[/<burst>].".format(text))
+    if rate <= 0 or burst <= 0:
+        raise RateLimitError("Rate limits must be positive: '{}'.".format(text))
+
+    return RateLimit(rate, burst)
+
+# Parse "<name>=<rate>[/<burst>],..." into {name: RateLimit}.
+def parse_rate_limits(text):
+    rate_limits = {}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        name, separator, rate_limit_text = item.partition("=")
+        if not separator:
+            raise RateLimitError("Invalid rate limit '{}', expected <name>=<rate>[/<burst>].".format(item))
+        rate_limits[name.strip()] = parse_rate_limit(rate_limit_text.strip())
+
+    return rate_limits
+
+class TokenBuckets:
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self._lock = threading.Lock()
+        self._connection = None
+        self._connection_pid = None
+        self._last_purge = 0.0
+
+        self.granted = 0
+        self.limited = 0
+
+    # Called with the lock held. A connection must not be used across a
+    # fork, so every process opens its own, on first use.
+    def _connect(self):
+        if self._connection_pid == os.getpid():
+            return self._connection
+
+        self._connection = sqlite3.connect(
+            self.database_path,
+            timeout=BUSY_TIMEOUT_SECONDS,
+            isolation_level=None,
+            check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=OFF")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            "key TEXT PRIMARY KEY, "
+            "tokens REAL NOT NULL, "
+            "updated REAL NOT NULL, "
+            "full_at REAL NOT NULL)")
+        self._connection_pid = os.getpid()
+
+        return self._connection
+
+    @staticmethod
+    def _refilled(row, rate_limit, now):
+        if row is None:
+            return rate_limit.burst
+        (tokens, updated) = row
+        return min(rate_limit.burst, tokens + max(0.0, now - updated) * rate_limit.rate)
+
+    @staticmethod
+    def _store(connection, key, rate_limit, tokens, now):
+        connection.execute(
+            "INSERT OR REPLACE INTO buckets VALUES (?, ?, ?, ?)",
+            (key, tokens, now, now + (rate_limit.burst - tokens) / rate_limit.rate))
+
+        return None
+
+    def _purge_if_due(self, connection, now):
+        if now - self._last_purge < PURGE_INTERVAL_SECONDS:
+            return None
+        self._last_purge = now
+        connection.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+
+        return None
+
+    # Take cost tokens from every bucket in costs, a list of (key,
+    # RateLimit, cost), or from none of them. A bucket in debt admits
+    # nothing, even at cost 0. Returns 0.0 when the tokens were taken,
+    # else the seconds until they would all be available.
+    def acquire(self, costs, now=None):
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                buckets = []
+                retry_after_seconds = 0.0
+                for (key, rate_limit, cost) in costs:
+                    row = connection.execute(
+                        "SELECT tokens, updated FROM buckets WHERE key = ?",
+                        (key,)).fetchone()
+                    tokens = self._refilled(row, rate_limit, now)
+                    # A request larger than the bucket waits for a full one.
+                    needed = max(0.0, min(cost, rate_limit.burst))
+                    if tokens < needed:
+                        retry_after_seconds = max(
+                            retry_after_seconds,
+                            (needed - tokens) / rate_limit.rate)
+                    buckets.append((key, rate_limit, tokens - cost))
+
+                if 0.0 == retry_after_seconds:
+                    for (key, rate_limit, tokens) in buckets:
+                        self._store(connection, key, rate_limit, tokens, now)
+                    self._purge_if_due(connection, now)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+            if 0.0 == retry_after_seconds:
+                self.granted += 1
+            else:
+                self.limited += 1
+
+        return retry_after_seconds
+
+    # Take amount tokens from a bucket after the fact, going into debt if
+    # it holds fewer.
+    def charge(self, key, rate_limit, amount, now=None):
+        if now is None:
+            now = time.time()
+        if amount <= 0:
+            return None
+
+        with self._lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = connection.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?",
+                    (key,)).fetchone()
+                tokens = self._refilled(row, rate_limit, now) - amount
+                self._store(connection, key, rate_limit, tokens, now)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+        return None
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None and self._connection_pid == os.getpid():
+                self._connection.close()
+            self._connection = None
+            self._connection_pid = None
+
+        return None
+
+    def stats(self):
+        with self._lock:
+            connection = self._connect()
+            bucket_count = connection.execute("SELECT COUNT(*) FROM buckets").fetchone()[0]
+            return {
+                "buckets": bucket_count,
+                "granted": self.granted,
+                "limited": self.limited
+            }
+
+# Per-user limits on requests (overall and per route) and on upload and
+# download bytes. A limit left as None is not enforced.
+class RateLimiter:
+    def __init__(self,
+                 token_buckets,
+                 user_limit=None,
+                 route_limits=None,
+                 upload_byte_limit=None,
+                 download_byte_limit=None):
+        self.token_buckets = token_buckets
+        self.user_limit = user_limit
+        self.route_limits = dict(route_limits or {})
+        self.upload_byte_limit = upload_byte_limit
+        self.download_byte_limit = download_byte_limit
+
+        # Checks and charges that failed on the database, i.e. when it
+        # stayed locked past BUSY_TIMEOUT_SECONDS. Limits fail open: the
+        # request is admitted, or the charge dropped, rather than failed.
+        self.errors = 0
+        self._errors_lock = threading.Lock()
+
+    def _count_error(self, error):
+        with self._errors_lock:
+            self.errors += 1
+        print(error)
+
+        return None
+
+    # Admit one request by username to route (its name without the
+    # leading slash). Returns 0.0, or the seconds to wait before retrying.
+    def admit(self, username, route, uploads=False, downloads=False):
+        costs = []
+        if self.user_limit is not None:
+            costs.append(("user:{}".format(username), self.user_limit, 1))
+        route_limit = self.route_limits.get(route)
+        if route_limit is not None:
+            costs.append(("route:{}:{}".format(route, username), route_limit, 1))
+        if uploads and self.upload_byte_limit is not None:
+            costs.append(("upload-bytes:{}".format(username), self.upload_byte_limit, 0))
+        if downloads and self.download_byte_limit is not None:
+            costs.append(("download-bytes:{}".format(username), self.download_byte_limit, 0))
+        if not costs:
+            return 0.0
+
+        try:
+            return self.token_buckets.acquire(costs)
+        except sqlite3.Error as e:
+            self._count_error(e)
+            return 0.0
+
+    def _charge(self, key, rate_limit, byte_count):
+        try:
+            self.token_buckets.charge(key, rate_limit, byte_count)
+        except sqlite3.Error as e:
+            self._count_error(e)
+
+        return None
+
+    def charge_upload(self, username, byte_count):
+        if self.upload_byte_limit is not None:
+            self._charge("upload-bytes:{}".format(username), self.upload_byte_limit, byte_count)
+
+        return None
+
+    def charge_download(self, username, byte_count):
+        if self.download_byte_limit is not None:
+            self._charge("download-bytes:{}".format(username), self.download_byte_limit, byte_count)
+
+        return None
+
+    def stats(self):
+        stats = self.token_buckets.stats()
+        with self._errors_lock:
+            stats["errors"] = self.errors
+        return stats
@@ -1,20 +1,38 @@
 #!/usr/bin/python3
+import concurrent.futures
 import json
+import math
 import os
-import oso_cloud
 import sys
+import threading
 
 from flask import Flask
+from flask import g
 from flask import jsonify
 from flask import make_response
 from flask import request
-from flask import send_file
+from flask import Response
 
 # Add the current directory to the system path
 application_dir = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(application_dir)
 
+import authzcache
+import circuitbreaker
+import compressioncache
+import directorylisting
+import factjournal
+import fileresponses
+import listingcache
+import loadshedding
+import localpolicy
+import metrics
+import multipartuploads
+import osoclientpool
+import ratelimits
+import repoarchives
 import repohostutils
+import sharedfacts
 
 from policydefinitions import RepositoryPermissions, RepositoryRoles
 from repohostutils import ApiParameterKeys, ApiResponseKeys
@@ -27,8 +45,374 @@ from repohostutils import ParameterValidation
 #   API services.
 _oso_client = None
 
+# Authorization decision cache:
+#   Sits in front of _oso_client.authorize so that repeated checks
+#   for the same (user, permission, repository) do not each pay an
+#   Oso Cloud round trip. It is configured at the bottom of the file.
+_authorization_cache = None
+
+# Local policy evaluation engine:
+#   When "local decisions" mode is enabled, authorization requests are
+#   answered in-process from policy.polar and a mirrored copy of the
+#   "has_role" facts, so no network call is made in the hot path. Facts
+#   written by /create-repo go to a file shared by every worker process
+#   (see sharedfacts.py), which also keeps them across restarts.
+_local_authorizer = None
+_granted_facts = None
+
+# Write-behind fact journal:
+#   When enabled, facts are appended to a durable local journal and sent
+#   to Oso Cloud in bulk by a background worker, instead of being told
+#   synchronously inside the request.
+_fact_journal = None
+
+# Circuit breaker around Oso Cloud calls:
+#   Bounds how long a request waits on Oso Cloud and stops calling it
+#   after repeated failures. While it is open, the last known decisions
+#   are served from the decision cache, and requests without one get a
+#   503 response.
+_oso_breaker = None
+
+# Background revalidation of stale decisions served while Oso Cloud is
+# unavailable. Disabled unless an executor is configured.
+_revalidation_executor = None
+_revalidating_keys = set()
+_revalidating_keys_lock = threading.Lock()
+
+# Largest accepted /upload-file body in bytes, or None for no limit.
+_max_upload_bytes = None
+
+# Largest file a /complete-multipart-upload may assemble, in bytes, or
+# None for no limit. Defaults to _max_upload_bytes.
+_max_multipart_upload_bytes = None
+
+# Largest total size of the files extracted by one /upload-archive
+# request. Set from the upload cap at the bottom of the file.
+_max_extracted_bytes = repoarchives.DEFAULT_MAX_EXTRACTED_BYTES
+
+# Per-user request and byte rate limits (see ratelimits.py), shared by
+# all worker processes. Disabled unless configured at the bottom of the
+# file.
+_rate_limiter = None
+
+# Admission control (see loadshedding.py): bounds the requests each
+# worker process runs at once and sheds low priority ones with a 503
+# under overload. Disabled unless configured at the bottom of the file.
+_admission_controller = None
+
+# Request metrics served by /metrics (see metrics.py), shared by all
+# worker processes through files under the host directory.
+_metrics = None
+
+# Upper bound on the number of checks in one /authorize-batch request.
+MAX_AUTHORIZE_BATCH_SIZE = 1000
+
 _app = Flask(__name__)
 
+# Log an exception caught by a route, and count it by class for /metrics.
+def _report_error(error):
+    print(error)
+    metrics.record_error(error)
+
+    return None
+
+# Call Oso Cloud through the circuit breaker, when one is configured.
+def _call_oso(function, *args):
+    if _oso_breaker is None:
+        return function(*args)
+    return _oso_breaker.call(function, *args)
+
+def _revalidate(user_object_dict, permission, repo_object_dict):
+    key = (user_object_dict["id"], permission, repo_object_dict["id"])
+    try:
+        generation = _authorization_cache.generation(key[0], key[2])
+        allowed = _call_oso(_oso_client.authorize,
+                            user_object_dict,
+                            permission,
+                            repo_object_dict)
+        _authorization_cache.put(key[0], permission, key[2], allowed, generation)
+    except Exception as e:
+        print(e)
+    finally:
+        with _revalidating_keys_lock:
+            _revalidating_keys.discard(key)
+
+    return None
+
+# Return the last known decision, if any, while Oso Cloud is failing, and
+# schedule a background refresh of it.
+def _stale_decision(user_object_dict, permission, repo_object_dict):
+    if _authorization_cache is None:
+        return None
+
+    allowed = _authorization_cache.get_stale(user_object_dict["id"],
+                                             permission,
+                                             repo_object_dict["id"])
+    if allowed is not None and _revalidation_executor is not None:
+        key = (user_object_dict["id"], permission, repo_object_dict["id"])
+        with _revalidating_keys_lock:
+            if key in _revalidating_keys:
+                return allowed
+            _revalidating_keys.add(key)
+        _revalidation_executor.submit(_revalidate,
+                                      user_object_dict,
+                                      permission,
+                                      repo_object_dict)
+
+    return allowed
+
+# The local decisions mode answer: a fact loaded from Oso Cloud at start-up,
+# or one written by any worker since, grants the permission.
+def _local_allows(user_object_dict, permission, repo_object_dict):
+    if _local_authorizer.authorize(user_object_dict, permission, repo_object_dict):
+        return True
+    return (_granted_facts is not None and
+            _granted_facts.authorize(user_object_dict, permission, repo_object_dict))
+
+# Check Oso Cloud (or the local engine/decision cache) to see whether the
+# actor has the permission on the resource.
+@metrics.timed_stage(metrics.STAGE_AUTHORIZATION)
+def _authorize(user_object_dict, permission, repo_object_dict):
+    if _local_authorizer is not None:
+        return _local_allows(user_object_dict,
+                             permission,
+                             repo_object_dict)
+
+    # Honor facts that have not been confirmed by Oso Cloud yet.
+    if (_fact_journal is not None and
+        _fact_journal.pending_allows(user_object_dict, permission, repo_object_dict)):
+        return True
+
+    username = user_object_dict["id"]
+    repo_name = repo_object_dict["id"]
+    generation = None
+    if _authorization_cache is not None:
+        allowed = _authorization_cache.get(username, permission, repo_name)
+        if allowed is not None:
+            return allowed
+        # A grant told while Oso Cloud answers must win over its answer.
+        generation = _authorization_cache.generation(username, repo_name)
+
+    try:
+        allowed = _call_oso(_oso_client.authorize,
+                            user_object_dict,
+                            permission,
+                            repo_object_dict)
+    except Exception:
+        # Serve the last known decision while Oso Cloud is failing.
+        allowed = _stale_decision(user_object_dict, permission, repo_object_dict)
+        if allowed is None:
+            raise
+        return allowed
+
+    if _authorization_cache is not None:
+        _authorization_cache.put(username, permission, repo_name, allowed, generation)
+
+    return allowed
+
+# Resolve a list of (username, permission, repo_name) checks in one pass.
+# Duplicate checks are resolved once, cached decisions are reused, and the
+# remaining checks are grouped per (username, permission) so that each
+# group costs a single Oso Cloud authorize_resources call instead of one
+# authorize call per repository.
+@metrics.timed_stage(metrics.STAGE_AUTHORIZATION)
+def _authorize_batch(checks):
+    decisions = {}
+    pending_repos = {}
+    generations = {}
+    for check in dict.fromkeys(checks):
+        (username, permission, repo_name) = check
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if _local_authorizer is not None:
+            decisions[check] = _local_allows(user_object_dict,
+                                             permission,
+                                             repo_object_dict)
+            continue
+
+        if (_fact_journal is not None and
+            _fact_journal.pending_allows(user_object_dict, permission, repo_object_dict)):
+            decisions[check] = True
+            continue
+
+        if _authorization_cache is not None:
+            allowed = _authorization_cache.get(username, permission, repo_name)
+            if allowed is not None:
+                decisions[check] = allowed
+                continue
+            generations[check] = _authorization_cache.generation(username, repo_name)
+
+        pending_repos.setdefault((username, permission), []).append(repo_object_dict)
+
+    for ((username, permission), repo_object_dicts) in pending_repos.items():
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        try:
+            allowed_repo_names = set(
+                allowed_repo["id"] for allowed_repo in _call_oso(
+                    _oso_client.authorize_resources,
+                    user_object_dict,
+                    permission,
+                    repo_object_dicts))
+        except Exception:
+            # Serve the last known decisions while Oso Cloud is failing.
+            for repo_object_dict in repo_object_dicts:
+                allowed = _stale_decision(user_object_dict, permission, repo_object_dict)
+                if allowed is None:
+                    raise
+                decisions[(username, permission, repo_object_dict["id"])] = allowed
+            continue
+
+        for repo_object_dict in repo_object_dicts:
+            repo_name = repo_object_dict["id"]
+            allowed = repo_name in allowed_repo_names
+            decisions[(username, permission, repo_name)] = allowed
+            if _authorization_cache is not None:
+                _authorization_cache.put(username, permission, repo_name, allowed,
+                                         generations[(username, permission, repo_name)])
+
+    return [decisions[check] for check in checks]
+
+# Create an Oso fact granting the actor a role on the resource. The fact is
+# either told to Oso Cloud or queued in the write-behind journal. It is
+# written to the shared granted facts when local decisions mode is enabled, and
+# any cached decisions for the pair are dropped. Denies are never cached,
+# so a grant made by any worker is seen by every other one at once.
+@metrics.timed_stage(metrics.STAGE_AUTHORIZATION)
+def _tell_has_role(user_object_dict, role, repo_object_dict):
+    result = None
+    if _fact_journal is not None:
+        result = _fact_journal.append(
+            "has_role",
+            user_object_dict,
+            role,
+            repo_object_dict)
+    elif _local_authorizer is None or _oso_client is not None:
+        result = _call_oso(
+            _oso_client.tell,
+            "has_role",
+            user_object_dict,
+            role,
+            repo_object_dict)
+    if _granted_facts is not None:
+        _granted_facts.tell(
+            "has_role",
+            user_object_dict,
+            role,
+            repo_object_dict)
+    elif _local_authorizer is not None:
+        _local_authorizer.tell(
+            "has_role",
+            user_object_dict,
+            role,
+            repo_object_dict)
+    if _authorization_cache is not None:
+        _authorization_cache.invalidate(user_object_dict["id"],
+                                        repo_object_dict["id"])
+
+    return result
+
+# Drop cached decisions for facts once Oso Cloud has confirmed them.
+def _on_facts_confirmed(facts):
+    if _authorization_cache is not None:
+        for (_, user_object_dict, _, repo_object_dict) in facts:
+            _authorization_cache.invalidate(user_object_dict["id"],
+                                            repo_object_dict["id"])
+
+    return None
+
+# Routes whose bytes count against the upload and download byte rates.
+_UPLOAD_ROUTES = ("upload-file", "upload-archive", "upload-part")
+_DOWNLOAD_ROUTES = ("download-file", "download-archive")
+
+# Returns a 429 response for a request over its user's rate limits, with
+# a Retry-After header of the seconds until it would be admitted, or None.
+def _rate_limit_response(username, route):
+    retry_after_seconds = _rate_limiter.admit(
+        username,
+        route,
+        uploads=route in _UPLOAD_ROUTES,
+        downloads=route in _DOWNLOAD_ROUTES)
+    if 0.0 == retry_after_seconds:
+        return None
+
+    response = make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_429_TOO_MANY_REQUESTS)
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after_seconds)))
+    return response
+
+# Every route names its user in the query string or the JSON body, so
+# rate limits are applied before any route runs, and before it calls
+# Oso Cloud. Requests without a username are left to the route to reject.
+@_app.before_request
+def _limit_request_rate():
+    if _rate_limiter is None:
+        return None
+
+    username = request.args.get(ApiParameterKeys.USERNAME)
+    if None == username and request.is_json:
+        request_json = request.get_json(silent=True)
+        if isinstance(request_json, dict):
+            username = request_json.get(ApiParameterKeys.USERNAME)
+    if not isinstance(username, str):
+        return None
+
+    route = request.path.strip("/")
+    response = _rate_limit_response(username, route)
+    if None != response:
+        return response
+
+    g.rate_limited_username = username
+    if route in _UPLOAD_ROUTES:
+        # Count the body as the route reads it.
+        g.upload_reader = repohostutils.LimitedReader(request.environ["wsgi.input"], None)
+        request.environ["wsgi.input"] = g.upload_reader
+
+    return None
+
+# Everything a request went through before this point counts as queueing
+# time in /metrics.
+@_app.before_request
+def _mark_route_started():
+    metrics.mark_handler_started()
+
+    return None
+
+# Charge the bytes a request moved to its user's byte rates.
+@_app.after_request
+def _charge_transferred_bytes(response):
+    username = g.get("rate_limited_username")
+    if None == username:
+        return response
+
+    upload_reader = g.get("upload_reader")
+    if None != upload_reader:
+        _rate_limiter.charge_upload(username, upload_reader.bytes_read)
+    elif request.path.strip("/") in _DOWNLOAD_ROUTES and "HEAD" != request.method:
+        if None != response.content_length:
+            _rate_limiter.charge_download(username, response.content_length)
+        elif not response.direct_passthrough:
+            # Streamed archives: charged as they are sent.
+            response.response = _charged_download_chunks(response.response, username)
+
+    return response
+
+def _charged_download_chunks(chunks, username):
+    byte_count = 0
+    try:
+        for chunk in chunks:
+            byte_count += len(chunk)
+            yield chunk
+    finally:
+        _rate_limiter.charge_download(username, byte_count)
+
 # This API route is controlled by the application provider.
 # Users subscribed to this application have permission to create
 # new repositories with their username. Oso Cloud manages the
@@ -42,9 +426,9 @@ def create_repo():
     repo_name = request.json.get(ApiParameterKeys.REPO_NAME)
 
     # Check that the required parameters have been provided in the HTTP request.
-    if (not ParameterValidation.check_required_str(ApiParameterKeys.USERNAME, username) or
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
         not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name)):
-        return make_response(None, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
 
     response_json = None
     try:
@@ -59,8 +443,7 @@ def create_repo():
             "type": "Repository",
             "id": repo_name
         }
-        _oso_client.tell(
-            "has_role",
+        _tell_has_role(
             user_object_dict,
             RepositoryRoles.OWNER,
             repo_object_dict)
@@ -69,9 +452,12 @@ def create_repo():
         # Get the relative path of the repo as a JSON
         # for to the response back to the client.
         response_json = repohostutils.get_path_json(relative_path)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
     except Exception as e:
-        print(e)
-        return make_response(None, HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
 
     return make_response(response_json, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
 
@@ -82,10 +468,10 @@ def create_directory():
     directory_path = request.json.get(ApiParameterKeys.DIRECTORY_PATH)
 
     # Check that the required parameters have been provided in the HTTP request.
-    if (not ParameterValidation.check_required_str(ApiParameterKeys.USERNAME, username) or
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
         not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
         not ParameterValidation.check_required_str(ApiParameterKeys.DIRECTORY_PATH, directory_path)):
-        return make_response(None, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
 
     response_json = None
     try:
@@ -99,37 +485,77 @@ def create_directory():
             "type": "Repository",
             "id": repo_name
         }
-        if _oso_client.authorize(user_object_dict,
-                                 RepositoryPermissions.CREATE_DIRECTORY,
-                                 repo_object_dict):
+        if _authorize(user_object_dict,
+                      RepositoryPermissions.CREATE_DIRECTORY,
+                      repo_object_dict):
             relative_path = repohostutils.create_user_repo_directory(
                 username,
                 repo_name,
                 directory_path)
             response_json = repohostutils.get_path_json(relative_path)
         else:
-            return make_response(None, HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
     except Exception as e:
-        print(e)
-        return make_response(None, HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
 
     return make_response(response_json, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
 
+# Page size of /list-directories when the request asks for entries
+# (files or a recursive walk) without giving a limit, and the largest
+# limit accepted.
+DEFAULT_LISTING_PAGE_SIZE = 1000
+MAX_LISTING_PAGE_SIZE = 10000
+
 @_app.route("/list-directories", methods=['GET'])
 def list_directories():
     username = request.json.get(ApiParameterKeys.USERNAME)
     repo_name = request.json.get(ApiParameterKeys.REPO_NAME)
     directory_path = request.json.get(ApiParameterKeys.DIRECTORY_PATH)
+    limit = request.json.get(ApiParameterKeys.LIMIT)
+    cursor = request.json.get(ApiParameterKeys.CURSOR)
+    recursive = request.json.get(ApiParameterKeys.RECURSIVE)
+    max_depth = request.json.get(ApiParameterKeys.MAX_DEPTH)
+    include_files = request.json.get(ApiParameterKeys.INCLUDE_FILES)
     if None == directory_path:
         directory_path = "."
 
     # Check that the required parameters have been provided in the HTTP request.
-    if (not ParameterValidation.check_required_str(ApiParameterKeys.USERNAME, username) or
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
         not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
-        not ParameterValidation.check_required_str(ApiParameterKeys.DIRECTORY_PATH, directory_path)):
-        return make_response(None, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+        not ParameterValidation.check_required_str(ApiParameterKeys.DIRECTORY_PATH, directory_path) or
+        not ParameterValidation.check_optional_int(ApiParameterKeys.LIMIT, limit, minimum=1) or
+        (None != cursor and not ParameterValidation.check_required_str(ApiParameterKeys.CURSOR, cursor)) or
+        not ParameterValidation.check_optional_bool(ApiParameterKeys.RECURSIVE, recursive) or
+        not ParameterValidation.check_optional_int(ApiParameterKeys.MAX_DEPTH, max_depth, minimum=1) or
+        not ParameterValidation.check_optional_bool(ApiParameterKeys.INCLUDE_FILES, include_files)):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    # Without any of the listing options the response keeps its original
+    # form: {"subdirectories": [...]}. With them it is a page of entries,
+    # or an NDJSON stream of entries if the client accepts one.
+    stream_entries = fileresponses.accepts_ndjson()
+    list_entries = (stream_entries or
+                    any(None != option for option in (limit, cursor, recursive, max_depth, include_files)))
+    if recursive:
+        max_depth = max_depth if None != max_depth else directorylisting.MAX_DEPTH
+    else:
+        max_depth = 1
+    include_files = bool(include_files)
+    if None != limit:
+        limit = min(limit, MAX_LISTING_PAGE_SIZE)
+    elif list_entries and not stream_entries:
+        limit = DEFAULT_LISTING_PAGE_SIZE
+
+    # Everything besides the directory's contents that the response depends on.
+    listing_shape = (list_entries, stream_entries, max_depth, include_files, limit, cursor)
 
     response_json = None
+    response = None
+    directory_stat = None
     try:
         # Check Oso Cloud to ensure the specified User has permission to
         # list directories from the specified Repository object.
@@ -141,26 +567,89 @@ def list_directories():
             "type": "Repository",
             "id": repo_name
         }
-        if _oso_client.authorize(user_object_dict,
-                                 RepositoryPermissions.LIST_DIRECTORIES,
-                                 repo_object_dict):
-            subdirectories = repohostutils.list_directories(
-                username,
-                repo_name,
-                directory_path
-            )
-            # Generate the list of subdirectories to provide in the server response to the client.
-            subdirectories_map = {
-                ApiResponseKeys.SUBDIRECTORIES: subdirectories
-            }
-            response_json = jsonify(subdirectories_map)
+        if _authorize(user_object_dict,
+                      RepositoryPermissions.LIST_DIRECTORIES,
+                      repo_object_dict):
+            # The directory's own ETag only covers its direct subdirectories,
+            # so recursive listings and listings with files have no validators.
+            if 1 == max_depth and not include_files:
+                directory_stat = repohostutils.get_directory_stat(
+                    username,
+                    repo_name,
+                    directory_path
+                )
+            if None != directory_stat:
+                not_modified_response = fileresponses.not_modified_response(
+                    fileresponses.listing_etag(directory_stat, listing_shape),
+                    directory_stat.st_mtime,
+                    weak=True)
+                if None != not_modified_response:
+                    not_modified_response.vary.add("Accept")
+                    return not_modified_response
+
+            if not list_entries:
+                subdirectories = repohostutils.list_directories(
+                    username,
+                    repo_name,
+                    directory_path
+                )
+                # Generate the list of subdirectories to provide in the server response to the client.
+                subdirectories_map = {
+                    ApiResponseKeys.SUBDIRECTORIES: subdirectories
+                }
+                response_json = jsonify(subdirectories_map)
+            elif None == limit:
+                entries = repohostutils.iterate_repo_entries(
+                    username,
+                    repo_name,
+                    directory_path,
+                    max_depth=max_depth,
+                    include_files=include_files
+                )
+                if None == entries:
+                    return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+                response = fileresponses.ndjson_response(entries)
+            else:
+                entries_page = repohostutils.page_repo_entries(
+                    username,
+                    repo_name,
+                    directory_path,
+                    limit,
+                    cursor=cursor,
+                    max_depth=max_depth,
+                    include_files=include_files
+                )
+                if None == entries_page:
+                    return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+                (entries, next_cursor) = entries_page
+                if stream_entries:
+                    response = fileresponses.ndjson_response(
+                        entries,
+                        last_line={ApiResponseKeys.NEXT_CURSOR: next_cursor})
+                else:
+                    response_json = jsonify({
+                        ApiResponseKeys.ENTRIES: entries,
+                        ApiResponseKeys.NEXT_CURSOR: next_cursor
+                    })
         else:
-            return make_response(None, HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+    except directorylisting.InvalidCursorError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
     except Exception as e:
-        print(e)
-        return make_response(None, HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
 
-    return make_response(response_json, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+    if None == response:
+        response = make_response(response_json, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+    # The response is JSON or NDJSON depending on the Accept header.
+    response.vary.add("Accept")
+    if None != directory_stat:
+        fileresponses.set_listing_validators(response, directory_stat, listing_shape)
+    return response
 
 @_app.route("/download-file", methods=['GET'])
 def download_file():
@@ -172,14 +661,14 @@ def download_file():
         download_file_name = repohostutils.get_file_name_from_path(file_path)
 
     # Check that the required parameters have been provided in the HTTP request.
-    if (not ParameterValidation.check_required_str(ApiParameterKeys.USERNAME, username) or
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
         not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
         not ParameterValidation.check_required_str(ApiParameterKeys.FILE_PATH, file_path)):
-        return make_response(None, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
 
 
-    file_object = None
-    file_object = None
+    full_file_path = None
+    file_record = None
     try:
         # Check Oso Cloud to ensure the specified User has permission to
         # download files from the specified Repository object.
@@ -191,32 +680,126 @@ def download_file():
             "type": "Repository",
             "id": repo_name
         }
-        if _oso_client.authorize(user_object_dict,
-                                 RepositoryPermissions.DOWNLOAD_FILE,
-                                 repo_object_dict):
-            file_mimetype = repohostutils.get_file_mimetype(
+        if _authorize(user_object_dict,
+                      RepositoryPermissions.DOWNLOAD_FILE,
+                      repo_object_dict):
+            file_record = repohostutils.get_file_record(
                 username,
                 repo_name,
                 file_path
             )
-            file_object = repohostutils.open_read_only_file(
+            full_file_path = repohostutils.get_file_path(
                 username,
                 repo_name,
-                file_path
+                file_path,
+                file_record=file_record
+            )
+            file_mimetype = repohostutils.get_file_mimetype(
+                username,
+                repo_name,
+                file_path,
+                file_record=file_record
             )
         else:
-            return make_response(None, HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
     except Exception as e:
-        print(e)
-        return make_response(None, HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
 
 
-    return send_file(
-                file_object,
-                mimetype=file_mimetype,
-                as_attachment=True,
-                download_name=download_file_name
-    )
+    if None == full_file_path:
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+
+    # Answers conditional requests with 304, Range/If-Range requests with
+    # 206 responses, and falls back to send_file (zero-copy on servers
+    # with a wsgi.file_wrapper) otherwise.
+    try:
+        return fileresponses.send_repo_file(
+                    full_file_path,
+                    file_mimetype,
+                    download_file_name,
+                    file_record=file_record
+        )
+    except (FileNotFoundError, IsADirectoryError):
+        # Indexed, but removed since.
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+
+@_app.route("/download-archive", methods=['GET'])
+def download_archive():
+    username = request.json.get(ApiParameterKeys.USERNAME)
+    repo_name = request.json.get(ApiParameterKeys.REPO_NAME)
+    directory_path = request.json.get(ApiParameterKeys.DIRECTORY_PATH)
+    archive_format = request.json.get(ApiParameterKeys.ARCHIVE_FORMAT)
+    compression = request.json.get(ApiParameterKeys.COMPRESSION)
+    download_file_name = request.json.get(ApiParameterKeys.DOWNLOAD_FILE_NAME)
+    if None == directory_path:
+        directory_path = "."
+    if None == archive_format:
+        archive_format = repoarchives.ARCHIVE_FORMAT_TAR
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.DIRECTORY_PATH, directory_path)):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    try:
+        repoarchives.check_archive_options(archive_format, compression)
+    except repoarchives.ArchiveOptionError as e:
+        print("[ERROR] {}".format(e))
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    if None == download_file_name:
+        download_file_name = "{}.{}".format(
+            repo_name,
+            repoarchives.archive_file_extension(archive_format, compression))
+
+    full_directory_path = None
+    try:
+        # Check Oso Cloud once, for the whole archive, to ensure the
+        # specified User has permission to download files from the
+        # specified Repository object.
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if _authorize(user_object_dict,
+                      RepositoryPermissions.DOWNLOAD_FILE,
+                      repo_object_dict):
+            full_directory_path = repohostutils.get_directory_path(
+                username,
+                repo_name,
+                directory_path
+            )
+        else:
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    if None == full_directory_path:
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+
+    # The archive is generated while it is sent, so its length is unknown
+    # and the response is streamed (chunked).
+    response = Response(
+        repoarchives.stream_archive(full_directory_path, archive_format, compression),
+        mimetype=repoarchives.archive_mimetype(archive_format, compression))
+    response.headers.set(
+        "Content-Disposition",
+        "attachment",
+        **fileresponses.content_disposition_parameters(download_file_name))
+    return response
 
 @_app.route("/upload-file", methods=['PUT'])
 def upload_file():
@@ -232,11 +815,17 @@ def upload_file():
         write_mode = "wb"
 
     # Check that the required parameters have been provided in the HTTP request.
-    if (not ParameterValidation.check_required_str(ApiParameterKeys.USERNAME, username) or
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
         not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
         not ParameterValidation.check_required_str(ApiParameterKeys.FILE_NAME, file_name) or
         not ParameterValidation.check_required_str(ApiParameterKeys.DIRECTORY_PATH, directory_path)):
-        return make_response(None, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    # Reject uploads that declare a body larger than the configured cap.
+    if (_max_upload_bytes is not None and
+        request.content_length is not None and
+        request.content_length > _max_upload_bytes):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_413_PAYLOAD_TOO_LARGE)
 
     json_response = None
     try:
@@ -250,36 +839,590 @@ def upload_file():
             "type": "Repository",
             "id": repo_name
         }
-        if _oso_client.authorize(user_object_dict,
-                                 RepositoryPermissions.UPLOAD_FILE,
-                                 repo_object_dict):
-            relative_path = repohostutils.write_file(
+        if _authorize(user_object_dict,
+                      RepositoryPermissions.UPLOAD_FILE,
+                      repo_object_dict):
+            # Stream the request body to disk rather than buffering it.
+            relative_path = repohostutils.write_file_stream(
                 username,
                 repo_name,
                 directory_path,
                 file_name,
-                request.data,
-                write_mode=write_mode
+                request.stream,
+                write_mode=write_mode,
+                max_bytes=_max_upload_bytes
             )
             json_response = repohostutils.get_path_json(relative_path)
         else:
-            return make_response(None, HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+    except repohostutils.UploadTooLargeError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_413_PAYLOAD_TOO_LARGE)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
     except Exception as e:
-        print(e)
-        return make_response(None, HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
 
     return make_response(json_response, HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED)
 
+# Extract a tar or zip archive sent as the request body into a directory
+# of the repository. Members are written as they are read from the
+# stream; with atomic=true nothing is written unless the whole archive is
+# valid.
+@_app.route("/upload-archive", methods=['PUT'])
+def upload_archive():
+    username = request.args.get(ApiParameterKeys.USERNAME)
+    repo_name = request.args.get(ApiParameterKeys.REPO_NAME)
+    directory_path = request.args.get(ApiParameterKeys.DIRECTORY_PATH)
+    archive_format = request.args.get(ApiParameterKeys.ARCHIVE_FORMAT)
+    compression = request.args.get(ApiParameterKeys.COMPRESSION)
+    atomic = request.args.get(ApiParameterKeys.ATOMIC, "false").lower()
+    if None == directory_path:
+        directory_path = "."
+    if None == archive_format:
+        archive_format = repoarchives.ARCHIVE_FORMAT_TAR
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.DIRECTORY_PATH, directory_path) or
+        atomic not in ("true", "false")):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    try:
+        repoarchives.check_archive_options(archive_format, compression)
+    except repoarchives.ArchiveOptionError as e:
+        print("[ERROR] {}".format(e))
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    # Reject uploads that declare a body larger than the configured cap.
+    if (_max_upload_bytes is not None and
+        request.content_length is not None and
+        request.content_length > _max_upload_bytes):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_413_PAYLOAD_TOO_LARGE)
+
+    json_response = None
+    try:
+        # Check Oso Cloud once, for the whole archive, to ensure the
+        # specified User has permission to upload files to the specified
+        # Repository object.
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if _authorize(user_object_dict,
+                      RepositoryPermissions.UPLOAD_FILE,
+                      repo_object_dict):
+            file_count = repohostutils.write_archive(
+                username,
+                repo_name,
+                directory_path,
+                repohostutils.LimitedReader(request.stream, _max_upload_bytes),
+                archive_format=archive_format,
+                compression=compression,
+                atomic=("true" == atomic),
+                max_bytes=_max_extracted_bytes
+            )
+            json_response = jsonify({
+                ApiResponseKeys.PATH: "{}/{}".format(repo_name, directory_path),
+                ApiResponseKeys.FILES: file_count
+            })
+        else:
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+    except repoarchives.InvalidArchiveError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+    except (FileExistsError, NotADirectoryError, IsADirectoryError) as e:
+        # A member's path is taken by a file or directory of the other kind.
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_409_CONFLICT)
+    except repohostutils.UploadTooLargeError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_413_PAYLOAD_TOO_LARGE)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    return make_response(json_response, HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED)
+
+def _upload_part_json(upload_part):
+    return {
+        ApiParameterKeys.PART_NUMBER: upload_part.part_number,
+        ApiResponseKeys.SIZE: upload_part.size,
+        ApiParameterKeys.CHECKSUM: upload_part.checksum
+    }
+
+# Start a multipart upload session for a file. The parts are sent with
+# /upload-part and joined with /complete-multipart-upload.
+@_app.route("/start-multipart-upload", methods=['POST'])
+def start_multipart_upload():
+    username = request.json.get(ApiParameterKeys.USERNAME)
+    repo_name = request.json.get(ApiParameterKeys.REPO_NAME)
+    file_name = request.json.get(ApiParameterKeys.FILE_NAME)
+    directory_path = request.json.get(ApiParameterKeys.DIRECTORY_PATH)
+    write_mode = request.json.get(ApiParameterKeys.WRITE_MODE)
+    if None == directory_path:
+        directory_path = "."
+
+    if None == write_mode:
+        write_mode = "wb"
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.FILE_NAME, file_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.DIRECTORY_PATH, directory_path) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.WRITE_MODE, write_mode)):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    json_response = None
+    try:
+        # Check Oso Cloud to ensure the specified User has permission to
+        # upload files to the specified Repository object.
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if _authorize(user_object_dict,
+                      RepositoryPermissions.UPLOAD_FILE,
+                      repo_object_dict):
+            session = repohostutils.get_upload_sessions().start(
+                username,
+                repo_name,
+                directory_path,
+                file_name,
+                write_mode
+            )
+            json_response = jsonify({
+                ApiParameterKeys.UPLOAD_ID: session.upload_id
+            })
+        else:
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    return make_response(json_response, HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED)
+
+# Upload one numbered part of a multipart upload. Parts may be sent in
+# any order and in parallel, and sending a part again replaces it.
+@_app.route("/upload-part", methods=['PUT'])
+def upload_part():
+    username = request.args.get(ApiParameterKeys.USERNAME)
+    repo_name = request.args.get(ApiParameterKeys.REPO_NAME)
+    upload_id = request.args.get(ApiParameterKeys.UPLOAD_ID)
+    part_number = request.args.get(ApiParameterKeys.PART_NUMBER, type=int)
+    checksum = request.args.get(ApiParameterKeys.CHECKSUM)
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.UPLOAD_ID, upload_id) or
+        None == part_number):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    # Reject parts that declare a body larger than the configured cap.
+    if (_max_upload_bytes is not None and
+        request.content_length is not None and
+        request.content_length > _max_upload_bytes):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_413_PAYLOAD_TOO_LARGE)
+
+    json_response = None
+    try:
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if _authorize(user_object_dict,
+                      RepositoryPermissions.UPLOAD_FILE,
+                      repo_object_dict):
+            upload_sessions = repohostutils.get_upload_sessions()
+            session = upload_sessions.get(upload_id, username, repo_name)
+            uploaded_part = upload_sessions.put_part(
+                session,
+                part_number,
+                request.stream,
+                checksum=checksum,
+                max_bytes=_max_upload_bytes
+            )
+            json_response = jsonify(_upload_part_json(uploaded_part))
+        else:
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+    except multipartuploads.UploadSessionNotFoundError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+    except multipartuploads.PartTooLargeError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_413_PAYLOAD_TOO_LARGE)
+    except multipartuploads.MultipartUploadError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    return make_response(json_response, HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED)
+
+# List the parts of a multipart upload received so far, so that a client
+# resuming after a disconnect only sends the missing ones.
+@_app.route("/list-upload-parts", methods=['GET'])
+def list_upload_parts():
+    username = request.json.get(ApiParameterKeys.USERNAME)
+    repo_name = request.json.get(ApiParameterKeys.REPO_NAME)
+    upload_id = request.json.get(ApiParameterKeys.UPLOAD_ID)
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.UPLOAD_ID, upload_id)):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    json_response = None
+    try:
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if _authorize(user_object_dict,
+                      RepositoryPermissions.UPLOAD_FILE,
+                      repo_object_dict):
+            upload_sessions = repohostutils.get_upload_sessions()
+            session = upload_sessions.get(upload_id, username, repo_name)
+            json_response = jsonify({
+                ApiParameterKeys.UPLOAD_ID: upload_id,
+                ApiParameterKeys.PARTS: [
+                    _upload_part_json(uploaded_part)
+                    for uploaded_part in upload_sessions.parts(session)
+                ]
+            })
+        else:
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+    except multipartuploads.UploadSessionNotFoundError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    return make_response(json_response, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+
+# Join the parts of a multipart upload, in part number order, into the
+# file the session was started for. "parts", when given, lists the
+# part_number (and optionally checksum) of every part to use.
+@_app.route("/complete-multipart-upload", methods=['POST'])
+def complete_multipart_upload():
+    username = request.json.get(ApiParameterKeys.USERNAME)
+    repo_name = request.json.get(ApiParameterKeys.REPO_NAME)
+    upload_id = request.json.get(ApiParameterKeys.UPLOAD_ID)
+    parts_json = request.json.get(ApiParameterKeys.PARTS)
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.UPLOAD_ID, upload_id) or
+        not (parts_json is None or isinstance(parts_json, list))):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    expected_parts = None
+    if parts_json is not None:
+        expected_parts = []
+        for part_json in parts_json:
+            if not isinstance(part_json, dict):
+                return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+            part_number = part_json.get(ApiParameterKeys.PART_NUMBER)
+            checksum = part_json.get(ApiParameterKeys.CHECKSUM)
+            if (None == part_number or
+                not ParameterValidation.check_optional_int(ApiParameterKeys.PART_NUMBER, part_number, 1) or
+                not (checksum is None or isinstance(checksum, str))):
+                return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+            expected_parts.append((part_number, checksum))
+
+    json_response = None
+    try:
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if _authorize(user_object_dict,
+                      RepositoryPermissions.UPLOAD_FILE,
+                      repo_object_dict):
+            session = repohostutils.get_upload_sessions().get(upload_id, username, repo_name)
+            relative_path = repohostutils.complete_multipart_upload(
+                session,
+                expected_parts,
+                max_bytes=_max_multipart_upload_bytes
+            )
+            json_response = repohostutils.get_path_json(relative_path)
+        else:
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+    except multipartuploads.UploadSessionNotFoundError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+    except repohostutils.UploadTooLargeError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_413_PAYLOAD_TOO_LARGE)
+    except multipartuploads.MultipartUploadError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    return make_response(json_response, HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED)
+
+# Drop a multipart upload session and the parts received so far.
+@_app.route("/abort-multipart-upload", methods=['POST'])
+def abort_multipart_upload():
+    username = request.json.get(ApiParameterKeys.USERNAME)
+    repo_name = request.json.get(ApiParameterKeys.REPO_NAME)
+    upload_id = request.json.get(ApiParameterKeys.UPLOAD_ID)
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.UPLOAD_ID, upload_id)):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    try:
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if _authorize(user_object_dict,
+                      RepositoryPermissions.UPLOAD_FILE,
+                      repo_object_dict):
+            upload_sessions = repohostutils.get_upload_sessions()
+            upload_sessions.abort(upload_sessions.get(upload_id, username, repo_name))
+        else:
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+    except multipartuploads.UploadSessionNotFoundError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    return make_response("", HttpResponseCode.SUCCESSFUL_RESPONSE_204_NO_CONTENT)
+
+# Resolve many authorization checks in one request. Each check in the
+# request's "checks" list names a username, permission and repo_name, and
+# the decisions are returned in the same order.
+@_app.route("/authorize-batch", methods=['POST'])
+def authorize_batch():
+    checks_json = request.json.get(ApiParameterKeys.CHECKS)
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not isinstance(checks_json, list) or
+        len(checks_json) > MAX_AUTHORIZE_BATCH_SIZE):
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    checks = []
+    for check_json in checks_json:
+        if not isinstance(check_json, dict):
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+        username = check_json.get(ApiParameterKeys.USERNAME)
+        permission = check_json.get(ApiParameterKeys.PERMISSION)
+        repo_name = check_json.get(ApiParameterKeys.REPO_NAME)
+        if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+            not ParameterValidation.check_required_str(ApiParameterKeys.PERMISSION, permission) or
+            not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name)):
+            return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+        checks.append((username, permission, repo_name))
+
+    response_json = None
+    try:
+        decisions = _authorize_batch(checks)
+        # Generate the list of decisions to provide in the server response to the client.
+        decisions_map = {
+            ApiResponseKeys.DECISIONS: [
+                {
+                    ApiParameterKeys.USERNAME: username,
+                    ApiParameterKeys.PERMISSION: permission,
+                    ApiParameterKeys.REPO_NAME: repo_name,
+                    ApiResponseKeys.ALLOWED: allowed
+                }
+                for ((username, permission, repo_name), allowed) in zip(checks, decisions)
+            ]
+        }
+        response_json = jsonify(decisions_map)
+    except circuitbreaker.BackendUnavailableError as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        _report_error(e)
+        return make_response("", HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    return make_response(response_json, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+
+
+# Counters and gauges kept by other modules, read into /metrics.
+def _collect_metrics():
+    samples = []
+    caches = (
+        ("authorization", _authorization_cache),
+        ("listing", repohostutils.get_listing_cache()),
+        ("compression", fileresponses.get_compression_cache())
+    )
+    for (cache_name, cache) in caches:
+        if cache is not None:
+            cache_stats = cache.stats()
+            samples.append(("repo_api_cache_hits_total", {"cache": cache_name}, cache_stats["hits"]))
+            samples.append(("repo_api_cache_misses_total", {"cache": cache_name}, cache_stats["misses"]))
+
+    if _oso_breaker is not None:
+        breaker_stats = _oso_breaker.stats()
+        for result in ("successes", "failures", "timeouts", "rejections"):
+            samples.append(("repo_api_oso_breaker_calls_total", {"result": result}, breaker_stats[result]))
+
+    if _rate_limiter is not None:
+        token_buckets = _rate_limiter.token_buckets
+        samples.append(("repo_api_rate_limit_checks_total", {"result": "granted"}, token_buckets.granted))
+        samples.append(("repo_api_rate_limit_checks_total", {"result": "limited"}, token_buckets.limited))
+        samples.append(("repo_api_rate_limit_checks_total", {"result": "error"}, _rate_limiter.errors))
+
+    if _admission_controller is not None:
+        admission_stats = _admission_controller.stats()
+        for priority in loadshedding.PRIORITIES:
+            priority_labels = {"priority": priority}
+            samples.append(("repo_api_admitted_requests_total", priority_labels, admission_stats["admitted"][priority]))
+            samples.append(("repo_api_shed_requests_total", priority_labels, admission_stats["shed"][priority]))
+            samples.append(("repo_api_queued_requests", priority_labels, admission_stats["queued"][priority]))
+        samples.append(("repo_api_in_flight_requests", {}, admission_stats["in_flight"]))
+        samples.append(("repo_api_queue_delay_seconds", {}, admission_stats["standing_queue_delay_seconds"]))
+
+    return samples
+
+# Request counts, latencies by stage, bytes, cache hit counts and error
+# classes of every worker process, in the Prometheus text format.
+@_app.route("/metrics", methods=['GET'])
+def get_metrics():
+    if _metrics is None:
+        return make_response("", HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+
+    return Response(_metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 ###############################################################################
 # Configure the Oso Client
 ###############################################################################
 try:
-    # Authenticate the connection to Oso Cloud.
-    host_api_key = os.environ.get("OSO_AUTH")
-    _oso_client = oso_cloud.Oso(
-        url="https://cloud.osohq.com",
-        api_key=host_api_key)
+    # Authenticate the connection to Oso Cloud. The shared client keeps a
+    # pool of connections open, sized to the worker's thread count.
+    _oso_client = osoclientpool.get_shared_client()
+except Exception as e:
+    print(e)
+
+###############################################################################
+# Configure the Oso Cloud circuit breaker
+###############################################################################
+# The breaker and the revalidation executor own threads, so a pre-forked
+# worker creates its own (see init_worker).
+def _configure_oso_breaker():
+    global _oso_breaker
+    global _revalidation_executor
+    try:
+        _oso_breaker = circuitbreaker.CircuitBreaker(
+            failure_threshold=int(os.environ.get(
+                "REPO_API_OSO_FAILURE_THRESHOLD",
+                circuitbreaker.DEFAULT_FAILURE_THRESHOLD)),
+            reset_timeout_seconds=float(os.environ.get(
+                "REPO_API_OSO_RESET_TIMEOUT",
+                circuitbreaker.DEFAULT_RESET_TIMEOUT_SECONDS)),
+            call_timeout_seconds=float(os.environ.get(
+                "REPO_API_OSO_CALL_TIMEOUT",
+                circuitbreaker.DEFAULT_CALL_TIMEOUT_SECONDS)),
+            max_concurrent_calls=int(os.environ.get(
+                "REPO_API_OSO_MAX_CONCURRENT_CALLS",
+                circuitbreaker.DEFAULT_MAX_CONCURRENT_CALLS)))
+        if os.environ.get("REPO_API_AUTHZ_REVALIDATE", "").lower() in ("1", "true", "yes"):
+            _revalidation_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=2,
+                thread_name_prefix="authz-revalidation")
+    except Exception as e:
+        print(e)
+
+    return None
+
+_configure_oso_breaker()
+
+###############################################################################
+# Configure local decisions mode
+###############################################################################
+if os.environ.get("REPO_API_LOCAL_DECISIONS", "").lower() in ("1", "true", "yes"):
+    try:
+        local_policy = localpolicy.load_policy_file(localpolicy.default_policy_file_path())
+        _local_authorizer = localpolicy.LocalAuthorizer(local_policy)
+        # Start from the facts already stored in Oso Cloud, when available.
+        if _oso_client is not None:
+            _local_authorizer.load_facts(_oso_client)
+        # Facts written by /create-repo in any worker, and by earlier runs.
+        _granted_facts = sharedfacts.SharedFacts(
+            "{}/{}".format(
+                repohostutils.create_host_data_directory(sharedfacts.SHARED_FACTS_DIRECTORY_NAME),
+                sharedfacts.GRANTED_FACTS_FILE_NAME),
+            local_policy)
+    except Exception as e:
+        print(e)
+
+###############################################################################
+# Configure the authorization decision cache
+###############################################################################
+try:
+    # A cache size of 0 disables caching of authorization decisions.
+    cache_max_entries = int(os.environ.get(
+        "REPO_API_AUTHZ_CACHE_SIZE",
+        authzcache.DEFAULT_MAX_ENTRIES))
+    cache_ttl_seconds = float(os.environ.get(
+        "REPO_API_AUTHZ_CACHE_TTL",
+        authzcache.DEFAULT_TTL_SECONDS))
+    if cache_max_entries > 0:
+        _authorization_cache = authzcache.AuthorizationCache(
+            max_entries=cache_max_entries,
+            ttl_seconds=cache_ttl_seconds)
 except Exception as e:
     print(e)
 
@@ -288,6 +1431,208 @@ except Exception as e:
 ###############################################################################
 repohostutils.repo_host_init()
 
+# Cache directory listings in-process.
+listing_cache_size = int(os.environ.get(
+    "REPO_API_LISTING_CACHE_SIZE",
+    listingcache.DEFAULT_MAX_ENTRIES))
+if listing_cache_size > 0:
+    repohostutils.enable_listing_cache(max_entries=listing_cache_size)
+
+# Compress text downloads for clients that accept gzip (or zstd), keeping
+# the compressed copies on disk up to this many bytes.
+compression_cache_bytes = int(os.environ.get(
+    "REPO_API_COMPRESSION_CACHE_BYTES",
+    compressioncache.DEFAULT_MAX_CACHE_BYTES))
+if compression_cache_bytes > 0:
+    fileresponses.enable_compression(
+        repohostutils.create_host_data_directory(compressioncache.COMPRESSED_DIRECTORY_NAME),
+        max_bytes=compression_cache_bytes)
+
+# Serialize writers to the same path, across worker processes.
+if os.environ.get("REPO_API_PATH_LOCKS", "1").lower() not in ("0", "false", "no"):
+    repohostutils.enable_path_locks()
+
+# Record the size, mtime, hash and mimetype of every file written.
+if os.environ.get("REPO_API_FILE_INDEX", "1").lower() not in ("0", "false", "no"):
+    repohostutils.enable_file_index()
+
+# Store file contents once in a content-addressed blob store and link
+# repository paths to them.
+if os.environ.get("REPO_API_BLOB_STORE", "").lower() in ("1", "true", "yes"):
+    repohostutils.enable_blob_store()
+
+if os.environ.get("REPO_API_MAX_UPLOAD_BYTES"):
+    _max_upload_bytes = int(os.environ.get("REPO_API_MAX_UPLOAD_BYTES"))
+
+_max_multipart_upload_bytes = _max_upload_bytes
+if os.environ.get("REPO_API_MAX_MULTIPART_UPLOAD_BYTES"):
+    _max_multipart_upload_bytes = int(os.environ.get("REPO_API_MAX_MULTIPART_UPLOAD_BYTES"))
+
+if _max_upload_bytes is not None:
+    _max_extracted_bytes = repoarchives.EXTRACTED_BYTES_PER_UPLOADED_BYTE * _max_upload_bytes
+if os.environ.get("REPO_API_MAX_EXTRACTED_BYTES"):
+    _max_extracted_bytes = int(os.environ.get("REPO_API_MAX_EXTRACTED_BYTES"))
+
+repohostutils.enable_multipart_uploads(max_age_seconds=float(os.environ.get(
+    "REPO_API_MULTIPART_MAX_AGE",
+    multipartuploads.DEFAULT_MAX_AGE_SECONDS)))
+
+###############################################################################
+# Configure rate limits
+###############################################################################
+# Limits are "<rate>[/<burst>]", per second and per user, i.e. "10/50".
+# Route limits are a comma-separated list of "<route>=<rate>[/<burst>]".
+# An invalid limit stops the server from starting rather than leaving
+# every limit off.
+rate_limit_settings = {
+    "user_limit": os.environ.get("REPO_API_USER_RATE_LIMIT"),
+    "upload_byte_limit": os.environ.get("REPO_API_UPLOAD_BYTE_RATE"),
+    "download_byte_limit": os.environ.get("REPO_API_DOWNLOAD_BYTE_RATE")
+}
+route_rate_limits = ratelimits.parse_rate_limits(os.environ.get("REPO_API_ROUTE_RATE_LIMITS", ""))
+if route_rate_limits or any(rate_limit_settings.values()):
+    token_buckets = ratelimits.TokenBuckets("{}/{}".format(
+        repohostutils.create_host_data_directory(ratelimits.RATE_LIMITS_DIRECTORY_NAME),
+        ratelimits.BUCKETS_FILE_NAME))
+    _rate_limiter = ratelimits.RateLimiter(
+        token_buckets,
+        route_limits=route_rate_limits,
+        **{
+            name: ratelimits.parse_rate_limit(value) if value else None
+            for (name, value) in rate_limit_settings.items()
+        })
+
+###############################################################################
+# Configure load shedding
+###############################################################################
+# Requests wait for one of the worker's max in flight slots in front of
+# the whole application, so the worker needs more threads than slots for
+# requests to queue in. Route priorities are a comma-separated list of
+# "<route>=<high|normal|low>".
+try:
+    max_in_flight = int(os.environ.get("REPO_API_MAX_IN_FLIGHT", "0"))
+    max_queued = os.environ.get("REPO_API_MAX_QUEUED")
+    if max_in_flight > 0:
+        _admission_controller = loadshedding.AdmissionController(
+            max_in_flight,
+            max_queued=int(max_queued) if max_queued else None,
+            target_queue_delay_seconds=float(os.environ.get(
+                "REPO_API_TARGET_QUEUE_DELAY",
+                loadshedding.DEFAULT_TARGET_QUEUE_DELAY_SECONDS)),
+            max_queue_delay_seconds=float(os.environ.get(
+                "REPO_API_MAX_QUEUE_DELAY",
+                loadshedding.DEFAULT_MAX_QUEUE_DELAY_SECONDS)),
+            route_priorities=loadshedding.parse_route_priorities(
+                os.environ.get("REPO_API_ROUTE_PRIORITIES", "")))
+        _app.wsgi_app = loadshedding.AdmissionMiddleware(_app.wsgi_app, _admission_controller)
+except Exception as e:
+    print(e)
+
+###############################################################################
+# Configure metrics
+###############################################################################
+# The metrics middleware goes around the load shedding one, so the time a
+# request waits for admission is counted as queueing.
+if os.environ.get("REPO_API_METRICS", "1").lower() not in ("0", "false", "no"):
+    try:
+        metrics_registry = metrics.MetricsRegistry()
+        metrics_registry.add_collector(_collect_metrics)
+        _metrics = metrics.SharedMetrics(
+            metrics_registry,
+            repohostutils.create_host_data_directory(metrics.METRICS_DIRECTORY_NAME))
+        _metrics.clear()
+        _app.wsgi_app = metrics.MetricsMiddleware(
+            _app.wsgi_app,
+            metrics_registry,
+            [rule.rule.strip("/") for rule in _app.url_map.iter_rules()])
+        # A pre-forked worker starts writing its metrics after fork.
+        if not os.environ.get("REPO_API_PREFORK"):
+            _metrics.start()
+    except Exception as e:
+        print(e)
+
+###############################################################################
+# Configure the write-behind fact journal
+###############################################################################
+# Facts can only be written behind when there is an Oso Cloud client to
+# send them to. Each pre-forked worker keeps a journal of its own, named
+# after its worker slot, so no two processes ever append to or compact the
+# same file; a restarted worker replays the journal of the one it replaces.
+def _start_fact_journal(worker_slot=0):
+    global _fact_journal
+    if (os.environ.get("REPO_API_FACT_WRITE_BEHIND", "").lower() not in ("1", "true", "yes") or
+        _oso_client is None):
+        return None
+
+    try:
+        journal_directory = repohostutils.create_host_data_directory(
+            factjournal.JOURNAL_DIRECTORY_NAME)
+        journal_policy = localpolicy.load_policy_file(localpolicy.default_policy_file_path())
+        # Pending facts of every worker, so each honors the others' grants.
+        shared_pending = sharedfacts.SharedFacts(
+            "{}/{}".format(
+                repohostutils.create_host_data_directory(sharedfacts.SHARED_FACTS_DIRECTORY_NAME),
+                sharedfacts.PENDING_FACTS_FILE_NAME),
+            journal_policy)
+        _fact_journal = factjournal.FactJournal(
+            "{}/{}".format(journal_directory, factjournal.journal_file_name(worker_slot)),
+            _oso_client,
+            journal_policy,
+            on_confirmed=_on_facts_confirmed,
+            shared_pending=shared_pending)
+        _fact_journal.start()
+    except Exception as e:
+        print(e)
+
+    return None
+
+# When reposerver.py preloads the application, the journal is started in
+# each worker after fork instead.
+if not os.environ.get("REPO_API_PREFORK"):
+    _start_fact_journal()
+
+###############################################################################
+# Re-create per-process resources in a pre-forked worker
+###############################################################################
+# Called by reposerver.py in every worker process right after fork. The
+# configuration above is read once, in the parent, and shared by all
+# workers; what owns connections or threads is created again here, since
+# neither survives a fork. Path lock descriptors are reopened by pathlocks
+# itself, and file index connections are only opened by requests.
+def init_worker(worker_slot=0):
+    global _oso_client
+    if _oso_client is not None:
+        osoclientpool.reset_shared_client()
+        try:
+            _oso_client = osoclientpool.get_shared_client()
+        except Exception as e:
+            print(e)
+    _configure_oso_breaker()
+    _start_fact_journal(worker_slot)
+    if _metrics is not None:
+        _metrics.start()
+
+    return None
+
+# Send the facts still in the journal, and write the last metrics, before
+# a worker exits.
+def shutdown_worker(timeout_seconds=None):
+    if _fact_journal is not None:
+        _fact_journal.close(timeout_seconds)
+    if _metrics is not None:
+        _metrics.stop(retire=True)
+
+    return None
+
+# Fold the metrics of a worker that has exited into the retired totals.
+# Called by reposerver.py when it reaps a worker, which covers workers
+# that died without shutting down.
+def retire_worker(pid):
+    if _metrics is not None:
+        _metrics.retire(pid)
+
+    return None
+
 ###############################################################################
 # Run the API application
 ###############################################################################
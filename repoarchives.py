@@ -0,0 +1,300 @@
+#!/usr/bin/python3
+import os
+import shutil
+import stat
+import tarfile
+import tempfile
+import time
+import zipfile
+import zlib
+
+import compressioncache
+import directorylisting
+
+# Streaming tar and zip archives of repository directories.
+#
+# Downloads: archives are produced as a generator of byte chunks while the directory
+# tree is walked, so neither the archive nor any file in it is held in
+# memory or written to disk. Tar entries are written by hand (a tarfile
+# header, the file in STREAM_CHUNK_SIZE chunks, then padding) because
+# tarfile.addfile copies a whole file before returning; zip entries go
+# through zipfile, which writes data descriptors on unseekable streams.
+#
+# Uploads: tar archives are read member by member straight from the
+# request stream (tarfile's "r|*" mode, which also detects gzip, bzip2
+# and xz). A zip archive keeps its directory at the end, so it is first
+# spooled to a temporary file. Member names are checked by
+# safe_archive_path before anything is written.
+
+ARCHIVE_FORMAT_TAR = "tar"
+ARCHIVE_FORMAT_ZIP = "zip"
+
+COMPRESSION_GZIP = "gzip"
+COMPRESSION_ZSTD = "zstd"
+COMPRESSION_DEFLATE = "deflate"
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+_TAR_RECORD_SIZE = tarfile.RECORDSIZE
+
+# Entries read from an uploaded archive.
+MEMBER_TYPE_DIRECTORY = "directory"
+MEMBER_TYPE_FILE = "file"
+
+# Uploaded archives with more members than this are rejected.
+MAX_ARCHIVE_MEMBERS = 100000
+
+# Default cap on the bytes one uploaded archive may extract: this many
+# times the largest accepted upload, or DEFAULT_MAX_EXTRACTED_BYTES when
+# uploads are not capped. Well-compressed text rarely goes past 10:1,
+# while a decompression bomb goes far beyond it.
+EXTRACTED_BYTES_PER_UPLOADED_BYTE = 20
+DEFAULT_MAX_EXTRACTED_BYTES = 16 * 1024 * 1024 * 1024
+
+class ArchiveOptionError(ValueError):
+    pass
+
+# The uploaded archive is malformed or would write outside its target.
+class InvalidArchiveError(ValueError):
+    pass
+
+# The compressions each format accepts (None: uncompressed).
+def supported_compressions(archive_format):
+    if ARCHIVE_FORMAT_ZIP == archive_format:
+        return [None, COMPRESSION_DEFLATE]
+    if compressioncache.zstandard is not None:
+        return [None, COMPRESSION_GZIP, COMPRESSION_ZSTD]
+    return [None, COMPRESSION_GZIP]
+
+def archive_mimetype(archive_format, compression=None):
+    if ARCHIVE_FORMAT_ZIP == archive_format:
+        return "application/zip"
+    if COMPRESSION_GZIP == compression:
+        return "application/gzip"
+    if COMPRESSION_ZSTD == compression:
+        return "application/zstd"
+    return "application/x-tar"
+
+def archive_file_extension(archive_format, compression=None):
+    if ARCHIVE_FORMAT_ZIP == archive_format:
+        return "zip"
+    if COMPRESSION_GZIP == compression:
+        return "tar.gz"
+    if COMPRESSION_ZSTD == compression:
+        return "tar.zst"
+    return "tar"
+
+def check_archive_options(archive_format, compression):
+    if archive_format not in (ARCHIVE_FORMAT_TAR, ARCHIVE_FORMAT_ZIP):
+        raise ArchiveOptionError("Unknown archive format '{}'.".format(archive_format))
+    if compression not in supported_compressions(archive_format):
+        raise ArchiveOptionError("A {} archive cannot be compressed with '{}'.".format(
+            archive_format,
+            compression))
+
+    return None
+
+# Yields (archive_path, full_path, lstat result) for the directories and
+# regular files under full_directory_path. Symbolic links and special
+# files are left out, so an archive never reaches outside the repository.
+def _archive_members(full_directory_path):
+    entries = directorylisting.walk_entries(
+        full_directory_path,
+        max_depth=directorylisting.MAX_DEPTH,
+        include_files=True)
+    for (relative_path, _, _) in entries:
+        full_path = os.path.join(full_directory_path, relative_path)
+        try:
+            member_stat = os.lstat(full_path)
+        except FileNotFoundError:
+            continue
+        if stat.S_ISDIR(member_stat.st_mode) or stat.S_ISREG(member_stat.st_mode):
+            yield (relative_path, full_path, member_stat)
+
+# Yields exactly size bytes of the file: a file that grew since it was
+# stat'ed is cut off and one that shrank is padded with zeros, so the
+# sizes already written to the archive stay true.
+def _read_file_chunks(full_path, size):
+    remaining = size
+    with open(full_path, "rb") as f:
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    while remaining > 0:
+        padding_size = min(STREAM_CHUNK_SIZE, remaining)
+        remaining -= padding_size
+        yield bytes(padding_size)
+
+def _tar_chunks(full_directory_path):
+    bytes_written = 0
+    for (archive_path, full_path, member_stat) in _archive_members(full_directory_path):
+        tar_info = tarfile.TarInfo(archive_path)
+        tar_info.mtime = int(member_stat.st_mtime)
+        tar_info.mode = stat.S_IMODE(member_stat.st_mode)
+        if stat.S_ISDIR(member_stat.st_mode):
+            tar_info.type = tarfile.DIRTYPE
+            tar_info.mode |= 0o700
+        else:
+            tar_info.size = member_stat.st_size
+            tar_info.mode |= 0o600
+
+        header = tar_info.tobuf(tarfile.PAX_FORMAT, "utf-8", "surrogateescape")
+        bytes_written += len(header)
+        yield header
+        if tar_info.isdir():
+            continue
+
+        for chunk in _read_file_chunks(full_path, tar_info.size):
+            yield chunk
+        (_, remainder) = divmod(tar_info.size, _TAR_BLOCK_SIZE)
+        if remainder:
+            yield bytes(_TAR_BLOCK_SIZE - remainder)
+        bytes_written += tar_info.size + (_TAR_BLOCK_SIZE - remainder if remainder else 0)
+
+    # Two empty blocks end the archive, padded to a whole record.
+    end_of_archive_size = 2 * _TAR_BLOCK_SIZE
+    (_, remainder) = divmod(bytes_written + end_of_archive_size, _TAR_RECORD_SIZE)
+    if remainder:
+        end_of_archive_size += _TAR_RECORD_SIZE - remainder
+    yield bytes(end_of_archive_size)
+
+def _compressed_chunks(chunks, compression):
+    if COMPRESSION_GZIP == compression:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    else:
+        compressor = compressioncache.zstandard.ZstdCompressor(
+            level=compressioncache.ZSTD_LEVEL).compressobj()
+
+    for chunk in chunks:
+        compressed_chunk = compressor.compress(chunk)
+        if compressed_chunk:
+            yield compressed_chunk
+    yield compressor.flush()
+
+# A write-only stream that collects what zipfile writes until the
+# generator hands it on.
+class _ChunkBuffer:
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        return None
+
+    def drain(self):
+        chunks = self._chunks
+        self._chunks = []
+        return chunks
+
+def _zip_chunks(full_directory_path, compression):
+    compress_type = zipfile.ZIP_DEFLATED if COMPRESSION_DEFLATE == compression else zipfile.ZIP_STORED
+    chunk_buffer = _ChunkBuffer()
+    with zipfile.ZipFile(chunk_buffer, "w", compression=compress_type) as zip_file:
+        for (archive_path, full_path, member_stat) in _archive_members(full_directory_path):
+            date_time = time.localtime(max(member_stat.st_mtime, 315532800))[:6]
+            if stat.S_ISDIR(member_stat.st_mode):
+                zip_info = zipfile.ZipInfo(archive_path + "/", date_time=date_time)
+                zip_info.external_attr = (0o40755 << 16) | 0x10
+                zip_file.writestr(zip_info, b"")
+                yield from chunk_buffer.drain()
+                continue
+
+            zip_info = zipfile.ZipInfo(archive_path, date_time=date_time)
+            zip_info.compress_type = compress_type
+            zip_info.file_size = member_stat.st_size
+            zip_info.external_attr = (stat.S_IMODE(member_stat.st_mode) | 0o100000) << 16
+            with zip_file.open(zip_info, "w") as zip_entry:
+                for chunk in _read_file_chunks(full_path, member_stat.st_size):
+                    zip_entry.write(chunk)
+                    yield from chunk_buffer.drain()
+            yield from chunk_buffer.drain()
+    yield from chunk_buffer.drain()
+
+# Returns a generator of the archive's bytes. Options must have been
+# checked with check_archive_options.
+def stream_archive(full_directory_path, archive_format=ARCHIVE_FORMAT_TAR, compression=None):
+    if ARCHIVE_FORMAT_ZIP == archive_format:
+        return _zip_chunks(full_directory_path, compression)
+
+    chunks = _tar_chunks(full_directory_path)
+    if compression is not None:
+        chunks = _compressed_chunks(chunks, compression)
+    return chunks
+
+# Returns the member name as a clean relative path ("a/b/c"), or None for
+# the archive's root entry. Absolute paths, drive letters and ".."
+# components are rejected.
+def safe_archive_path(member_name):
+    normalized_name = member_name.replace("\\", "/")
+    path_parts = [part for part in normalized_name.split("/") if part not in ("", ".")]
+    if ("\x00" in normalized_name or
+        normalized_name.startswith("/") or
+        ".." in path_parts or
+        (path_parts and ":" in path_parts[0])):
+        raise InvalidArchiveError("Unsafe path in archive: '{}'.".format(member_name))
+
+    if not path_parts:
+        return None
+    return "/".join(path_parts)
+
+def _tar_members(stream, compression):
+    if COMPRESSION_ZSTD == compression:
+        stream = compressioncache.zstandard.ZstdDecompressor().stream_reader(stream)
+
+    with tarfile.open(fileobj=stream, mode="r|*") as tar_file:
+        for tar_info in tar_file:
+            archive_path = safe_archive_path(tar_info.name)
+            if archive_path is None:
+                continue
+            if tar_info.isdir():
+                yield (MEMBER_TYPE_DIRECTORY, archive_path, None)
+            elif tar_info.isfile():
+                yield (MEMBER_TYPE_FILE, archive_path, tar_file.extractfile(tar_info))
+            # Links and special files are not extracted.
+
+def _zip_members(stream, spool_directory):
+    with tempfile.TemporaryFile(dir=spool_directory) as spool_file:
+        shutil.copyfileobj(stream, spool_file, STREAM_CHUNK_SIZE)
+        spool_file.seek(0)
+        with zipfile.ZipFile(spool_file) as zip_file:
+            for zip_info in zip_file.infolist():
+                archive_path = safe_archive_path(zip_info.filename)
+                if archive_path is None:
+                    continue
+                if zip_info.is_dir():
+                    yield (MEMBER_TYPE_DIRECTORY, archive_path, None)
+                    continue
+                if stat.S_ISLNK(zip_info.external_attr >> 16):
+                    continue
+                with zip_file.open(zip_info) as member_stream:
+                    yield (MEMBER_TYPE_FILE, archive_path, member_stream)
+
+# Yields (member_type, archive_path, stream) for each directory and
+# regular file of an uploaded archive, in archive order. A file's stream
+# must be read before the next member is requested. Malformed archives
+# and unsafe member names raise InvalidArchiveError.
+def read_archive(stream, archive_format=ARCHIVE_FORMAT_TAR, compression=None, spool_directory=None):
+    if ARCHIVE_FORMAT_ZIP == archive_format:
+        members = _zip_members(stream, spool_directory)
+    else:
+        members = _tar_members(stream, compression)
+
+    member_count = 0
+    try:
+        for member in members:
+            member_count += 1
+            if member_count > MAX_ARCHIVE_MEMBERS:
+                raise InvalidArchiveError("The archive has more than {} members.".format(
+                    MAX_ARCHIVE_MEMBERS))
+            yield member
+    except (tarfile.TarError, zipfile.BadZipFile, EOFError, zlib.error) as e:
+        raise InvalidArchiveError("The archive could not be read: {}".format(e))
+    finally:
+        members.close()
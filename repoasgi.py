@@ -0,0 +1,910 @@
+#!/usr/bin/python3
+import asyncio
+import concurrent.futures
+import contextvars
+import datetime
+import functools
+import json
+import math
+import os
+import sys
+import urllib.parse
+
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import dump_options_header, http_date, is_resource_modified, parse_accept_header, quote_etag
+
+# Add the current directory to the system path
+application_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(application_dir)
+
+import circuitbreaker
+import directorylisting
+import fileresponses
+import loadshedding
+import metrics
+import osoclientpool
+import repoapis
+import repohostutils
+
+from policydefinitions import RepositoryPermissions, RepositoryRoles
+from repohostutils import ApiParameterKeys, ApiResponseKeys
+from repohostutils import HttpResponseCode
+from repohostutils import ParameterValidation
+
+# An asyncio (ASGI) build of the /create-repo, /create-directory,
+# /list-directories, /download-file and /upload-file routes, with the same
+# request and response contracts as repoapis.py:
+#   uvicorn repoasgi:app
+#
+# Importing repoapis applies the same environment settings, so both
+# builds share the decision cache, local decisions mode, the write-behind
+# journal and the circuit breaker. Checks that cannot be answered in
+# process go to Oso Cloud through osoclientpool.AsyncOsoClient when the
+# optional httpx package is installed, and through the synchronous client
+# on the I/O threads otherwise. Disk work runs on a bounded pool of I/O
+# threads, and request and response bodies are streamed in chunks, so one
+# process can keep thousands of requests waiting on Oso Cloud or the disk.
+#
+# Downloads are always sent uncompressed.
+
+# Threads running file I/O (and blocking Oso Cloud calls without httpx).
+DEFAULT_IO_THREADS = 32
+
+# Largest JSON request body read into memory.
+MAX_JSON_BODY_BYTES = 1024 * 1024
+
+STREAM_CHUNK_SIZE = repohostutils.STREAM_CHUNK_SIZE
+
+# Listing entries read from disk per hop to an I/O thread.
+ENTRY_BATCH_SIZE = 256
+
+_JSON_MIMETYPE = "application/json"
+_EMPTY_BODY_MIMETYPE = "text/html; charset=utf-8"
+
+# Both are created on first use, inside the worker process and its event
+# loop, so neither is ever shared across a fork.
+_io_executor = None
+_async_oso_client = None
+
+class _ClientDisconnected(Exception):
+    pass
+
+def _get_io_executor():
+    global _io_executor
+    if _io_executor is None:
+        _io_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=int(os.environ.get("REPO_API_ASGI_IO_THREADS", DEFAULT_IO_THREADS)),
+            thread_name_prefix="asgi-io")
+
+    return _io_executor
+
+# The call runs in a copy of the caller's context, so its time still counts
+# towards the request's metrics.
+async def _run_blocking(function, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_io_executor(),
+        functools.partial(contextvars.copy_context().run, function, *args, **kwargs))
+
+def _get_async_oso_client():
+    global _async_oso_client
+    if _async_oso_client is None and repoapis._oso_client is not None:
+        _async_oso_client = osoclientpool.create_async_oso_client()
+
+    return _async_oso_client
+
+class _Request:
+    def __init__(self, scope, receive):
+        self.method = scope["method"]
+        self.headers = {}
+        for (name, value) in scope["headers"]:
+            name = name.decode("latin-1").lower()
+            value = value.decode("latin-1")
+            if name in self.headers:
+                value = "{}, {}".format(self.headers[name], value)
+            self.headers[name] = value
+        self.args = {
+            name: values[0]
+            for (name, values) in urllib.parse.parse_qs(
+                scope["query_string"].decode("latin-1"),
+                keep_blank_values=True).items()
+        }
+        self._receive = receive
+
+    @property
+    def content_length(self):
+        content_length = self.headers.get("content-length")
+        if content_length is None or not content_length.isdigit():
+            return None
+        return int(content_length)
+
+    # The request headers as a WSGI environ, for werkzeug's helpers.
+    def environ(self):
+        environ = {"REQUEST_METHOD": self.method}
+        for (name, value) in self.headers.items():
+            environ["HTTP_{}".format(name.upper().replace("-", "_"))] = value
+        return environ
+
+    async def body_chunks(self):
+        while True:
+            message = await self._receive()
+            if "http.disconnect" == message["type"]:
+                raise _ClientDisconnected("The client disconnected.")
+            yield message.get("body", b"")
+            if not message.get("more_body", False):
+                return
+
+    # Returns the JSON object in the body, or None if there is none.
+    async def json(self):
+        body = b""
+        async for chunk in self.body_chunks():
+            body += chunk
+            if len(body) > MAX_JSON_BODY_BYTES:
+                return None
+        try:
+            request_json = json.loads(body)
+        except ValueError:
+            return None
+        if not isinstance(request_json, dict):
+            return None
+        return request_json
+
+    def accepts_ndjson(self):
+        accept_mimetypes = parse_accept_header(self.headers.get("accept"), MIMEAccept)
+        return accept_mimetypes.best_match(
+            [_JSON_MIMETYPE, fileresponses.NDJSON_MIMETYPE]) == fileresponses.NDJSON_MIMETYPE
+
+# A blocking binary stream over the request body, for the I/O threads:
+# each read waits for the event loop to receive more of the body.
+class _BodyReader:
+    def __init__(self, request, loop):
+        self._body_chunks = request.body_chunks()
+        self._loop = loop
+        self._buffer = b""
+        self._finished = False
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        while not self._finished and (size < 0 or len(self._buffer) < size):
+            future = asyncio.run_coroutine_threadsafe(self._body_chunks.__anext__(), self._loop)
+            try:
+                self._buffer += future.result()
+            except StopAsyncIteration:
+                self._finished = True
+
+        if size < 0:
+            (chunk, self._buffer) = (self._buffer, b"")
+        else:
+            (chunk, self._buffer) = (self._buffer[:size], self._buffer[size:])
+        self.bytes_read += len(chunk)
+        return chunk
+
+def _encode_headers(headers):
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for (name, value) in headers]
+
+async def _send_response(send, status, body=b"", headers=None, mimetype=_EMPTY_BODY_MIMETYPE):
+    headers = list(headers or [])
+    if mimetype is not None:
+        headers.append(("Content-Type", mimetype))
+    if HttpResponseCode.REDIRECTION_MESSAGE_304_NOT_MODIFIED != status:
+        headers.append(("Content-Length", str(len(body))))
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": _encode_headers(headers)
+    })
+    await send({"type": "http.response.body", "body": body})
+
+    return None
+
+async def _send_json(send, status, response_json, headers=None):
+    body = (json.dumps(response_json) + "\n").encode("utf-8")
+    return await _send_response(send, status, body, headers, mimetype=_JSON_MIMETYPE)
+
+# Send a body from an async iterator of byte chunks. Without a
+# content_length the response is chunked.
+async def _send_stream(send, status, chunks, headers, content_length=None):
+    headers = list(headers)
+    if content_length is not None:
+        headers.append(("Content-Length", str(content_length)))
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": _encode_headers(headers)
+    })
+    async for chunk in chunks:
+        if chunk:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+    await send({"type": "http.response.body", "body": b""})
+
+    return None
+
+# Yields the items of a blocking iterator, read on the I/O threads in
+# batches.
+async def _iterate_blocking(iterator, batch_size=ENTRY_BATCH_SIZE):
+    def next_batch():
+        batch = []
+        for item in iterator:
+            batch.append(item)
+            if len(batch) >= batch_size:
+                break
+        return batch
+
+    while True:
+        batch = await _run_blocking(next_batch)
+        if not batch:
+            return
+        for item in batch:
+            yield item
+
+async def _ndjson_chunks(objects, last_line=None):
+    async for json_object in objects:
+        yield (json.dumps(json_object) + "\n").encode("utf-8")
+    if last_line is not None:
+        yield (json.dumps(last_line) + "\n").encode("utf-8")
+
+def _validator_headers(etag, last_modified, weak=False):
+    return [
+        ("ETag", quote_etag(etag, weak=weak)),
+        ("Last-Modified", http_date(last_modified))
+    ]
+
+def _is_not_modified(request, etag, last_modified):
+    if request.method not in ("GET", "HEAD"):
+        return False
+    last_modified_datetime = datetime.datetime.fromtimestamp(
+        last_modified,
+        tz=datetime.timezone.utc)
+    return not is_resource_modified(request.environ(), etag=etag, last_modified=last_modified_datetime)
+
+# Sends 429 and returns True when the request is over its user's rate
+# limits, as repoapis does before every route.
+async def _rate_limited(send, username, route):
+    if repoapis._rate_limiter is None:
+        return False
+
+    retry_after_seconds = await _run_blocking(
+        repoapis._rate_limiter.admit,
+        username,
+        route,
+        uploads=route in repoapis._UPLOAD_ROUTES,
+        downloads=route in repoapis._DOWNLOAD_ROUTES)
+    if 0.0 == retry_after_seconds:
+        return False
+
+    await _send_response(
+        send,
+        HttpResponseCode.CLIENT_ERROR_RESPONSE_429_TOO_MANY_REQUESTS,
+        headers=[("Retry-After", str(max(1, math.ceil(retry_after_seconds))))])
+    return True
+
+async def _charge_download(request, username, byte_count):
+    if repoapis._rate_limiter is not None and "HEAD" != request.method:
+        await _run_blocking(repoapis._rate_limiter.charge_download, username, byte_count)
+
+    return None
+
+# The asyncio counterpart of repoapis._authorize: answered in process when
+# possible, else awaited from Oso Cloud through the circuit breaker.
+@metrics.timed_stage(metrics.STAGE_AUTHORIZATION)
+async def _authorize(user_object_dict, permission, repo_object_dict):
+    if repoapis._local_authorizer is not None:
+        return repoapis._local_allows(user_object_dict,
+                                      permission,
+                                      repo_object_dict)
+
+    # Honor facts that have not been confirmed by Oso Cloud yet.
+    if (repoapis._fact_journal is not None and
+        repoapis._fact_journal.pending_allows(user_object_dict, permission, repo_object_dict)):
+        return True
+
+    username = user_object_dict["id"]
+    repo_name = repo_object_dict["id"]
+    generation = None
+    if repoapis._authorization_cache is not None:
+        allowed = repoapis._authorization_cache.get(username, permission, repo_name)
+        if allowed is not None:
+            return allowed
+        generation = repoapis._authorization_cache.generation(username, repo_name)
+
+    async_oso_client = _get_async_oso_client()
+    if async_oso_client is None:
+        return await _run_blocking(repoapis._authorize,
+                                   user_object_dict,
+                                   permission,
+                                   repo_object_dict)
+
+    try:
+        if repoapis._oso_breaker is None:
+            allowed = await async_oso_client.authorize(user_object_dict,
+                                                       permission,
+                                                       repo_object_dict)
+        else:
+            allowed = await repoapis._oso_breaker.call_async(async_oso_client.authorize,
+                                                             user_object_dict,
+                                                             permission,
+                                                             repo_object_dict)
+    except Exception:
+        # Serve the last known decision while Oso Cloud is failing.
+        allowed = repoapis._stale_decision(user_object_dict, permission, repo_object_dict)
+        if allowed is None:
+            raise
+        return allowed
+
+    if repoapis._authorization_cache is not None:
+        repoapis._authorization_cache.put(username, permission, repo_name, allowed, generation)
+
+    return allowed
+
+def _create_repo_blocking(username, repo_name):
+    user_object_dict = {
+        "type": "User",
+        "id": username
+    }
+    repo_object_dict = {
+        "type": "Repository",
+        "id": repo_name
+    }
+    repoapis._tell_has_role(
+        user_object_dict,
+        RepositoryRoles.OWNER,
+        repo_object_dict)
+
+    return repohostutils.create_user_repo(username, repo_name)
+
+async def create_repo(request, send):
+    request_json = await request.json()
+    if None == request_json:
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+    username = request_json.get(ApiParameterKeys.USERNAME)
+    repo_name = request_json.get(ApiParameterKeys.REPO_NAME)
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name)):
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    if await _rate_limited(send, username, "create-repo"):
+        return None
+
+    try:
+        relative_path = await _run_blocking(_create_repo_blocking, username, repo_name)
+    except circuitbreaker.BackendUnavailableError as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    return await _send_json(send, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK, {"path": relative_path})
+
+async def create_directory(request, send):
+    request_json = await request.json()
+    if None == request_json:
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+    username = request_json.get(ApiParameterKeys.USERNAME)
+    repo_name = request_json.get(ApiParameterKeys.REPO_NAME)
+    directory_path = request_json.get(ApiParameterKeys.DIRECTORY_PATH)
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.DIRECTORY_PATH, directory_path)):
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    if await _rate_limited(send, username, "create-directory"):
+        return None
+
+    try:
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if not await _authorize(user_object_dict,
+                                RepositoryPermissions.CREATE_DIRECTORY,
+                                repo_object_dict):
+            return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+        relative_path = await _run_blocking(
+            repohostutils.create_user_repo_directory,
+            username,
+            repo_name,
+            directory_path)
+    except circuitbreaker.BackendUnavailableError as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    return await _send_json(send, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK, {"path": relative_path})
+
+async def list_directories(request, send):
+    request_json = await request.json()
+    if None == request_json:
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+    username = request_json.get(ApiParameterKeys.USERNAME)
+    repo_name = request_json.get(ApiParameterKeys.REPO_NAME)
+    directory_path = request_json.get(ApiParameterKeys.DIRECTORY_PATH)
+    limit = request_json.get(ApiParameterKeys.LIMIT)
+    cursor = request_json.get(ApiParameterKeys.CURSOR)
+    recursive = request_json.get(ApiParameterKeys.RECURSIVE)
+    max_depth = request_json.get(ApiParameterKeys.MAX_DEPTH)
+    include_files = request_json.get(ApiParameterKeys.INCLUDE_FILES)
+    if None == directory_path:
+        directory_path = "."
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.DIRECTORY_PATH, directory_path) or
+        not ParameterValidation.check_optional_int(ApiParameterKeys.LIMIT, limit, minimum=1) or
+        (None != cursor and not ParameterValidation.check_required_str(ApiParameterKeys.CURSOR, cursor)) or
+        not ParameterValidation.check_optional_bool(ApiParameterKeys.RECURSIVE, recursive) or
+        not ParameterValidation.check_optional_int(ApiParameterKeys.MAX_DEPTH, max_depth, minimum=1) or
+        not ParameterValidation.check_optional_bool(ApiParameterKeys.INCLUDE_FILES, include_files)):
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    if await _rate_limited(send, username, "list-directories"):
+        return None
+
+    # The same listing modes as repoapis.list_directories.
+    stream_entries = request.accepts_ndjson()
+    list_entries = (stream_entries or
+                    any(None != option for option in (limit, cursor, recursive, max_depth, include_files)))
+    if recursive:
+        max_depth = max_depth if None != max_depth else directorylisting.MAX_DEPTH
+    else:
+        max_depth = 1
+    include_files = bool(include_files)
+    if None != limit:
+        limit = min(limit, repoapis.MAX_LISTING_PAGE_SIZE)
+    elif list_entries and not stream_entries:
+        limit = repoapis.DEFAULT_LISTING_PAGE_SIZE
+
+    # Everything besides the directory's contents that the response depends on.
+    listing_shape = (list_entries, stream_entries, max_depth, include_files, limit, cursor)
+
+    response_json = None
+    # The response is JSON or NDJSON depending on the Accept header.
+    validator_headers = [("Vary", "Accept")]
+    try:
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if not await _authorize(user_object_dict,
+                                RepositoryPermissions.LIST_DIRECTORIES,
+                                repo_object_dict):
+            return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+
+        # The directory's own ETag only covers its direct subdirectories,
+        # so recursive listings and listings with files have no validators.
+        if 1 == max_depth and not include_files:
+            directory_stat = await _run_blocking(
+                repohostutils.get_directory_stat,
+                username,
+                repo_name,
+                directory_path)
+            if None != directory_stat:
+                etag = fileresponses.listing_etag(directory_stat, listing_shape)
+                validator_headers += _validator_headers(etag, directory_stat.st_mtime, weak=True)
+                if _is_not_modified(request, etag, directory_stat.st_mtime):
+                    return await _send_response(
+                        send,
+                        HttpResponseCode.REDIRECTION_MESSAGE_304_NOT_MODIFIED,
+                        headers=validator_headers,
+                        mimetype=None)
+
+        if not list_entries:
+            subdirectories = await _run_blocking(
+                repohostutils.list_directories,
+                username,
+                repo_name,
+                directory_path)
+            response_json = {
+                ApiResponseKeys.SUBDIRECTORIES: subdirectories
+            }
+        elif None == limit:
+            entries = await _run_blocking(
+                repohostutils.iterate_repo_entries,
+                username,
+                repo_name,
+                directory_path,
+                max_depth=max_depth,
+                include_files=include_files)
+            if None == entries:
+                return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+            return await _send_stream(
+                send,
+                HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+                _ndjson_chunks(_iterate_blocking(entries)),
+                validator_headers + [("Content-Type", fileresponses.NDJSON_MIMETYPE)])
+        else:
+            entries_page = await _run_blocking(
+                repohostutils.page_repo_entries,
+                username,
+                repo_name,
+                directory_path,
+                limit,
+                cursor=cursor,
+                max_depth=max_depth,
+                include_files=include_files)
+            if None == entries_page:
+                return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+            (entries, next_cursor) = entries_page
+            if stream_entries:
+                async def page_entries():
+                    for entry in entries:
+                        yield entry
+                return await _send_stream(
+                    send,
+                    HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+                    _ndjson_chunks(page_entries(), last_line={ApiResponseKeys.NEXT_CURSOR: next_cursor}),
+                    validator_headers + [("Content-Type", fileresponses.NDJSON_MIMETYPE)])
+            response_json = {
+                ApiResponseKeys.ENTRIES: entries,
+                ApiResponseKeys.NEXT_CURSOR: next_cursor
+            }
+    except directorylisting.InvalidCursorError as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+    except circuitbreaker.BackendUnavailableError as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    return await _send_json(send, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK, response_json, validator_headers)
+
+def _download_file_info(username, repo_name, file_path):
+    file_record = repohostutils.get_file_record(username, repo_name, file_path)
+    full_file_path = repohostutils.get_file_path(
+        username,
+        repo_name,
+        file_path,
+        file_record=file_record)
+    if None == full_file_path:
+        return None
+
+    file_mimetype = repohostutils.get_file_mimetype(
+        username,
+        repo_name,
+        file_path,
+        file_record=file_record)
+
+    # The file is opened here so that a replace after the stat cannot mix
+    # two versions in one response.
+    try:
+        file_object = open(full_file_path, "rb")
+    except (FileNotFoundError, IsADirectoryError):
+        # Indexed, but removed since.
+        return None
+    return (full_file_path, file_object, os.fstat(file_object.fileno()), file_record, file_mimetype)
+
+async def _file_chunks(file_object, start, stop):
+    try:
+        await _run_blocking(file_object.seek, start)
+        remaining = stop - start
+        while remaining > 0:
+            chunk = await _run_blocking(file_object.read, min(STREAM_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        file_object.close()
+
+async def _blocking_chunks(chunks):
+    async for chunk in _iterate_blocking(chunks, batch_size=1):
+        yield chunk
+
+async def download_file(request, send):
+    request_json = await request.json()
+    if None == request_json:
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+    username = request_json.get(ApiParameterKeys.USERNAME)
+    repo_name = request_json.get(ApiParameterKeys.REPO_NAME)
+    file_path = request_json.get(ApiParameterKeys.FILE_PATH)
+    download_file_name = request_json.get(ApiParameterKeys.DOWNLOAD_FILE_NAME)
+    if None == download_file_name:
+        download_file_name = repohostutils.get_file_name_from_path(file_path)
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.FILE_PATH, file_path)):
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    if await _rate_limited(send, username, "download-file"):
+        return None
+
+    download_info = None
+    try:
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if not await _authorize(user_object_dict,
+                                RepositoryPermissions.DOWNLOAD_FILE,
+                                repo_object_dict):
+            return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+        download_info = await _run_blocking(_download_file_info, username, repo_name, file_path)
+    except circuitbreaker.BackendUnavailableError as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+
+    if None == download_info:
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+
+    (_, file_object, file_stat, file_record, file_mimetype) = download_info
+    if None == file_mimetype:
+        file_mimetype = "application/octet-stream"
+    etag = fileresponses.file_etag(file_stat, file_record)
+    file_size = file_stat.st_size
+    last_modified = fileresponses.file_last_modified(file_stat)
+    headers = _validator_headers(etag, last_modified)
+
+    if _is_not_modified(request, etag, last_modified):
+        file_object.close()
+        return await _send_response(
+            send,
+            HttpResponseCode.REDIRECTION_MESSAGE_304_NOT_MODIFIED,
+            headers=headers,
+            mimetype=None)
+
+    byte_ranges = fileresponses.requested_byte_ranges(
+        request.method,
+        request.headers.get("range"),
+        request.headers.get("if-range"),
+        etag,
+        file_stat)
+    if None != byte_ranges and not byte_ranges:
+        file_object.close()
+        return await _send_response(
+            send,
+            HttpResponseCode.CLIENT_ERROR_RESPONSE_416_RANGE_NOT_SATISFIABLE,
+            headers=[("Content-Range", "bytes */{}".format(file_size))])
+
+    headers.append(("Accept-Ranges", "bytes"))
+    headers.append(("Content-Disposition", dump_options_header(
+        "attachment",
+        fileresponses.content_disposition_parameters(download_file_name))))
+    if None == byte_ranges:
+        headers.append(("Content-Type", file_mimetype))
+        await _charge_download(request, username, file_size)
+        return await _send_stream(
+            send,
+            HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+            _file_chunks(file_object, 0, file_size),
+            headers,
+            content_length=file_size)
+
+    if 1 == len(byte_ranges):
+        (start, stop) = byte_ranges[0]
+        headers.append(("Content-Type", file_mimetype))
+        headers.append(("Content-Range", "bytes {}-{}/{}".format(start, stop - 1, file_size)))
+        await _charge_download(request, username, stop - start)
+        return await _send_stream(
+            send,
+            HttpResponseCode.SUCCESSFUL_RESPONSE_206_PARTIAL_CONTENT,
+            _file_chunks(file_object, start, stop),
+            headers,
+            content_length=stop - start)
+
+    (body, boundary, content_length) = fileresponses.multiple_ranges_body(
+        file_object,
+        file_mimetype,
+        byte_ranges,
+        file_size)
+    headers.append(("Content-Type", "multipart/byteranges; boundary={}".format(boundary)))
+    await _charge_download(request, username, content_length)
+    return await _send_stream(
+        send,
+        HttpResponseCode.SUCCESSFUL_RESPONSE_206_PARTIAL_CONTENT,
+        _blocking_chunks(body),
+        headers,
+        content_length=content_length)
+
+async def upload_file(request, send):
+    username = request.args.get(ApiParameterKeys.USERNAME)
+    repo_name = request.args.get(ApiParameterKeys.REPO_NAME)
+    file_name = request.args.get(ApiParameterKeys.FILE_NAME)
+    directory_path = request.args.get(ApiParameterKeys.DIRECTORY_PATH)
+    write_mode = request.args.get(ApiParameterKeys.WRITE_MODE)
+    if None == directory_path:
+        directory_path = "."
+
+    if None == write_mode:
+        write_mode = "wb"
+
+    # Check that the required parameters have been provided in the HTTP request.
+    if (not ParameterValidation.check_username(ApiParameterKeys.USERNAME, username) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.REPO_NAME, repo_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.FILE_NAME, file_name) or
+        not ParameterValidation.check_required_str(ApiParameterKeys.DIRECTORY_PATH, directory_path)):
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+    if await _rate_limited(send, username, "upload-file"):
+        return None
+
+    # Reject uploads that declare a body larger than the configured cap.
+    if (repoapis._max_upload_bytes is not None and
+        request.content_length is not None and
+        request.content_length > repoapis._max_upload_bytes):
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_413_PAYLOAD_TOO_LARGE)
+
+    body_reader = _BodyReader(request, asyncio.get_running_loop())
+    try:
+        user_object_dict = {
+            "type": "User",
+            "id": username
+        }
+        repo_object_dict = {
+            "type": "Repository",
+            "id": repo_name
+        }
+        if not await _authorize(user_object_dict,
+                                RepositoryPermissions.UPLOAD_FILE,
+                                repo_object_dict):
+            return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+        # The body is streamed to disk by an I/O thread as it arrives.
+        relative_path = await _run_blocking(
+            repohostutils.write_file_stream,
+            username,
+            repo_name,
+            directory_path,
+            file_name,
+            body_reader,
+            write_mode=write_mode,
+            max_bytes=repoapis._max_upload_bytes)
+    except repohostutils.UploadTooLargeError as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_413_PAYLOAD_TOO_LARGE)
+    except circuitbreaker.BackendUnavailableError as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+    except Exception as e:
+        repoapis._report_error(e)
+        return await _send_response(send, HttpResponseCode.SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR)
+    finally:
+        if repoapis._rate_limiter is not None:
+            await _run_blocking(repoapis._rate_limiter.charge_upload, username, body_reader.bytes_read)
+
+    return await _send_json(send, HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED, {"path": relative_path})
+
+async def get_metrics(request, send):
+    if repoapis._metrics is None:
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+
+    body = await _run_blocking(repoapis._metrics.render)
+    return await _send_response(
+        send,
+        HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+        body.encode("utf-8"),
+        mimetype=metrics.CONTENT_TYPE)
+
+# Route -> (HTTP methods, handler). GET routes answer HEAD too, as in Flask.
+_ROUTES = {
+    "/create-repo": (("POST",), create_repo),
+    "/create-directory": (("POST",), create_directory),
+    "/list-directories": (("GET", "HEAD"), list_directories),
+    "/download-file": (("GET", "HEAD"), download_file),
+    "/upload-file": (("PUT",), upload_file),
+    "/metrics": (("GET",), get_metrics)
+}
+
+# Route labels for metrics.
+_ROUTE_NAMES = frozenset(path.strip("/") for path in _ROUTES)
+
+async def _lifespan(receive, send):
+    global _async_oso_client
+    while True:
+        message = await receive()
+        if "lifespan.startup" == message["type"]:
+            await send({"type": "lifespan.startup.complete"})
+        elif "lifespan.shutdown" == message["type"]:
+            if _async_oso_client is not None:
+                await _async_oso_client.aclose()
+                _async_oso_client = None
+            await send({"type": "lifespan.shutdown.complete"})
+            return None
+
+async def app(scope, receive, send):
+    if "lifespan" == scope["type"]:
+        return await _lifespan(receive, send)
+    if "http" != scope["type"]:
+        return None
+    if repoapis._metrics is None:
+        return await _dispatch(scope, receive, send)
+
+    # Time the request and count its bytes, as repoapis does in
+    # metrics.MetricsMiddleware.
+    request_timer = metrics.RequestTimer(
+        metrics.route_label(scope["path"], _ROUTE_NAMES),
+        scope["method"])
+
+    async def counted_receive():
+        message = await receive()
+        request_timer.bytes_received += len(message.get("body", b""))
+        return message
+
+    async def timed_send(message):
+        if "http.response.start" == message["type"]:
+            metrics.mark_handler_finished(message["status"])
+        elif "http.response.body" == message["type"]:
+            request_timer.bytes_sent += len(message.get("body", b""))
+        await send(message)
+
+    token = metrics.start_request(request_timer)
+    try:
+        return await _dispatch(scope, counted_receive, timed_send)
+    finally:
+        metrics.end_request(token)
+        repoapis._metrics.registry.record_request(request_timer)
+
+async def _dispatch(scope, receive, send):
+    route = _ROUTES.get(scope["path"])
+    if route is None:
+        return await _send_response(send, HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+    (methods, handler) = route
+    if scope["method"] not in methods:
+        return await _send_response(
+            send,
+            HttpResponseCode.CLIENT_ERROR_RESPONSE_405_METHOD_NOT_ALLOWED,
+            headers=[("Allow", ", ".join(methods))])
+
+    if "HEAD" == scope["method"]:
+        # Same headers as GET, without the body.
+        send_body = send
+        async def send(message):
+            if "http.response.body" == message["type"]:
+                message = {"type": "http.response.body", "more_body": message.get("more_body", False)}
+            await send_body(message)
+
+    # Admission control, as repoapis applies around the Flask application.
+    admission_controller = repoapis._admission_controller
+    if admission_controller is not None:
+        try:
+            await admission_controller.admit_async(scope["path"])
+        except loadshedding.LoadShedError as e:
+            return await _send_response(
+                send,
+                HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE,
+                headers=[("Retry-After", loadshedding.retry_after_header(e))])
+
+    metrics.mark_handler_started()
+    try:
+        return await handler(_Request(scope, receive), send)
+    except _ClientDisconnected as e:
+        print(e)
+        return None
+    finally:
+        if admission_controller is not None:
+            admission_controller.release()
+
+if __name__ == "__main__":
+    try:
+        import uvicorn
+    except ImportError:
+        print("[ERROR] Serving repoasgi.py needs an ASGI server, i.e. 'pip install uvicorn'.")
+        sys.exit(1)
+
+    uvicorn.run(
+        app,
+        host=repohostutils.DEFAULT_HTTP_HOST_NAME,
+        port=int(repohostutils.DEFAULT_HTTP_PORT_NUMBER))
@@ -1,16 +1,31 @@
 #!/usr/bin/python3
+import contextlib
+import io
 import mimetypes
 import os
+import shutil
 import sys
+import tempfile
 
 from flask import jsonify
 
+import blobstore
+import directorylisting
+import fileindex
+import listingcache
+import multipartuploads
+import pathlocks
+import repoarchives
+
 
 # HTTP Utils
 class HttpResponseCode:
     SUCCESSFUL_RESPONSE_200_OK = 200
     SUCCESSFUL_RESPONSE_201_CREATED = 201
     SUCCESSFUL_RESPONSE_204_NO_CONTENT = 204
+    SUCCESSFUL_RESPONSE_206_PARTIAL_CONTENT = 206
+
+    REDIRECTION_MESSAGE_304_NOT_MODIFIED = 304
 
     CLIENT_ERROR_RESPONSE_400_BAD_REQUEST = 400
     CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED = 401
@@ -18,6 +33,8 @@ class HttpResponseCode:
     CLIENT_ERROR_RESPONSE_404_NOT_FOUND = 404
     CLIENT_ERROR_RESPONSE_405_METHOD_NOT_ALLOWED = 405
     CLIENT_ERROR_RESPONSE_409_CONFLICT = 409
+    CLIENT_ERROR_RESPONSE_413_PAYLOAD_TOO_LARGE = 413
+    CLIENT_ERROR_RESPONSE_416_RANGE_NOT_SATISFIABLE = 416
     CLIENT_ERROR_RESPONSE_429_TOO_MANY_REQUESTS = 429
 
     SERVER_ERROR_RESPONSE_500_INTERNAL_SERVER_ERROR = 500
@@ -31,16 +48,72 @@ class ApiParameterKeys:
     FILE_NAME = "file_name"
     DOWNLOAD_FILE_NAME = "download_file_name"
     WRITE_MODE = "write_mode"
+    PERMISSION = "permission"
+    CHECKS = "checks"
+    LIMIT = "limit"
+    CURSOR = "cursor"
+    RECURSIVE = "recursive"
+    MAX_DEPTH = "max_depth"
+    INCLUDE_FILES = "include_files"
+    ARCHIVE_FORMAT = "format"
+    COMPRESSION = "compression"
+    ATOMIC = "atomic"
+    UPLOAD_ID = "upload_id"
+    PART_NUMBER = "part_number"
+    CHECKSUM = "checksum"
+    PARTS = "parts"
 
 class ApiResponseKeys:
     SUBDIRECTORIES = "subdirectories"
+    DECISIONS = "decisions"
+    ALLOWED = "allowed"
+    ENTRIES = "entries"
+    NEXT_CURSOR = "next_cursor"
+    PATH = "path"
+    TYPE = "type"
+    SIZE = "size"
+    FILES = "files"
 
 class ParameterValidation:
     @staticmethod
     def check_required_str(parameter_name, parameter):
         if not isinstance(parameter, str):
-            log_message = "'parameter_name' must be provided in the request."
-            commonutils.log_error(log_message)
+            log_message = "'{}' must be provided in the request.".format(parameter_name)
+            print("[ERROR] {}".format(log_message))
+            return False
+        return True
+
+    # Usernames name directories under the application root, next to the
+    # host's own data directories (see create_host_data_directory), which
+    # all start with a ".". Such usernames are refused so no user can own,
+    # list or read them.
+    @staticmethod
+    def check_username(parameter_name, parameter):
+        if not ParameterValidation.check_required_str(parameter_name, parameter):
+            return False
+        if parameter.startswith("."):
+            log_message = "'{}' must not start with '.'.".format(parameter_name)
+            print("[ERROR] {}".format(log_message))
+            return False
+        return True
+
+    @staticmethod
+    def check_optional_bool(parameter_name, parameter):
+        if parameter is not None and not isinstance(parameter, bool):
+            log_message = "'{}' must be true or false.".format(parameter_name)
+            print("[ERROR] {}".format(log_message))
+            return False
+        return True
+
+    @staticmethod
+    def check_optional_int(parameter_name, parameter, minimum=None):
+        if parameter is None:
+            return True
+        if (isinstance(parameter, bool) or
+            not isinstance(parameter, int) or
+            (minimum is not None and parameter < minimum)):
+            log_message = "'{}' must be an integer of at least {}.".format(parameter_name, minimum)
+            print("[ERROR] {}".format(log_message))
             return False
         return True
 
@@ -72,23 +145,14 @@ def _create_directory(path):
             current_folder_set.append(folder)
             current_path = "/".join(current_folder_set)
             if not os.path.exists(current_path):
-                os.mkdir(current_path)
+                try:
+                    os.mkdir(current_path)
+                except FileExistsError:
+                    # Created by a concurrent writer.
+                    pass
 
     return None
 
-def _create_file(file_path):
-    file_name = None
-    folders_in_path = file_path.split("/")
-    if len(folders_in_path) > 0:
-        file_name = folders_in_path[-1]
-        folders_in_path = folders_in_path[:-1]
-    file_directory = "/".join(folders_in_path)
-    _create_directory(file_directory)
-    with open(file_path, "w") as f:
-        pass
-
-    return file_path
-
 def _application_root_directory():
     working_directory = DEFAULT_HOST_WORKING_DIRECTORY
     return "{}/{}".format(
@@ -129,6 +193,19 @@ def repo_host_init():
 
     return None
 
+# Create (if needed) a directory for application data, such as journals
+# or caches, under the application root directory. Its name must start
+# with a "." so that it cannot be a user's directory.
+def create_host_data_directory(directory_name):
+    if not directory_name.startswith("."):
+        raise ValueError("Host data directory '{}' must start with '.'.".format(directory_name))
+    data_directory = "{}/{}".format(
+        _application_root_directory(),
+        directory_name)
+    _create_directory(data_directory)
+
+    return data_directory
+
 def create_user_repo(username, repo_name):
     user_repo_directory = _get_user_repo_path(username, repo_name)
     _create_directory(user_repo_directory)
@@ -141,30 +218,377 @@ def create_user_repo_directory(username, repo_name, directory_path):
         directory_path)
 
     _create_directory(full_directory_path)
+    _invalidate_listings(username, repo_name, directory_path)
 
     return "{}/{}".format(repo_name, directory_path)
 
 def create_user_repo_file(username, repo_name, file_path):
-    full_file_path = _get_user_repo_resource_path(
-        username,
-        repo_name,
-        file_path)
-
-    _create_file(full_file_path)
+    # An empty file replaces any existing one like any other write; it is
+    # never truncated in place.
+    _write_repo_file(username, repo_name, file_path, io.BytesIO(), "wb", None)
 
     return "{}/{}".format(repo_name, file_path)
 
+# In-process cache of list_directories results (see listingcache.py).
+_listing_cache = None
+
+def enable_listing_cache(max_entries=listingcache.DEFAULT_MAX_ENTRIES):
+    global _listing_cache
+    _listing_cache = listingcache.ListingCache(max_entries=max_entries)
+
+    return _listing_cache
+
+def get_listing_cache():
+    return _listing_cache
+
+def _invalidate_listings(username, repo_name, directory_path):
+    if _listing_cache is not None:
+        _listing_cache.invalidate_path(username, repo_name, directory_path or ".")
+
+    return None
+
 def list_directories(username, repo_name, directory_path):
     full_directory_path = _get_user_repo_resource_path(
         username,
         repo_name,
         directory_path)
 
-    subdirectories = None
-    if os.path.exists(full_directory_path):
+    if _listing_cache is None:
+        subdirectories = None
+        if os.path.exists(full_directory_path):
+            subdirectories = [obj.path for obj in os.scandir(full_directory_path) if obj.is_dir()]
+        return subdirectories
+
+    try:
+        directory_stat = os.stat(full_directory_path)
+    except FileNotFoundError:
+        return None
+
+    subdirectories = _listing_cache.get(username, repo_name, directory_path, directory_stat)
+    if subdirectories is None:
         subdirectories = [obj.path for obj in os.scandir(full_directory_path) if obj.is_dir()]
+        _listing_cache.put(username, repo_name, directory_path, directory_stat, subdirectories)
+
+    # Callers get their own copy of the cached list.
+    return list(subdirectories)
+
+def _repo_entry(directory_path, entry):
+    (relative_path, entry_type, size) = entry
+    directory_path = os.path.normpath(directory_path.replace("\\", "/"))
+    if "." != directory_path:
+        relative_path = "{}/{}".format(directory_path, relative_path)
+
+    repo_entry = {
+        ApiResponseKeys.PATH: relative_path,
+        ApiResponseKeys.TYPE: entry_type
+    }
+    if size is not None:
+        repo_entry[ApiResponseKeys.SIZE] = size
+    return repo_entry
+
+# Yield the entries under a directory in the repository one at a time, as
+# {"path", "type", "size"} dicts with paths relative to the repository.
+# Returns None if the directory does not exist.
+def iterate_repo_entries(username,
+                         repo_name,
+                         directory_path,
+                         max_depth=1,
+                         include_files=False):
+    full_directory_path = _get_user_repo_resource_path(
+        username,
+        repo_name,
+        directory_path)
 
-    return subdirectories
+    if not os.path.isdir(full_directory_path):
+        return None
+
+    entries = directorylisting.walk_entries(
+        full_directory_path,
+        max_depth=max_depth,
+        include_files=include_files)
+    return (_repo_entry(directory_path, entry) for entry in entries)
+
+# Returns one page of entries (as for iterate_repo_entries) and the cursor
+# of the next page, or None if the directory does not exist. Raises
+# directorylisting.InvalidCursorError for a malformed cursor.
+def page_repo_entries(username,
+                      repo_name,
+                      directory_path,
+                      page_size,
+                      cursor=None,
+                      max_depth=1,
+                      include_files=False):
+    full_directory_path = _get_user_repo_resource_path(
+        username,
+        repo_name,
+        directory_path)
+
+    if not os.path.isdir(full_directory_path):
+        return None
+
+    (entries, next_cursor) = directorylisting.page_entries(
+        full_directory_path,
+        page_size,
+        cursor=cursor,
+        max_depth=max_depth,
+        include_files=include_files)
+    return ([_repo_entry(directory_path, entry) for entry in entries], next_cursor)
+
+# Returns the full path of an existing directory in the repository, or None.
+def get_directory_path(username, repo_name, directory_path):
+    full_directory_path = _get_user_repo_resource_path(
+        username,
+        repo_name,
+        directory_path)
+
+    if not os.path.isdir(full_directory_path):
+        return None
+
+    return os.path.abspath(full_directory_path)
+
+# Returns the os.stat result of a directory in the repository, or None.
+def get_directory_stat(username, repo_name, directory_path):
+    full_directory_path = _get_user_repo_resource_path(
+        username,
+        repo_name,
+        directory_path)
+
+    if not os.path.isdir(full_directory_path):
+        return None
+
+    return os.stat(full_directory_path)
+
+# Size of the chunks copied from an upload stream to disk.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# The process umask, read once at import since reading it means setting
+# it. Files written through a temporary file get the permissions open()
+# would have given them.
+_UMASK = os.umask(0o022)
+os.umask(_UMASK)
+NEW_FILE_MODE = 0o666 & ~_UMASK
+
+# Raised when an upload stream is longer than the allowed maximum.
+class UploadTooLargeError(Exception):
+    pass
+
+def _binary_write_mode(write_mode):
+    if write_mode.startswith("a"):
+        return "ab"
+    return "wb"
+
+def _copy_stream(stream, file_object, max_bytes):
+    bytes_written = 0
+    while True:
+        chunk = stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            break
+        bytes_written += len(chunk)
+        if max_bytes is not None and bytes_written > max_bytes:
+            raise UploadTooLargeError(
+                "The upload is larger than {} bytes.".format(max_bytes))
+        file_object.write(chunk)
+
+    return bytes_written
+
+# Per-repository file metadata indexes (see fileindex.py). When they are
+# enabled, every write records the file's size, mtime, hash and mimetype.
+_file_indexes = None
+
+def enable_file_index():
+    global _file_indexes
+    _file_indexes = fileindex.FileIndexes(
+        create_host_data_directory(fileindex.INDEX_DIRECTORY_NAME))
+
+    return _file_indexes
+
+def _index_file(username, repo_name, file_path, full_file_path, content_hash):
+    if _file_indexes is None:
+        return None
+
+    with _file_indexes.repo_index(username, repo_name) as repo_index:
+        repo_index.put(fileindex.make_record(
+            file_path,
+            os.stat(full_file_path),
+            content_hash))
+
+    return None
+
+# Returns the indexed metadata (fileindex.FileRecord) of a file, or None
+# if it has not been indexed.
+def get_file_record(username, repo_name, file_path):
+    if _file_indexes is None:
+        return None
+
+    with _file_indexes.repo_index(username, repo_name) as repo_index:
+        return repo_index.get(file_path)
+
+# Content-addressed blob store (see blobstore.py). When it is enabled,
+# repository files are hard links to deduplicated blobs.
+_blob_store = None
+
+def enable_blob_store():
+    global _blob_store
+    _blob_store = blobstore.BlobStore(
+        create_host_data_directory(blobstore.BLOB_DIRECTORY_NAME))
+
+    return _blob_store
+
+def get_blob_store():
+    return _blob_store
+
+# Hash the new contents into a temporary blob, store it (once) and link the
+# repository path to it. An append copies the current contents first,
+# since the blob behind the file may be shared.
+def _write_blob_file(full_file_path, stream, write_mode, max_bytes):
+    (temporary_file_descriptor, temporary_file_path) = _blob_store.temporary_file()
+    try:
+        with os.fdopen(temporary_file_descriptor, "wb") as f:
+            hashing_writer = blobstore.HashingWriter(f)
+            if "ab" == write_mode and os.path.isfile(full_file_path):
+                with open(full_file_path, "rb") as current_file:
+                    shutil.copyfileobj(current_file, hashing_writer, STREAM_CHUNK_SIZE)
+            _copy_stream(stream, hashing_writer, max_bytes)
+    except BaseException:
+        os.unlink(temporary_file_path)
+        raise
+
+    content_hash = hashing_writer.hexdigest()
+    blob_path = _blob_store.commit(
+        temporary_file_path,
+        content_hash,
+        hashing_writer.bytes_written)
+    _blob_store.link(blob_path, full_file_path)
+
+    return content_hash
+
+# Returns the content hash of the written file when the file index needs
+# it, or None.
+def _write_plain_file(full_file_path, stream, write_mode, max_bytes):
+    # A file with other links may share its contents with a blob.
+    if ("ab" == write_mode and
+        _path_locks is not None and
+        os.path.isfile(full_file_path) and
+        1 == os.stat(full_file_path).st_nlink):
+        return _append_plain_file(full_file_path, stream, max_bytes)
+
+    (temporary_file_descriptor, temporary_file_path) = tempfile.mkstemp(
+        prefix=".upload-",
+        dir=os.path.dirname(full_file_path))
+    try:
+        # mkstemp creates the file readable by its owner only.
+        os.fchmod(temporary_file_descriptor, NEW_FILE_MODE)
+        with os.fdopen(temporary_file_descriptor, "wb") as f:
+            if _file_indexes is None:
+                writer = f
+            else:
+                writer = blobstore.HashingWriter(f)
+            # Without path locks, an append copies the current contents
+            # first, so concurrent appends and a failed append never leave
+            # a partly appended file.
+            if "ab" == write_mode and os.path.isfile(full_file_path):
+                with open(full_file_path, "rb") as current_file:
+                    shutil.copyfileobj(current_file, writer, STREAM_CHUNK_SIZE)
+            _copy_stream(stream, writer, max_bytes)
+        os.replace(temporary_file_path, full_file_path)
+    except BaseException:
+        os.unlink(temporary_file_path)
+        raise
+
+    if _file_indexes is None:
+        return None
+    return writer.hexdigest()
+
+# Append to a file in place, which the caller holds the write lock of, so
+# an append costs the size of the new data rather than of the whole file.
+# A failed append is cut off again. Readers may see an append in
+# progress. The file is not hashed again: its index record keeps no
+# content hash, and its ETag falls back to its inode, mtime and size.
+def _append_plain_file(full_file_path, stream, max_bytes):
+    original_size = os.path.getsize(full_file_path)
+    try:
+        with open(full_file_path, "ab") as f:
+            _copy_stream(stream, f, max_bytes)
+    except BaseException:
+        os.truncate(full_file_path, original_size)
+        raise
+
+    return None
+
+# Per-path write locks shared by the worker processes (see pathlocks.py).
+_path_locks = None
+
+def enable_path_locks():
+    global _path_locks
+    _path_locks = pathlocks.PathLocks(
+        create_host_data_directory(pathlocks.LOCKS_DIRECTORY_NAME))
+
+    return _path_locks
+
+def get_path_locks():
+    return _path_locks
+
+# Hold the write locks of the given files of a repository.
+def _locked_files(username, repo_name, *file_paths):
+    if _path_locks is None:
+        return contextlib.nullcontext()
+
+    return _path_locks.locked(*[
+        "{}/{}/{}".format(username, repo_name, fileindex.normalize_file_path(file_path))
+        for file_path in file_paths
+    ])
+
+# Write a repository file, then record it in the file index, while holding
+# its write lock: concurrent writers to the same path take turns, and the
+# index always describes the file's latest contents.
+def _write_repo_file(username, repo_name, file_path, stream, write_mode, max_bytes):
+    full_file_path = _get_user_repo_resource_path(
+        username,
+        repo_name,
+        file_path)
+
+    _create_directory(os.path.dirname(full_file_path))
+
+    with _locked_files(username, repo_name, file_path):
+        if _blob_store is None:
+            content_hash = _write_plain_file(full_file_path, stream, write_mode, max_bytes)
+        else:
+            content_hash = _write_blob_file(full_file_path, stream, write_mode, max_bytes)
+        _index_file(username, repo_name, file_path, full_file_path, content_hash)
+    _invalidate_listings(username, repo_name, os.path.dirname(file_path))
+
+    return None
+
+# Write the contents of a binary stream to a file in the user's repo,
+# STREAM_CHUNK_SIZE bytes at a time, so memory use does not depend on
+# the size of the file.
+# The contents are written to a temporary file next to the target (or a
+# temporary blob) and moved into place with os.replace, so readers never
+# see a partially written file. Appends ("a"/"ab") are written in place
+# under the path's lock, or copy the current contents into the temporary
+# file first when there are no path locks or the file is a shared blob.
+# Writers to the same path hold its lock, so concurrent appends all land.
+def write_file_stream(username,
+                      repo_name,
+                      directory_path,
+                      file_name,
+                      stream,
+                      write_mode="wb",
+                      max_bytes=None):
+    file_path = "{}/{}".format(
+        directory_path,
+        file_name
+    )
+
+    _write_repo_file(
+        username,
+        repo_name,
+        file_path,
+        stream,
+        _binary_write_mode(write_mode),
+        max_bytes)
+
+    return "{}/{}".format(repo_name, file_path)
 
 def write_file(username,
                repo_name,
@@ -172,23 +596,244 @@ def write_file(username,
                file_name,
                file_data,
                write_mode="w"):
-    file_path = "{}/{}".format(
-        directory_path,
-        file_name
-    )
+    # Fill the file with the contents of file_data
+    if isinstance(file_data, str):
+        file_data = file_data.encode("utf-8")
 
-    full_file_path = _get_user_repo_resource_path(
+    return write_file_stream(
         username,
         repo_name,
-        file_path)
+        directory_path,
+        file_name,
+        io.BytesIO(file_data),
+        write_mode=write_mode)
+
+# A reader that raises UploadTooLargeError once more than max_bytes have
+# been read from the wrapped stream.
+class LimitedReader:
+    def __init__(self, stream, max_bytes):
+        self._stream = stream
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self._stream.read(size)
+        self.bytes_read += len(chunk)
+        if self.max_bytes is not None and self.bytes_read > self.max_bytes:
+            raise UploadTooLargeError(
+                "The upload is larger than {} bytes.".format(self.max_bytes))
+        return chunk
+
+STAGING_DIRECTORY_NAME = ".staging"
+
+def _make_directories(full_directory_path, created_directories):
+    missing_directories = []
+    while full_directory_path and not os.path.isdir(full_directory_path):
+        missing_directories.append(full_directory_path)
+        full_directory_path = os.path.dirname(full_directory_path)
+    for missing_directory in reversed(missing_directories):
+        try:
+            os.mkdir(missing_directory)
+        except FileExistsError:
+            # Created by a concurrent writer since the check, so it is not
+            # this commit's to remove on roll back.
+            if not os.path.isdir(missing_directory):
+                raise
+            continue
+        created_directories.append(missing_directory)
 
-    _create_file(full_file_path)
+    return None
 
-    # Fill the file with the contents of file_data
-    with open(full_file_path, write_mode) as f:
-        f.write(file_data)
+# Files and directories written to a staging directory and moved into a
+# repository together by commit(), or not at all.
+#
+# The staging directory sits under the application root, on the same
+# filesystem as the repositories, so every file is moved into place with
+# os.replace. A file that is replaced is first hard linked to a backup,
+# so readers never see it missing and a failed commit can restore it.
+class StagedWrites:
+    def __init__(self, username, repo_name):
+        self.username = username
+        self.repo_name = repo_name
+        self.staging_directory = tempfile.mkdtemp(
+            prefix="{}-".format(repo_name),
+            dir=create_host_data_directory(STAGING_DIRECTORY_NAME))
+        self.bytes_written = 0
+        # File path in the repo -> (staged path, content hash). A path
+        # written twice keeps its last contents.
+        self._files = {}
+        self._directories = []
+
+    def add_directory(self, directory_path):
+        self._directories.append(directory_path)
+
+        return None
+
+    # Stage the contents of a binary stream as file_path. Returns the
+    # number of bytes staged.
+    def write_stream(self, file_path, stream, max_bytes=None):
+        staged_path = os.path.join(self.staging_directory, str(len(self._files)))
+        if _blob_store is None:
+            content_hash = _write_plain_file(staged_path, stream, "wb", max_bytes)
+        else:
+            content_hash = _write_blob_file(staged_path, stream, "wb", max_bytes)
+        self._files[fileindex.normalize_file_path(file_path)] = (staged_path, content_hash)
+
+        staged_size = os.path.getsize(staged_path)
+        self.bytes_written += staged_size
+        return staged_size
+
+    def _full_path(self, resource_path):
+        return _get_user_repo_resource_path(self.username, self.repo_name, resource_path)
+
+    def _move_into_place(self, created_directories, replaced_files):
+        for directory_path in self._directories:
+            _make_directories(self._full_path(directory_path), created_directories)
+
+        for (file_number, (file_path, (staged_path, _))) in enumerate(self._files.items()):
+            full_file_path = self._full_path(file_path)
+            _make_directories(os.path.dirname(full_file_path), created_directories)
+            backup_path = None
+            if os.path.lexists(full_file_path):
+                backup_path = os.path.join(self.staging_directory, "backup-{}".format(file_number))
+                os.link(full_file_path, backup_path)
+            replaced_files.append((full_file_path, backup_path))
+            os.replace(staged_path, full_file_path)
+
+        return None
 
-    return "{}/{}".format(repo_name, file_path)
+    @staticmethod
+    def _roll_back(created_directories, replaced_files):
+        for (full_file_path, backup_path) in reversed(replaced_files):
+            try:
+                if backup_path is None:
+                    os.unlink(full_file_path)
+                else:
+                    os.replace(backup_path, full_file_path)
+            except OSError as e:
+                print(e)
+        for created_directory in reversed(created_directories):
+            try:
+                os.rmdir(created_directory)
+            except OSError as e:
+                print(e)
+
+        return None
+
+    # Move every staged file into the repository, holding all of their
+    # write locks. If any of them cannot be moved, the ones already moved
+    # are put back and the error raised.
+    def commit(self):
+        created_directories = []
+        replaced_files = []
+        with _locked_files(self.username, self.repo_name, *self._files):
+            try:
+                self._move_into_place(created_directories, replaced_files)
+            except BaseException:
+                self._roll_back(created_directories, replaced_files)
+                raise
+
+            for (file_path, (_, content_hash)) in self._files.items():
+                _index_file(self.username, self.repo_name, file_path, self._full_path(file_path), content_hash)
+        for file_path in self._files:
+            _invalidate_listings(self.username, self.repo_name, os.path.dirname(file_path))
+        for directory_path in self._directories:
+            _invalidate_listings(self.username, self.repo_name, directory_path)
+
+        return len(self._files)
+
+    def discard(self):
+        shutil.rmtree(self.staging_directory, ignore_errors=True)
+
+        return None
+
+# Write the members of an uploaded archive (see repoarchives.read_archive)
+# under directory_path as they are read. In atomic mode the members are
+# staged first and only moved into the repository once the whole archive
+# has been read, so a bad archive leaves the repository untouched.
+# max_bytes bounds the total size of the extracted files. Returns the
+# number of files written.
+def write_archive(username,
+                  repo_name,
+                  directory_path,
+                  stream,
+                  archive_format=repoarchives.ARCHIVE_FORMAT_TAR,
+                  compression=None,
+                  atomic=False,
+                  max_bytes=None):
+    members = repoarchives.read_archive(
+        stream,
+        archive_format,
+        compression,
+        spool_directory=create_host_data_directory(STAGING_DIRECTORY_NAME))
+
+    if atomic:
+        staged_writes = StagedWrites(username, repo_name)
+        try:
+            for (member_type, archive_path, member_stream) in members:
+                member_path = os.path.normpath(os.path.join(directory_path, archive_path))
+                if repoarchives.MEMBER_TYPE_DIRECTORY == member_type:
+                    staged_writes.add_directory(member_path)
+                    continue
+                remaining_bytes = None
+                if max_bytes is not None:
+                    remaining_bytes = max_bytes - staged_writes.bytes_written
+                staged_writes.write_stream(member_path, member_stream, remaining_bytes)
+            return staged_writes.commit()
+        finally:
+            staged_writes.discard()
+
+    file_count = 0
+    bytes_written = 0
+    for (member_type, archive_path, member_stream) in members:
+        member_path = os.path.normpath(os.path.join(directory_path, archive_path))
+        if repoarchives.MEMBER_TYPE_DIRECTORY == member_type:
+            create_user_repo_directory(username, repo_name, member_path)
+            continue
+        remaining_bytes = None
+        if max_bytes is not None:
+            remaining_bytes = max_bytes - bytes_written
+        write_file_stream(
+            username,
+            repo_name,
+            os.path.dirname(member_path) or ".",
+            os.path.basename(member_path),
+            member_stream,
+            max_bytes=remaining_bytes)
+        bytes_written += os.path.getsize(_get_user_repo_resource_path(username, repo_name, member_path))
+        file_count += 1
+
+    return file_count
+
+# Resumable multipart upload sessions (see multipartuploads.py).
+_upload_sessions = None
+
+def enable_multipart_uploads(max_age_seconds=multipartuploads.DEFAULT_MAX_AGE_SECONDS):
+    global _upload_sessions
+    _upload_sessions = multipartuploads.UploadSessions(
+        create_host_data_directory(multipartuploads.SESSIONS_DIRECTORY_NAME),
+        max_age_seconds=max_age_seconds)
+
+    return _upload_sessions
+
+def get_upload_sessions():
+    return _upload_sessions
+
+# Assemble the parts of a multipart upload session into its target file,
+# as write_file_stream would write it, and end the session.
+# expected_parts is an optional list of (part_number, checksum).
+def complete_multipart_upload(session, expected_parts=None, max_bytes=None):
+    with _upload_sessions.completing(session, expected_parts) as parts_stream:
+        relative_path = write_file_stream(
+            session.username,
+            session.repo_name,
+            session.directory_path,
+            session.file_name,
+            parts_stream,
+            write_mode=session.write_mode,
+            max_bytes=max_bytes)
+
+    return relative_path
 
 def open_read_only_file(username,
                         repo_name,
@@ -207,12 +852,36 @@ def open_read_only_file(username,
 
     return file_object
 
-def get_file_mimetype(username, repo_name, file_path):
+# Returns the full path of an existing file in the repository, or None.
+# A file with an index record (see get_file_record) is not stat'ed again:
+# the caller opening it finds out if it is gone.
+def get_file_path(username,
+                  repo_name,
+                  file_path,
+                  file_record=None):
     full_file_path = _get_user_repo_resource_path(
         username,
         repo_name,
         file_path)
 
+    if file_record is None and not os.path.isfile(full_file_path):
+        return None
+
+    # send_file resolves relative paths against the application's root
+    # directory rather than the working directory.
+    return os.path.abspath(full_file_path)
+
+# The mimetype of the file_record of a file, if it has one, else a guess
+# from its name.
+def get_file_mimetype(username, repo_name, file_path, file_record=None):
+    full_file_path = _get_user_repo_resource_path(
+        username,
+        repo_name,
+        file_path)
+
+    if file_record is not None:
+        return file_record.mimetype
+
     (mimetype_str, _) = mimetypes.guess_type(full_file_path)
 
     return mimetype_str
\ No newline at end of file
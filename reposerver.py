@@ -0,0 +1,526 @@
+#!/usr/bin/python3
+import time
+
+# Taken first, so the cold start includes importing everything below.
+_launch_time = time.monotonic()
+
+import argparse
+import concurrent.futures
+import importlib
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+
+from werkzeug.serving import BaseWSGIServer, WSGIRequestHandler
+
+try:
+    import gunicorn.app.base
+except ImportError:
+    gunicorn = None
+
+# Add the current directory to the system path
+application_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(application_dir)
+
+import osoclientpool
+import repohostutils
+
+# Production entry point for the repository API:
+#   python3 reposerver.py [--workers <n>] [--threads <n>] [--asgi]
+#
+# The application is imported (and so configured: Oso Cloud client,
+# policy, caches, host directories) once, in the parent process, before
+# worker processes are forked from it. Workers then share that work and
+# its memory, and each one re-creates only what owns connections or
+# threads (repoapis.init_worker), since neither survives a fork.
+#
+# With gunicorn installed it manages the workers: gthread workers for the
+# Flask application, or uvicorn workers for repoasgi.py with --asgi.
+# Otherwise a small built-in supervisor does the same for the Flask
+# application, each worker serving requests from a fixed pool of threads.
+#
+# Either way, SIGHUP replaces the workers with new ones without dropping
+# a request (the preloaded code is kept; restart the server for new
+# code), and SIGTERM stops accepting connections and lets the requests in
+# flight finish for up to --graceful-timeout seconds, after which the fact
+# journals are flushed.
+#
+# The time from process start to the first worker accepting requests is
+# reported at start-up, split into interpreter start-up, preloading and
+# worker initialization, to keep an eye on how fast new instances can
+# take traffic.
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_GRACEFUL_TIMEOUT_SECONDS = 30.0
+LISTEN_BACKLOG = 2048
+
+# Seconds the supervisor waits between respawns of a worker that exits
+# before it is ready, so a broken configuration does not fork in a loop.
+RESPAWN_DELAY_SECONDS = 1.0
+POLL_INTERVAL_SECONDS = 0.5
+
+# Seconds this process had been running when this module started, read
+# from /proc on Linux (None elsewhere).
+def _process_age_seconds():
+    try:
+        with open("/proc/self/stat") as f:
+            # Fields after the command name, which may contain spaces.
+            stat_fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime_seconds = float(f.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+
+    return uptime_seconds - int(stat_fields[19]) / os.sysconf("SC_CLK_TCK")
+
+_interpreter_startup_seconds = _process_age_seconds()
+_preload_seconds = 0.0
+
+def _cold_start_message(worker_ready_seconds):
+    cold_start_seconds = time.monotonic() - _launch_time
+    if _interpreter_startup_seconds is not None:
+        cold_start_seconds += _interpreter_startup_seconds
+        return "[INFO] Cold start: {:.3f}s (interpreter {:.3f}s, preload {:.3f}s, worker {:.3f}s)".format(
+            cold_start_seconds,
+            _interpreter_startup_seconds,
+            _preload_seconds,
+            worker_ready_seconds)
+    return "[INFO] Cold start: {:.3f}s (preload {:.3f}s, worker {:.3f}s)".format(
+        cold_start_seconds,
+        _preload_seconds,
+        worker_ready_seconds)
+
+# Import and configure the application in this process. Returns the
+# module and the application object to serve.
+def _preload(asgi=False):
+    global _preload_seconds
+    start_time = time.monotonic()
+
+    # The fact journal is started per worker, after fork.
+    os.environ["REPO_API_PREFORK"] = "1"
+    module = importlib.import_module("repoasgi" if asgi else "repoapis")
+    application = module.app if asgi else module._app
+
+    _preload_seconds = time.monotonic() - start_time
+    print("[INFO] Preloaded the application in {:.3f}s".format(_preload_seconds))
+
+    return (module, application)
+
+def _init_worker(worker_slot):
+    import repoapis
+    repoapis.init_worker(worker_slot)
+
+    return None
+
+def _shutdown_worker(timeout_seconds):
+    import repoapis
+    repoapis.shutdown_worker(timeout_seconds)
+
+    return None
+
+def _retire_worker(pid):
+    import repoapis
+    try:
+        repoapis.retire_worker(pid)
+    except Exception as e:
+        print(e)
+
+    return None
+
+# The lowest worker slot no live worker holds. Slots name per-worker
+# state, such as fact journals, that must not be shared by two workers.
+def _free_slot(used_slots):
+    used_slots = set(used_slots)
+    slot = 0
+    while slot in used_slots:
+        slot += 1
+
+    return slot
+
+###############################################################################
+# gunicorn
+###############################################################################
+def _run_gunicorn(application, host, port, workers, threads, graceful_timeout_seconds, asgi=False):
+    class _Application(gunicorn.app.base.BaseApplication):
+        def __init__(self, options):
+            self._options = options
+            super().__init__()
+
+        def load_config(self):
+            for (key, value) in self._options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    def pre_fork(server, worker):
+        worker.slot = _free_slot(getattr(live_worker, "slot", None) for live_worker in server.WORKERS.values())
+
+    def post_fork(server, worker):
+        worker.fork_time = time.monotonic()
+        _init_worker(worker.slot)
+
+    def post_worker_init(worker):
+        worker_ready_seconds = time.monotonic() - worker.fork_time
+        print("[INFO] Worker {} (pid {}) ready in {:.3f}s".format(worker.slot, worker.pid, worker_ready_seconds))
+        print(_cold_start_message(worker_ready_seconds))
+
+    def worker_exit(server, worker):
+        _shutdown_worker(graceful_timeout_seconds)
+
+    def child_exit(server, worker):
+        _retire_worker(worker.pid)
+
+    _Application({
+        "bind": "{}:{}".format(host, port),
+        "workers": workers,
+        "threads": threads,
+        "worker_class": "uvicorn.workers.UvicornWorker" if asgi else "gthread",
+        "preload_app": True,
+        "graceful_timeout": graceful_timeout_seconds,
+        "backlog": LISTEN_BACKLOG,
+        "pre_fork": pre_fork,
+        "post_fork": post_fork,
+        "post_worker_init": post_worker_init,
+        "worker_exit": worker_exit,
+        "child_exit": child_exit
+    }).run()
+
+    return None
+
+###############################################################################
+# Built-in pre-fork server
+###############################################################################
+# Connections are closed after each response, so an idle keep-alive
+# connection never holds one of the worker's threads.
+class _RequestHandler(WSGIRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+# A WSGI server answering requests from a fixed pool of threads. While
+# every thread is busy it stops accepting, leaving new connections to
+# the other workers listening on the same socket.
+class _PooledWSGIServer(BaseWSGIServer):
+    multithread = True
+
+    def __init__(self, host, port, application, threads, fd):
+        super().__init__(host, port, application, handler=_RequestHandler, fd=fd)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=threads,
+            thread_name_prefix="request")
+        self._free_threads = threading.Semaphore(threads)
+
+    def process_request(self, request, client_address):
+        self._free_threads.acquire()
+        try:
+            self._executor.submit(self._process_request, request, client_address)
+        except BaseException:
+            self._free_threads.release()
+            self.shutdown_request(request)
+            raise
+
+        return None
+
+    def _process_request(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self._free_threads.release()
+
+        return None
+
+    # Wait up to timeout_seconds for the requests in flight. Returns
+    # whether they all finished.
+    def drain(self, timeout_seconds):
+        drained = threading.Event()
+
+        def wait_for_requests():
+            self._executor.shutdown(wait=True)
+            drained.set()
+
+        threading.Thread(target=wait_for_requests, name="drain", daemon=True).start()
+        return drained.wait(timeout_seconds)
+
+class _Worker:
+    def __init__(self, slot):
+        self.slot = slot
+        self.started = time.monotonic()
+        self.ready = False
+        self.retiring = False
+
+class PreforkServer:
+    def __init__(self,
+                 application,
+                 host=repohostutils.DEFAULT_HTTP_HOST_NAME,
+                 port=int(repohostutils.DEFAULT_HTTP_PORT_NUMBER),
+                 workers=DEFAULT_WORKERS,
+                 threads=osoclientpool.DEFAULT_POOL_SIZE,
+                 graceful_timeout_seconds=DEFAULT_GRACEFUL_TIMEOUT_SECONDS,
+                 on_worker_start=None,
+                 on_worker_exit=None):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.threads = threads
+        self.graceful_timeout_seconds = graceful_timeout_seconds
+        self.on_worker_start = on_worker_start
+        self.on_worker_exit = on_worker_exit
+
+        # pid -> _Worker
+        self._workers = {}
+        # New workers that must be ready before the ones they replace stop.
+        self._replacements = set()
+        self._socket = None
+        self._ready_read = None
+        self._ready_write = None
+        self._stopping = False
+        self._reload_requested = False
+        self._first_ready = True
+
+    def _handle_stop(self, signal_number, frame):
+        self._stopping = True
+
+    def _handle_reload(self, signal_number, frame):
+        self._reload_requested = True
+
+    def _spawn_worker(self, slot):
+        pid = os.fork()
+        if 0 == pid:
+            exit_code = 1
+            try:
+                exit_code = self._run_worker(slot)
+            except BaseException as e:
+                print(e)
+            finally:
+                sys.stdout.flush()
+                os._exit(exit_code)
+        self._workers[pid] = _Worker(slot)
+
+        return pid
+
+    # The body of a worker process; returns its exit code.
+    def _run_worker(self, slot):
+        fork_time = time.monotonic()
+        stop_requested = threading.Event()
+        server = None
+
+        def handle_stop(signal_number, frame):
+            stop_requested.set()
+            if server is not None:
+                # shutdown() waits for serve_forever, which runs on this thread.
+                threading.Thread(target=server.shutdown, name="shutdown", daemon=True).start()
+
+        signal.signal(signal.SIGTERM, handle_stop)
+        signal.signal(signal.SIGINT, handle_stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        os.close(self._ready_read)
+
+        if self.on_worker_start is not None:
+            self.on_worker_start(slot)
+        server = _PooledWSGIServer(
+            self.host,
+            self.port,
+            self.application,
+            self.threads,
+            self._socket.fileno())
+        # The supervisor reports it, so worker output never interleaves.
+        os.write(self._ready_write, "{} {}\n".format(
+            os.getpid(),
+            time.monotonic() - fork_time).encode("ascii"))
+
+        if not stop_requested.is_set():
+            server.serve_forever(poll_interval=POLL_INTERVAL_SECONDS)
+        # serve_forever has closed the server's socket; close the inherited
+        # one too, so the other workers take the new connections.
+        self._socket.close()
+        if not server.drain(self.graceful_timeout_seconds):
+            print("[WARNING] Worker {} stopped with requests still in flight.".format(slot))
+        if self.on_worker_exit is not None:
+            self.on_worker_exit(self.graceful_timeout_seconds)
+
+        return 0
+
+    def _spawn_workers(self):
+        new_pids = set()
+        for _ in range(self.workers):
+            new_pids.add(self._spawn_worker(_free_slot(worker.slot for worker in self._workers.values())))
+
+        return new_pids
+
+    def _read_ready_workers(self):
+        try:
+            ready_lines = os.read(self._ready_read, 65536).decode("ascii").splitlines()
+        except BlockingIOError:
+            return None
+
+        for ready_line in ready_lines:
+            (pid, worker_ready_seconds) = ready_line.split()
+            worker = self._workers.get(int(pid))
+            if worker is None:
+                continue
+            worker.ready = True
+            print("[INFO] Worker {} (pid {}) ready in {:.3f}s".format(worker.slot, pid, float(worker_ready_seconds)))
+            if self._first_ready:
+                self._first_ready = False
+                print(_cold_start_message(float(worker_ready_seconds)))
+
+        # Retire the old workers once all their replacements are ready.
+        if self._replacements and all(
+                self._workers[pid].ready for pid in self._replacements if pid in self._workers):
+            self._replacements = set()
+            for (pid, worker) in self._workers.items():
+                if worker.retiring:
+                    os.kill(pid, signal.SIGTERM)
+
+        return None
+
+    def _reap_workers(self):
+        while True:
+            try:
+                (pid, status) = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return None
+            if 0 == pid:
+                return None
+
+            worker = self._workers.pop(pid, None)
+            if worker is None:
+                continue
+            _retire_worker(pid)
+            if worker.retiring or self._stopping:
+                continue
+            print("[WARNING] Worker {} (pid {}) exited with status {}.".format(
+                worker.slot,
+                pid,
+                os.waitstatus_to_exitcode(status)))
+            if pid in self._replacements:
+                # A replacement failed: keep the old workers serving.
+                print("[ERROR] Reload failed; keeping the current workers.")
+                for (other_pid, other_worker) in self._workers.items():
+                    if other_pid in self._replacements:
+                        os.kill(other_pid, signal.SIGTERM)
+                        other_worker.retiring = True
+                    else:
+                        other_worker.retiring = False
+                self._replacements = set()
+                continue
+            if not worker.ready:
+                time.sleep(RESPAWN_DELAY_SECONDS)
+            self._spawn_worker(worker.slot)
+
+    # Start a new set of workers; the current ones are stopped gracefully
+    # once the new ones are ready.
+    def _reload(self):
+        self._reload_requested = False
+        if self._replacements:
+            return None
+        print("[INFO] Reloading workers.")
+        for worker in self._workers.values():
+            worker.retiring = True
+        self._replacements = self._spawn_workers()
+
+        return None
+
+    def _stop_workers(self):
+        for pid in self._workers:
+            os.kill(pid, signal.SIGTERM)
+
+        # Allow for the drain and the journal flush that follows it.
+        deadline = time.monotonic() + 2 * self.graceful_timeout_seconds
+        while self._workers and time.monotonic() < deadline:
+            self._reap_workers()
+            time.sleep(0.05)
+        for pid in self._workers:
+            print("[WARNING] Killing worker pid {}.".format(pid))
+            os.kill(pid, signal.SIGKILL)
+        while self._workers:
+            (pid, _) = os.waitpid(-1, 0)
+            if self._workers.pop(pid, None) is not None:
+                _retire_worker(pid)
+
+        return None
+
+    def run(self):
+        self._socket = socket.create_server((self.host, self.port), backlog=LISTEN_BACKLOG)
+        self.port = self._socket.getsockname()[1]
+        (self._ready_read, self._ready_write) = os.pipe()
+        os.set_blocking(self._ready_read, False)
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_reload)
+        print("[INFO] Listening on http://{}:{} with {} workers of {} threads".format(
+            self.host,
+            self.port,
+            self.workers,
+            self.threads))
+        # Flush before forking, so workers do not print it again.
+        sys.stdout.flush()
+
+        self._spawn_workers()
+        while not self._stopping:
+            select.select([self._ready_read], [], [], POLL_INTERVAL_SECONDS)
+            self._read_ready_workers()
+            self._reap_workers()
+            if self._reload_requested and not self._stopping:
+                self._reload()
+            sys.stdout.flush()
+
+        print("[INFO] Stopping workers.")
+        self._stop_workers()
+        self._socket.close()
+
+        return None
+
+def _parse_arguments():
+    parser = argparse.ArgumentParser(description="Serve the repository API from pre-forked workers.")
+    parser.add_argument("--host", default=repohostutils.DEFAULT_HTTP_HOST_NAME)
+    parser.add_argument("--port", type=int, default=int(repohostutils.DEFAULT_HTTP_PORT_NUMBER))
+    parser.add_argument("--workers", type=int,
+                        default=int(os.environ.get("REPO_API_WORKERS", DEFAULT_WORKERS)),
+                        help="Worker processes.")
+    parser.add_argument("--threads", type=int,
+                        default=osoclientpool.default_pool_size(),
+                        help="Threads serving requests in each worker.")
+    parser.add_argument("--graceful-timeout", type=float,
+                        default=float(os.environ.get("REPO_API_GRACEFUL_TIMEOUT", DEFAULT_GRACEFUL_TIMEOUT_SECONDS)),
+                        help="Seconds a stopping worker waits for the requests in flight.")
+    parser.add_argument("--asgi", action="store_true",
+                        help="Serve repoasgi.py with uvicorn workers (needs gunicorn and uvicorn).")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    arguments = _parse_arguments()
+    # Size the Oso Cloud connection pools to the threads of a worker.
+    os.environ["REPO_API_WORKER_THREADS"] = str(arguments.threads)
+    os.environ.setdefault("REPO_API_ASGI_IO_THREADS", str(arguments.threads))
+
+    if arguments.asgi and gunicorn is None:
+        print("[ERROR] Serving repoasgi.py from workers needs gunicorn, i.e. 'pip install gunicorn uvicorn'.")
+        sys.exit(1)
+
+    (_, application) = _preload(asgi=arguments.asgi)
+    if gunicorn is not None:
+        _run_gunicorn(
+            application,
+            arguments.host,
+            arguments.port,
+            arguments.workers,
+            arguments.threads,
+            arguments.graceful_timeout,
+            asgi=arguments.asgi)
+    else:
+        PreforkServer(
+            application,
+            host=arguments.host,
+            port=arguments.port,
+            workers=arguments.workers,
+            threads=arguments.threads,
+            graceful_timeout_seconds=arguments.graceful_timeout,
+            on_worker_start=_init_worker,
+            on_worker_exit=_shutdown_worker).run()
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+import json
+import os
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import localpolicy
+
+# Facts shared by every worker process through an append-only file.
+#
+# Records are JSON lines of one of two forms:
+#   {"tell": [<predicate>, <arg>, ...]}
+#   {"delete": [<predicate>, <arg>, ...]}
+# A fact holds while it has been told more times than deleted, so two
+# workers telling the same fact and one deleting it leave it in place.
+#
+# Writers append a whole record under an exclusive flock on the file.
+# Every process reads the records appended since its last look before it
+# answers from its own LocalAuthorizer, which costs one stat of the file
+# when nothing changed. The file outlives the processes, so its facts are
+# loaded again after a restart. It is compacted to the facts that still
+# hold once it grows past compact_size_in_bytes; a process seeing it
+# replaced reads it again from the start.
+#
+# Local decisions mode keeps the facts written by /create-repo here, and
+# the write-behind journals keep the facts Oso Cloud has not confirmed
+# yet, so that every worker honors them, not only the one that wrote them.
+
+SHARED_FACTS_DIRECTORY_NAME = ".shared-facts"
+GRANTED_FACTS_FILE_NAME = "granted.log"
+PENDING_FACTS_FILE_NAME = "pending.log"
+
+DEFAULT_COMPACT_SIZE_IN_BYTES = 1024 * 1024
+
+def _fact_key(fact):
+    return json.dumps(fact, sort_keys=True)
+
+class SharedFacts:
+    def __init__(self,
+                 facts_path,
+                 policy,
+                 compact_size_in_bytes=DEFAULT_COMPACT_SIZE_IN_BYTES):
+        self.facts_path = facts_path
+        self.compact_size_in_bytes = compact_size_in_bytes
+        self._authorizer = localpolicy.LocalAuthorizer(policy)
+        # Fact key -> times told minus times deleted, for the facts that hold.
+        self._counts = {}
+        self._inode = None
+        self._offset = 0
+        self._lock = threading.Lock()
+
+        # Create the file, so every process reads the same one.
+        with open(self.facts_path, "a"):
+            pass
+        self.refresh()
+
+    # Called with the lock held.
+    def _apply(self, record):
+        if "tell" in record:
+            fact = record["tell"]
+            key = _fact_key(fact)
+            count = self._counts.get(key, 0)
+            self._counts[key] = count + 1
+            if 0 == count:
+                self._authorizer.tell(*fact)
+        elif "delete" in record:
+            fact = record["delete"]
+            key = _fact_key(fact)
+            count = self._counts.get(key, 0)
+            if 1 == count:
+                del self._counts[key]
+                self._authorizer.delete(*fact)
+            elif count > 1:
+                self._counts[key] = count - 1
+
+        return None
+
+    # Read the records appended by any process since the last refresh.
+    def refresh(self):
+        with self._lock:
+            try:
+                facts_stat = os.stat(self.facts_path)
+            except FileNotFoundError:
+                return None
+            if (facts_stat.st_ino == self._inode and
+                facts_stat.st_size == self._offset):
+                return None
+
+            with open(self.facts_path, "rb") as facts_file:
+                if os.fstat(facts_file.fileno()).st_ino != self._inode:
+                    # Compacted by another process: start over.
+                    self._authorizer.clear_data()
+                    self._counts = {}
+                    self._inode = os.fstat(facts_file.fileno()).st_ino
+                    self._offset = 0
+                facts_file.seek(self._offset)
+                data = facts_file.read()
+
+            # Leave a record still being appended for the next refresh.
+            end = data.rfind(b"\n") + 1
+            for line in data[:end].splitlines():
+                try:
+                    self._apply(json.loads(line))
+                except ValueError:
+                    continue
+            self._offset += end
+
+        return None
+
+    def _append(self, record):
+        while True:
+            with open(self.facts_path, "a") as facts_file:
+                if fcntl is not None:
+                    fcntl.flock(facts_file.fileno(), fcntl.LOCK_EX)
+                    # Compacted while this process waited for the lock.
+                    if os.fstat(facts_file.fileno()).st_ino != os.stat(self.facts_path).st_ino:
+                        continue
+                facts_file.write(json.dumps(record) + "\n")
+                facts_file.flush()
+                if facts_file.tell() >= self.compact_size_in_bytes:
+                    self._compact_locked()
+                break
+
+        self.refresh()
+
+        return None
+
+    # Called while holding the flock of the file. Rewrites it with one tell
+    # per fact that still holds.
+    def _compact_locked(self):
+        counts = {}
+        facts = {}
+        with open(self.facts_path, "rb") as facts_file:
+            for line in facts_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "tell" in record:
+                    key = _fact_key(record["tell"])
+                    counts[key] = counts.get(key, 0) + 1
+                    facts[key] = record["tell"]
+                elif "delete" in record:
+                    key = _fact_key(record["delete"])
+                    if counts.get(key, 0) > 0:
+                        counts[key] -= 1
+
+        temporary_path = "{}.tmp".format(self.facts_path)
+        with open(temporary_path, "w") as facts_file:
+            for (key, count) in counts.items():
+                for _ in range(count):
+                    facts_file.write(json.dumps({"tell": facts[key]}) + "\n")
+        os.replace(temporary_path, self.facts_path)
+
+        return None
+
+    def tell(self, predicate, *args):
+        return self._append({"tell": [predicate] + list(args)})
+
+    def delete(self, predicate, *args):
+        return self._append({"delete": [predicate] + list(args)})
+
+    def authorize(self, actor, action, resource):
+        self.refresh()
+        return self._authorizer.authorize(actor, action, resource)
+
+    def fact_count(self):
+        self.refresh()
+        with self._lock:
+            return len(self._counts)
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+import os
+import sys
+import time
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import authzcache
+import policydefinitions
+
+# Test the expected behavior of the authorization decision cache.
+class AuthorizationCacheTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+
+    def test_hit_and_miss(self):
+        cache = authzcache.AuthorizationCache()
+        permission = policydefinitions.RepositoryPermissions.UPLOAD_FILE
+
+        self.assertIsNone(cache.get("user@test-cache", permission, "test-cache"))
+        cache.put("user@test-cache", permission, "test-cache", True)
+        self.assertTrue(cache.get("user@test-cache", permission, "test-cache"))
+
+        stats = cache.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        return None
+
+    def test_denies_not_cached(self):
+        cache = authzcache.AuthorizationCache()
+        permission = policydefinitions.RepositoryPermissions.UPLOAD_FILE
+
+        # Another worker may grant the role at any time, unseen by this cache.
+        cache.put("user@test-deny", permission, "test-deny", False)
+        self.assertIsNone(cache.get("user@test-deny", permission, "test-deny"))
+        self.assertIsNone(cache.get_stale("user@test-deny", permission, "test-deny"))
+        self.assertEqual(0, cache.stats()["size"])
+        return None
+
+    def test_invalidate_during_lookup(self):
+        cache = authzcache.AuthorizationCache()
+        permission = policydefinitions.RepositoryPermissions.DOWNLOAD_FILE
+
+        # A decision read from Oso Cloud before a fact write for the pair
+        # is not cached when it comes back after it.
+        generation = cache.generation("user@test-race", "test-race")
+        cache.invalidate("user@test-race", "test-race")
+        cache.put("user@test-race", permission, "test-race", True, generation)
+        self.assertIsNone(cache.get("user@test-race", permission, "test-race"))
+
+        # Writes for other pairs do not get in the way.
+        generation = cache.generation("user@test-race", "test-race")
+        cache.invalidate("user@test-race", "other-repo")
+        cache.put("user@test-race", permission, "test-race", True, generation)
+        self.assertTrue(cache.get("user@test-race", permission, "test-race"))
+
+        # Nor does emptying the generation table, except for decisions
+        # read before it.
+        small_cache = authzcache.AuthorizationCache(max_entries=1)
+        generation = small_cache.generation("user@test-race", "test-race")
+        small_cache.invalidate("user@test-race", "repo-0")
+        small_cache.invalidate("user@test-race", "repo-1")
+        small_cache.put("user@test-race", permission, "test-race", True, generation)
+        self.assertIsNone(small_cache.get("user@test-race", permission, "test-race"))
+        small_cache.put("user@test-race", permission, "test-race", True,
+                        small_cache.generation("user@test-race", "test-race"))
+        self.assertTrue(small_cache.get("user@test-race", permission, "test-race"))
+        return None
+
+    def test_lru_eviction(self):
+        cache = authzcache.AuthorizationCache(max_entries=2)
+        permission = policydefinitions.RepositoryPermissions.LIST_DIRECTORIES
+
+        cache.put("user@test-lru", permission, "repo-0", True)
+        cache.put("user@test-lru", permission, "repo-1", True)
+        # Touch repo-0 so that repo-1 becomes the least recently used.
+        cache.get("user@test-lru", permission, "repo-0")
+        cache.put("user@test-lru", permission, "repo-2", True)
+
+        self.assertTrue(cache.get("user@test-lru", permission, "repo-0"))
+        self.assertIsNone(cache.get("user@test-lru", permission, "repo-1"))
+        self.assertEqual(1, cache.stats()["evictions"])
+        return None
+
+    def test_ttl_expiry(self):
+        cache = authzcache.AuthorizationCache(ttl_seconds=0.01)
+        permission = policydefinitions.RepositoryPermissions.DOWNLOAD_FILE
+
+        cache.put("user@test-ttl", permission, "test-ttl", True)
+        time.sleep(0.02)
+        self.assertIsNone(cache.get("user@test-ttl", permission, "test-ttl"))
+        return None
+
+    def test_invalidate_after_grant(self):
+        cache = authzcache.AuthorizationCache()
+        permissions = policydefinitions.RepositoryPermissions
+
+        # Cache an allow for every permission, then write a fact for the pair.
+        for permission in (permissions.LIST_DIRECTORIES,
+                           permissions.CREATE_DIRECTORY,
+                           permissions.DOWNLOAD_FILE,
+                           permissions.UPLOAD_FILE):
+            cache.put("user@test-grant", permission, "test-grant", True)
+        cache.put("user@test-grant", permissions.UPLOAD_FILE, "other-repo", True)
+
+        cache.invalidate("user@test-grant", "test-grant")
+
+        self.assertIsNone(cache.get("user@test-grant", permissions.UPLOAD_FILE, "test-grant"))
+        self.assertTrue(cache.get("user@test-grant", permissions.UPLOAD_FILE, "other-repo"))
+        self.assertEqual(1, cache.stats()["size"])
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
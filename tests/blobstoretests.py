@@ -0,0 +1,100 @@
+#!/usr/bin/python3
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import blobstore
+import fileresponses
+
+def _store_bytes(blob_store, data):
+    (file_descriptor, temporary_path) = blob_store.temporary_file()
+    with os.fdopen(file_descriptor, "wb") as f:
+        writer = blobstore.HashingWriter(f)
+        writer.write(data)
+    return blob_store.commit(temporary_path, writer.hexdigest(), writer.bytes_written)
+
+# Test the expected behavior of the content-addressed blob store.
+class BlobStoreTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.root_directory = tempfile.mkdtemp()
+        self.blob_store = blobstore.BlobStore(
+            os.path.join(self.root_directory, blobstore.BLOB_DIRECTORY_NAME))
+
+    def tearDown(self):
+        shutil.rmtree(self.root_directory)
+
+    def test_identical_contents_are_stored_once(self):
+        first_blob_path = _store_bytes(self.blob_store, b"vendored library")
+        second_blob_path = _store_bytes(self.blob_store, b"vendored library")
+        self.assertEqual(first_blob_path, second_blob_path)
+
+        first_file_path = os.path.join(self.root_directory, "first.bin")
+        second_file_path = os.path.join(self.root_directory, "second.bin")
+        self.blob_store.link(first_blob_path, first_file_path)
+        self.blob_store.link(second_blob_path, second_file_path)
+        self.assertEqual(
+            os.stat(first_file_path).st_ino,
+            os.stat(second_file_path).st_ino)
+        with open(second_file_path, "rb") as f:
+            self.assertEqual(b"vendored library", f.read())
+
+        stats = self.blob_store.stats()
+        self.assertEqual(1, stats["blobs_written"])
+        self.assertEqual(1, stats["blobs_reused"])
+        self.assertEqual(len(b"vendored library"), stats["bytes_deduplicated"])
+        return None
+
+    def test_relinked_file_is_not_older(self):
+        file_path = os.path.join(self.root_directory, "file.txt")
+        old_blob_path = _store_bytes(self.blob_store, b"old")
+        # The blob was stored long ago.
+        os.utime(old_blob_path, (1000000000, 1000000000))
+        self.blob_store.link(old_blob_path, file_path)
+        self.blob_store.link(_store_bytes(self.blob_store, b"new"), file_path)
+        new_last_modified = fileresponses.file_last_modified(os.stat(file_path))
+
+        # Putting the old contents back keeps Last-Modified moving forward,
+        # though the path now shares the old blob's inode and mtime.
+        self.blob_store.link(_store_bytes(self.blob_store, b"old"), file_path)
+        file_stat = os.stat(file_path)
+        self.assertEqual(1000000000, file_stat.st_mtime)
+        self.assertGreaterEqual(fileresponses.file_last_modified(file_stat), new_last_modified)
+        return None
+
+    def test_link_replaces_existing_file(self):
+        file_path = os.path.join(self.root_directory, "file.txt")
+        self.blob_store.link(_store_bytes(self.blob_store, b"old"), file_path)
+        self.blob_store.link(_store_bytes(self.blob_store, b"new"), file_path)
+        with open(file_path, "rb") as f:
+            self.assertEqual(b"new", f.read())
+        return None
+
+    def test_collect_garbage_keeps_linked_blobs(self):
+        linked_blob_path = _store_bytes(self.blob_store, b"linked")
+        unlinked_blob_path = _store_bytes(self.blob_store, b"unlinked")
+        self.blob_store.link(linked_blob_path, os.path.join(self.root_directory, "linked.txt"))
+
+        bytes_freed = self.blob_store.collect_garbage(grace_seconds=-1.0)
+        self.assertEqual(len(b"unlinked"), bytes_freed)
+        self.assertTrue(os.path.exists(linked_blob_path))
+        self.assertFalse(os.path.exists(unlinked_blob_path))
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+import asyncio
+import os
+import sys
+import threading
+import time
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import circuitbreaker
+
+def _fail():
+    raise Exception("Oso Cloud is unavailable.")
+
+# Test the expected behavior of the Oso Cloud circuit breaker.
+class CircuitBreakerTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+
+    def test_opens_after_threshold(self):
+        breaker = circuitbreaker.CircuitBreaker(failure_threshold=2)
+        for _ in range(2):
+            with self.assertRaises(Exception):
+                breaker.call(_fail)
+
+        self.assertEqual(circuitbreaker.STATE_OPEN, breaker.state)
+        with self.assertRaises(circuitbreaker.CircuitOpenError):
+            breaker.call(lambda: True)
+        return None
+
+    def test_half_open_trial_closes(self):
+        breaker = circuitbreaker.CircuitBreaker(
+            failure_threshold=1,
+            reset_timeout_seconds=0.01)
+        with self.assertRaises(Exception):
+            breaker.call(_fail)
+        time.sleep(0.02)
+
+        self.assertEqual(circuitbreaker.STATE_HALF_OPEN, breaker.state)
+        self.assertTrue(breaker.call(lambda: True))
+        self.assertEqual(circuitbreaker.STATE_CLOSED, breaker.state)
+        return None
+
+    def test_slow_call_times_out(self):
+        release = threading.Event()
+        breaker = circuitbreaker.CircuitBreaker(call_timeout_seconds=0.01)
+        with self.assertRaises(circuitbreaker.CallTimeoutError):
+            breaker.call(release.wait)
+        release.set()
+        return None
+
+    def test_rejects_when_all_workers_are_busy(self):
+        release = threading.Event()
+        breaker = circuitbreaker.CircuitBreaker(
+            call_timeout_seconds=0.01,
+            max_concurrent_calls=1)
+        with self.assertRaises(circuitbreaker.CallTimeoutError):
+            breaker.call(release.wait)
+        # The slow call still holds the only worker.
+        with self.assertRaises(circuitbreaker.CircuitOpenError):
+            breaker.call(lambda: True)
+        release.set()
+        return None
+
+    def test_busy_workers_do_not_open_the_breaker(self):
+        started = threading.Event()
+        release = threading.Event()
+        breaker = circuitbreaker.CircuitBreaker(
+            failure_threshold=2,
+            call_timeout_seconds=5.0,
+            max_concurrent_calls=1)
+
+        def slow_backend():
+            started.set()
+            return release.wait()
+
+        slow_call = threading.Thread(target=breaker.call, args=(slow_backend,))
+        slow_call.start()
+        self.addCleanup(slow_call.join)
+        self.addCleanup(release.set)
+        started.wait(5.0)
+
+        # A burst of calls refused locally never reached the backend.
+        for _ in range(5):
+            with self.assertRaises(circuitbreaker.CircuitOpenError):
+                breaker.call(lambda: True)
+        stats = breaker.stats()
+        self.assertEqual(circuitbreaker.STATE_CLOSED, stats["state"])
+        self.assertEqual(0, stats["failures"])
+        self.assertEqual(5, stats["rejections"])
+
+        release.set()
+        slow_call.join()
+        self.assertTrue(breaker.call(lambda: True))
+        return None
+
+    def test_async_calls(self):
+        breaker = circuitbreaker.CircuitBreaker(
+            failure_threshold=1,
+            call_timeout_seconds=0.01)
+
+        async def allowed():
+            return True
+
+        self.assertTrue(asyncio.run(breaker.call_async(allowed)))
+        with self.assertRaises(circuitbreaker.CallTimeoutError):
+            asyncio.run(breaker.call_async(asyncio.sleep, 1))
+        with self.assertRaises(circuitbreaker.CircuitOpenError):
+            asyncio.run(breaker.call_async(allowed))
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import compressioncache
+
+# Test the expected behavior of the compressed download cache.
+class CompressionCacheTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, "source.txt")
+        self.file_data = b"print('hello world')\n" * 1000
+        with open(self.file_path, "wb") as f:
+            f.write(self.file_data)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_compressible_mimetypes(self):
+        self.assertTrue(compressioncache.is_compressible("text/x-python"))
+        self.assertTrue(compressioncache.is_compressible("application/json"))
+        self.assertTrue(compressioncache.is_compressible("application/vnd.api+json"))
+        self.assertFalse(compressioncache.is_compressible("image/png"))
+        self.assertFalse(compressioncache.is_compressible(None))
+        return None
+
+    def _open_variant(self, cache, etag):
+        with open(self.file_path, "rb") as source_file:
+            variant_file = cache.open_variant(source_file, etag, compressioncache.ENCODING_GZIP)
+        self.addCleanup(variant_file.close)
+        return variant_file
+
+    def test_file_is_compressed_once(self):
+        cache = compressioncache.CompressionCache(os.path.join(self.directory, "cache"))
+        variant_file = self._open_variant(cache, "etag-1")
+        self.assertEqual(variant_file.name, self._open_variant(cache, "etag-1").name)
+        with gzip.open(variant_file, "rb") as f:
+            self.assertEqual(self.file_data, f.read())
+
+        stats = cache.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertLess(stats["compression_ratio"], 0.1)
+        return None
+
+    def test_least_recently_served_variant_is_evicted(self):
+        cache = compressioncache.CompressionCache(os.path.join(self.directory, "cache"))
+        first_variant_path = self._open_variant(cache, "etag-1").name
+        cache.max_bytes = os.path.getsize(first_variant_path) + 1
+        second_variant_path = self._open_variant(cache, "etag-2").name
+
+        self.assertFalse(os.path.exists(first_variant_path))
+        self.assertTrue(os.path.exists(second_variant_path))
+        self.assertEqual(1, cache.stats()["evictions"])
+        return None
+
+    def test_variants_survive_a_restart(self):
+        cache_directory = os.path.join(self.directory, "cache")
+        self._open_variant(compressioncache.CompressionCache(cache_directory), "etag-1")
+
+        cache = compressioncache.CompressionCache(cache_directory)
+        self.assertEqual(1, cache.stats()["variants"])
+        self._open_variant(cache, "etag-1")
+        self.assertEqual(1, cache.stats()["hits"])
+        return None
+
+    def test_size_is_bounded_across_processes(self):
+        cache_directory = os.path.join(self.directory, "cache")
+        # Two workers sharing the cache directory.
+        cache = compressioncache.CompressionCache(cache_directory)
+        other_cache = compressioncache.CompressionCache(cache_directory)
+        variant_file = self._open_variant(cache, "etag-1")
+        variant_size = os.path.getsize(variant_file.name)
+        other_cache.max_bytes = variant_size + 1
+
+        self._open_variant(other_cache, "etag-2")
+        self.assertFalse(os.path.exists(variant_file.name))
+        self.assertEqual(variant_size, other_cache.stats()["bytes"])
+        self.assertEqual(variant_size, cache.stats()["bytes"])
+
+        # A variant evicted while it is being sent is still read whole, and
+        # the next request writes it again.
+        with gzip.open(variant_file, "rb") as f:
+            self.assertEqual(self.file_data, f.read())
+        self._open_variant(cache, "etag-1")
+        self.assertEqual(2, cache.stats()["misses"])
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
@@ -0,0 +1,85 @@
+#!/usr/bin/python3
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import directorylisting
+
+# Test the expected behavior of the bounded-memory directory walks.
+class DirectoryListingTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.root_directory = tempfile.mkdtemp()
+        # a/ a/x/ a/x/deep.txt a/y.txt b/ c.txt .upload-partial
+        for directory_path in ("a/x", "b"):
+            os.makedirs(os.path.join(self.root_directory, directory_path))
+        for file_path in ("a/x/deep.txt", "a/y.txt", "c.txt", ".upload-partial"):
+            with open(os.path.join(self.root_directory, file_path), "w") as f:
+                f.write("data")
+
+    def tearDown(self):
+        shutil.rmtree(self.root_directory)
+
+    def _all_pages(self, page_size, **options):
+        paths = []
+        cursor = None
+        while True:
+            (entries, cursor) = directorylisting.page_entries(
+                self.root_directory,
+                page_size,
+                cursor=cursor,
+                **options)
+            self.assertLessEqual(len(entries), page_size)
+            paths.extend(entry[0] for entry in entries)
+            if cursor is None:
+                return paths
+
+    def test_walk_lists_directories_only_by_default(self):
+        entries = list(directorylisting.walk_entries(self.root_directory))
+        self.assertEqual(
+            ["a", "b"],
+            sorted(relative_path for (relative_path, _, _) in entries))
+        return None
+
+    def test_walk_respects_depth_and_files(self):
+        entries = list(directorylisting.walk_entries(
+            self.root_directory,
+            max_depth=2,
+            include_files=True))
+        self.assertEqual(
+            ["a", "a/x", "a/y.txt", "b", "c.txt"],
+            sorted(relative_path for (relative_path, _, _) in entries))
+        self.assertIn(("c.txt", directorylisting.ENTRY_TYPE_FILE, 4), entries)
+        return None
+
+    def test_pages_cover_the_tree_in_order(self):
+        expected_paths = ["a", "a/x", "a/x/deep.txt", "a/y.txt", "b", "c.txt"]
+        for page_size in (1, 2, 4, 100):
+            self.assertEqual(
+                expected_paths,
+                self._all_pages(page_size, max_depth=directorylisting.MAX_DEPTH, include_files=True))
+        self.assertEqual(["a", "b"], self._all_pages(1))
+        return None
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(directorylisting.InvalidCursorError):
+            directorylisting.page_entries(self.root_directory, 10, cursor="not base64!")
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
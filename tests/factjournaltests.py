@@ -0,0 +1,188 @@
+#!/usr/bin/python3
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import factjournal
+import localpolicy
+import sharedfacts
+
+from policydefinitions import RepositoryPermissions, RepositoryRoles
+
+# Records the facts sent in bulk, failing the first `failures` calls and
+# rejecting, as the oso_cloud client does, any batch with a fact in
+# `rejected_facts`.
+class _RecordingOsoClient:
+    def __init__(self, failures=0, rejected_facts=()):
+        self.failures = failures
+        self.rejected_facts = [list(fact) for fact in rejected_facts]
+        self.batches = []
+
+    def bulk_tell(self, facts):
+        if self.failures > 0:
+            self.failures -= 1
+            raise Exception("Oso Cloud is unavailable.")
+        if any(fact in self.rejected_facts for fact in facts):
+            raise Exception("Got unexpected error from Oso Service: 400\n{\"message\": \"Invalid fact.\"}")
+        self.batches.append(facts)
+
+def _has_role_fact(index):
+    test_user = {
+        "type": "User",
+        "id": "user@test-journal-{}".format(index)
+    }
+    test_user_repo = {
+        "type": "Repository",
+        "id": "test-journal-{}".format(index)
+    }
+    return ("has_role", test_user, RepositoryRoles.OWNER, test_user_repo)
+
+# Test the expected behavior of the write-behind fact journal.
+class FactJournalTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.journal_directory = tempfile.mkdtemp()
+        self.journal_path = os.path.join(self.journal_directory, factjournal.JOURNAL_FILE_NAME)
+        self.policy = localpolicy.load_policy_file("policy.polar")
+
+    def tearDown(self):
+        shutil.rmtree(self.journal_directory)
+
+    def test_pending_fact_is_honored(self):
+        journal = factjournal.FactJournal(self.journal_path, _RecordingOsoClient(), self.policy)
+        (_, test_user, _, test_user_repo) = _has_role_fact(0)
+        self.assertFalse(journal.pending_allows(
+            test_user,
+            RepositoryPermissions.UPLOAD_FILE,
+            test_user_repo))
+
+        journal.append(*_has_role_fact(0))
+        self.assertTrue(journal.pending_allows(
+            test_user,
+            RepositoryPermissions.UPLOAD_FILE,
+            test_user_repo))
+
+        # Once confirmed, the decision is left to Oso Cloud.
+        journal.flush_once()
+        self.assertFalse(journal.pending_allows(
+            test_user,
+            RepositoryPermissions.UPLOAD_FILE,
+            test_user_repo))
+        journal.close()
+        return None
+
+    def test_pending_fact_is_shared(self):
+        shared_pending_path = os.path.join(self.journal_directory, sharedfacts.PENDING_FACTS_FILE_NAME)
+        journals = [
+            factjournal.FactJournal(
+                os.path.join(self.journal_directory, factjournal.journal_file_name(worker_slot)),
+                _RecordingOsoClient(),
+                self.policy,
+                shared_pending=sharedfacts.SharedFacts(shared_pending_path, self.policy))
+            for worker_slot in range(2)
+        ]
+        (_, test_user, _, test_user_repo) = _has_role_fact(0)
+
+        # Appended by one worker, honored by the other one too.
+        journals[0].append(*_has_role_fact(0))
+        self.assertTrue(journals[1].pending_allows(
+            test_user,
+            RepositoryPermissions.UPLOAD_FILE,
+            test_user_repo))
+
+        journals[0].flush_once()
+        self.assertFalse(journals[1].pending_allows(
+            test_user,
+            RepositoryPermissions.UPLOAD_FILE,
+            test_user_repo))
+        for journal in journals:
+            journal.close()
+        return None
+
+    def test_flush_in_order_with_retry(self):
+        oso_client = _RecordingOsoClient(failures=1)
+        journal = factjournal.FactJournal(
+            self.journal_path,
+            oso_client,
+            self.policy,
+            max_batch_size=2,
+            min_retry_delay_seconds=0.01)
+        for index in range(5):
+            journal.append(*_has_role_fact(index))
+
+        journal.start()
+        deadline = time.monotonic() + 5
+        while journal.pending_count() > 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        journal.close(timeout_seconds=5)
+
+        sent_facts = [fact for batch in oso_client.batches for fact in batch]
+        self.assertEqual([list(_has_role_fact(index)) for index in range(5)], sent_facts)
+        self.assertEqual(0, journal.pending_count())
+        return None
+
+    def test_rejected_fact_is_dead_lettered(self):
+        oso_client = _RecordingOsoClient(rejected_facts=[_has_role_fact(1)])
+        journal = factjournal.FactJournal(self.journal_path, oso_client, self.policy)
+        for index in range(3):
+            journal.append(*_has_role_fact(index))
+
+        # The facts around the rejected one still get through, in order.
+        self.assertEqual(2, journal.flush_once())
+        self.assertEqual([[list(_has_role_fact(0))], [list(_has_role_fact(2))]], oso_client.batches)
+        self.assertEqual(0, journal.pending_count())
+        self.assertEqual(1, journal.stats()["rejected"])
+        journal.close()
+
+        with open(factjournal.dead_letter_path(self.journal_path)) as dead_letter_file:
+            records = [json.loads(line) for line in dead_letter_file]
+        self.assertEqual([(2, list(_has_role_fact(1)))], [(record["seq"], record["fact"]) for record in records])
+        self.assertIn("400", records[0]["error"])
+
+        # Nothing is sent again after a restart.
+        journal = factjournal.FactJournal(self.journal_path, _RecordingOsoClient(), self.policy)
+        self.assertEqual(0, journal.pending_count())
+        journal.close()
+
+        # Transport errors and 5xx responses are retried; throttling too.
+        self.assertFalse(factjournal.is_rejection(Exception("Oso Cloud is unavailable.")))
+        self.assertFalse(factjournal.is_rejection(Exception("Got unexpected error from Oso Service: 503\n")))
+        self.assertFalse(factjournal.is_rejection(Exception("Got unexpected error from Oso Service: 429\n")))
+        return None
+
+    def test_replay_unconfirmed_facts(self):
+        journal = factjournal.FactJournal(self.journal_path, _RecordingOsoClient(), self.policy)
+        for index in range(3):
+            journal.append(*_has_role_fact(index))
+        # Confirm only the first fact, then "crash".
+        journal.max_batch_size = 1
+        journal.flush_once()
+        journal.close(timeout_seconds=0)
+
+        oso_client = _RecordingOsoClient()
+        journal = factjournal.FactJournal(self.journal_path, oso_client, self.policy)
+        self.assertEqual(2, journal.pending_count())
+        journal.flush_once()
+        self.assertEqual([[list(_has_role_fact(1)), list(_has_role_fact(2))]], oso_client.batches)
+        journal.close()
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
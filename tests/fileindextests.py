@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import fileindex
+
+# Test the expected behavior of the per-repository file metadata index.
+class FileIndexTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.root_directory = tempfile.mkdtemp()
+        self.file_indexes = fileindex.FileIndexes(
+            os.path.join(self.root_directory, fileindex.INDEX_DIRECTORY_NAME))
+
+    def tearDown(self):
+        self.file_indexes.close()
+        shutil.rmtree(self.root_directory)
+
+    def _write_repo_file(self, file_path, file_data):
+        full_file_path = os.path.join(self.root_directory, "user", "repo", file_path)
+        os.makedirs(os.path.dirname(full_file_path), exist_ok=True)
+        with open(full_file_path, "wb") as f:
+            f.write(file_data)
+        return full_file_path
+
+    def test_put_and_get(self):
+        full_file_path = self._write_repo_file("docs/readme.txt", b"hello")
+        with self.file_indexes.repo_index("user", "repo") as repo_index:
+            repo_index.put(fileindex.make_record(
+                "./docs/readme.txt",
+                os.stat(full_file_path),
+                fileindex.hash_file(full_file_path)))
+
+            file_record = repo_index.get("docs/readme.txt")
+            self.assertEqual(5, file_record.size)
+            self.assertEqual("text/plain", file_record.mimetype)
+            self.assertEqual(
+                "2cf24dba5fb0a30e26e83b2ac5b9e29e1b161e5c1fa7425e73043362938b9824",
+                file_record.content_hash)
+            self.assertIsNone(repo_index.get("docs/missing.txt"))
+        return None
+
+    def test_rebuild_from_disk(self):
+        self._write_repo_file("a.json", b"{}")
+        self._write_repo_file("lib/b.bin", b"\x00\x01")
+        self._write_repo_file("lib/.upload-partial", b"\x00")
+        with self.file_indexes.repo_index("user", "repo") as repo_index:
+            repo_index.put(fileindex.FileRecord("stale.txt", 1, 0, 0, None, "text/plain"))
+
+            self.assertEqual(2, repo_index.rebuild(os.path.join(self.root_directory, "user", "repo")))
+            self.assertEqual(
+                ["a.json", "lib/b.bin"],
+                [file_record.file_path for file_record in repo_index.records()])
+            self.assertEqual("application/json", repo_index.get("a.json").mimetype)
+        return None
+
+    def test_index_is_persisted(self):
+        full_file_path = self._write_repo_file("a.txt", b"a")
+        with self.file_indexes.repo_index("user", "repo") as repo_index:
+            repo_index.put(fileindex.make_record(
+                "a.txt",
+                os.stat(full_file_path),
+                None))
+        self.file_indexes.close()
+
+        self.file_indexes = fileindex.FileIndexes(self.file_indexes.root_directory)
+        with self.file_indexes.repo_index("user", "repo") as repo_index:
+            self.assertEqual(1, repo_index.get("a.txt").size)
+        return None
+
+    def test_evicted_index_stays_open_while_in_use(self):
+        self.file_indexes.close()
+        self.file_indexes = fileindex.FileIndexes(
+            self.file_indexes.root_directory,
+            max_open_indexes=1)
+
+        with self.file_indexes.repo_index("user", "repo") as repo_index:
+            # Opening another repository's index evicts this one.
+            with self.file_indexes.repo_index("user", "other-repo") as other_repo_index:
+                self.assertIsNone(other_repo_index.get("a.txt"))
+            self.assertIsNone(repo_index.get("a.txt"))
+
+        # It is closed once the last thread using it is done.
+        with self.assertRaises(sqlite3.ProgrammingError):
+            repo_index.get("a.txt")
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
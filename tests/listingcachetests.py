@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import listingcache
+
+# Test the expected behavior of the directory listing cache.
+class ListingCacheTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.directory = tempfile.mkdtemp()
+        self.cache = listingcache.ListingCache(max_entries=2, racy_seconds=0.0)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_hit_after_put(self):
+        directory_stat = os.stat(self.directory)
+        self.assertIsNone(self.cache.get("user", "repo", "./a", directory_stat))
+        self.cache.put("user", "repo", "./a", directory_stat, ["a/b"])
+        self.assertEqual(["a/b"], self.cache.get("user", "repo", "a", directory_stat))
+
+        stats = self.cache.stats()
+        self.assertEqual(1, stats["hits"])
+        self.assertEqual(1, stats["misses"])
+        self.assertEqual(0.5, stats["hit_ratio"])
+        return None
+
+    def test_changed_directory_is_a_miss(self):
+        self.cache.put("user", "repo", ".", os.stat(self.directory), [])
+        os.utime(self.directory, ns=(0, 1))
+        self.assertIsNone(self.cache.get("user", "repo", ".", os.stat(self.directory)))
+        self.assertEqual(1, self.cache.stats()["stale"])
+        return None
+
+    def test_invalidate_path_drops_ancestors(self):
+        directory_stat = os.stat(self.directory)
+        self.cache.put("user", "repo", ".", directory_stat, ["a"])
+        self.cache.put("user", "repo", "a", directory_stat, ["a/b"])
+        self.cache.invalidate_path("user", "repo", "a/b/c")
+        self.assertIsNone(self.cache.get("user", "repo", ".", directory_stat))
+        self.assertIsNone(self.cache.get("user", "repo", "a", directory_stat))
+        self.assertEqual(2, self.cache.stats()["invalidations"])
+        return None
+
+    def test_recently_modified_directory_is_not_cached(self):
+        cache = listingcache.ListingCache(racy_seconds=60.0)
+        directory_stat = os.stat(self.directory)
+        cache.put("user", "repo", ".", directory_stat, [])
+        self.assertIsNone(cache.get("user", "repo", ".", directory_stat))
+        return None
+
+    def test_least_recently_used_listing_is_evicted(self):
+        directory_stat = os.stat(self.directory)
+        for directory_path in ("a", "b", "c"):
+            self.cache.put("user", "repo", directory_path, directory_stat, [])
+        self.assertIsNone(self.cache.get("user", "repo", "a", directory_stat))
+        self.assertEqual([], self.cache.get("user", "repo", "c", directory_stat))
+        self.assertEqual(1, self.cache.stats()["evictions"])
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
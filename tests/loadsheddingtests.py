@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+import asyncio
+import io
+import os
+import sys
+import threading
+import time
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import loadshedding
+
+from loadshedding import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
+
+# Stands in for a server's wsgi.file_wrapper.
+class _FileWrapper:
+    def __init__(self, file_object, block_size=8192):
+        self.file_object = file_object
+        self.close = file_object.close
+
+    def __iter__(self):
+        return iter(lambda: self.file_object.read(8192), b"")
+
+class _Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+# Test admission control and priority load shedding.
+class LoadSheddingFunctionalTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.clock = _Clock()
+
+    def _controller(self, **kwargs):
+        return loadshedding.AdmissionController(clock=self.clock, **kwargs)
+
+    # Starts admitting a request to route on a thread. Returns the list
+    # the outcome is appended to: "admitted", or the LoadShedError.
+    def _admit_in_thread(self, admission_controller, route):
+        outcomes = []
+
+        def admit():
+            try:
+                admission_controller.admit(route)
+                outcomes.append("admitted")
+            except loadshedding.LoadShedError as e:
+                outcomes.append(e)
+
+        thread = threading.Thread(target=admit)
+        thread.start()
+        self.addCleanup(thread.join)
+        return (outcomes, thread)
+
+    def _wait_for_queued(self, admission_controller, count):
+        deadline = time.monotonic() + 5.0
+        while sum(admission_controller.stats()["queued"].values()) < count:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+
+    def test_parse_route_priorities(self):
+        self.assertEqual(
+            loadshedding.parse_route_priorities("/download-file=low, create-repo=high"),
+            {"download-file": PRIORITY_LOW, "create-repo": PRIORITY_HIGH})
+        self.assertEqual(loadshedding.parse_route_priorities(""), {})
+        with self.assertRaises(ValueError):
+            loadshedding.parse_route_priorities("upload-file=urgent")
+
+        admission_controller = self._controller(
+            max_in_flight=1,
+            route_priorities={"download-file": PRIORITY_LOW})
+        self.assertEqual(admission_controller.priority_of("/list-directories"), PRIORITY_HIGH)
+        self.assertEqual(admission_controller.priority_of("/upload-archive"), PRIORITY_LOW)
+        self.assertEqual(admission_controller.priority_of("/download-file"), PRIORITY_LOW)
+        self.assertEqual(admission_controller.priority_of("/create-repo"), PRIORITY_NORMAL)
+
+    def test_waiting_requests_admitted_by_priority(self):
+        admission_controller = self._controller(max_in_flight=1)
+        admission_controller.admit("/create-repo")
+
+        (low_outcomes, low_thread) = self._admit_in_thread(admission_controller, "/upload-file")
+        self._wait_for_queued(admission_controller, 1)
+        (high_outcomes, high_thread) = self._admit_in_thread(admission_controller, "/list-directories")
+        self._wait_for_queued(admission_controller, 2)
+
+        # The freed slot goes to the high priority request that came last.
+        admission_controller.release()
+        high_thread.join(5.0)
+        self.assertEqual(high_outcomes, ["admitted"])
+        self.assertEqual(low_outcomes, [])
+
+        admission_controller.release()
+        low_thread.join(5.0)
+        self.assertEqual(low_outcomes, ["admitted"])
+
+        admission_controller.release()
+        stats = admission_controller.stats()
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(stats["admitted"], {PRIORITY_HIGH: 1, PRIORITY_NORMAL: 1, PRIORITY_LOW: 1})
+
+    def test_full_queue_sheds_lower_priority_first(self):
+        admission_controller = self._controller(max_in_flight=1, max_queued=1)
+        admission_controller.admit("/create-repo")
+
+        (low_outcomes, low_thread) = self._admit_in_thread(admission_controller, "/upload-archive")
+        self._wait_for_queued(admission_controller, 1)
+
+        # The high priority request takes the low priority one's place.
+        (high_outcomes, high_thread) = self._admit_in_thread(admission_controller, "/list-directories")
+        low_thread.join(5.0)
+        self.assertIsInstance(low_outcomes[0], loadshedding.LoadShedError)
+
+        # With only high priority requests waiting, the next one is refused.
+        with self.assertRaises(loadshedding.LoadShedError):
+            admission_controller.admit("/list-directories")
+
+        admission_controller.release()
+        high_thread.join(5.0)
+        self.assertEqual(high_outcomes, ["admitted"])
+        self.assertEqual(admission_controller.stats()["shed"], {PRIORITY_HIGH: 1, PRIORITY_NORMAL: 0, PRIORITY_LOW: 1})
+
+    def test_queueing_delay_sheds_by_class(self):
+        admission_controller = self._controller(
+            max_in_flight=1,
+            target_queue_delay_seconds=0.1,
+            max_queue_delay_seconds=30.0)
+        admission_controller.admit("/create-repo")
+        (outcomes, thread) = self._admit_in_thread(admission_controller, "/list-directories")
+        self._wait_for_queued(admission_controller, 1)
+
+        # Nothing got through for two measurement intervals, so the queue
+        # stands at the age of its oldest request.
+        self.clock.now += loadshedding.MEASUREMENT_INTERVAL_SECONDS
+        self.assertEqual(admission_controller.stats()["standing_queue_delay_seconds"], 0.0)
+        self.clock.now += 0.3
+        self.assertEqual(admission_controller.stats()["standing_queue_delay_seconds"], 0.0)
+        self.clock.now += loadshedding.MEASUREMENT_INTERVAL_SECONDS
+        self.assertAlmostEqual(
+            admission_controller.stats()["standing_queue_delay_seconds"],
+            2 * loadshedding.MEASUREMENT_INTERVAL_SECONDS + 0.3)
+
+        # 2.3 seconds is above both the low (0.1) and normal (0.5) budgets.
+        with self.assertRaises(loadshedding.LoadShedError) as context:
+            admission_controller.admit("/upload-file")
+        self.assertGreater(context.exception.retry_after_seconds, 2.0)
+        with self.assertRaises(loadshedding.LoadShedError):
+            admission_controller.admit("/create-directory")
+
+        admission_controller.release()
+        thread.join(5.0)
+        self.assertEqual(outcomes, ["admitted"])
+        admission_controller.release()
+
+        # Once requests get through without waiting, the delay drops again.
+        self.clock.now += loadshedding.MEASUREMENT_INTERVAL_SECONDS
+        admission_controller.admit("/list-directories")
+        admission_controller.release()
+        self.clock.now += loadshedding.MEASUREMENT_INTERVAL_SECONDS
+        self.assertEqual(admission_controller.stats()["standing_queue_delay_seconds"], 0.0)
+        admission_controller.admit("/upload-file")
+        admission_controller.release()
+
+    def test_waiting_request_times_out(self):
+        admission_controller = self._controller(max_in_flight=1, max_queue_delay_seconds=0.05)
+        admission_controller.admit("/create-repo")
+        with self.assertRaises(loadshedding.LoadShedError):
+            admission_controller.admit("/create-directory")
+
+        stats = admission_controller.stats()
+        self.assertEqual(stats["queued"][PRIORITY_NORMAL], 0)
+        self.assertEqual(stats["shed"][PRIORITY_NORMAL], 1)
+
+    def test_admit_async(self):
+        admission_controller = self._controller(max_in_flight=1)
+        admission_controller.admit("/create-repo")
+
+        async def admit_when_released():
+            asyncio.get_running_loop().call_later(0.05, threading.Thread(
+                target=admission_controller.release).start)
+            await admission_controller.admit_async("/download-file")
+
+        asyncio.run(admit_when_released())
+        self.assertEqual(admission_controller.stats()["in_flight"], 1)
+        self.assertEqual(admission_controller.stats()["admitted"][PRIORITY_NORMAL], 2)
+
+    def test_middleware(self):
+        admission_controller = self._controller(max_in_flight=1, max_queue_delay_seconds=0.01)
+
+        def application(environ, start_response):
+            start_response("200 OK", [("Content-Length", "2")])
+            return [b"ok"]
+
+        middleware = loadshedding.AdmissionMiddleware(application, admission_controller)
+        statuses = []
+
+        def start_response(status, headers):
+            statuses.append((status, dict(headers)))
+
+        # The slot is held until the response is closed.
+        response = middleware({"PATH_INFO": "/upload-file"}, start_response)
+        self.assertEqual(b"".join(response), b"ok")
+        self.assertEqual(middleware({"PATH_INFO": "/upload-file"}, start_response), [b""])
+        self.assertTrue(statuses[1][0].startswith("503"))
+        self.assertEqual(statuses[1][1]["Retry-After"], "1")
+
+        response.close()
+        self.assertEqual(admission_controller.stats()["in_flight"], 0)
+
+    def test_middleware_keeps_file_wrapper(self):
+        admission_controller = self._controller(max_in_flight=1)
+
+        def application(environ, start_response):
+            start_response("200 OK", [("Content-Length", "4")])
+            return environ["wsgi.file_wrapper"](io.BytesIO(b"data"))
+
+        middleware = loadshedding.AdmissionMiddleware(application, admission_controller)
+        response = middleware(
+            {"PATH_INFO": "/download-file", "wsgi.file_wrapper": _FileWrapper},
+            lambda status, headers: None)
+
+        # The server still gets its own file wrapper, so it can sendfile it,
+        # and closing it frees the slot.
+        self.assertIsInstance(response, _FileWrapper)
+        self.assertEqual(b"".join(response), b"data")
+        self.assertEqual(admission_controller.stats()["in_flight"], 1)
+        response.close()
+        self.assertEqual(admission_controller.stats()["in_flight"], 0)
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
@@ -0,0 +1,116 @@
+#!/usr/bin/python3
+import os
+import sys
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import localpolicy
+import osoclientpool
+
+from policydefinitions import RepositoryPermissions, RepositoryRoles
+
+_ALL_ROLES = (
+    RepositoryRoles.OWNER,
+    RepositoryRoles.ADMIN,
+    RepositoryRoles.GUEST
+)
+
+_ALL_PERMISSIONS = (
+    RepositoryPermissions.LIST_DIRECTORIES,
+    RepositoryPermissions.CREATE_DIRECTORY,
+    RepositoryPermissions.DOWNLOAD_FILE,
+    RepositoryPermissions.UPLOAD_FILE
+)
+
+# The decisions Oso Cloud makes for policy.polar (see policytests.py).
+_EXPECTED_ROLE_PERMISSIONS = {
+    RepositoryRoles.OWNER: set(_ALL_PERMISSIONS),
+    RepositoryRoles.ADMIN: set(_ALL_PERMISSIONS),
+    RepositoryRoles.GUEST: {
+        RepositoryPermissions.LIST_DIRECTORIES,
+        RepositoryPermissions.DOWNLOAD_FILE
+    }
+}
+
+def _test_objects(role):
+    test_user = {
+        "type": "User",
+        "id": "user@test-local-role-{}".format(role)
+    }
+    test_user_repo = {
+        "type": "Repository",
+        "id": "test-local-role-{}".format(role)
+    }
+    return (test_user, test_user_repo)
+
+# Test that local evaluation of policy.polar matches Oso Cloud.
+class LocalPolicyFunctionalTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.local_authorizer = localpolicy.LocalAuthorizer.from_policy_file("policy.polar")
+
+    def test_role_permission_table(self):
+        table = self.local_authorizer.policy.role_permission_table("Repository")
+        for role in _ALL_ROLES:
+            self.assertEqual(_EXPECTED_ROLE_PERMISSIONS[role], set(table[role]))
+        return None
+
+    def test_every_role_permission_pair(self):
+        for role in _ALL_ROLES:
+            (test_user, test_user_repo) = _test_objects(role)
+            self.local_authorizer.tell("has_role", test_user, role, test_user_repo)
+            for permission in _ALL_PERMISSIONS:
+                self.assertEqual(
+                    permission in _EXPECTED_ROLE_PERMISSIONS[role],
+                    self.local_authorizer.authorize(test_user, permission, test_user_repo))
+        return None
+
+    def test_no_role_is_denied(self):
+        (test_user, test_user_repo) = _test_objects("none")
+        for permission in _ALL_PERMISSIONS:
+            self.assertFalse(self.local_authorizer.authorize(
+                test_user,
+                permission,
+                test_user_repo))
+        return None
+
+    def test_role_on_other_repo_is_denied(self):
+        (test_user, test_user_repo) = _test_objects(RepositoryRoles.OWNER)
+        self.local_authorizer.tell("has_role", test_user, RepositoryRoles.OWNER, test_user_repo)
+        other_repo = {
+            "type": "Repository",
+            "id": "test-local-other-repo"
+        }
+        self.assertFalse(self.local_authorizer.authorize(
+            test_user,
+            RepositoryPermissions.LIST_DIRECTORIES,
+            other_repo))
+        return None
+
+    @unittest.skipUnless(os.environ.get("OSO_AUTH"), "requires an Oso Cloud API key")
+    def test_parity_with_oso_cloud(self):
+        oso_client = osoclientpool.get_shared_client()
+        for role in _ALL_ROLES:
+            (test_user, test_user_repo) = _test_objects(role)
+            oso_client.tell("has_role", test_user, role, test_user_repo)
+            self.local_authorizer.tell("has_role", test_user, role, test_user_repo)
+            for permission in _ALL_PERMISSIONS:
+                self.assertEqual(
+                    oso_client.authorize(test_user, permission, test_user_repo),
+                    self.local_authorizer.authorize(test_user, permission, test_user_repo))
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+import asyncio
+import glob
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import metrics
+
+# Returns {sample: value} of the samples in a Prometheus text exposition.
+def _parse_samples(text):
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            (name, value) = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+# Stands in for a server's wsgi.file_wrapper.
+class _FileWrapper:
+    def __init__(self, file_object, block_size=8192):
+        self.file_object = file_object
+        self.close = file_object.close
+
+    def __iter__(self):
+        return iter(lambda: self.file_object.read(8192), b"")
+
+# Test request timing, the Prometheus rendering and the aggregation of
+# the metrics of several processes.
+class MetricsFunctionalTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.registry = metrics.MetricsRegistry()
+        self.shared_metrics = metrics.SharedMetrics(self.registry, tempfile.mkdtemp())
+
+    def test_render(self):
+        self.registry.inc("repo_api_requests_total", {"route": "create-repo", "method": "POST", "status": "200"})
+        self.registry.inc("repo_api_errors_total", {"route": "create-repo", "class": "Quote\"Error"}, 2)
+        self.registry.observe("repo_api_request_duration_seconds", {"route": "create-repo"}, 0.003)
+        self.registry.observe("repo_api_request_duration_seconds", {"route": "create-repo"}, 60.0)
+        text = metrics.render([self.registry.snapshot()])
+
+        self.assertIn("# TYPE repo_api_request_duration_seconds histogram", text)
+        samples = _parse_samples(text)
+        self.assertEqual(samples['repo_api_requests_total{method="POST",route="create-repo",status="200"}'], 1)
+        self.assertEqual(samples['repo_api_errors_total{class="Quote\\"Error",route="create-repo"}'], 2)
+        self.assertEqual(samples['repo_api_request_duration_seconds_bucket{route="create-repo",le="0.0025"}'], 0)
+        self.assertEqual(samples['repo_api_request_duration_seconds_bucket{route="create-repo",le="0.005"}'], 1)
+        self.assertEqual(samples['repo_api_request_duration_seconds_bucket{route="create-repo",le="30.0"}'], 1)
+        self.assertEqual(samples['repo_api_request_duration_seconds_bucket{route="create-repo",le="+Inf"}'], 2)
+        self.assertEqual(samples['repo_api_request_duration_seconds_count{route="create-repo"}'], 2)
+        self.assertAlmostEqual(samples['repo_api_request_duration_seconds_sum{route="create-repo"}'], 60.003)
+
+    def test_timed_stages(self):
+        @metrics.timed_stage(metrics.STAGE_AUTHORIZATION)
+        def authorize(nested):
+            if nested:
+                # Counted once, by the outer call.
+                authorize(False)
+            return True
+
+        @metrics.timed_stage(metrics.STAGE_AUTHORIZATION)
+        async def authorize_async():
+            return authorize(True)
+
+        request_timer = metrics.RequestTimer("download-file", "GET")
+        token = metrics.start_request(request_timer)
+        try:
+            self.assertTrue(authorize(True))
+            self.assertTrue(asyncio.run(authorize_async()))
+            metrics.record_error(PermissionError("denied"))
+        finally:
+            metrics.end_request(token)
+
+        # Outside a request nothing is recorded.
+        self.assertTrue(authorize(True))
+        self.assertGreater(request_timer.stage_seconds[metrics.STAGE_AUTHORIZATION], 0.0)
+        self.assertEqual(request_timer.errors, ["PermissionError"])
+
+        self.registry.record_request(request_timer)
+        samples = _parse_samples(metrics.render([self.registry.snapshot()]))
+        for stage in (metrics.STAGE_QUEUE, metrics.STAGE_AUTHORIZATION, metrics.STAGE_FILESYSTEM, metrics.STAGE_RESPONSE):
+            self.assertEqual(samples['repo_api_request_stage_duration_seconds_count{{route="download-file",stage="{}"}}'.format(stage)], 1)
+        self.assertEqual(samples['repo_api_errors_total{class="PermissionError",route="download-file"}'], 1)
+        self.assertEqual(samples['repo_api_requests_total{method="GET",route="download-file",status="None"}'], 1)
+
+    def test_middleware(self):
+        @metrics.timed_stage(metrics.STAGE_AUTHORIZATION)
+        def authorize():
+            return True
+
+        def application(environ, start_response):
+            environ["wsgi.input"].read()
+            authorize()
+            if "/download-file" == environ["PATH_INFO"]:
+                start_response("200 OK", [("Content-Length", "4")])
+                return environ["wsgi.file_wrapper"](io.BytesIO(b"data"))
+            start_response("201 CREATED", [])
+            return [b"created", b"!"]
+
+        middleware = metrics.MetricsMiddleware(application, self.registry, ["upload-file", "download-file"])
+
+        def call(method, path, body):
+            environ = {
+                "REQUEST_METHOD": method,
+                "PATH_INFO": path,
+                "wsgi.input": io.BytesIO(body),
+                "wsgi.file_wrapper": _FileWrapper
+            }
+            response = middleware(environ, lambda status, headers, *args: None)
+            return (response, b"".join(response))
+
+        (response, body) = call("PUT", "/upload-file", b"uploaded")
+        self.assertEqual(body, b"created!")
+        response.close()
+
+        # File bodies reach the server as they are, so it can sendfile them.
+        (response, body) = call("GET", "/download-file", b"")
+        self.assertIsInstance(response, _FileWrapper)
+        self.assertEqual(body, b"data")
+        response.close()
+
+        call("GET", "/../etc/passwd", b"")[0].close()
+
+        samples = _parse_samples(metrics.render([self.registry.snapshot()]))
+        self.assertEqual(samples['repo_api_requests_total{method="PUT",route="upload-file",status="201"}'], 1)
+        self.assertEqual(samples['repo_api_requests_total{method="GET",route="download-file",status="200"}'], 1)
+        self.assertEqual(samples['repo_api_requests_total{method="GET",route="other",status="201"}'], 1)
+        self.assertEqual(samples['repo_api_received_bytes_total{route="upload-file"}'], 8)
+        self.assertEqual(samples['repo_api_sent_bytes_total{route="upload-file"}'], 8)
+        self.assertEqual(samples['repo_api_sent_bytes_total{route="download-file"}'], 4)
+        self.assertEqual(samples['repo_api_request_stage_duration_seconds_count{route="upload-file",stage="authorization"}'], 1)
+
+    def test_aggregated_across_processes(self):
+        self.registry.add_collector(lambda: [
+            ("repo_api_cache_hits_total", {"cache": "listing"}, 3),
+            ("repo_api_in_flight_requests", {}, 2)
+        ])
+        self.registry.inc("repo_api_requests_total", {"route": "create-repo", "method": "POST", "status": "200"})
+
+        pid = os.fork()
+        if 0 == pid:
+            # The child serves one more request, writes its metrics and exits.
+            exit_code = 1
+            try:
+                self.registry.inc("repo_api_requests_total", {"route": "create-repo", "method": "POST", "status": "200"})
+                self.shared_metrics.flush()
+                exit_code = 0
+            finally:
+                os._exit(exit_code)
+        (_, status) = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+        samples = _parse_samples(self.shared_metrics.render())
+        # The parent's one request, plus the two the child had counted.
+        self.assertEqual(samples['repo_api_requests_total{method="POST",route="create-repo",status="200"}'], 3)
+        self.assertEqual(samples['repo_api_cache_hits_total{cache="listing"}'], 6)
+        # Gauges are only reported for running processes.
+        self.assertEqual(samples['repo_api_in_flight_requests{{pid="{}"}}'.format(os.getpid())], 2)
+        self.assertNotIn('repo_api_in_flight_requests{{pid="{}"}}'.format(pid), samples)
+
+        # Once the child is retired its file is gone, but not its counts,
+        # and a new process reusing its pid starts from zero.
+        self.shared_metrics.retire(pid)
+        self.assertNotIn("{}.json".format(pid), os.listdir(self.shared_metrics.directory))
+        with open("{}/{}.json".format(self.shared_metrics.directory, pid), "w") as metrics_file:
+            json.dump(metrics.MetricsRegistry().snapshot(), metrics_file)
+        samples = _parse_samples(self.shared_metrics.render())
+        self.assertEqual(samples['repo_api_requests_total{method="POST",route="create-repo",status="200"}'], 3)
+        self.assertEqual(samples['repo_api_cache_hits_total{cache="listing"}'], 6)
+
+        self.shared_metrics.clear()
+        samples = _parse_samples(metrics.render([]))
+        self.assertEqual(samples, {})
+
+    def test_flush_in_background(self):
+        self.shared_metrics.start()
+        self.registry.inc("repo_api_requests_total", {"route": "create-repo", "method": "POST", "status": "200"})
+        self.shared_metrics.stop()
+
+        file_names = glob.glob("{}/*.json".format(self.shared_metrics.directory))
+        self.assertEqual(file_names, ["{}/{}.json".format(self.shared_metrics.directory, os.getpid())])
+
+        # An exiting worker moves its counters to the retired totals.
+        self.shared_metrics.stop(retire=True)
+        file_names = glob.glob("{}/*.json".format(self.shared_metrics.directory))
+        self.assertEqual(file_names, ["{}/{}".format(self.shared_metrics.directory, metrics.RETIRED_FILE_NAME)])
+        samples = _parse_samples(self.shared_metrics.render())
+        self.assertEqual(samples['repo_api_requests_total{method="POST",route="create-repo",status="200"}'], 1)
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+import hashlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import multipartuploads
+
+# Test the expected behavior of the multipart upload sessions.
+class MultipartUploadsTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.directory = tempfile.mkdtemp()
+        self.upload_sessions = multipartuploads.UploadSessions(self.directory)
+        self.session = self.upload_sessions.start("user", "repo", "docs", "big.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _assemble(self, expected_parts=None):
+        with self.upload_sessions.completing(self.session, expected_parts) as parts_stream:
+            return parts_stream.read(-1) + parts_stream.read(-1) + parts_stream.read(-1)
+
+    def test_parts_are_joined_in_order(self):
+        self.upload_sessions.put_part(self.session, 2, io.BytesIO(b"world"))
+        self.upload_sessions.put_part(self.session, 1, io.BytesIO(b"hello "))
+        self.assertEqual(
+            [1, 2],
+            [upload_part.part_number for upload_part in self.upload_sessions.parts(self.session)])
+        self.assertEqual(b"hello world", self._assemble())
+        # The session is gone once completed.
+        with self.assertRaises(multipartuploads.UploadSessionNotFoundError):
+            self.upload_sessions.get(self.session.upload_id, "user", "repo")
+        return None
+
+    def test_checksums(self):
+        checksum = hashlib.sha256(b"part").hexdigest()
+        upload_part = self.upload_sessions.put_part(self.session, 1, io.BytesIO(b"part"), checksum=checksum)
+        self.assertEqual(checksum, upload_part.checksum)
+        with self.assertRaises(multipartuploads.MultipartUploadError):
+            self.upload_sessions.put_part(self.session, 2, io.BytesIO(b"damaged"), checksum=checksum)
+        self.assertEqual(1, len(self.upload_sessions.parts(self.session)))
+        return None
+
+    def test_part_uploaded_again_replaces_the_earlier_one(self):
+        self.upload_sessions.put_part(self.session, 1, io.BytesIO(b"first"))
+        time.sleep(0.01)
+        upload_part = self.upload_sessions.put_part(self.session, 1, io.BytesIO(b"second"))
+        self.assertEqual([upload_part], self.upload_sessions.parts(self.session))
+        part_file_names = [
+            file_name for file_name in os.listdir(os.path.join(self.directory, self.session.upload_id))
+            if not file_name.startswith(".") and multipartuploads.SESSION_FILE_NAME != file_name
+        ]
+        self.assertEqual(1, len(part_file_names))
+        self.assertEqual(b"second", self._assemble())
+        return None
+
+    def test_failed_completion_keeps_the_session(self):
+        self.upload_sessions.put_part(self.session, 1, io.BytesIO(b"a"))
+        with self.assertRaises(multipartuploads.MultipartUploadError):
+            self._assemble([(1, None), (2, None)])
+        with self.assertRaises(multipartuploads.MultipartUploadError):
+            self._assemble([(1, "0" * 64)])
+
+        # The client can resume and complete.
+        self.upload_sessions.put_part(self.session, 2, io.BytesIO(b"b"))
+        self.assertEqual(b"ab", self._assemble([(1, None), (2, None)]))
+        return None
+
+    def test_sessions_belong_to_their_repository(self):
+        with self.assertRaises(multipartuploads.UploadSessionNotFoundError):
+            self.upload_sessions.get(self.session.upload_id, "user", "other-repo")
+        with self.assertRaises(multipartuploads.UploadSessionNotFoundError):
+            self.upload_sessions.get("../../etc", "user", "repo")
+        return None
+
+    def test_part_size_limit(self):
+        with self.assertRaises(multipartuploads.PartTooLargeError):
+            self.upload_sessions.put_part(self.session, 1, io.BytesIO(b"x" * 10), max_bytes=5)
+        self.assertEqual([], self.upload_sessions.parts(self.session))
+        return None
+
+    def test_abandoned_sessions_are_collected(self):
+        active_session = self.upload_sessions.start("user", "repo", ".", "active.bin")
+        session_directory = os.path.join(self.directory, self.session.upload_id)
+        old_time = time.time() - 2 * multipartuploads.DEFAULT_MAX_AGE_SECONDS
+        os.utime(session_directory, (old_time, old_time))
+
+        self.assertEqual(1, self.upload_sessions.collect_garbage())
+        self.assertFalse(os.path.exists(session_directory))
+        self.upload_sessions.get(active_session.upload_id, "user", "repo")
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
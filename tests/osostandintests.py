@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+import os
+import requests
+import sys
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import osostandin
+
+from policydefinitions import RepositoryPermissions, RepositoryRoles
+
+_standin_server = None
+
+def _api_url(route):
+    return "{}/api/{}".format(_standin_server.url, route)
+
+def _has_role_fact(username, role, repo_name):
+    return {
+        "predicate": "has_role",
+        "args": [
+            {"type": "User", "id": username},
+            {"type": "String", "id": role},
+            {"type": "Repository", "id": repo_name}
+        ]
+    }
+
+def _authorize(username, permission, repo_name):
+    http_response = requests.post(_api_url("authorize"), json={
+        "actor_type": "User",
+        "actor_id": username,
+        "action": permission,
+        "resource_type": "Repository",
+        "resource_id": repo_name,
+        "context_facts": []
+    })
+    http_response.raise_for_status()
+    return http_response.json()["allowed"]
+
+# Test the Oso Cloud stand-in through its HTTP API.
+class OsoStandinFunctionalTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        requests.post(_api_url("clear_data")).raise_for_status()
+
+    def test_tell_and_authorize(self):
+        requests.post(
+            _api_url("facts"),
+            json=_has_role_fact("user@test-standin", RepositoryRoles.GUEST, "test-standin")
+        ).raise_for_status()
+
+        self.assertTrue(_authorize(
+            "user@test-standin",
+            RepositoryPermissions.DOWNLOAD_FILE,
+            "test-standin"))
+        self.assertFalse(_authorize(
+            "user@test-standin",
+            RepositoryPermissions.UPLOAD_FILE,
+            "test-standin"))
+        return None
+
+    def test_bulk_load_and_get(self):
+        facts = [
+            _has_role_fact("user@test-standin-bulk", RepositoryRoles.OWNER, "repo-{}".format(index))
+            for index in range(3)
+        ]
+        requests.post(_api_url("bulk_load"), json=facts).raise_for_status()
+
+        http_response = requests.get(_api_url("facts"), params={
+            "predicate": "has_role",
+            "args.2.type": "Repository",
+            "args.2.id": "repo-1"
+        })
+        self.assertEqual([facts[1]], http_response.json())
+        return None
+
+    def test_authorize_resources(self):
+        requests.post(
+            _api_url("facts"),
+            json=_has_role_fact("user@test-standin-resources", RepositoryRoles.ADMIN, "repo-0")
+        ).raise_for_status()
+
+        http_response = requests.post(_api_url("authorize_resources"), json={
+            "actor_type": "User",
+            "actor_id": "user@test-standin-resources",
+            "action": RepositoryPermissions.UPLOAD_FILE,
+            "resources": [
+                {"type": "Repository", "id": "repo-0"},
+                {"type": "Repository", "id": "repo-1"}
+            ],
+            "context_facts": []
+        })
+        self.assertEqual(
+            [{"type": "Repository", "id": "repo-0"}],
+            http_response.json()["results"])
+        return None
+
+    def test_policy_rejected_by_stored_facts(self):
+        requests.post(
+            _api_url("facts"),
+            json=_has_role_fact("user@test-standin-policy", RepositoryRoles.GUEST, "test-standin-policy")
+        ).raise_for_status()
+        policy_string = requests.get(_api_url("policy")).json()["policy"]["src"]
+
+        # A policy without the "guest" role cannot hold the stored fact.
+        http_response = requests.post(_api_url("policy"), json={
+            "filename": "policy.polar",
+            "src": policy_string.replace(
+                'roles = ["owner", "admin", "guest"];',
+                'roles = ["owner", "admin"];').replace(
+                '"list_directories" if "guest";', "").replace(
+                '"download_file" if "guest";', "")
+        })
+        self.assertEqual(400, http_response.status_code)
+
+        # The old policy and every fact are still in place.
+        self.assertEqual(policy_string, requests.get(_api_url("policy")).json()["policy"]["src"])
+        self.assertTrue(_authorize(
+            "user@test-standin-policy",
+            RepositoryPermissions.DOWNLOAD_FILE,
+            "test-standin-policy"))
+        return None
+
+    def test_injected_errors(self):
+        _standin_server.faults.error_rate = 1.0
+        try:
+            http_response = requests.post(_api_url("clear_data"))
+        finally:
+            _standin_server.faults.error_rate = 0.0
+        self.assertEqual(500, http_response.status_code)
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Start the stand-in on a free port for the duration of the tests.
+        _standin_server = osostandin.start_standin_server(policy_file_name="policy.polar")
+
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
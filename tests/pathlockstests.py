@@ -0,0 +1,106 @@
+#!/usr/bin/python3
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import pathlocks
+
+def _hold_lock(root_directory, key, locked_event, release_event):
+    path_locks = pathlocks.PathLocks(root_directory)
+    with path_locks.locked(key):
+        locked_event.set()
+        release_event.wait(10)
+
+# Test the expected behavior of the per-path write locks.
+class PathLocksTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.directory = tempfile.mkdtemp()
+        self.path_locks = pathlocks.PathLocks(self.directory)
+
+    def tearDown(self):
+        self.path_locks.close()
+        shutil.rmtree(self.directory)
+
+    def test_threads_take_turns(self):
+        holders = []
+        overlaps = []
+
+        def write(number):
+            with self.path_locks.locked("user/repo/file.txt"):
+                if holders:
+                    overlaps.append(number)
+                holders.append(number)
+                time.sleep(0.01)
+                holders.remove(number)
+
+        threads = [threading.Thread(target=write, args=(number,)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], overlaps)
+        self.assertEqual(8, self.path_locks.stats()["acquisitions"])
+        self.assertGreater(self.path_locks.stats()["contentions"], 0)
+        return None
+
+    def test_several_paths_at_once(self):
+        keys = ["user/repo/{}".format(number) for number in range(50)]
+        with self.path_locks.locked(*keys):
+            pass
+        with self.path_locks.locked(*reversed(keys)):
+            pass
+        return None
+
+    @unittest.skipIf(pathlocks.fcntl is None, "fcntl is not available")
+    def test_processes_take_turns(self):
+        context = multiprocessing.get_context("fork")
+        locked_event = context.Event()
+        release_event = context.Event()
+        process = context.Process(
+            target=_hold_lock,
+            args=(self.directory, "user/repo/file.txt", locked_event, release_event))
+        process.start()
+        try:
+            self.assertTrue(locked_event.wait(10))
+
+            acquired = threading.Event()
+            def write():
+                with self.path_locks.locked("user/repo/file.txt"):
+                    acquired.set()
+            thread = threading.Thread(target=write)
+            thread.start()
+            self.assertFalse(acquired.wait(0.2))
+
+            # Other paths are not held up.
+            with self.path_locks.locked("user/repo/other.txt"):
+                pass
+
+            release_event.set()
+            self.assertTrue(acquired.wait(10))
+            thread.join()
+        finally:
+            release_event.set()
+            process.join()
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
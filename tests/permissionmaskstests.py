@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+import os
+import sys
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import localpolicy
+import permissionmasks
+
+from policydefinitions import RepositoryPermissions, RepositoryRoles
+
+# Test the compiled bitmask form of the Repository roles and permissions.
+class PermissionMaskTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        policy = localpolicy.load_policy_file("policy.polar")
+        self.role_permissions = policy.role_permission_table("Repository")
+        self.model = permissionmasks.compile_repository_model(self.role_permissions)
+
+    def test_one_bit_per_permission(self):
+        bits = list(self.model.permission_bits.values())
+        self.assertEqual(len(permissionmasks.REPOSITORY_PERMISSIONS), len(bits))
+        for bit in bits:
+            self.assertEqual(1, bin(bit).count("1"))
+        self.assertEqual(len(bits), len(set(bits)))
+        return None
+
+    def test_owner_inherits_admin(self):
+        self.assertEqual(
+            self.model.role_masks[RepositoryRoles.ADMIN],
+            self.model.role_masks[RepositoryRoles.OWNER])
+        return None
+
+    def test_grant_table_matches_role_permissions(self):
+        grant_table = permissionmasks.GrantTable(self.model)
+        for role in permissionmasks.REPOSITORY_ROLES:
+            grant_table.grant("user@test-mask-{}".format(role), role, "test-mask")
+
+        for role in permissionmasks.REPOSITORY_ROLES:
+            for permission in permissionmasks.REPOSITORY_PERMISSIONS:
+                self.assertEqual(
+                    permission in self.role_permissions[role],
+                    grant_table.check("user@test-mask-{}".format(role), permission, "test-mask"))
+        return None
+
+    def test_revoke(self):
+        grant_table = permissionmasks.GrantTable(self.model)
+        grant_table.grant("user@test-revoke", RepositoryRoles.GUEST, "test-revoke")
+        grant_table.grant("user@test-revoke", RepositoryRoles.ADMIN, "test-revoke")
+        grant_table.revoke("user@test-revoke", RepositoryRoles.ADMIN, "test-revoke")
+
+        self.assertEqual({RepositoryRoles.GUEST}, grant_table.roles("user@test-revoke", "test-revoke"))
+        self.assertFalse(grant_table.check(
+            "user@test-revoke",
+            RepositoryPermissions.UPLOAD_FILE,
+            "test-revoke"))
+        self.assertTrue(grant_table.check(
+            "user@test-revoke",
+            RepositoryPermissions.DOWNLOAD_FILE,
+            "test-revoke"))
+
+        # Revoking the last role removes the grant, and the user with it.
+        grant_table.grant("user@test-revoke", RepositoryRoles.GUEST, "test-revoke-other")
+        self.assertEqual(2, len(grant_table))
+        grant_table.revoke("user@test-revoke", RepositoryRoles.GUEST, "test-revoke")
+        grant_table.revoke("user@test-revoke", RepositoryRoles.GUEST, "test-revoke-other")
+        self.assertEqual(0, len(grant_table))
+        self.assertFalse(grant_table.check(
+            "user@test-revoke",
+            RepositoryPermissions.DOWNLOAD_FILE,
+            "test-revoke"))
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
@@ -1,11 +1,11 @@
 #!/usr/bin/python3
 import os
-import oso_cloud
 import sys
 import unittest
 
 # Make sure to call all the tests from the parent directory.
 sys.path.append(os.getcwd())
+import osoclientpool
 import osoenvconfig
 import policydefinitions
 
@@ -149,10 +149,7 @@ if __name__ == "__main__":
         osoenvconfig.load_policy("policy.polar")
 
         # Authenticate the connection to Oso Cloud.
-        host_api_key = os.environ.get("OSO_AUTH")
-        _oso_client = oso_cloud.Oso(
-            url="https://cloud.osohq.com",
-            api_key=host_api_key)
+        _oso_client = osoclientpool.get_shared_client()
 
         # Run the tests.
         unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/python3
+import os
+import sys
+import tempfile
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import ratelimits
+
+from ratelimits import RateLimit
+
+# Test the shared token buckets and the per-user limits built on them.
+class RateLimitsFunctionalTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.database_path = os.path.join(tempfile.mkdtemp(), ratelimits.BUCKETS_FILE_NAME)
+        self.token_buckets = ratelimits.TokenBuckets(self.database_path)
+        self.addCleanup(self.token_buckets.close)
+
+    def test_parse_rate_limits(self):
+        self.assertEqual(ratelimits.parse_rate_limit("10/50"), RateLimit(10.0, 50.0))
+        self.assertEqual(ratelimits.parse_rate_limit("0.5"), RateLimit(0.5, 1.0))
+        self.assertEqual(
+            ratelimits.parse_rate_limits("upload-file=2/4, create-repo=1"),
+            {"upload-file": RateLimit(2.0, 4.0), "create-repo": RateLimit(1.0, 1.0)})
+        self.assertEqual(ratelimits.parse_rate_limits(""), {})
+        for text in ("fast", "0", "-1/5", "10/0"):
+            with self.assertRaises(ratelimits.RateLimitError):
+                ratelimits.parse_rate_limit(text)
+        with self.assertRaises(ratelimits.RateLimitError):
+            ratelimits.parse_rate_limits("upload-file")
+
+    def test_burst_and_refill(self):
+        rate_limit = RateLimit(2.0, 3.0)
+        for _ in range(3):
+            self.assertEqual(self.token_buckets.acquire([("a", rate_limit, 1)], now=100.0), 0.0)
+        self.assertAlmostEqual(self.token_buckets.acquire([("a", rate_limit, 1)], now=100.0), 0.5)
+
+        # Half a second refills one token.
+        self.assertEqual(self.token_buckets.acquire([("a", rate_limit, 1)], now=100.5), 0.0)
+        self.assertGreater(self.token_buckets.acquire([("a", rate_limit, 1)], now=100.5), 0.0)
+
+        # Other keys have buckets of their own.
+        self.assertEqual(self.token_buckets.acquire([("b", rate_limit, 1)], now=100.5), 0.0)
+        self.assertEqual(self.token_buckets.stats()["limited"], 2)
+
+    def test_all_or_nothing(self):
+        wide_limit = RateLimit(1.0, 10.0)
+        narrow_limit = RateLimit(1.0, 1.0)
+        self.assertEqual(self.token_buckets.acquire(
+            [("wide", wide_limit, 1), ("narrow", narrow_limit, 1)],
+            now=100.0), 0.0)
+        self.assertAlmostEqual(self.token_buckets.acquire(
+            [("wide", wide_limit, 1), ("narrow", narrow_limit, 1)],
+            now=100.0), 1.0)
+
+        # The refused request took nothing from the wide bucket.
+        for _ in range(9):
+            self.assertEqual(self.token_buckets.acquire([("wide", wide_limit, 1)], now=100.0), 0.0)
+        self.assertGreater(self.token_buckets.acquire([("wide", wide_limit, 1)], now=100.0), 0.0)
+
+    def test_byte_debt(self):
+        # 1000 bytes per second, bursts of 2000.
+        rate_limiter = ratelimits.RateLimiter(
+            self.token_buckets,
+            upload_byte_limit=RateLimit(1000.0, 2000.0))
+        self.assertEqual(rate_limiter.admit("user", "upload-file", uploads=True), 0.0)
+
+        # A 5000 byte upload leaves the bucket 3000 bytes short, so the
+        # next upload waits about three seconds.
+        rate_limiter.charge_upload("user", 5000)
+        retry_after_seconds = rate_limiter.admit("user", "upload-file", uploads=True)
+        self.assertGreater(retry_after_seconds, 2.5)
+        self.assertLessEqual(retry_after_seconds, 3.0)
+
+        # Downloads and other users are not held back.
+        self.assertEqual(rate_limiter.admit("user", "download-file"), 0.0)
+        self.assertEqual(rate_limiter.admit("other", "upload-file", uploads=True), 0.0)
+
+    def test_user_and_route_limits(self):
+        rate_limiter = ratelimits.RateLimiter(
+            self.token_buckets,
+            user_limit=RateLimit(0.001, 3.0),
+            route_limits={"upload-file": RateLimit(0.001, 1.0)})
+        self.assertEqual(rate_limiter.admit("user", "upload-file"), 0.0)
+        self.assertGreater(rate_limiter.admit("user", "upload-file"), 0.0)
+
+        # The route limit does not hold back other routes, but the
+        # user's overall limit counts every request.
+        self.assertEqual(rate_limiter.admit("user", "download-file"), 0.0)
+        self.assertEqual(rate_limiter.admit("user", "download-file"), 0.0)
+        self.assertGreater(rate_limiter.admit("user", "download-file"), 0.0)
+
+    def test_database_errors_fail_open(self):
+        # A database that cannot be opened, like one that stays locked.
+        token_buckets = ratelimits.TokenBuckets(os.path.join(
+            os.path.dirname(self.database_path),
+            "missing",
+            ratelimits.BUCKETS_FILE_NAME))
+        rate_limiter = ratelimits.RateLimiter(
+            token_buckets,
+            user_limit=RateLimit(0.001, 1.0),
+            upload_byte_limit=RateLimit(0.001, 1.0))
+        self.assertEqual(rate_limiter.admit("user", "upload-file", uploads=True), 0.0)
+        self.assertEqual(rate_limiter.admit("user", "upload-file", uploads=True), 0.0)
+        rate_limiter.charge_upload("user", 100)
+        self.assertEqual(rate_limiter.errors, 3)
+
+    def test_shared_between_processes(self):
+        rate_limit = RateLimit(0.001, 2.0)
+        self.assertEqual(self.token_buckets.acquire([("shared", rate_limit, 1)]), 0.0)
+
+        pid = os.fork()
+        if 0 == pid:
+            # The child reopens the database and sees the parent's bucket.
+            exit_code = 1
+            try:
+                if 0.0 == self.token_buckets.acquire([("shared", rate_limit, 1)]):
+                    exit_code = 0
+            finally:
+                os._exit(exit_code)
+        (_, status) = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+
+        other_token_buckets = ratelimits.TokenBuckets(self.database_path)
+        self.addCleanup(other_token_buckets.close)
+        self.assertGreater(other_token_buckets.acquire([("shared", rate_limit, 1)]), 0.0)
+
+    def test_full_buckets_are_purged(self):
+        rate_limit = RateLimit(1.0, 1.0)
+        self.token_buckets.acquire([("old", rate_limit, 1)], now=100.0)
+        self.assertEqual(self.token_buckets.stats()["buckets"], 1)
+
+        # Long after "old" refilled, the next write removes it.
+        self.token_buckets.acquire(
+            [("new", rate_limit, 1)],
+            now=100.0 + ratelimits.PURGE_INTERVAL_SECONDS + 1)
+        self.assertEqual(self.token_buckets.stats()["buckets"], 1)
+
+if __name__ == "__main__":
+    try:
+        unittest.main()
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
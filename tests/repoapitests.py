@@ -1,15 +1,23 @@
 #!/usr/bin/python3
+import concurrent.futures
+import hashlib
+import io
+import json
 import os
 import requests
+import stat
 import sys
+import tarfile
 import time
 import unittest
+import zipfile
 
 # Make sure to call all the tests from the parent directory.
 sys.path.append(os.getcwd())
 import repohostutils
 
 from repohostutils import ApiParameterKeys
+from repohostutils import ApiResponseKeys
 from repohostutils import HttpResponseCode
 
 
@@ -79,6 +87,20 @@ class RepoAccessFunctionalTests(unittest.TestCase):
             http_response.status_code)
         return None
 
+    def test_create_repo_in_host_data_directory(self):
+        # Usernames starting with "." could name the host's own data
+        # directories (i.e. ".blobs") and expose them through the repo routes.
+        for username in (".blobs", ".oso-facts", "."):
+            http_response = _HelperFunctions.create_repo(
+                username,
+                "test-host-data"
+            )
+
+            self.assertEqual(
+                HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST,
+                http_response.status_code)
+        return None
+
     def test_create_directory(self):
         # Create a repo for the test.
         # The user will own the associated repository specified in the request.
@@ -212,6 +234,100 @@ class RepoAccessFunctionalTests(unittest.TestCase):
             HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED,
             http_response.status_code)
 
+    def test_concurrent_appends(self):
+        username = "user@test-concurrent-appends"
+        repo_name = "test-concurrent-appends"
+        _HelperFunctions.create_repo(
+            username,
+            repo_name
+        )
+        api_request_url = repohostutils.localhost_api_endpoint("/upload-file")
+        content_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.FILE_NAME: "log.txt",
+            ApiParameterKeys.WRITE_MODE: "ab"
+        }
+        lines = ["line {:02d}\n".format(number).encode("utf-8") * 1000 for number in range(16)]
+
+        def append(line):
+            return requests.put(api_request_url, params=content_data, data=line)
+
+        # Every append lands, whole, whatever the interleaving.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+            http_responses = list(executor.map(append, lines))
+        for http_response in http_responses:
+            self.assertEqual(
+                HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED,
+                http_response.status_code)
+        full_file_path = repohostutils.get_file_path(username, repo_name, "log.txt")
+        with open(full_file_path, "rb") as f:
+            file_data = f.read()
+        self.assertEqual(sum(len(line) for line in lines), len(file_data))
+        for line in lines:
+            self.assertIn(line, file_data)
+        # Written through a temporary file, with the permissions of a new file.
+        self.assertEqual(repohostutils.NEW_FILE_MODE, stat.S_IMODE(os.stat(full_file_path).st_mode))
+        return None
+
+    def test_authorize_batch(self):
+        # Create a repo for the test.
+        # The user will own the associated repository specified in the request.
+        username = "user@test-authorize-batch"
+        repo_name = "test-authorize-batch"
+        http_response = _HelperFunctions.create_repo(
+            username,
+            repo_name
+        )
+
+        # Check every permission on the owned repo and on a repo the
+        # user has no role on. The owned repo is checked twice.
+        other_repo_name = "test-authorize-batch-other"
+        permissions = [
+            "list_directories",
+            "create_directory",
+            "download_file",
+            "upload_file"
+        ]
+        checks = []
+        for checked_repo_name in (repo_name, other_repo_name, repo_name):
+            for permission in permissions:
+                checks.append({
+                    ApiParameterKeys.USERNAME: username,
+                    ApiParameterKeys.PERMISSION: permission,
+                    ApiParameterKeys.REPO_NAME: checked_repo_name
+                })
+
+        # Create the API Request URL
+        api_request_url = repohostutils.localhost_api_endpoint("/authorize-batch")
+
+        # Form the HTTP request.
+        http_headers = {
+            'Content-Type': "application/json",
+        }
+        content_data = {
+            ApiParameterKeys.CHECKS: checks
+        }
+        http_response = requests.post(
+            api_request_url,
+            headers=http_headers,
+            json=content_data
+        )
+
+        # Validate a successful HTTP response from the server.
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+            http_response.status_code)
+
+        # The decisions are returned in the order of the checks.
+        decisions = http_response.json().get('decisions')
+        self.assertEqual(len(checks), len(decisions))
+        for (check, decision) in zip(checks, decisions):
+            self.assertEqual(
+                check[ApiParameterKeys.REPO_NAME] == repo_name,
+                decision.get('allowed'))
+        return None
+
     def test_download_file(self):
         # Create a repo for the test.
         # The user will own the associated repository specified in the request.
@@ -268,8 +384,569 @@ class RepoAccessFunctionalTests(unittest.TestCase):
         self.assertEqual(
             HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
             http_response.status_code)
+
+        # A file removed behind the API's back is not found, even though
+        # the file index still has a record of it from its upload.
+        http_response = requests.put(
+            repohostutils.localhost_api_endpoint("/upload-file"),
+            headers={'Content-Type': "application/octet-stream"},
+            params={
+                ApiParameterKeys.USERNAME: username,
+                ApiParameterKeys.REPO_NAME: repo_name,
+                ApiParameterKeys.FILE_NAME: repo_file_name,
+                ApiParameterKeys.DIRECTORY_PATH: repo_directory_path,
+                ApiParameterKeys.WRITE_MODE: "wb"
+            },
+            data=test_file_content.encode('utf-8')
+        )
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED,
+            http_response.status_code)
+        os.remove(repohostutils.get_file_path(username, repo_name, repo_file_name))
+        http_response = requests.get(
+            api_request_url,
+            headers=http_headers,
+            json=content_data
+        )
+        self.assertEqual(
+            HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND,
+            http_response.status_code)
         return None
 
+    def test_download_file_range(self):
+        username = "user@test-download-file-range"
+        repo_name = "test-download-file-range"
+        _HelperFunctions.create_repo(
+            username,
+            repo_name
+        )
+
+        repo_file_name = "test-file.txt"
+        test_file_content = "0123456789abcdefghij"
+        repohostutils.write_file(
+            username=username,
+            repo_name=repo_name,
+            directory_path=".",
+            file_name=repo_file_name,
+            file_data=test_file_content
+        )
+
+        api_request_url = repohostutils.localhost_api_endpoint("/download-file")
+        content_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.FILE_PATH: repo_file_name
+        }
+
+        # A single range is answered with 206 and just those bytes.
+        http_response = requests.get(
+            api_request_url,
+            headers={"Range": "bytes=5-9"},
+            json=content_data
+        )
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_206_PARTIAL_CONTENT,
+            http_response.status_code)
+        self.assertEqual("56789", http_response.content.decode('utf-8'))
+        self.assertEqual("bytes 5-9/20", http_response.headers.get("Content-Range"))
+
+        # A suffix range and several ranges at once.
+        http_response = requests.get(
+            api_request_url,
+            headers={"Range": "bytes=-3"},
+            json=content_data
+        )
+        self.assertEqual("hij", http_response.content.decode('utf-8'))
+
+        http_response = requests.get(
+            api_request_url,
+            headers={"Range": "bytes=0-1,10-11"},
+            json=content_data
+        )
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_206_PARTIAL_CONTENT,
+            http_response.status_code)
+        self.assertTrue(http_response.headers.get("Content-Type").startswith("multipart/byteranges"))
+        self.assertIn(b"Content-Range: bytes 10-11/20\r\n\r\nab\r\n", http_response.content)
+
+        # If-Range with a stale validator returns the whole file.
+        http_response = requests.get(
+            api_request_url,
+            headers={"Range": "bytes=5-9", "If-Range": '"stale-etag"'},
+            json=content_data
+        )
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+            http_response.status_code)
+        self.assertEqual(test_file_content, http_response.content.decode('utf-8'))
+
+        # A range past the end of the file cannot be satisfied.
+        http_response = requests.get(
+            api_request_url,
+            headers={"Range": "bytes=100-"},
+            json=content_data
+        )
+        self.assertEqual(
+            HttpResponseCode.CLIENT_ERROR_RESPONSE_416_RANGE_NOT_SATISFIABLE,
+            http_response.status_code)
+        self.assertEqual("bytes */20", http_response.headers.get("Content-Range"))
+        return None
+
+    def test_conditional_requests(self):
+        username = "user@test-conditional-requests"
+        repo_name = "test-conditional-requests"
+        _HelperFunctions.create_repo(
+            username,
+            repo_name
+        )
+        repohostutils.write_file(
+            username=username,
+            repo_name=repo_name,
+            directory_path=".",
+            file_name="test-file.txt",
+            file_data="unchanged"
+        )
+
+        # A download with a matching ETag is answered with 304.
+        api_request_url = repohostutils.localhost_api_endpoint("/download-file")
+        content_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.FILE_PATH: "test-file.txt"
+        }
+        http_response = requests.get(api_request_url, json=content_data)
+        file_etag = http_response.headers.get("ETag")
+        file_last_modified = http_response.headers.get("Last-Modified")
+        self.assertIsNotNone(file_etag)
+        self.assertFalse(file_etag.startswith("W/"))
+
+        http_response = requests.get(
+            api_request_url,
+            headers={"If-None-Match": file_etag},
+            json=content_data
+        )
+        self.assertEqual(
+            HttpResponseCode.REDIRECTION_MESSAGE_304_NOT_MODIFIED,
+            http_response.status_code)
+        self.assertEqual(b"", http_response.content)
+
+        http_response = requests.get(
+            api_request_url,
+            headers={"If-Modified-Since": file_last_modified},
+            json=content_data
+        )
+        self.assertEqual(
+            HttpResponseCode.REDIRECTION_MESSAGE_304_NOT_MODIFIED,
+            http_response.status_code)
+
+        # A listing carries a weak ETag that changes when a directory is added.
+        api_request_url = repohostutils.localhost_api_endpoint("/list-directories")
+        content_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name
+        }
+        http_response = requests.get(api_request_url, json=content_data)
+        listing_etag = http_response.headers.get("ETag")
+        self.assertTrue(listing_etag.startswith("W/"))
+
+        http_response = requests.get(
+            api_request_url,
+            headers={"If-None-Match": listing_etag},
+            json=content_data
+        )
+        self.assertEqual(
+            HttpResponseCode.REDIRECTION_MESSAGE_304_NOT_MODIFIED,
+            http_response.status_code)
+        self.assertIn("Accept", http_response.headers.get("Vary"))
+
+        # A page of entries, or an NDJSON stream, is another representation
+        # of the directory and does not match the listing's ETag.
+        http_response = requests.get(
+            api_request_url,
+            headers={"If-None-Match": listing_etag},
+            json=dict(content_data, **{ApiParameterKeys.LIMIT: 1})
+        )
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+            http_response.status_code)
+        self.assertNotEqual(listing_etag, http_response.headers.get("ETag"))
+        http_response = requests.get(
+            api_request_url,
+            headers={"If-None-Match": listing_etag, "Accept": "application/x-ndjson"},
+            json=content_data
+        )
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+            http_response.status_code)
+        self.assertIn("Accept", http_response.headers.get("Vary"))
+
+        _HelperFunctions.create_directory(username, repo_name, "new-directory")
+        http_response = requests.get(
+            api_request_url,
+            headers={"If-None-Match": listing_etag},
+            json=content_data
+        )
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+            http_response.status_code)
+        self.assertNotEqual(listing_etag, http_response.headers.get("ETag"))
+        return None
+
+    def test_list_directories_pages(self):
+        username = "user@test-list-directories-pages"
+        repo_name = "test-list-directories-pages"
+        _HelperFunctions.create_repo(
+            username,
+            repo_name
+        )
+        for directory_path in ("a", "a/b", "c"):
+            _HelperFunctions.create_directory(
+                username,
+                repo_name,
+                directory_path
+            )
+        repohostutils.write_file(
+            username=username,
+            repo_name=repo_name,
+            directory_path="a/b",
+            file_name="test-file.txt",
+            file_data="data"
+        )
+
+        # Walk the whole repository two entries at a time.
+        api_request_url = repohostutils.localhost_api_endpoint("/list-directories")
+        content_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.RECURSIVE: True,
+            ApiParameterKeys.INCLUDE_FILES: True,
+            ApiParameterKeys.LIMIT: 2
+        }
+        entries = []
+        while True:
+            http_response = requests.get(api_request_url, json=content_data)
+            self.assertEqual(
+                HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+                http_response.status_code)
+            response_data = http_response.json()
+            entries.extend(response_data.get('entries'))
+            if None == response_data.get('next_cursor'):
+                break
+            content_data[ApiParameterKeys.CURSOR] = response_data.get('next_cursor')
+
+        self.assertEqual(
+            ["a", "a/b", "a/b/test-file.txt", "c"],
+            [entry.get('path') for entry in entries])
+        self.assertEqual({"path": "a/b/test-file.txt", "type": "file", "size": 4}, entries[2])
+
+        # Stream the entries of one directory as NDJSON.
+        content_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.DIRECTORY_PATH: "a/b",
+            ApiParameterKeys.INCLUDE_FILES: True
+        }
+        http_response = requests.get(
+            api_request_url,
+            headers={"Accept": "application/x-ndjson"},
+            json=content_data,
+            stream=True
+        )
+        self.assertEqual("application/x-ndjson", http_response.headers.get("Content-Type"))
+        streamed_entries = [json.loads(line) for line in http_response.iter_lines() if line]
+        self.assertEqual(["a/b/test-file.txt"], [entry.get('path') for entry in streamed_entries])
+        return None
+
+    def test_download_file_compressed(self):
+        username = "user@test-download-file-compressed"
+        repo_name = "test-download-file-compressed"
+        _HelperFunctions.create_repo(
+            username,
+            repo_name
+        )
+        test_file_content = "def test():\n    return None\n" * 200
+        repohostutils.write_file(
+            username=username,
+            repo_name=repo_name,
+            directory_path=".",
+            file_name="test-file.py",
+            file_data=test_file_content
+        )
+
+        api_request_url = repohostutils.localhost_api_endpoint("/download-file")
+        content_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.FILE_PATH: "test-file.py"
+        }
+        http_response = requests.get(
+            api_request_url,
+            headers={"Accept-Encoding": "gzip"},
+            json=content_data
+        )
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+            http_response.status_code)
+        self.assertEqual("gzip", http_response.headers.get("Content-Encoding"))
+        self.assertEqual("none", http_response.headers.get("Accept-Ranges"))
+        self.assertLess(int(http_response.headers.get("Content-Length")), len(test_file_content))
+        # requests decodes the gzip body.
+        self.assertEqual(test_file_content, http_response.content.decode('utf-8'))
+
+        http_response = requests.get(
+            api_request_url,
+            headers={"Accept-Encoding": "identity"},
+            json=content_data
+        )
+        self.assertIsNone(http_response.headers.get("Content-Encoding"))
+        self.assertEqual("bytes", http_response.headers.get("Accept-Ranges"))
+        self.assertEqual(len(test_file_content), int(http_response.headers.get("Content-Length")))
+        return None
+
+    def test_download_archive(self):
+        username = "user@test-download-archive"
+        repo_name = "test-download-archive"
+        _HelperFunctions.create_repo(
+            username,
+            repo_name
+        )
+        test_files = {
+            "README.md": "# Test\n",
+            "src/main.py": "print('main')\n",
+            "src/lib/util.py": "print('util')\n"
+        }
+        for (file_path, file_data) in test_files.items():
+            repohostutils.write_file(
+                username=username,
+                repo_name=repo_name,
+                directory_path=os.path.dirname(file_path) or ".",
+                file_name=os.path.basename(file_path),
+                file_data=file_data
+            )
+
+        api_request_url = repohostutils.localhost_api_endpoint("/download-archive")
+        content_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.COMPRESSION: "gzip"
+        }
+        http_response = requests.get(api_request_url, json=content_data)
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+            http_response.status_code)
+        with tarfile.open(fileobj=io.BytesIO(http_response.content), mode="r:gz") as tar_file:
+            for (file_path, file_data) in test_files.items():
+                self.assertEqual(file_data.encode('utf-8'), tar_file.extractfile(file_path).read())
+
+        content_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.DIRECTORY_PATH: "src",
+            ApiParameterKeys.ARCHIVE_FORMAT: "zip"
+        }
+        http_response = requests.get(api_request_url, json=content_data)
+        with zipfile.ZipFile(io.BytesIO(http_response.content)) as zip_file:
+            self.assertEqual(b"print('util')\n", zip_file.read("lib/util.py"))
+
+        content_data[ApiParameterKeys.COMPRESSION] = "gzip"
+        http_response = requests.get(api_request_url, json=content_data)
+        self.assertEqual(
+            HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST,
+            http_response.status_code)
+        return None
+
+    def test_upload_archive(self):
+        username = "user@test-upload-archive"
+        repo_name = "test-upload-archive"
+        _HelperFunctions.create_repo(
+            username,
+            repo_name
+        )
+        test_files = {
+            "README.md": b"# Test\n",
+            "src/main.py": b"print('main')\n",
+            "src/lib/util.py": os.urandom(200000)
+        }
+        tar_buffer = io.BytesIO()
+        with tarfile.open(fileobj=tar_buffer, mode="w:gz") as tar_file:
+            for (file_path, file_data) in test_files.items():
+                tar_info = tarfile.TarInfo(file_path)
+                tar_info.size = len(file_data)
+                tar_file.addfile(tar_info, io.BytesIO(file_data))
+
+        api_request_url = repohostutils.localhost_api_endpoint("/upload-archive")
+        content_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.DIRECTORY_PATH: "tar"
+        }
+        http_response = requests.put(api_request_url, params=content_data, data=tar_buffer.getvalue())
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED,
+            http_response.status_code)
+        self.assertEqual(len(test_files), http_response.json()[ApiResponseKeys.FILES])
+        for (file_path, file_data) in test_files.items():
+            full_file_path = repohostutils.get_file_path(username, repo_name, "tar/" + file_path)
+            with open(full_file_path, "rb") as f:
+                self.assertEqual(file_data, f.read())
+
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w") as zip_file:
+            for (file_path, file_data) in test_files.items():
+                zip_file.writestr(file_path, file_data)
+        content_data[ApiParameterKeys.DIRECTORY_PATH] = "zip"
+        content_data[ApiParameterKeys.ARCHIVE_FORMAT] = "zip"
+        content_data[ApiParameterKeys.ATOMIC] = "true"
+        http_response = requests.put(api_request_url, params=content_data, data=zip_buffer.getvalue())
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED,
+            http_response.status_code)
+        self.assertIsNotNone(repohostutils.get_file_path(username, repo_name, "zip/src/lib/util.py"))
+
+        # An unsafe member fails the atomic upload before anything is written.
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w") as zip_file:
+            zip_file.writestr("atomic/first.txt", b"first")
+            zip_file.writestr("../../escaped.txt", b"escaped")
+        content_data[ApiParameterKeys.DIRECTORY_PATH] = "."
+        http_response = requests.put(api_request_url, params=content_data, data=zip_buffer.getvalue())
+        self.assertEqual(
+            HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST,
+            http_response.status_code)
+        self.assertIsNone(repohostutils.get_file_path(username, repo_name, "atomic/first.txt"))
+        self.assertIsNone(repohostutils.get_directory_path(username, repo_name, "atomic"))
+        return None
+
+    def test_multipart_upload(self):
+        username = "user@test-multipart-upload"
+        repo_name = "test-multipart-upload"
+        _HelperFunctions.create_repo(
+            username,
+            repo_name
+        )
+        file_data = os.urandom(300000)
+        part_size = 100000
+        parts = [file_data[offset:offset + part_size] for offset in range(0, len(file_data), part_size)]
+
+        api_request_url = repohostutils.localhost_api_endpoint("/start-multipart-upload")
+        content_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.FILE_NAME: "big.bin",
+            ApiParameterKeys.DIRECTORY_PATH: "uploads"
+        }
+        http_response = requests.post(api_request_url, json=content_data)
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED,
+            http_response.status_code)
+        upload_id = http_response.json()[ApiParameterKeys.UPLOAD_ID]
+
+        def upload_part(part_number, part_data, checksum):
+            return requests.put(
+                repohostutils.localhost_api_endpoint("/upload-part"),
+                params={
+                    ApiParameterKeys.USERNAME: username,
+                    ApiParameterKeys.REPO_NAME: repo_name,
+                    ApiParameterKeys.UPLOAD_ID: upload_id,
+                    ApiParameterKeys.PART_NUMBER: part_number,
+                    ApiParameterKeys.CHECKSUM: checksum
+                },
+                data=part_data)
+
+        # Send the last two parts in parallel; a damaged copy of the
+        # first one is rejected.
+        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+            http_responses = list(executor.map(
+                upload_part,
+                [2, 3],
+                parts[1:],
+                [hashlib.sha256(part_data).hexdigest() for part_data in parts[1:]]))
+        for http_response in http_responses:
+            self.assertEqual(
+                HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED,
+                http_response.status_code)
+        http_response = upload_part(1, b"damaged", hashlib.sha256(parts[0]).hexdigest())
+        self.assertEqual(
+            HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST,
+            http_response.status_code)
+
+        # Resume: only the first part is missing.
+        session_data = {
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.UPLOAD_ID: upload_id
+        }
+        http_response = requests.get(
+            repohostutils.localhost_api_endpoint("/list-upload-parts"),
+            json=session_data)
+        self.assertEqual(
+            [2, 3],
+            [part_json[ApiParameterKeys.PART_NUMBER] for part_json in http_response.json()[ApiParameterKeys.PARTS]])
+        upload_part(1, parts[0], hashlib.sha256(parts[0]).hexdigest())
+
+        http_response = requests.post(
+            repohostutils.localhost_api_endpoint("/complete-multipart-upload"),
+            json=session_data)
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED,
+            http_response.status_code)
+        with open(repohostutils.get_file_path(username, repo_name, "uploads/big.bin"), "rb") as f:
+            self.assertEqual(file_data, f.read())
+
+        # The session is over.
+        http_response = requests.post(
+            repohostutils.localhost_api_endpoint("/complete-multipart-upload"),
+            json=session_data)
+        self.assertEqual(
+            HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND,
+            http_response.status_code)
+        return None
+
+
+    def test_metrics(self):
+        username = "user@test-metrics"
+        repo_name = "test-metrics"
+        http_response = _HelperFunctions.create_repo(
+            username,
+            repo_name
+        )
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+            http_response.status_code)
+
+        # A request the route cannot authorize is counted too.
+        http_response = requests.get(
+            repohostutils.localhost_api_endpoint("/download-file"),
+            json={
+                ApiParameterKeys.USERNAME: "other@test-metrics",
+                ApiParameterKeys.REPO_NAME: repo_name,
+                ApiParameterKeys.FILE_PATH: "missing.txt"
+            })
+        self.assertEqual(
+            HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED,
+            http_response.status_code)
+
+        http_response = requests.get(repohostutils.localhost_api_endpoint("/metrics"))
+        self.assertEqual(
+            HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK,
+            http_response.status_code)
+        self.assertTrue(http_response.headers["Content-Type"].startswith("text/plain"))
+        samples = {}
+        for line in http_response.text.splitlines():
+            if not line.startswith("#"):
+                (name, value) = line.rsplit(" ", 1)
+                samples[name] = float(value)
+
+        self.assertGreaterEqual(
+            samples['repo_api_requests_total{method="POST",route="create-repo",status="200"}'], 1)
+        self.assertGreaterEqual(
+            samples['repo_api_requests_total{method="GET",route="download-file",status="401"}'], 1)
+        for stage in ("queue", "authorization", "filesystem", "response"):
+            self.assertGreaterEqual(
+                samples['repo_api_request_stage_duration_seconds_count{{route="create-repo",stage="{}"}}'.format(stage)], 1)
+        self.assertGreater(samples['repo_api_received_bytes_total{route="create-repo"}'], 0)
+        self.assertGreater(samples['repo_api_sent_bytes_total{route="create-repo"}'], 0)
+        return None
 
 if __name__ == "__main__":
     try:
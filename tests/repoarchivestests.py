@@ -0,0 +1,124 @@
+#!/usr/bin/python3
+import io
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import unittest
+import zipfile
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import repoarchives
+
+def _tar_bytes(members):
+    tar_buffer = io.BytesIO()
+    with tarfile.open(fileobj=tar_buffer, mode="w:gz") as tar_file:
+        for (member_name, member_data) in members:
+            tar_info = tarfile.TarInfo(member_name)
+            tar_info.size = len(member_data)
+            tar_file.addfile(tar_info, io.BytesIO(member_data))
+    return tar_buffer.getvalue()
+
+# Test the expected behavior of reading uploaded archives.
+class RepoArchivesTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_safe_archive_path(self):
+        self.assertEqual("a/b.txt", repoarchives.safe_archive_path("./a//b.txt"))
+        self.assertEqual("a/b.txt", repoarchives.safe_archive_path("a\\b.txt"))
+        self.assertEqual("a", repoarchives.safe_archive_path("a/"))
+        self.assertIsNone(repoarchives.safe_archive_path("./"))
+        for unsafe_name in ("/etc/passwd", "../a", "a/../../b", "C:/a", "a\x00b", "..\\a"):
+            with self.assertRaises(repoarchives.InvalidArchiveError):
+                repoarchives.safe_archive_path(unsafe_name)
+        return None
+
+    def test_read_tar_archive(self):
+        archive_data = _tar_bytes([("./a.txt", b"a"), ("src/b.txt", b"b" * 100000)])
+        members = []
+        for (member_type, archive_path, member_stream) in repoarchives.read_archive(io.BytesIO(archive_data)):
+            members.append((member_type, archive_path, member_stream.read()))
+        self.assertEqual(
+            [(repoarchives.MEMBER_TYPE_FILE, "a.txt", b"a"),
+             (repoarchives.MEMBER_TYPE_FILE, "src/b.txt", b"b" * 100000)],
+            members)
+        return None
+
+    def test_read_zip_archive(self):
+        zip_buffer = io.BytesIO()
+        with zipfile.ZipFile(zip_buffer, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+            zip_file.writestr("docs/", b"")
+            zip_file.writestr("docs/c.txt", b"c" * 1000)
+        zip_buffer.seek(0)
+
+        members = []
+        for (member_type, archive_path, member_stream) in repoarchives.read_archive(
+                zip_buffer,
+                repoarchives.ARCHIVE_FORMAT_ZIP,
+                spool_directory=self.directory):
+            members.append((member_type, archive_path, member_stream and member_stream.read()))
+        self.assertEqual(
+            [(repoarchives.MEMBER_TYPE_DIRECTORY, "docs", None),
+             (repoarchives.MEMBER_TYPE_FILE, "docs/c.txt", b"c" * 1000)],
+            members)
+        # The spooled copy is removed.
+        self.assertEqual([], os.listdir(self.directory))
+        return None
+
+    def test_links_are_skipped(self):
+        tar_buffer = io.BytesIO()
+        with tarfile.open(fileobj=tar_buffer, mode="w") as tar_file:
+            tar_info = tarfile.TarInfo("link")
+            tar_info.type = tarfile.SYMTYPE
+            tar_info.linkname = "/etc/passwd"
+            tar_file.addfile(tar_info)
+        tar_buffer.seek(0)
+        self.assertEqual([], list(repoarchives.read_archive(tar_buffer)))
+        return None
+
+    def test_invalid_archives(self):
+        with self.assertRaises(repoarchives.InvalidArchiveError):
+            list(repoarchives.read_archive(io.BytesIO(b"not an archive" * 100)))
+        with self.assertRaises(repoarchives.InvalidArchiveError):
+            list(repoarchives.read_archive(io.BytesIO(_tar_bytes([("../evil", b"x")]))))
+        with self.assertRaises(repoarchives.InvalidArchiveError):
+            list(repoarchives.read_archive(
+                io.BytesIO(b"not a zip"),
+                repoarchives.ARCHIVE_FORMAT_ZIP,
+                spool_directory=self.directory))
+        return None
+
+    def test_round_trip(self):
+        os.makedirs(os.path.join(self.directory, "repo", "src"))
+        with open(os.path.join(self.directory, "repo", "src", "main.py"), "wb") as f:
+            f.write(b"print('main')\n")
+        archive_data = b"".join(repoarchives.stream_archive(os.path.join(self.directory, "repo")))
+
+        members = [(member_type, archive_path)
+                   for (member_type, archive_path, _) in repoarchives.read_archive(io.BytesIO(archive_data))]
+        self.assertEqual(
+            [(repoarchives.MEMBER_TYPE_DIRECTORY, "src"),
+             (repoarchives.MEMBER_TYPE_FILE, "src/main.py")],
+            members)
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
@@ -0,0 +1,290 @@
+#!/usr/bin/python3
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import unittest
+import urllib.parse
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import loadshedding
+import osostandin
+
+from repohostutils import ApiParameterKeys
+from repohostutils import ApiResponseKeys
+from repohostutils import HttpResponseCode
+
+# Imported once the stand-in is running, from a scratch host directory.
+repoasgi = None
+
+_loop = None
+
+# Drive the ASGI application in process and collect its response as
+# (status, headers, body).
+def _call(method, path, request_json=None, query=None, body_chunks=None, headers=None):
+    headers = dict(headers or {})
+    if request_json is not None:
+        body_chunks = [json.dumps(request_json).encode("utf-8")]
+        headers["Content-Type"] = "application/json"
+    body_chunks = list(body_chunks or [b""])
+    scope = {
+        "type": "http",
+        "method": method,
+        "path": path,
+        "query_string": urllib.parse.urlencode(query or {}).encode("latin-1"),
+        "headers": [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for (name, value) in headers.items()]
+    }
+    response = {"body": b""}
+
+    async def receive():
+        if body_chunks:
+            body = body_chunks.pop(0)
+            return {"type": "http.request", "body": body, "more_body": bool(body_chunks)}
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if "http.response.start" == message["type"]:
+            response["status"] = message["status"]
+            response["headers"] = {
+                name.decode("latin-1"): value.decode("latin-1")
+                for (name, value) in message["headers"]
+            }
+        else:
+            response["body"] += message.get("body", b"")
+
+    _loop.run_until_complete(repoasgi.app(scope, receive, send))
+    return (response["status"], response["headers"], response["body"])
+
+# Test the asyncio build of the repository routes.
+class RepoAsgiFunctionalTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+
+    def _create_repo(self, username, repo_name):
+        (status, _, body) = _call("POST", "/create-repo", request_json={
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name
+        })
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+        return json.loads(body)
+
+    def _upload_file(self, username, repo_name, file_name, body_chunks):
+        return _call("PUT", "/upload-file", query={
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.FILE_NAME: file_name
+        }, body_chunks=body_chunks)
+
+    def test_create_repo_and_directory(self):
+        self.assertIn("path", self._create_repo("user@test-asgi", "test-asgi-directory"))
+
+        (status, _, body) = _call("POST", "/create-directory", request_json={
+            ApiParameterKeys.USERNAME: "user@test-asgi",
+            ApiParameterKeys.REPO_NAME: "test-asgi-directory",
+            ApiParameterKeys.DIRECTORY_PATH: "docs"
+        })
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+        self.assertIn("path", json.loads(body))
+
+        (status, headers, body) = _call("GET", "/list-directories", request_json={
+            ApiParameterKeys.USERNAME: "user@test-asgi",
+            ApiParameterKeys.REPO_NAME: "test-asgi-directory"
+        })
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+        subdirectories = json.loads(body)[ApiResponseKeys.SUBDIRECTORIES]
+        self.assertEqual(len(subdirectories), 1)
+        self.assertTrue(subdirectories[0].endswith("docs"))
+
+        # The listing's validators answer a repeated request with 304.
+        (status, _, body) = _call("GET", "/list-directories", request_json={
+            ApiParameterKeys.USERNAME: "user@test-asgi",
+            ApiParameterKeys.REPO_NAME: "test-asgi-directory"
+        }, headers={"If-None-Match": headers["etag"]})
+        self.assertEqual(status, HttpResponseCode.REDIRECTION_MESSAGE_304_NOT_MODIFIED)
+        self.assertEqual(body, b"")
+
+        # An NDJSON stream of the same directory has its own ETag.
+        (status, ndjson_headers, _) = _call("GET", "/list-directories", request_json={
+            ApiParameterKeys.USERNAME: "user@test-asgi",
+            ApiParameterKeys.REPO_NAME: "test-asgi-directory"
+        }, headers={"If-None-Match": headers["etag"], "Accept": "application/x-ndjson"})
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+        self.assertEqual(ndjson_headers["vary"], "Accept")
+        self.assertNotEqual(ndjson_headers["etag"], headers["etag"])
+
+        # Entries stream as NDJSON when the client accepts it.
+        (status, headers, body) = _call("GET", "/list-directories", request_json={
+            ApiParameterKeys.USERNAME: "user@test-asgi",
+            ApiParameterKeys.REPO_NAME: "test-asgi-directory",
+            ApiParameterKeys.RECURSIVE: True
+        }, headers={"Accept": "application/x-ndjson"})
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+        self.assertEqual(headers["content-type"], "application/x-ndjson")
+        self.assertEqual([json.loads(line)["path"] for line in body.splitlines()], ["docs"])
+
+    def test_upload_and_download_file(self):
+        self._create_repo("user@test-asgi", "test-asgi-file")
+        file_contents = b"0123456789" * 10000
+        body_chunks = [file_contents[offset:offset + 4096] for offset in range(0, len(file_contents), 4096)]
+
+        (status, _, body) = self._upload_file("user@test-asgi", "test-asgi-file", "data.bin", body_chunks)
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED)
+        self.assertIn("path", json.loads(body))
+
+        download_json = {
+            ApiParameterKeys.USERNAME: "user@test-asgi",
+            ApiParameterKeys.REPO_NAME: "test-asgi-file",
+            ApiParameterKeys.FILE_PATH: "data.bin"
+        }
+        (status, headers, body) = _call("GET", "/download-file", request_json=download_json)
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+        self.assertEqual(body, file_contents)
+        self.assertEqual(headers["content-length"], str(len(file_contents)))
+        self.assertEqual(headers["accept-ranges"], "bytes")
+        self.assertIn("attachment", headers["content-disposition"])
+        etag = headers["etag"]
+
+        (status, _, body) = _call("GET", "/download-file", request_json=download_json,
+                                  headers={"If-None-Match": etag})
+        self.assertEqual(status, HttpResponseCode.REDIRECTION_MESSAGE_304_NOT_MODIFIED)
+        self.assertEqual(body, b"")
+
+        (status, headers, body) = _call("GET", "/download-file", request_json=download_json,
+                                        headers={"Range": "bytes=10-19"})
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_206_PARTIAL_CONTENT)
+        self.assertEqual(body, file_contents[10:20])
+        self.assertEqual(headers["content-range"], "bytes 10-19/{}".format(len(file_contents)))
+
+        (status, headers, body) = _call("GET", "/download-file", request_json=download_json,
+                                        headers={"Range": "bytes=0-1,20-21"})
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_206_PARTIAL_CONTENT)
+        self.assertTrue(headers["content-type"].startswith("multipart/byteranges"))
+        self.assertEqual(headers["content-length"], str(len(body)))
+
+        (status, _, _) = _call("GET", "/download-file", request_json=download_json,
+                               headers={"Range": "bytes=200000-"})
+        self.assertEqual(status, HttpResponseCode.CLIENT_ERROR_RESPONSE_416_RANGE_NOT_SATISFIABLE)
+
+        (status, headers, body) = _call("HEAD", "/download-file", request_json=download_json)
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+        self.assertEqual(headers["content-length"], str(len(file_contents)))
+        self.assertEqual(body, b"")
+
+    def test_unauthorized_and_invalid_requests(self):
+        self._create_repo("user@test-asgi", "test-asgi-private")
+
+        (status, _, _) = self._upload_file("other@test-asgi", "test-asgi-private", "data.bin", [b"data"])
+        self.assertEqual(status, HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+
+        (status, _, _) = _call("GET", "/download-file", request_json={
+            ApiParameterKeys.USERNAME: "other@test-asgi",
+            ApiParameterKeys.REPO_NAME: "test-asgi-private",
+            ApiParameterKeys.FILE_PATH: "data.bin"
+        })
+        self.assertEqual(status, HttpResponseCode.CLIENT_ERROR_RESPONSE_401_UNAUTHORIZED)
+
+        (status, _, _) = _call("GET", "/download-file", request_json={
+            ApiParameterKeys.USERNAME: "user@test-asgi",
+            ApiParameterKeys.REPO_NAME: "test-asgi-private",
+            ApiParameterKeys.FILE_PATH: "missing.bin"
+        })
+        self.assertEqual(status, HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+
+        (status, _, _) = _call("POST", "/create-repo", body_chunks=[b"not json"])
+        self.assertEqual(status, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+        # Usernames starting with "." would name the host's data directories.
+        (status, _, _) = _call("POST", "/create-repo", request_json={
+            ApiParameterKeys.USERNAME: ".blobs",
+            ApiParameterKeys.REPO_NAME: "test-asgi-host-data"
+        })
+        self.assertEqual(status, HttpResponseCode.CLIENT_ERROR_RESPONSE_400_BAD_REQUEST)
+
+        (status, _, _) = _call("GET", "/create-repo")
+        self.assertEqual(status, HttpResponseCode.CLIENT_ERROR_RESPONSE_405_METHOD_NOT_ALLOWED)
+
+        (status, _, _) = _call("GET", "/no-such-route")
+        self.assertEqual(status, HttpResponseCode.CLIENT_ERROR_RESPONSE_404_NOT_FOUND)
+
+    def test_metrics(self):
+        self._create_repo("user@test-asgi", "test-asgi-metrics")
+        (status, _, _) = self._upload_file("user@test-asgi", "test-asgi-metrics", "data.bin", [b"data"])
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED)
+
+        (status, headers, body) = _call("GET", "/metrics")
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+        self.assertTrue(headers["content-type"].startswith("text/plain"))
+        text = body.decode("utf-8")
+        self.assertIn('repo_api_requests_total{method="PUT",route="upload-file",status="201"}', text)
+        self.assertIn('repo_api_received_bytes_total{route="upload-file"} ', text)
+        self.assertIn('repo_api_request_stage_duration_seconds_count{route="upload-file",stage="authorization"} ', text)
+
+    def test_rate_limited_requests(self):
+        self._create_repo("user@test-asgi-limited", "test-asgi-limited")
+        directory_json = {
+            ApiParameterKeys.USERNAME: "user@test-asgi-limited",
+            ApiParameterKeys.REPO_NAME: "test-asgi-limited",
+            ApiParameterKeys.DIRECTORY_PATH: "docs"
+        }
+
+        # The route allows bursts of two requests per user.
+        for _ in range(2):
+            (status, _, _) = _call("POST", "/create-directory", request_json=directory_json)
+            self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+        (status, headers, _) = _call("POST", "/create-directory", request_json=directory_json)
+        self.assertEqual(status, HttpResponseCode.CLIENT_ERROR_RESPONSE_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(headers["retry-after"]), 0)
+
+        # Other users have limits of their own.
+        self._create_repo("other@test-asgi-limited", "test-asgi-limited")
+        (status, _, _) = _call("POST", "/create-directory", request_json=dict(
+            directory_json, **{ApiParameterKeys.USERNAME: "other@test-asgi-limited"}))
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+
+    def test_shed_requests(self):
+        self._create_repo("user@test-asgi", "test-asgi-shed")
+
+        # Every slot is taken, and waiting requests give up at once.
+        admission_controller = loadshedding.AdmissionController(1, max_queue_delay_seconds=0.01)
+        admission_controller.admit("/create-repo")
+        configured_admission_controller = repoasgi.repoapis._admission_controller
+        repoasgi.repoapis._admission_controller = admission_controller
+        self.addCleanup(setattr, repoasgi.repoapis, "_admission_controller", configured_admission_controller)
+
+        (status, headers, _) = self._upload_file("user@test-asgi", "test-asgi-shed", "data.bin", [b"data"])
+        self.assertEqual(status, HttpResponseCode.SERVER_ERROR_RESPONSE_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(headers["retry-after"], "1")
+
+        admission_controller.release()
+        (status, _, _) = self._upload_file("user@test-asgi", "test-asgi-shed", "data.bin", [b"data"])
+        self.assertEqual(status, HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED)
+        stats = admission_controller.stats()
+        self.assertEqual(stats["in_flight"], 0)
+        self.assertEqual(stats["shed"][loadshedding.PRIORITY_LOW], 1)
+
+if __name__ == "__main__":
+    try:
+        # Serve the application against a stand-in for Oso Cloud, from a
+        # scratch host directory.
+        standin_server = osostandin.start_standin_server(policy_file_name="policy.polar")
+        os.environ["OSO_URL"] = standin_server.url
+        os.environ["OSO_AUTH"] = "standin"
+        os.environ["REPO_API_ROUTE_RATE_LIMITS"] = "create-directory=0.001/2"
+        os.chdir(tempfile.mkdtemp(prefix="repoasgitests-"))
+        import repoasgi
+        _loop = asyncio.new_event_loop()
+
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
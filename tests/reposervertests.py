@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+import os
+import queue
+import requests
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import metrics
+import osostandin
+
+from repohostutils import ApiParameterKeys
+from repohostutils import HttpResponseCode
+
+_standin_server = None
+
+_SERVER_SCRIPT = os.path.join(os.getcwd(), "reposerver.py")
+_STARTUP_TIMEOUT_SECONDS = 30.0
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+# Runs reposerver.py in a scratch host directory and collects its output.
+class _ServerProcess:
+    def __init__(self, workers):
+        self.port = _free_port()
+        environment = dict(os.environ)
+        environment["OSO_URL"] = _standin_server.url
+        environment["OSO_AUTH"] = "standin"
+        self.process = subprocess.Popen(
+            [sys.executable, "-u", _SERVER_SCRIPT,
+             "--workers", str(workers),
+             "--threads", "4",
+             "--port", str(self.port),
+             "--graceful-timeout", "10"],
+            cwd=tempfile.mkdtemp(prefix="reposervertests-"),
+            env=environment,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True)
+        self._lines = queue.Queue()
+        threading.Thread(target=self._read_output, daemon=True).start()
+
+    def _read_output(self):
+        for line in self.process.stdout:
+            self._lines.put(line)
+
+    # Returns the next output line containing text.
+    def wait_for(self, text, timeout_seconds=_STARTUP_TIMEOUT_SECONDS):
+        deadline = time.monotonic() + timeout_seconds
+        while True:
+            line = self._lines.get(timeout=max(0.0, deadline - time.monotonic()))
+            if text in line:
+                return line
+
+    def url(self, route):
+        return "http://localhost:{}{}".format(self.port, route)
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.wait()
+
+# Test the pre-fork launcher: start-up, reload and graceful shutdown.
+class RepoServerFunctionalTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.server = _ServerProcess(workers=2)
+        self.addCleanup(self.server.stop)
+        self.server.wait_for("Cold start")
+
+    def _create_repo(self, username, repo_name):
+        http_response = requests.post(self.server.url("/create-repo"), json={
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name
+        })
+        self.assertEqual(http_response.status_code, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+
+    def _upload_file(self, username, repo_name, file_name, data):
+        return requests.put(self.server.url("/upload-file"), params={
+            ApiParameterKeys.USERNAME: username,
+            ApiParameterKeys.REPO_NAME: repo_name,
+            ApiParameterKeys.FILE_NAME: file_name
+        }, data=data)
+
+    def test_serve_and_reload(self):
+        self._create_repo("user@test-server", "test-server-reload")
+        http_response = self._upload_file("user@test-server", "test-server-reload", "before.bin", b"before")
+        self.assertEqual(http_response.status_code, HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED)
+
+        self.server.process.send_signal(signal.SIGHUP)
+        self.server.wait_for("Reloading workers")
+        self.server.wait_for("ready in")
+        self.server.wait_for("ready in")
+
+        # The new workers serve the same host and repositories.
+        http_response = requests.get(self.server.url("/download-file"), json={
+            ApiParameterKeys.USERNAME: "user@test-server",
+            ApiParameterKeys.REPO_NAME: "test-server-reload",
+            ApiParameterKeys.FILE_PATH: "before.bin"
+        })
+        self.assertEqual(http_response.status_code, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+        self.assertEqual(http_response.content, b"before")
+
+    def test_metrics_across_workers(self):
+        for index in range(6):
+            self._create_repo("user@test-server", "test-server-metrics-{}".format(index))
+
+        # Each worker writes its metrics for the others about once a second.
+        time.sleep(2 * metrics.FLUSH_INTERVAL_SECONDS)
+        http_response = requests.get(self.server.url("/metrics"))
+        self.assertEqual(http_response.status_code, HttpResponseCode.SUCCESSFUL_RESPONSE_200_OK)
+        self.assertIn(
+            'repo_api_requests_total{method="POST",route="create-repo",status="200"} 6\n',
+            http_response.text)
+
+    def test_graceful_shutdown(self):
+        self._create_repo("user@test-server", "test-server-drain")
+
+        # An upload still arriving when the server is told to stop.
+        def slow_body():
+            for _ in range(5):
+                time.sleep(0.2)
+                yield b"x" * 1024
+
+        upload_responses = []
+        upload_thread = threading.Thread(target=lambda: upload_responses.append(
+            self._upload_file("user@test-server", "test-server-drain", "slow.bin", slow_body())))
+        upload_thread.start()
+        time.sleep(0.3)
+        self.server.process.send_signal(signal.SIGTERM)
+        upload_thread.join()
+
+        self.assertEqual(upload_responses[0].status_code, HttpResponseCode.SUCCESSFUL_RESPONSE_201_CREATED)
+        self.assertEqual(self.server.process.wait(timeout=30), 0)
+        with self.assertRaises(requests.ConnectionError):
+            requests.post(self.server.url("/create-repo"), json={})
+
+if __name__ == "__main__":
+    try:
+        # Start the stand-in on a free port for the duration of the tests.
+        _standin_server = osostandin.start_standin_server(policy_file_name="policy.polar")
+
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise
@@ -0,0 +1,92 @@
+#!/usr/bin/python3
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+# Make sure to call all the tests from the parent directory.
+sys.path.append(os.getcwd())
+import localpolicy
+import sharedfacts
+
+from policydefinitions import RepositoryPermissions, RepositoryRoles
+
+_TEST_USER = {
+    "type": "User",
+    "id": "user@test-shared-facts"
+}
+_TEST_REPO = {
+    "type": "Repository",
+    "id": "test-shared-facts"
+}
+
+# Test the fact file shared by the worker processes.
+class SharedFactsTests(unittest.TestCase):
+    def setUp(self):
+        log_message = "[INFO] Performing Test {}::{}".format(
+            os.path.basename(__file__),
+            self._testMethodName
+        )
+
+        print(log_message)
+        self.directory = tempfile.mkdtemp()
+        self.facts_path = os.path.join(self.directory, sharedfacts.GRANTED_FACTS_FILE_NAME)
+        self.policy = localpolicy.load_policy_file(localpolicy.default_policy_file_path())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _allows(self, shared_facts):
+        return shared_facts.authorize(_TEST_USER, RepositoryPermissions.UPLOAD_FILE, _TEST_REPO)
+
+    def test_fact_is_seen_by_other_processes(self):
+        shared_facts = sharedfacts.SharedFacts(self.facts_path, self.policy)
+        other_shared_facts = sharedfacts.SharedFacts(self.facts_path, self.policy)
+        self.assertFalse(self._allows(other_shared_facts))
+
+        shared_facts.tell("has_role", _TEST_USER, RepositoryRoles.OWNER, _TEST_REPO)
+        self.assertTrue(self._allows(other_shared_facts))
+
+        # The facts are loaded again after a restart.
+        self.assertTrue(self._allows(sharedfacts.SharedFacts(self.facts_path, self.policy)))
+        return None
+
+    def test_fact_told_twice_needs_two_deletes(self):
+        shared_facts = sharedfacts.SharedFacts(self.facts_path, self.policy)
+        other_shared_facts = sharedfacts.SharedFacts(self.facts_path, self.policy)
+        shared_facts.tell("has_role", _TEST_USER, RepositoryRoles.OWNER, _TEST_REPO)
+        other_shared_facts.tell("has_role", _TEST_USER, RepositoryRoles.OWNER, _TEST_REPO)
+
+        shared_facts.delete("has_role", _TEST_USER, RepositoryRoles.OWNER, _TEST_REPO)
+        self.assertTrue(self._allows(other_shared_facts))
+        other_shared_facts.delete("has_role", _TEST_USER, RepositoryRoles.OWNER, _TEST_REPO)
+        self.assertFalse(self._allows(shared_facts))
+        return None
+
+    def test_compaction_keeps_the_facts_that_hold(self):
+        shared_facts = sharedfacts.SharedFacts(self.facts_path, self.policy, compact_size_in_bytes=1)
+        other_shared_facts = sharedfacts.SharedFacts(self.facts_path, self.policy)
+        other_repo = {
+            "type": "Repository",
+            "id": "test-shared-facts-other"
+        }
+        shared_facts.tell("has_role", _TEST_USER, RepositoryRoles.OWNER, other_repo)
+        shared_facts.delete("has_role", _TEST_USER, RepositoryRoles.OWNER, other_repo)
+        shared_facts.tell("has_role", _TEST_USER, RepositoryRoles.OWNER, _TEST_REPO)
+
+        with open(self.facts_path) as facts_file:
+            self.assertEqual(1, len(facts_file.readlines()))
+        # A process that read the file before it was replaced reads it again.
+        self.assertTrue(self._allows(other_shared_facts))
+        self.assertEqual(1, other_shared_facts.fact_count())
+        return None
+
+if __name__ == "__main__":
+    try:
+        # Run the tests.
+        unittest.main()
+
+    except SystemExit as error:
+        if error.args[0] == True:
+            raise